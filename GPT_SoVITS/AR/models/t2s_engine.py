@@ -0,0 +1,498 @@
+import threading
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+import torch
+from torch.nn import functional as F
+
+from AR.models.utils import BatchSampler
+
+
+class PagedKVCache:
+    """
+    Block (paged) kv cache shared by all sequences of a T2SDecodeEngine.
+        Every layer has one key and one value pool of num_blocks * block_size positions. A
+        sequence owns a list of blocks (its block table) that grows one block at a time, so
+        adding or removing a sequence never copies the caches of the others.
+    Args:
+        num_layers: int, number of transformer layers.
+        hidden_dim: int, width of the keys and values.
+        num_blocks: int, number of blocks in the pools.
+        block_size: int, number of positions per block.
+        dtype: torch.dtype, dtype of the pools.
+        device: torch.device, device of the pools.
+    """
+
+    def __init__(
+        self,
+        num_layers: int,
+        hidden_dim: int,
+        num_blocks: int,
+        block_size: int = 16,
+        dtype: torch.dtype = torch.float32,
+        device: torch.device = torch.device("cpu"),
+    ):
+        self.num_blocks = num_blocks
+        self.block_size = block_size
+        self.device = device
+        # 置零而不是 empty: 被 mask 的位置注意力权重为 0, 但 0 * nan 仍然是 nan
+        self.k_pool: List[torch.Tensor] = [
+            torch.zeros((num_blocks * block_size, hidden_dim), dtype=dtype, device=device) for _ in range(num_layers)
+        ]
+        self.v_pool: List[torch.Tensor] = [
+            torch.zeros((num_blocks * block_size, hidden_dim), dtype=dtype, device=device) for _ in range(num_layers)
+        ]
+        # decode 时各行的 kv 取到这里, 所有层依次复用, 按需扩大
+        self._k_buffer = torch.empty((0, hidden_dim), dtype=dtype, device=device)
+        self._v_buffer = torch.empty((0, hidden_dim), dtype=dtype, device=device)
+        self._free_blocks: List[int] = list(range(num_blocks - 1, -1, -1))
+        self._block_tables: Dict[int, List[int]] = {}
+        self._lengths: Dict[int, int] = {}
+
+    @property
+    def free_blocks(self) -> int:
+        return len(self._free_blocks)
+
+    def blocks_for(self, num_tokens: int) -> int:
+        return -(-num_tokens // self.block_size)
+
+    def blocks_to_append(self, seq_ids: List[int]) -> int:
+        # 下一个位置刚好开始新块的序列数
+        return sum(1 for seq_id in seq_ids if self._lengths[seq_id] % self.block_size == 0)
+
+    def allocate(self, seq_id: int, num_tokens: int) -> torch.Tensor:
+        """
+        Allocate blocks for a new sequence of num_tokens positions.
+        Returns:
+            torch.LongTensor: the pool positions of the sequence, to write its prefill into.
+        """
+        num_blocks = self.blocks_for(num_tokens)
+        if num_blocks > len(self._free_blocks):
+            raise RuntimeError(f"Not enough kv cache blocks: {num_blocks} needed, {len(self._free_blocks)} free.")
+        self._block_tables[seq_id] = [self._free_blocks.pop() for _ in range(num_blocks)]
+        self._lengths[seq_id] = num_tokens
+        table = torch.tensor(self._block_tables[seq_id], dtype=torch.long, device=self.device)
+        slots = table.unsqueeze(1) * self.block_size + torch.arange(self.block_size, device=self.device)
+        return slots.flatten()[:num_tokens]
+
+    def append(self, seq_id: int) -> int:
+        """
+        Reserve the next position of a sequence, taking a new block when the last one is full.
+        Returns:
+            int: the pool position to write the keys and values of the new token to.
+        """
+        length = self._lengths[seq_id]
+        table = self._block_tables[seq_id]
+        if length == len(table) * self.block_size:
+            if not self._free_blocks:
+                raise RuntimeError("Not enough kv cache blocks: none free.")
+            table.append(self._free_blocks.pop())
+        self._lengths[seq_id] = length + 1
+        return table[length // self.block_size] * self.block_size + length % self.block_size
+
+    def free(self, seq_id: int):
+        if seq_id not in self._block_tables:
+            return
+        self._free_blocks.extend(reversed(self._block_tables.pop(seq_id)))
+        del self._lengths[seq_id]
+
+    def buffers(self, num_slots: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Key and value buffers of num_slots positions to gather the sequences of a step into.
+        """
+        if self._k_buffer.shape[0] < num_slots:
+            # 成倍扩大, 行数和长度增长时不必每步重新分配
+            size = max(num_slots, 2 * self._k_buffer.shape[0])
+            self._k_buffer = self._k_buffer.new_empty((size, self._k_buffer.shape[1]))
+            self._v_buffer = self._v_buffer.new_empty((size, self._v_buffer.shape[1]))
+        return self._k_buffer[:num_slots], self._v_buffer[:num_slots]
+
+    def gather(self, seq_ids: List[int]) -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
+        """
+        Pool positions of several sequences for one decoding step.
+        Returns:
+            torch.LongTensor: (B, L) positions of each sequence, padded to the longest one.
+            torch.BoolTensor: (B, 1, 1, L) attention mask, True for the padding; None without padding.
+        """
+        lengths = [self._lengths[seq_id] for seq_id in seq_ids]
+        num_blocks = max(len(self._block_tables[seq_id]) for seq_id in seq_ids)
+        # 填充的块号为 0, 读到的是其他序列的有效值, 由 mask 屏蔽
+        tables = torch.tensor(
+            [self._block_tables[seq_id] + [0] * (num_blocks - len(self._block_tables[seq_id])) for seq_id in seq_ids],
+            dtype=torch.long,
+            device=self.device,
+        )
+        max_len = max(lengths)
+        slots = tables.unsqueeze(2) * self.block_size + torch.arange(self.block_size, device=self.device)
+        slots = slots.view(len(seq_ids), -1)[:, :max_len].contiguous()
+        if min(lengths) == max_len:
+            return slots, None
+        lengths = torch.tensor(lengths, device=self.device)
+        attn_mask = torch.arange(max_len, device=self.device).unsqueeze(0) >= lengths.unsqueeze(1)
+        return slots, attn_mask.view(len(seq_ids), 1, 1, max_len)
+
+
+class T2SRequest:
+    """
+    One sequence to decode with a T2SDecodeEngine.
+        When done, y and idx hold what infer_panel_naive() returns for it: the prompt and the
+        generated tokens, and the index of the last decoding step.
+    Args:
+        x: torch.LongTensor, (phones,) phoneme ids of the text.
+        bert_feature: torch.Tensor, (1024, phones) BERT features of the text.
+        prompt: torch.LongTensor, (T,) semantic tokens of the reference audio, None without a prompt.
+        top_k: int, top k sampling.
+        top_p: float, top p sampling.
+        temperature: float, temperature for sampling.
+        repetition_penalty: float, repetition penalty.
+        early_stop_num: int, maximum number of generated tokens, -1 for no limit.
+        generator: torch.Generator, optional, the random generator of this sequence.
+        cancel_token: CancellationToken, optional, stops the sequence at the next step.
+        prefix: T2SPrefix, optional, cached states of the prompt; x and bert_feature then only
+            hold the target text (see Text2SemanticDecoder.build_prefix).
+    """
+
+    def __init__(
+        self,
+        x: torch.LongTensor,
+        bert_feature: torch.Tensor,
+        prompt: Optional[torch.LongTensor] = None,
+        top_k: int = -100,
+        top_p: float = 100,
+        temperature: float = 1.0,
+        repetition_penalty: float = 1.35,
+        early_stop_num: int = -1,
+        generator: Optional[torch.Generator] = None,
+        cancel_token=None,
+        prefix=None,
+    ):
+        self.x = x
+        self.bert_feature = bert_feature
+        self.prompt = prompt
+        self.top_k = top_k
+        self.top_p = top_p
+        self.temperature = temperature
+        self.repetition_penalty = repetition_penalty
+        self.early_stop_num = early_stop_num
+        self.generator = generator
+        self.cancel_token = cancel_token
+        self.prefix = prefix
+        self.y: Optional[torch.LongTensor] = None
+        self.idx: int = 0
+        self.error: Optional[BaseException] = None
+        self._done = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_token is not None and self.cancel_token.cancelled
+
+    def result(self, timeout: Optional[float] = None) -> Tuple[torch.LongTensor, int]:
+        if not self._done.wait(timeout):
+            raise TimeoutError("T2S decoding did not finish in time.")
+        if self.error is not None:
+            raise self.error
+        return self.y, self.idx
+
+
+class _Sequence:
+    # 引擎内部的解码状态, 被抢占后保留 y 和 idx, 重新 prefill 后继续
+    def __init__(self, seq_id: int, request: T2SRequest):
+        self.seq_id = seq_id
+        self.request = request
+        self.x_emb: Optional[torch.Tensor] = None
+        self.y: Optional[torch.LongTensor] = None
+        self.prefix_len: int = 0 if request.prompt is None else request.prompt.shape[-1]
+        self.idx: int = 0
+
+
+class T2SDecodeEngine:
+    """
+    Continuous (iteration-level) batching for semantic-token decoding.
+        Sequences are submitted from any thread and decoded together by a background thread.
+        Each iteration decodes one token for every running sequence, then admits waiting
+        sequences into the free rows; their prompt prefill runs on its own and their first
+        token is sampled from it, so a new request never waits for the longest row of a batch.
+        The kv caches live in a PagedKVCache: finished sequences return their blocks without
+        touching the other rows. When the pool runs out of blocks the latest admitted sequence
+        is preempted and later prefilled again with the tokens it has generated so far.
+        Every sequence is decoded as infer_panel_naive() would decode it on its own.
+    Args:
+        model: Text2SemanticDecoder, the T2S model (only read).
+        max_batch_size: int, maximum number of sequences decoded together.
+        num_blocks: int, number of kv cache blocks.
+        block_size: int, number of positions per kv cache block.
+        max_steps: int, maximum number of decoding steps per sequence.
+    """
+
+    def __init__(
+        self,
+        model,
+        max_batch_size: int = 16,
+        num_blocks: int = 1024,
+        block_size: int = 16,
+        max_steps: int = 1500,
+    ):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_steps = max_steps
+        param = next(model.parameters())
+        self.device = param.device
+        self.cache = PagedKVCache(model.num_layers, model.model_dim, num_blocks, block_size, param.dtype, param.device)
+        self._waiting: Deque[_Sequence] = deque()
+        self._running: List[_Sequence] = []
+        # 与 _running 一一对应的采样参数和已出现的 token, 所有行一次采样
+        self._sampler = BatchSampler(model.vocab_size, self.device)
+        self._next_seq_id = 0
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        self._stats = {"steps": 0, "step_rows": 0, "prefills": 0, "preempted": 0, "finished": 0}
+
+    @staticmethod
+    def blocks_for_memory(model, memory_mb: float, block_size: int = 16) -> int:
+        """
+        Number of blocks of block_size positions that fit in memory_mb for the kv cache of model.
+        """
+        param = next(model.parameters())
+        bytes_per_block = 2 * model.num_layers * block_size * model.model_dim * param.element_size()
+        return max(1, int(memory_mb * 1024 * 1024 // bytes_per_block))
+
+    def submit(self, request: T2SRequest) -> T2SRequest:
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("The T2S decode engine is closed.")
+            self._waiting.append(_Sequence(self._next_seq_id, request))
+            self._next_seq_id += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="t2s-engine", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return request
+
+    def decode(self, requests: List[T2SRequest]) -> Tuple[List[torch.LongTensor], List[int]]:
+        """
+        Decode several sequences and wait for all of them.
+        Returns:
+            list: y of every request, as infer_panel_naive_batched().
+            list: idx of every request.
+        """
+        for request in requests:
+            self.submit(request)
+        results = [request.result() for request in requests]
+        return [y for y, _ in results], [idx for _, idx in results]
+
+    def close(self):
+        """
+        Stop accepting sequences; the background thread exits after the submitted ones.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+
+    def stats(self) -> Dict[str, float]:
+        with self._cond:
+            stats = dict(self._stats)
+            stats["waiting"] = len(self._waiting)
+            stats["running"] = len(self._running)
+        stats["free_blocks"] = self.cache.free_blocks
+        stats["num_blocks"] = self.cache.num_blocks
+        stats["mean_step_rows"] = stats["step_rows"] / max(stats["steps"], 1)
+        return stats
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._waiting and not self._running:
+                    if self._closed:
+                        self._thread = None
+                        return
+                    self._cond.wait()
+            try:
+                with torch.no_grad():
+                    self.step()
+            except BaseException as exc:
+                self._fail_all(exc)
+
+    def step(self):
+        """
+        One iteration: decode a token for the running sequences, then admit waiting ones.
+        """
+        if self._running:
+            self._decode_step()
+        self._admit()
+
+    def _admit(self):
+        while len(self._running) < self.max_batch_size:
+            with self._cond:
+                if not self._waiting:
+                    return
+                seq = self._waiting[0]
+                if seq.request.cancelled:
+                    self._waiting.popleft()
+                    self._finish(seq)
+                    continue
+                x_len = seq.request.x.shape[-1]
+                y_len = seq.prefix_len if seq.y is None else seq.y.shape[1]
+                if seq.request.prefix is not None:
+                    x_len += seq.request.prefix.x_len
+                # prefill 之后至少还要能再解码一步
+                if self.cache.blocks_for(x_len + y_len + 1) > self.cache.free_blocks:
+                    if self._running:
+                        return
+                    self._waiting.popleft()
+                    self._finish(seq, RuntimeError(f"The sequence ({x_len + y_len} tokens) does not fit in the kv cache."))
+                    continue
+                self._waiting.popleft()
+            self._prefill(seq)
+
+    def _prefill(self, seq: _Sequence):
+        model = self.model
+        request = seq.request
+        if seq.x_emb is None:
+            x = request.x.unsqueeze(0).to(self.device)
+            bert_feature = request.bert_feature.unsqueeze(0).to(self.device)
+            if request.prefix is not None:
+                seq.x_emb = model.embed_after_prefix(x, bert_feature, request.prefix)
+            else:
+                x = model.ar_text_embedding(x) + model.bert_proj(bert_feature.transpose(1, 2))
+                seq.x_emb = model.ar_text_position(x)
+            if request.prompt is None:
+                seq.y = torch.zeros(1, 0, dtype=torch.int, device=self.device)
+            else:
+                seq.y = request.prompt.view(1, -1).to(self.device)
+        x = seq.x_emb
+        y = seq.y
+        x_len = x.shape[1]
+        prefix = request.prefix
+        if prefix is not None:
+            # 前缀的 kv 直接复制, 只计算目标文本和 prompt 最后一个 token 之后的部分
+            y_pos = model.embed_prefix_tail(y, prefix)
+            src_len = prefix.kv_len + x_len + y_pos.shape[1]
+            x_lens = torch.LongTensor([x_len]).to(self.device)
+            xy_attn_mask = model.prefix_attn_mask(prefix, x_lens, x_len, y_pos.shape[1])
+            xy_dec, k_cache, v_cache = model.t2s_transformer.process_prompt_prefixed(
+                torch.concat([x, y_pos], dim=1), xy_attn_mask, prefix.k_cache, prefix.v_cache, src_len
+            )
+        else:
+            y_len = y.shape[1]
+            xy_pos = torch.concat([x, model.ar_audio_position(model.ar_audio_embedding(y))], dim=1) if y_len > 0 else x
+
+            # 与 infer_panel_naive 的第一步相同: 文本之间互相可见, 语义 token 为因果注意力
+            src_len = x_len + y_len
+            x_attn_mask = F.pad(torch.zeros((x_len, x_len), dtype=torch.bool), (0, y_len), value=True)
+            y_attn_mask = F.pad(
+                torch.triu(torch.ones(y_len, y_len, dtype=torch.bool), diagonal=1), (x_len, 0), value=False
+            )
+            xy_attn_mask = (
+                torch.concat([x_attn_mask, y_attn_mask], dim=0)
+                .view(1, 1, src_len, src_len)
+                .expand(-1, model.num_head, -1, -1)
+                .to(device=self.device)
+            )
+            xy_dec, k_cache, v_cache = model.t2s_transformer.process_prompt(xy_pos, xy_attn_mask, None)
+
+        slots = self.cache.allocate(seq.seq_id, src_len)
+        for i in range(len(k_cache)):
+            self.cache.k_pool[i].index_copy_(0, slots, k_cache[i][0, :src_len])
+            self.cache.v_pool[i].index_copy_(0, slots, v_cache[i][0, :src_len])
+        self._stats["prefills"] += 1
+        with self._cond:
+            self._running.append(seq)
+        self._sampler.add_rows(
+            seq.y,
+            top_k=request.top_k,
+            top_p=request.top_p,
+            temperature=request.temperature,
+            repetition_penalty=request.repetition_penalty,
+            generator=request.generator,
+        )
+        self._sample([len(self._running) - 1], model.ar_predict_layer(xy_dec[:, -1]))
+
+    def _decode_step(self):
+        model = self.model
+        running = self._running
+        # 没有空闲块时抢占最后加入的序列, 释放它的块, 之后重新 prefill 再继续
+        while self.cache.blocks_to_append([seq.seq_id for seq in running]) > self.cache.free_blocks:
+            with self._cond:
+                seq = running.pop()
+                if running:
+                    self._waiting.appendleft(seq)
+            self.cache.free(seq.seq_id)
+            self._sampler.select_rows(range(len(running)))
+            if not running:
+                self._finish(seq, RuntimeError("The sequence does not fit in the kv cache."))
+                return
+            self._stats["preempted"] += 1
+
+        seq_ids = [seq.seq_id for seq in running]
+        write_slots = torch.tensor([self.cache.append(seq_id) for seq_id in seq_ids], device=self.device)
+        read_slots, attn_mask = self.cache.gather(seq_ids)
+        k_buffer, v_buffer = self.cache.buffers(read_slots.numel())
+
+        # 每行的位置不同: 最后一个 token 在 y 中的下标
+        position = model.ar_audio_position
+        positions = torch.tensor([seq.y.shape[1] - 1 for seq in running], device=position.pe.device)
+        y_emb = model.ar_audio_embedding(torch.concat([seq.y[:, -1:] for seq in running], dim=0))
+        xy_pos = y_emb * position.x_scale + position.alpha * position.pe[0, positions].unsqueeze(1).to(
+            dtype=y_emb.dtype, device=y_emb.device
+        )
+        xy_dec = model.t2s_transformer.decode_next_token_paged(
+            xy_pos, self.cache.k_pool, self.cache.v_pool, write_slots, read_slots, k_buffer, v_buffer, attn_mask
+        )
+        logits = model.ar_predict_layer(xy_dec[:, -1])
+        self._stats["steps"] += 1
+        self._stats["step_rows"] += len(running)
+        self._sample(list(range(len(running))), logits)
+
+    def _sample(self, rows: List[int], logits: torch.Tensor):
+        # rows: logits 各行对应的 _running 下标
+        model = self.model
+        sequences = [self._running[row] for row in rows]
+        ###至少预测出10个token不然不给停止（0.4s）, 与 logits[:, :-1] 相同
+        vocab_sizes = [model.EOS if seq.idx < 11 else logits.shape[-1] for seq in sequences]
+        samples, logits = self._sampler.sample(logits, rows, vocab_sizes)
+        eos = ((torch.argmax(logits, dim=-1) == model.EOS) | (samples[:, 0] == model.EOS)).tolist()
+
+        finished = set()
+        for i, seq in enumerate(sequences):
+            request = seq.request
+            seq.y = torch.concat([seq.y, samples[i : i + 1]], dim=1)
+            stop = request.early_stop_num != -1 and (seq.y.shape[1] - seq.prefix_len) > request.early_stop_num
+            stop = stop or eos[i]
+            if stop or request.cancelled or seq.idx == self.max_steps - 1:
+                finished.add(rows[i])
+            else:
+                seq.idx += 1
+        if not finished:
+            return
+        keep = [row for row in range(len(self._running)) if row not in finished]
+        with self._cond:
+            done = [self._running[row] for row in sorted(finished)]
+            self._running[:] = [self._running[row] for row in keep]
+        self._sampler.select_rows(keep)
+        for seq in done:
+            self.cache.free(seq.seq_id)
+            self._finish(seq)
+
+    def _finish(self, seq: _Sequence, error: Optional[BaseException] = None):
+        request = seq.request
+        if error is not None:
+            request.error = error
+        elif seq.y is None:
+            # 开始解码之前就被取消
+            request.y, request.idx = request.prompt, 0
+        else:
+            # 与 infer_panel_naive 相同, 没有参考音频时 idx 为 0
+            request.y, request.idx = seq.y[0, :-1], seq.idx if request.prompt is not None else 0
+        self._stats["finished"] += 1
+        request._done.set()
+
+    def _fail_all(self, exc: BaseException):
+        with self._cond:
+            sequences = list(self._running) + list(self._waiting)
+            self._running.clear()
+            self._waiting.clear()
+        self._sampler.select_rows([])
+        for seq in sequences:
+            self.cache.free(seq.seq_id)
+            self._finish(seq, exc)
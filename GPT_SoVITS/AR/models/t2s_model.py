@@ -10,12 +10,12 @@ from torchmetrics.classification import MulticlassAccuracy
 from tqdm import tqdm
 
 from AR.models.utils import (
+    BatchSampler,
     dpo_loss,
     get_batch_logps,
     make_pad_mask,
     make_pad_mask_left,
     make_reject_y,
-    sample,
     topk_sampling,
 )
 from AR.modules.embedding import SinePositionalEmbedding, TokenEmbedding
@@ -34,6 +34,42 @@ default_config = {
 }
 
 
+# 预分配 kv cache 时每个音素预留的语义 token 数 (25hz 约为 2~4 个), 不够时再扩容
+KV_CACHE_TOKENS_PER_PHONE = 8
+
+
+def kv_cache_len(
+    prefix_len: int,
+    num_phones: int,
+    early_stop_num: int,
+    max_steps: int = 1500,
+    tokens_per_phone: int = KV_CACHE_TOKENS_PER_PHONE,
+) -> int:
+    """
+    Length to preallocate the static kv cache with: the prompt plus the predicted number of
+        generated tokens, bounded by early_stop_num and the maximum number of decoding steps.
+    """
+    steps = max_steps if early_stop_num == -1 else min(max_steps, early_stop_num + 2)
+    return prefix_len + min(steps, num_phones * tokens_per_phone)
+
+
+def grow_kv_cache(cache: List[torch.Tensor], new_len: int) -> List[torch.Tensor]:
+    # 预估的长度不够时才会调用, 复制一次到更大的缓存
+    grown: List[torch.Tensor] = []
+    for buffer in cache:
+        new_buffer = buffer.new_empty((buffer.shape[0], new_len, buffer.shape[2]))
+        new_buffer[:, : buffer.shape[1]] = buffer
+        grown.append(new_buffer)
+    return grown
+
+
+def _cancelled_rows(cancel_tokens: Optional[list], batch_idx_map: List[int]) -> List[bool]:
+    # cancel_tokens 与原始batch的行一一对应, batch_idx_map 为当前仍在解码的行
+    if cancel_tokens is None:
+        return []
+    return [cancel_tokens[i] is not None and cancel_tokens[i].cancelled for i in batch_idx_map]
+
+
 # @torch.jit.script ## 使用的话首次推理会非常慢，而且推理速度不稳定
 # Efficient implementation equivalent to the following:
 def scaled_dot_product_attention(
@@ -173,6 +209,22 @@ class T2SBlock:
         )
         return x, k_cache, v_cache
 
+    def process_prompt_static(
+        self,
+        x: torch.Tensor,
+        attn_mask: torch.Tensor,
+        k_cache: torch.Tensor,
+        v_cache: torch.Tensor,
+        padding_mask: Optional[torch.Tensor] = None,
+        torch_sdpa: bool = True,
+    ):
+        # 与 process_prompt 相同, kv 写入预先分配的缓存的开头
+        x, k, v = self.process_prompt(x, attn_mask, padding_mask, torch_sdpa)
+        kv_len = k.shape[1]
+        k_cache[:, :kv_len] = k
+        v_cache[:, :kv_len] = v
+        return x
+
     def decode_next_token(
         self,
         x: torch.Tensor,
@@ -186,6 +238,79 @@ class T2SBlock:
         k_cache = torch.cat([k_cache, k], dim=1)
         v_cache = torch.cat([v_cache, v], dim=1)
 
+        x = self.attend_next_token(x, q, k_cache, v_cache, attn_mask, torch_sdpa)
+        return x, k_cache, v_cache
+
+    def decode_next_token_static(
+        self,
+        x: torch.Tensor,
+        k_cache: torch.Tensor,
+        v_cache: torch.Tensor,
+        cache_len: int,
+        attn_mask: Optional[torch.Tensor] = None,
+        torch_sdpa: bool = True,
+    ):
+        q, k, v = F.linear(x, self.qkv_w, self.qkv_b).chunk(3, dim=-1)
+
+        # 原地写入预先分配的缓存, 注意力只读取有效的前缀, 不重新分配和复制整个缓存
+        kv_len = cache_len + x.shape[1]
+        k_cache[:, cache_len:kv_len] = k
+        v_cache[:, cache_len:kv_len] = v
+
+        return self.attend_next_token(x, q, k_cache[:, :kv_len], v_cache[:, :kv_len], attn_mask, torch_sdpa)
+
+    def process_prompt_prefixed(
+        self,
+        x: torch.Tensor,
+        attn_mask: torch.Tensor,
+        k_cache: torch.Tensor,
+        v_cache: torch.Tensor,
+        prefix_len: int,
+        torch_sdpa: bool = True,
+    ):
+        # 缓存的前 prefix_len 个位置已经是参考 prompt 的 kv, 只计算其后的 x 个位置
+        q, k, v = F.linear(x, self.qkv_w, self.qkv_b).chunk(3, dim=-1)
+
+        kv_len = prefix_len + x.shape[1]
+        k_cache[:, prefix_len:kv_len] = k
+        v_cache[:, prefix_len:kv_len] = v
+        return self.attend_next_token(x, q, k_cache[:, :kv_len], v_cache[:, :kv_len], attn_mask, torch_sdpa)
+
+    def decode_next_token_paged(
+        self,
+        x: torch.Tensor,
+        k_pool: torch.Tensor,
+        v_pool: torch.Tensor,
+        write_slots: torch.Tensor,
+        read_slots: torch.Tensor,
+        k_buffer: torch.Tensor,
+        v_buffer: torch.Tensor,
+        attn_mask: Optional[torch.Tensor] = None,
+        torch_sdpa: bool = True,
+    ):
+        q, k, v = F.linear(x, self.qkv_w, self.qkv_b).chunk(3, dim=-1)
+
+        # kv 池按位置展平为 (slots, hidden_dim), 每行写入自己的块, 再按块表取出各行的全部位置.
+        # 取出仍要复制 (B, L) 个位置, 但写入复用的缓冲区, 每步每层不再分配新的张量
+        k_pool.index_copy_(0, write_slots, k.squeeze(1))
+        v_pool.index_copy_(0, write_slots, v.squeeze(1))
+        batch_size = read_slots.shape[0]
+        kv_len = read_slots.shape[1]
+        slots = read_slots.view(-1)
+        k_cache = torch.index_select(k_pool, 0, slots, out=k_buffer).view(batch_size, kv_len, -1)
+        v_cache = torch.index_select(v_pool, 0, slots, out=v_buffer).view(batch_size, kv_len, -1)
+
+        return self.attend_next_token(x, q, k_cache, v_cache, attn_mask, torch_sdpa)
+
+    def attend_next_token(
+        self,
+        x: torch.Tensor,
+        q: torch.Tensor,
+        k_cache: torch.Tensor,
+        v_cache: torch.Tensor,
+        attn_mask: Optional[torch.Tensor] = None,
+        torch_sdpa: bool = True,
+    ):
         batch_size = q.shape[0]
         q_len = q.shape[1]
         kv_len = k_cache.shape[1]
@@ -218,7 +343,7 @@ class T2SBlock:
             self.norm_b2,
             self.norm_eps2,
         )
-        return x, k_cache, v_cache
+        return x
 
 
 @torch.jit.script
@@ -256,6 +381,125 @@ class T2STransformer:
             )
         return x, k_cache, v_cache
 
+    def process_prompt_static(
+        self,
+        x: torch.Tensor,
+        attn_mask: torch.Tensor,
+        max_len: int,
+        padding_mask: Optional[torch.Tensor] = None,
+        torch_sdpa: bool = True,
+    ):
+        """
+        process_prompt() with the kv cache preallocated for max_len positions,
+            to be continued with decode_next_token_static().
+        """
+        k_cache: List[torch.Tensor] = []
+        v_cache: List[torch.Tensor] = []
+        for i in range(self.num_blocks):
+            k_buffer = x.new_empty((x.shape[0], max_len, self.blocks[i].hidden_dim))
+            v_buffer = x.new_empty((x.shape[0], max_len, self.blocks[i].hidden_dim))
+            x = self.blocks[i].process_prompt_static(x, attn_mask, k_buffer, v_buffer, padding_mask, torch_sdpa)
+            k_cache.append(k_buffer)
+            v_cache.append(v_buffer)
+        return x, k_cache, v_cache
+
+    def decode_next_token_static(
+        self,
+        x: torch.Tensor,
+        k_cache: List[torch.Tensor],
+        v_cache: List[torch.Tensor],
+        cache_len: int,
+        attn_mask: Optional[torch.Tensor] = None,
+        torch_sdpa: bool = True,
+    ):
+        """
+        Decode one token, writing its keys and values at position cache_len of the caches
+            in place; attn_mask covers the cache_len + 1 valid positions.
+            Several tokens (x of shape (B, n, D), e.g. the draft tokens of speculative decoding)
+            are written at cache_len ... cache_len + n - 1, attn_mask must then be causal.
+        """
+        for i in range(self.num_blocks):
+            x = self.blocks[i].decode_next_token_static(x, k_cache[i], v_cache[i], cache_len, attn_mask, torch_sdpa)
+        return x
+
+    def process_prompt_prefixed(
+        self,
+        x: torch.Tensor,
+        attn_mask: torch.Tensor,
+        prefix_k: List[torch.Tensor],
+        prefix_v: List[torch.Tensor],
+        max_len: int,
+        torch_sdpa: bool = True,
+    ):
+        """
+        process_prompt_static() for the positions after a cached prefix (see T2SPrefix):
+            the caches start with prefix_k/prefix_v, and x only holds the new positions.
+        """
+        k_cache: List[torch.Tensor] = []
+        v_cache: List[torch.Tensor] = []
+        prefix_len = prefix_k[0].shape[1]
+        for i in range(self.num_blocks):
+            k_buffer = x.new_empty((x.shape[0], max_len, self.blocks[i].hidden_dim))
+            v_buffer = x.new_empty((x.shape[0], max_len, self.blocks[i].hidden_dim))
+            k_buffer[:, :prefix_len] = prefix_k[i]
+            v_buffer[:, :prefix_len] = prefix_v[i]
+            x = self.blocks[i].process_prompt_prefixed(x, attn_mask, k_buffer, v_buffer, prefix_len, torch_sdpa)
+            k_cache.append(k_buffer)
+            v_cache.append(v_buffer)
+        return x, k_cache, v_cache
+
+    def decode_next_token_paged(
+        self,
+        x: torch.Tensor,
+        k_pool: List[torch.Tensor],
+        v_pool: List[torch.Tensor],
+        write_slots: torch.Tensor,
+        read_slots: torch.Tensor,
+        k_buffer: torch.Tensor,
+        v_buffer: torch.Tensor,
+        attn_mask: Optional[torch.Tensor] = None,
+        torch_sdpa: bool = True,
+    ):
+        """
+        Decode one token for rows whose kv caches live in the block pools of a PagedKVCache.
+            write_slots (B,) is the pool position of each row's new token, read_slots (B, L) all
+            positions of each row padded to the longest one, and attn_mask masks the padding.
+            Every layer gathers the B * L positions of its pools into k_buffer/v_buffer
+            (B * L, hidden_dim), which the layers reuse one after another. The gather copies
+            about as much memory as the attention reads, so a step costs more than with the
+            contiguous static cache (see tools/bench_kv_cache.py).
+        """
+        for i in range(self.num_blocks):
+            x = self.blocks[i].decode_next_token_paged(
+                x, k_pool[i], v_pool[i], write_slots, read_slots, k_buffer, v_buffer, attn_mask, torch_sdpa
+            )
+        return x
+
+
+class T2SPrefix:
+    """
+    Cached transformer states of a reference prompt, see Text2SemanticDecoder.build_prefix().
+        The keys/values cover the prompt phones and all prompt semantic tokens but the last;
+        the last token is run again with every segment so that the first prediction sees its text.
+    Args:
+        k_cache: list, (1, x_len + y_len - 1, hidden_dim) keys of every layer.
+        v_cache: list, (1, x_len + y_len - 1, hidden_dim) values of every layer.
+        x_len: int, number of prompt phones.
+        y_len: int, number of prompt semantic tokens.
+        prompt: torch.LongTensor, (1, y_len) prompt semantic tokens.
+    """
+
+    def __init__(self, k_cache: List[torch.Tensor], v_cache: List[torch.Tensor], x_len: int, y_len: int, prompt):
+        self.k_cache = k_cache
+        self.v_cache = v_cache
+        self.x_len = x_len
+        self.y_len = y_len
+        self.prompt = prompt
+
+    @property
+    def kv_len(self) -> int:
+        return self.x_len + self.y_len - 1
+
 
 class Text2SemanticDecoder(nn.Module):
     def __init__(self, config, norm_first=False, top_k=3):
@@ -575,6 +819,110 @@ class Text2SemanticDecoder(nn.Module):
             y = torch.concat([y, samples], dim=1)
         return y
 
+    def build_prefix(
+        self,
+        phones: torch.LongTensor,
+        bert_feature: torch.Tensor,
+        prompt: torch.LongTensor,
+    ) -> T2SPrefix:
+        """
+        Compute the transformer states of a reference prompt once, for the prefix mode of
+            infer_panel_batch_infer()/infer_panel_naive() (the "prefix" kwarg).
+            In the normal layout all phones attend to each other and the prompt semantic tokens
+            attend to the target text, so nothing of the prompt can be reused between segments.
+            In the prefix mode the prompt phones and prompt semantic tokens only attend to the
+            prompt; the target text and the generated tokens still attend to everything. The
+            prefill of a segment then only covers its own text, at the price of outputs that
+            differ from the normal layout.
+        Args:
+            phones: torch.LongTensor, (P,) phoneme ids of the prompt text.
+            bert_feature: torch.Tensor, (1024, P) BERT features of the prompt text.
+            prompt: torch.LongTensor, (Y,) semantic tokens of the reference audio.
+        Returns:
+            T2SPrefix: the cached states.
+        """
+        x = self.ar_text_embedding(phones.unsqueeze(0))
+        x = x + self.bert_proj(bert_feature.unsqueeze(0).transpose(1, 2))
+        x = self.ar_text_position(x)
+        prompt = prompt.view(1, -1)
+        assert prompt.shape[1] > 0, "Error: the prefix needs at least one prompt semantic token!"
+        y_pos = self.ar_audio_position(self.ar_audio_embedding(prompt[:, :-1]))
+        xy_pos = torch.concat([x, y_pos], dim=1)
+
+        x_len = x.shape[1]
+        y_len = y_pos.shape[1]
+        x_attn_mask = F.pad(torch.zeros((x_len, x_len), dtype=torch.bool), (0, y_len), value=True)
+        y_attn_mask = F.pad(torch.triu(torch.ones(y_len, y_len, dtype=torch.bool), diagonal=1), (x_len, 0), value=False)
+        xy_attn_mask = (
+            torch.concat([x_attn_mask, y_attn_mask], dim=0)
+            .view(1, 1, x_len + y_len, x_len + y_len)
+            .expand(-1, self.num_head, -1, -1)
+            .to(device=x.device)
+        )
+        _, k_cache, v_cache = self.t2s_transformer.process_prompt(xy_pos, xy_attn_mask, None)
+        return T2SPrefix(k_cache, v_cache, x_len, prompt.shape[1], prompt)
+
+    def embed_after_prefix(self, x: torch.LongTensor, bert_feature: torch.Tensor, prefix: T2SPrefix) -> torch.Tensor:
+        # 目标文本的位置接在 prompt 音素之后, 与正常布局中拼接后的位置编码相同
+        x = self.ar_text_embedding(x)
+        x = x + self.bert_proj(bert_feature.transpose(1, 2))
+        position = self.ar_text_position
+        end = prefix.x_len + x.shape[1]
+        if position.pe.size(1) < end:
+            position.extend_pe(x.new_zeros(1, end))
+        pe = position.pe[:, prefix.x_len : end].to(dtype=x.dtype, device=x.device)
+        return x * position.x_scale + position.alpha * pe
+
+    def embed_prefix_tail(self, y: torch.LongTensor, prefix: T2SPrefix) -> torch.Tensor:
+        # y 中从 prompt 最后一个 token 开始、尚未写入前缀缓存的部分
+        y_emb = self.ar_audio_embedding(y[:, prefix.y_len - 1 :])
+        position = self.ar_audio_position
+        if position.pe.size(1) < y.shape[1]:
+            position.extend_pe(y_emb.new_zeros(1, y.shape[1]))
+        pe = position.pe[:, prefix.y_len - 1 : y.shape[1]].to(dtype=y_emb.dtype, device=y_emb.device)
+        return y_emb * position.x_scale + position.alpha * pe
+
+    def prefix_attn_mask(self, prefix: T2SPrefix, x_lens: torch.LongTensor, x_len: int, y_len: int) -> torch.Tensor:
+        """
+        Attention mask of a prefill after a cached prefix.
+            The queries are the (left padded) target text and the y_len semantic tokens after
+            the prefix, the keys the prefix followed by the same positions. True is masked.
+        Returns:
+            torch.BoolTensor: (B, num_head, x_len + y_len, prefix.kv_len + x_len + y_len).
+        """
+        device = x_lens.device
+        prompt_x_len = prefix.x_len
+        prompt_y_len = prefix.kv_len - prefix.x_len
+        # 目标文本: 看得到 prompt 音素和全部目标文本, 看不到 prompt 语义 token
+        x_rows = torch.concat(
+            [
+                torch.zeros(x_len, prompt_x_len, dtype=torch.bool),
+                torch.ones(x_len, prompt_y_len, dtype=torch.bool),
+                torch.zeros(x_len, x_len, dtype=torch.bool),
+                torch.ones(x_len, y_len, dtype=torch.bool),
+            ],
+            dim=1,
+        )
+        # 语义 token: 看得到整个前缀和目标文本, 之间为因果注意力
+        y_rows = torch.concat(
+            [
+                torch.zeros(y_len, prefix.kv_len + x_len, dtype=torch.bool),
+                torch.triu(torch.ones(y_len, y_len, dtype=torch.bool), diagonal=1),
+            ],
+            dim=1,
+        )
+        bsz = x_lens.shape[0]
+        padding_mask = torch.concat(
+            [
+                torch.zeros(bsz, prefix.kv_len, dtype=torch.bool, device=device),
+                make_pad_mask_left(x_lens, x_len),
+                torch.zeros(bsz, y_len, dtype=torch.bool, device=device),
+            ],
+            dim=1,
+        )
+        attn_mask = torch.concat([x_rows, y_rows], dim=0).to(device).unsqueeze(0).logical_or(padding_mask.unsqueeze(1))
+        return attn_mask.unsqueeze(1).expand(-1, self.num_head, -1, -1)
+
     def pad_y_eos(self, y, y_mask_int, eos_id):
         targets = F.pad(y, (0, 1), value=0) + eos_id * F.pad(y_mask_int, (0, 1), value=1)
         # 错位
@@ -608,12 +956,17 @@ class Text2SemanticDecoder(nn.Module):
             )
 
         max_len = kwargs.get("max_len", x_lens.max())
+        # 参考 prompt 的缓存状态 (见 build_prefix), 此时 x 和 bert_feature 只有目标文本
+        prefix: Optional[T2SPrefix] = kwargs.get("prefix", None)
         x_list = []
         for x_item, bert_item in zip(x, bert_feature):
             # max_len = max(max_len, x_item.shape[0], bert_item.shape[1])
-            x_item = self.ar_text_embedding(x_item.unsqueeze(0))
-            x_item = x_item + self.bert_proj(bert_item.transpose(0, 1).unsqueeze(0))
-            x_item = self.ar_text_position(x_item).squeeze(0)
+            if prefix is not None:
+                x_item = self.embed_after_prefix(x_item.unsqueeze(0), bert_item.unsqueeze(0), prefix).squeeze(0)
+            else:
+                x_item = self.ar_text_embedding(x_item.unsqueeze(0))
+                x_item = x_item + self.bert_proj(bert_item.transpose(0, 1).unsqueeze(0))
+                x_item = self.ar_text_position(x_item).squeeze(0)
             # x_item = F.pad(x_item,(0,0,0,max_len-x_item.shape[0]),value=0) if x_item.shape[0]<max_len else x_item  ### padding right
             x_item = (
                 F.pad(x_item, (0, 0, max_len - x_item.shape[0], 0), value=0) if x_item.shape[0] < max_len else x_item
@@ -637,50 +990,56 @@ class Text2SemanticDecoder(nn.Module):
         y_len = y_emb.shape[1]
         prefix_len = y.shape[1]
         y_lens = torch.LongTensor([y_emb.shape[1]] * y_emb.shape[0]).to(x.device)
-        y_pos = self.ar_audio_position(y_emb)
-        xy_pos = torch.concat([x, y_pos], dim=1)
-
-        ##### create mask #####
         bsz = x.shape[0]
-        src_len = x_len + y_len
-        y_paddind_mask = make_pad_mask_left(y_lens, y_len)
-        x_paddind_mask = make_pad_mask_left(x_lens, max_len)
+        if prefix is not None:
+            # 前缀的 kv 已经计算好, prefill 只处理目标文本和 prompt 的最后一个 token
+            xy_pos = torch.concat([x, self.embed_prefix_tail(y, prefix)], dim=1)
+            src_len = prefix.kv_len + x_len + 1
+            attn_mask = self.prefix_attn_mask(prefix, x_lens, x_len, 1)
+        else:
+            y_pos = self.ar_audio_position(y_emb)
+            xy_pos = torch.concat([x, y_pos], dim=1)
 
-        # (bsz, x_len + y_len)
-        padding_mask = torch.concat([x_paddind_mask, y_paddind_mask], dim=1)
+            ##### create mask #####
+            src_len = x_len + y_len
+            y_paddind_mask = make_pad_mask_left(y_lens, y_len)
+            x_paddind_mask = make_pad_mask_left(x_lens, max_len)
 
-        x_mask = F.pad(
-            torch.zeros(x_len, x_len, dtype=torch.bool, device=x.device),
-            (0, y_len),
-            value=True,
-        )
+            # (bsz, x_len + y_len)
+            padding_mask = torch.concat([x_paddind_mask, y_paddind_mask], dim=1)
 
-        y_mask = F.pad(  ###yy的右上1扩展到左边xy的0,(y,x+y)
-            torch.triu(torch.ones(y_len, y_len, dtype=torch.bool, device=x.device), diagonal=1),
-            (x_len, 0),
-            value=False,
-        )
+            x_mask = F.pad(
+                torch.zeros(x_len, x_len, dtype=torch.bool, device=x.device),
+                (0, y_len),
+                value=True,
+            )
 
-        causal_mask = torch.concat([x_mask, y_mask], dim=0).view(1, src_len, src_len).repeat(bsz, 1, 1).to(x.device)
-        # padding_mask = padding_mask.unsqueeze(1) * padding_mask.unsqueeze(2) ### [b, x+y, x+y]
-        ### 上面是错误的，会导致padding的token被"看见"
+            y_mask = F.pad(  ###yy的右上1扩展到左边xy的0,(y,x+y)
+                torch.triu(torch.ones(y_len, y_len, dtype=torch.bool, device=x.device), diagonal=1),
+                (x_len, 0),
+                value=False,
+            )
 
-        # 正确的padding_mask应该是：
-        # |   pad_len   |  x_len  |  y_len  |
-        # [[PAD, PAD, PAD, 1, 2, 3, 4, 5, 6],
-        # [PAD, PAD, PAD, 1, 2, 3, 4, 5, 6],
-        # [PAD, PAD, PAD, 1, 2, 3, 4, 5, 6],  前3行按理说也应该被mask掉，但是为了防止计算attention时不出现nan，还是保留了，不影响结果
-        # [PAD, PAD, PAD, 1, 2, 3, 4, 5, 6],
-        # [PAD, PAD, PAD, 1, 2, 3, 4, 5, 6],
-        # [PAD, PAD, PAD, 1, 2, 3, 4, 5, 6],
-        # [PAD, PAD, PAD, 1, 2, 3, 4, 5, 6],
-        # [PAD, PAD, PAD, 1, 2, 3, 4, 5, 6],
-        # [PAD, PAD, PAD, 1, 2, 3, 4, 5, 6]]
+            causal_mask = torch.concat([x_mask, y_mask], dim=0).view(1, src_len, src_len).repeat(bsz, 1, 1).to(x.device)
+            # padding_mask = padding_mask.unsqueeze(1) * padding_mask.unsqueeze(2) ### [b, x+y, x+y]
+            ### 上面是错误的，会导致padding的token被"看见"
+
+            # 正确的padding_mask应该是：
+            # |   pad_len   |  x_len  |  y_len  |
+            # [[PAD, PAD, PAD, 1, 2, 3, 4, 5, 6],
+            # [PAD, PAD, PAD, 1, 2, 3, 4, 5, 6],
+            # [PAD, PAD, PAD, 1, 2, 3, 4, 5, 6],  前3行按理说也应该被mask掉，但是为了防止计算attention时不出现nan，还是保留了，不影响结果
+            # [PAD, PAD, PAD, 1, 2, 3, 4, 5, 6],
+            # [PAD, PAD, PAD, 1, 2, 3, 4, 5, 6],
+            # [PAD, PAD, PAD, 1, 2, 3, 4, 5, 6],
+            # [PAD, PAD, PAD, 1, 2, 3, 4, 5, 6],
+            # [PAD, PAD, PAD, 1, 2, 3, 4, 5, 6],
+            # [PAD, PAD, PAD, 1, 2, 3, 4, 5, 6]]
 
-        padding_mask = padding_mask.view(bsz, 1, src_len).repeat(1, src_len, 1)
+            padding_mask = padding_mask.view(bsz, 1, src_len).repeat(1, src_len, 1)
 
-        attn_mask: torch.Tensor = causal_mask.logical_or(padding_mask)
-        attn_mask = attn_mask.unsqueeze(1).expand(-1, self.num_head, -1, -1).bool()
+            attn_mask: torch.Tensor = causal_mask.logical_or(padding_mask)
+            attn_mask = attn_mask.unsqueeze(1).expand(-1, self.num_head, -1, -1).bool()
 
         # 正确的attn_mask应该是这样的：
         # |   pad_len   |  x_len  |  y_len  |
@@ -698,32 +1057,65 @@ class Text2SemanticDecoder(nn.Module):
         y_list = [None] * y.shape[0]
         batch_idx_map = list(range(y.shape[0]))
         idx_list = [None] * y.shape[0]
+        # 每行一个取消令牌(可为None), 被取消的行和生成完毕的行一样移出batch并释放其kv cache
+        cancel_tokens = kwargs.get("cancel_tokens", None)
+        # 每个请求自己的随机数生成器, 为 None 时使用全局随机状态; 也可以是每行一个生成器的列表
+        generator = kwargs.get("generator", None)
+        # 预先分配 kv cache 并原地写入, 否则每一步都要重新分配并复制整个缓存
+        static_kv_cache = kwargs.get("static_kv_cache", True)
+        cache_size = kv_cache_len(src_len, int(x_lens.max()), early_stop_num)
+        cache_len = src_len
+        # 逐行记录出现过的 token, 重复惩罚不必每一步都 gather 整个历史
+        sampler = BatchSampler(self.vocab_size, x.device)
+        sampler.add_rows(y, top_k, top_p, temperature, repetition_penalty, generator)
         for idx in tqdm(range(1500)):
-            if idx == 0:
+            if idx == 0 and prefix is not None:
+                xy_dec, k_cache, v_cache = self.t2s_transformer.process_prompt_prefixed(
+                    xy_pos, attn_mask, prefix.k_cache, prefix.v_cache, cache_size
+                )
+                if not static_kv_cache:
+                    k_cache = [k[:, :src_len] for k in k_cache]
+                    v_cache = [v[:, :src_len] for v in v_cache]
+            elif idx == 0 and static_kv_cache:
+                xy_dec, k_cache, v_cache = self.t2s_transformer.process_prompt_static(xy_pos, attn_mask, cache_size)
+            elif idx == 0:
                 xy_dec, k_cache, v_cache = self.t2s_transformer.process_prompt(xy_pos, attn_mask, None)
+            elif static_kv_cache:
+                if cache_len == cache_size:
+                    cache_size = min(cache_size * 2, src_len + 1500)
+                    k_cache = grow_kv_cache(k_cache, cache_size)
+                    v_cache = grow_kv_cache(v_cache, cache_size)
+                    attn_mask = F.pad(attn_mask, (0, cache_size - attn_mask.shape[-1]), value=False)
+                xy_dec = self.t2s_transformer.decode_next_token_static(
+                    xy_pos, k_cache, v_cache, cache_len, attn_mask[..., : cache_len + 1]
+                )
+                cache_len += 1
             else:
                 xy_dec, k_cache, v_cache = self.t2s_transformer.decode_next_token(xy_pos, k_cache, v_cache, attn_mask)
             logits = self.ar_predict_layer(xy_dec[:, -1])
 
             if idx == 0:
-                attn_mask = F.pad(attn_mask[:, :, -1].unsqueeze(-2), (0, 1), value=False)
+                # 静态缓存时 mask 也按缓存长度预先分配, 每一步只取有效的前缀
+                pad = cache_size - src_len if static_kv_cache else 1
+                attn_mask = F.pad(attn_mask[:, :, -1].unsqueeze(-2), (0, pad), value=False)
                 logits = logits[:, :-1]
-            else:
+            elif not static_kv_cache:
                 attn_mask = F.pad(attn_mask, (0, 1), value=False)
 
-            samples = sample(
-                logits, y, top_k=top_k, top_p=top_p, repetition_penalty=repetition_penalty, temperature=temperature
-            )[0]
+            samples, logits = sampler.sample(logits)
 
             y = torch.concat([y, samples], dim=1)
 
             ####### 移除batch中已经生成完毕的序列,进一步优化计算量
             tokens = torch.argmax(logits, dim=-1)
             reserved_idx_of_batch_for_y = None
-            if (self.EOS in samples[:, 0]) or (self.EOS in tokens):  ###如果生成到EOS，则停止
+            cancelled = _cancelled_rows(cancel_tokens, batch_idx_map)
+            if (self.EOS in samples[:, 0]) or (self.EOS in tokens) or any(cancelled):  ###如果生成到EOS，则停止
                 l1 = samples[:, 0] == self.EOS
                 l2 = tokens == self.EOS
                 l = l1.logical_or(l2)
+                if any(cancelled):
+                    l = l.logical_or(torch.tensor(cancelled, dtype=torch.bool, device=l.device))
                 removed_idx_of_batch_for_y = torch.where(l == True)[0].tolist()
                 reserved_idx_of_batch_for_y = torch.where(l == False)[0]
                 # batch_indexs = torch.tensor(batch_idx_map, device=y.device)[removed_idx_of_batch_for_y]
@@ -738,6 +1130,7 @@ class Text2SemanticDecoder(nn.Module):
             if reserved_idx_of_batch_for_y is not None:
                 # index = torch.LongTensor(batch_idx_map).to(y.device)
                 y = torch.index_select(y, dim=0, index=reserved_idx_of_batch_for_y)
+                sampler.select_rows(reserved_idx_of_batch_for_y.tolist())
                 attn_mask = torch.index_select(attn_mask, dim=0, index=reserved_idx_of_batch_for_y)
                 if k_cache is not None:
                     for i in range(len(k_cache)):
@@ -793,8 +1186,16 @@ class Text2SemanticDecoder(nn.Module):
     ):
         y_list = []
         idx_list = []
+        cancel_tokens = kwargs.pop("cancel_tokens", None)
+        generators = kwargs.get("generator", None)
+        # 给出草稿模型时逐行使用投机解码
+        infer_panel = self.infer_panel_speculative if kwargs.get("draft_model") is not None else self.infer_panel_naive
         for i in range(len(x)):
-            y, idx = self.infer_panel_naive(
+            if cancel_tokens is not None:
+                kwargs["cancel_tokens"] = [cancel_tokens[i]]
+            if isinstance(generators, (list, tuple)):
+                kwargs["generator"] = generators[i]
+            y, idx = infer_panel(
                 x[i].unsqueeze(0),
                 x_lens[i],
                 prompts[i].unsqueeze(0) if prompts is not None else None,
@@ -824,9 +1225,14 @@ class Text2SemanticDecoder(nn.Module):
         repetition_penalty: float = 1.35,
         **kwargs,
     ):
-        x = self.ar_text_embedding(x)
-        x = x + self.bert_proj(bert_feature.transpose(1, 2))
-        x = self.ar_text_position(x)
+        # 参考 prompt 的缓存状态 (见 build_prefix), 此时 x 和 bert_feature 只有目标文本
+        prefix: Optional[T2SPrefix] = kwargs.get("prefix", None)
+        if prefix is not None:
+            x = self.embed_after_prefix(x, bert_feature, prefix)
+        else:
+            x = self.ar_text_embedding(x)
+            x = x + self.bert_proj(bert_feature.transpose(1, 2))
+            x = self.ar_text_position(x)
 
         # AR Decoder
         y = prompts
@@ -856,28 +1262,59 @@ class Text2SemanticDecoder(nn.Module):
             ref_free = True
 
         bsz = x.shape[0]
-        src_len = x_len + y_len
-        x_attn_mask_pad = F.pad(
-            x_attn_mask,
-            (0, y_len),  ###xx的纯0扩展到xx纯0+xy纯1，(x,x+y)
-            value=True,
-        )
-        y_attn_mask = F.pad(  ###yy的右上1扩展到左边xy的0,(y,x+y)
-            torch.triu(torch.ones(y_len, y_len, dtype=torch.bool), diagonal=1),
-            (x_len, 0),
-            value=False,
-        )
-        xy_attn_mask = (
-            torch.concat([x_attn_mask_pad, y_attn_mask], dim=0)
-            .unsqueeze(0)
-            .expand(bsz * self.num_head, -1, -1)
-            .view(bsz, self.num_head, src_len, src_len)
-            .to(device=x.device, dtype=torch.bool)
-        )
+        if prefix is not None:
+            # 前缀的 kv 已经计算好, prefill 只处理目标文本和 prompt 的最后一个 token
+            xy_pos = torch.concat([x, self.embed_prefix_tail(y, prefix)], dim=1)
+            src_len = prefix.kv_len + x_len + 1
+            xy_attn_mask = self.prefix_attn_mask(prefix, torch.LongTensor([x_len] * bsz).to(x.device), x_len, 1)
+        else:
+            src_len = x_len + y_len
+            x_attn_mask_pad = F.pad(
+                x_attn_mask,
+                (0, y_len),  ###xx的纯0扩展到xx纯0+xy纯1，(x,x+y)
+                value=True,
+            )
+            y_attn_mask = F.pad(  ###yy的右上1扩展到左边xy的0,(y,x+y)
+                torch.triu(torch.ones(y_len, y_len, dtype=torch.bool), diagonal=1),
+                (x_len, 0),
+                value=False,
+            )
+            xy_attn_mask = (
+                torch.concat([x_attn_mask_pad, y_attn_mask], dim=0)
+                .unsqueeze(0)
+                .expand(bsz * self.num_head, -1, -1)
+                .view(bsz, self.num_head, src_len, src_len)
+                .to(device=x.device, dtype=torch.bool)
+            )
 
+        cancel_tokens = kwargs.get("cancel_tokens", None)
+        # 每个请求自己的随机数生成器, 为 None 时使用全局随机状态
+        generator = kwargs.get("generator", None)
+        # 预先分配 kv cache 并原地写入, 否则每一步都要重新分配并复制整个缓存
+        static_kv_cache = kwargs.get("static_kv_cache", True)
+        cache_size = kv_cache_len(src_len, int(x_len), early_stop_num)
+        cache_len = src_len
+        sampler = BatchSampler(self.vocab_size, x.device)
+        sampler.add_rows(y, top_k, top_p, temperature, repetition_penalty, generator)
         for idx in tqdm(range(1500)):
-            if xy_attn_mask is not None:
+            if xy_attn_mask is not None and prefix is not None:
+                xy_dec, k_cache, v_cache = self.t2s_transformer.process_prompt_prefixed(
+                    xy_pos, xy_attn_mask, prefix.k_cache, prefix.v_cache, cache_size
+                )
+                if not static_kv_cache:
+                    k_cache = [k[:, :src_len] for k in k_cache]
+                    v_cache = [v[:, :src_len] for v in v_cache]
+            elif xy_attn_mask is not None and static_kv_cache:
+                xy_dec, k_cache, v_cache = self.t2s_transformer.process_prompt_static(xy_pos, xy_attn_mask, cache_size)
+            elif xy_attn_mask is not None:
                 xy_dec, k_cache, v_cache = self.t2s_transformer.process_prompt(xy_pos, xy_attn_mask, None)
+            elif static_kv_cache:
+                if cache_len == cache_size:
+                    cache_size = min(cache_size * 2, src_len + 1500)
+                    k_cache = grow_kv_cache(k_cache, cache_size)
+                    v_cache = grow_kv_cache(v_cache, cache_size)
+                xy_dec = self.t2s_transformer.decode_next_token_static(xy_pos, k_cache, v_cache, cache_len)
+                cache_len += 1
             else:
                 xy_dec, k_cache, v_cache = self.t2s_transformer.decode_next_token(xy_pos, k_cache, v_cache)
 
@@ -888,9 +1325,7 @@ class Text2SemanticDecoder(nn.Module):
             if idx < 11:  ###至少预测出10个token不然不给停止（0.4s）
                 logits = logits[:, :-1]
 
-            samples = sample(
-                logits, y, top_k=top_k, top_p=top_p, repetition_penalty=repetition_penalty, temperature=temperature
-            )[0]
+            samples, logits = sampler.sample(logits)
 
             y = torch.concat([y, samples], dim=1)
 
@@ -900,6 +1335,9 @@ class Text2SemanticDecoder(nn.Module):
 
             if torch.argmax(logits, dim=-1)[0] == self.EOS or samples[0, 0] == self.EOS:
                 stop = True
+            if any(_cancelled_rows(cancel_tokens, [0])):
+                # 请求已被取消, 结果会被丢弃
+                stop = True
             if stop:
                 if y.shape[1] == 0:
                     y = torch.concat([y, torch.zeros_like(samples)], dim=1)
@@ -917,6 +1355,224 @@ class Text2SemanticDecoder(nn.Module):
             return y[:, :-1], 0
         return y[:, :-1], idx
 
+    def _speculative_prefill(
+        self,
+        x: torch.LongTensor,
+        bert_feature: torch.Tensor,
+        y: torch.LongTensor,
+        prefix: Optional[T2SPrefix],
+        cache_size: int,
+    ):
+        # 与 infer_panel_naive 的第一步相同, kv 写入预先分配的 cache_size 长的缓存
+        if prefix is not None:
+            x = self.embed_after_prefix(x, bert_feature, prefix)
+        else:
+            x = self.ar_text_embedding(x)
+            x = x + self.bert_proj(bert_feature.transpose(1, 2))
+            x = self.ar_text_position(x)
+        x_len = x.shape[1]
+        y_len = y.shape[1]
+        if prefix is not None:
+            xy_pos = torch.concat([x, self.embed_prefix_tail(y, prefix)], dim=1)
+            src_len = prefix.kv_len + x_len + 1
+            xy_attn_mask = self.prefix_attn_mask(prefix, torch.LongTensor([x_len]).to(x.device), x_len, 1)
+            xy_dec, k_cache, v_cache = self.t2s_transformer.process_prompt_prefixed(
+                xy_pos, xy_attn_mask, prefix.k_cache, prefix.v_cache, cache_size
+            )
+        else:
+            if y_len > 0:
+                xy_pos = torch.concat([x, self.ar_audio_position(self.ar_audio_embedding(y))], dim=1)
+            else:
+                xy_pos = x
+            src_len = x_len + y_len
+            x_attn_mask = F.pad(torch.zeros((x_len, x_len), dtype=torch.bool), (0, y_len), value=True)
+            y_attn_mask = F.pad(torch.triu(torch.ones(y_len, y_len, dtype=torch.bool), diagonal=1), (x_len, 0), value=False)
+            xy_attn_mask = (
+                torch.concat([x_attn_mask, y_attn_mask], dim=0)
+                .view(1, 1, src_len, src_len)
+                .expand(-1, self.num_head, -1, -1)
+                .to(device=x.device)
+            )
+            xy_dec, k_cache, v_cache = self.t2s_transformer.process_prompt_static(xy_pos, xy_attn_mask, cache_size)
+        return self.ar_predict_layer(xy_dec[:, -1]), k_cache, v_cache, src_len
+
+    def _speculative_decode(
+        self,
+        tokens: torch.LongTensor,
+        k_cache: List[torch.Tensor],
+        v_cache: List[torch.Tensor],
+        cache_len: int,
+        start: int,
+    ) -> torch.Tensor:
+        # tokens (1, n) 是 y 中从 start 开始的 n 个 token, 返回每个位置预测下一个 token 的 logits (n, V)
+        num_tokens = tokens.shape[1]
+        position = self.ar_audio_position
+        y_emb = self.ar_audio_embedding(tokens)
+        xy_pos = y_emb * position.x_scale + position.alpha * position.pe[:, start : start + num_tokens].to(
+            dtype=y_emb.dtype, device=y_emb.device
+        )
+        attn_mask = None
+        if num_tokens > 1:
+            kv_len = cache_len + num_tokens
+            attn_mask = torch.arange(kv_len, device=tokens.device).unsqueeze(0) > (
+                torch.arange(num_tokens, device=tokens.device) + cache_len
+            ).unsqueeze(1)
+            attn_mask = attn_mask.view(1, 1, num_tokens, kv_len)
+        xy_dec = self.t2s_transformer.decode_next_token_static(xy_pos, k_cache, v_cache, cache_len, attn_mask)
+        return self.ar_predict_layer(xy_dec[0])
+
+    def infer_panel_speculative(
+        self,
+        x: torch.LongTensor,  #####全部文本token
+        x_lens: torch.LongTensor,
+        prompts: torch.LongTensor,  ####参考音频token
+        bert_feature: torch.LongTensor,
+        top_k: int = -100,
+        top_p: int = 100,
+        early_stop_num: int = -1,
+        temperature: float = 1.0,
+        repetition_penalty: float = 1.35,
+        **kwargs,
+    ):
+        """
+        infer_panel_naive() with speculative decoding (one row).
+            A small draft model proposes num_draft_tokens tokens one by one; this model scores
+            all of them in one forward pass over its kv cache. A draft token d is accepted with
+            probability min(1, p(d) / q(d)), p and q being the distributions of this model and
+            of the draft model after the repetition penalty, top-k, top-p and temperature. At
+            the first rejection the token is sampled from max(p - q, 0) instead, and when all
+            are accepted one more token is sampled from p. The tokens thus follow the same
+            distribution as with infer_panel_naive() (but use other random numbers), while this
+            model runs once per accepted run of tokens instead of once per token.
+        Args:
+            kwargs["draft_model"]: Text2SemanticDecoder, the draft model, with the same phoneme
+                and semantic vocabularies (e.g. a GPT model with a few layers trained by s1_train.py).
+            kwargs["num_draft_tokens"]: int, tokens proposed per step, 4 by default.
+            kwargs["stats"]: dict, optional, "proposed", "accepted", "steps" (forward passes of
+                this model, including the prefill) and "tokens" are added to it.
+            The other kwargs are those of infer_panel_naive() (generator, cancel_tokens, prefix).
+        Returns:
+            as infer_panel_naive().
+        """
+        draft: Text2SemanticDecoder = kwargs["draft_model"]
+        num_draft_tokens = max(0, int(kwargs.get("num_draft_tokens", 4)))
+        prefix: Optional[T2SPrefix] = kwargs.get("prefix", None)
+        cancel_tokens = kwargs.get("cancel_tokens", None)
+        generator = kwargs.get("generator", None)
+        stats = kwargs.get("stats", None)
+        max_steps = 1500
+
+        ref_free = prompts is None
+        y = prompts if prompts is not None else torch.zeros(1, 0, dtype=torch.int, device=x.device)
+        prefix_len = y.shape[1]
+        x_len = x.shape[1] + (prefix.x_len if prefix is not None else 0)
+        # 校验时一次写入 num_draft_tokens + 1 个位置
+        reserve = num_draft_tokens + 1
+        cache_size = kv_cache_len(prefix_len + x_len, x.shape[1], early_stop_num) + reserve
+        logits, k_cache, v_cache, src_len = self._speculative_prefill(x, bert_feature, y, prefix, cache_size)
+        # 草稿模型不使用前缀模式 (前缀模式下 x 中没有参考文本), 只影响接受率
+        draft_size = kv_cache_len(prefix_len + x.shape[1], x.shape[1], early_stop_num) + reserve
+        _, draft_k, draft_v, draft_src_len = draft._speculative_prefill(x, bert_feature, y, None, draft_size)
+        # 两个模型的缓存中各有 y 的前多少个 token
+        main_y, draft_y = prefix_len, prefix_len
+
+        def vocab_sizes(first_idx: int, num: int) -> List[int]:
+            ###至少预测出10个token不然不给停止（0.4s）
+            return [self.EOS if first_idx + i < 11 else self.vocab_size for i in range(num)]
+
+        sampler = BatchSampler(self.vocab_size, x.device)
+        sampler.add_rows(y, top_k, top_p, temperature, repetition_penalty, generator)
+        probs, penalized = sampler.probs(logits, vocab_sizes=vocab_sizes(0, 1))
+        new_tokens = torch.multinomial(probs, 1, generator=generator).view(-1)
+        proposed = accepted = 0
+        steps = 1
+        idx = -1
+        stop = False
+        while True:
+            ###### 逐个处理新 token, 停止条件与 infer_panel_naive 相同 ######
+            eos = (torch.argmax(penalized, dim=-1) == self.EOS).logical_or(new_tokens == self.EOS).tolist()
+            for i in range(new_tokens.shape[0]):
+                idx += 1
+                y = torch.concat([y, new_tokens[i : i + 1].view(1, 1).to(dtype=y.dtype)], dim=1)
+                sampler.observe(new_tokens[i : i + 1])
+                if early_stop_num != -1 and (y.shape[1] - prefix_len) > early_stop_num:
+                    print("use early stop num:", early_stop_num)
+                    stop = True
+                stop = stop or eos[i] or idx == max_steps - 1
+                if stop:
+                    break
+            if any(_cancelled_rows(cancel_tokens, [0])):
+                # 请求已被取消, 结果会被丢弃
+                stop = True
+            if stop:
+                if y.shape[1] == 0:
+                    y = torch.concat([y, torch.zeros_like(y[:, :1])], dim=1)
+                    print("bad zero prediction")
+                print(f"T2S Decoding EOS [{prefix_len} -> {y.shape[1]}]")
+                break
+
+            ###### 草稿模型逐个提出 token ######
+            num_tokens = num_draft_tokens
+            if early_stop_num != -1:
+                num_tokens = min(num_tokens, early_stop_num - (y.shape[1] - prefix_len))
+            num_tokens = max(0, min(num_tokens, max_steps - 2 - idx))
+            y_len = y.shape[1]
+            if draft_src_len + y_len - prefix_len + num_tokens > draft_size:
+                draft_size = min(draft_size * 2, draft_src_len + max_steps + reserve)
+                draft_k = grow_kv_cache(draft_k, draft_size)
+                draft_v = grow_kv_cache(draft_v, draft_size)
+            drafts = torch.zeros(num_tokens, dtype=torch.long, device=x.device)
+            draft_probs = []
+            feed = y[:, draft_y:]
+            for i in range(num_tokens):
+                draft_logits = draft._speculative_decode(
+                    feed, draft_k, draft_v, draft_src_len + draft_y - prefix_len, draft_y
+                )[-1:]
+                draft_y += feed.shape[1]
+                q, _ = sampler.probs(draft_logits, pending=drafts[:i], vocab_sizes=vocab_sizes(idx + 1 + i, 1))
+                drafts[i] = torch.multinomial(q, 1, generator=generator)[0, 0]
+                draft_probs.append(q)
+                feed = drafts[i : i + 1].view(1, 1)
+
+            ###### 主模型一次计算 y 的最后一个 token 和全部草稿 token ######
+            if src_len + y_len - prefix_len + num_tokens > cache_size:
+                cache_size = min(cache_size * 2, src_len + max_steps + reserve)
+                k_cache = grow_kv_cache(k_cache, cache_size)
+                v_cache = grow_kv_cache(v_cache, cache_size)
+            feed = torch.concat([y[:, main_y:].long(), drafts.view(1, -1)], dim=1)
+            logits = self._speculative_decode(feed, k_cache, v_cache, src_len + main_y - prefix_len, main_y)
+            probs, penalized = sampler.probs(logits, pending=drafts, vocab_sizes=vocab_sizes(idx + 1, num_tokens + 1))
+            steps += 1
+
+            ###### 拒绝采样 ######
+            num_accepted = 0
+            if num_tokens > 0:
+                q = torch.concat(draft_probs, dim=0)
+                rows = torch.arange(num_tokens, device=x.device)
+                ratio = probs[rows, drafts] / q[rows, drafts]
+                uniform = torch.rand(num_tokens, generator=generator, device=x.device)
+                num_accepted = int((uniform < ratio).long().cumprod(dim=0).sum())
+            if num_accepted < num_tokens:
+                residual = (probs[num_accepted] - q[num_accepted]).clamp(min=0)
+                residual = residual if residual.sum() > 0 else probs[num_accepted]
+                next_token = torch.multinomial(residual.unsqueeze(0), 1, generator=generator).view(-1)
+            else:
+                next_token = torch.multinomial(probs[num_tokens : num_tokens + 1], 1, generator=generator).view(-1)
+            proposed += num_tokens
+            accepted += num_accepted
+            new_tokens = torch.concat([drafts[:num_accepted], next_token])
+            penalized = penalized[: num_accepted + 1]
+            # 被拒绝的草稿 token 的 kv 留在缓存中, 之后会被覆盖
+            main_y = y_len + num_accepted
+            draft_y = min(draft_y, y_len + num_accepted)
+
+        if stats is not None:
+            for key, value in (("proposed", proposed), ("accepted", accepted), ("steps", steps), ("tokens", idx + 1)):
+                stats[key] = stats.get(key, 0) + value
+        if ref_free:
+            return y[:, :-1], 0
+        return y[:, :-1], idx
+
     def infer_panel(
         self,
         x: torch.LongTensor,  #####全部文本token
@@ -1,6 +1,6 @@
 # modified from https://github.com/yangdongchao/SoundStorm/blob/master/soundstorm/s1/AR/models/utils.py
 # reference: https://github.com/lifeiteng/vall-e
-from typing import Tuple
+from typing import List, Optional, Sequence, Tuple, Union
 
 import torch
 import torch.nn.functional as F
@@ -139,8 +139,9 @@ from typing import Optional
 
 def multinomial_sample_one_no_sync(
     probs_sort,
+    generator: Optional[torch.Generator] = None,
 ):  # Does multinomial sampling without a cuda synchronization
-    q = torch.empty_like(probs_sort).exponential_(1)
+    q = torch.empty_like(probs_sort).exponential_(1, generator=generator)
     return torch.argmax(probs_sort / q, dim=-1, keepdim=True).to(dtype=torch.int)
 
 
@@ -192,13 +193,255 @@ def logits_to_probs(
 def sample(
     logits,
     previous_tokens: Optional[torch.Tensor] = None,
+    generator: Optional[torch.Generator] = None,
     **sampling_kwargs,
 ) -> Tuple[torch.Tensor, torch.Tensor]:
     probs = logits_to_probs(logits=logits, previous_tokens=previous_tokens, **sampling_kwargs)
-    idx_next = multinomial_sample_one_no_sync(probs)
+    idx_next = multinomial_sample_one_no_sync(probs, generator)
     return idx_next, probs
 
 
+class BatchSampler:
+    """
+    Vectorized sample() for a batch whose rows have their own sampling parameters.
+        Every row keeps its own top_k/top_p/temperature/repetition penalty and generator, so
+        rows of different requests can be sampled in one call. The tokens a row has seen are
+        kept in a (rows, vocab) occurrence table that is updated with every sampled token, so
+        the repetition penalty does not gather the whole history at every step. top_p is
+        evaluated only over the top-k candidates, with the probabilities of the whole
+        vocabulary, which keeps the same candidates as sample() without sorting the vocabulary.
+        With the same generator state the sampled tokens are those of sample().
+    Args:
+        vocab_size: int, size of the vocabulary (including EOS).
+        device: torch.device, device of the logits.
+    """
+
+    def __init__(self, vocab_size: int, device: torch.device):
+        self.vocab_size = vocab_size
+        self.device = device
+        self.occurrence = torch.zeros((0, vocab_size), dtype=torch.bool, device=device)
+        self.top_k = torch.zeros((0,), dtype=torch.long, device=device)
+        self.top_p = torch.zeros((0,), dtype=torch.float32, device=device)
+        self.temperature = torch.zeros((0,), dtype=torch.float32, device=device)
+        self.repetition_penalty = torch.zeros((0,), dtype=torch.float32, device=device)
+        self.generators: List[Optional[torch.Generator]] = []
+        # 每行参数 (top_k, top_p, temperature, repetition_penalty) 在 CPU 上的副本,
+        # 用于确定 topk 的大小并跳过所有行都不需要的计算, 而不必同步设备
+        self._params: List[Tuple[int, float, float, float]] = []
+
+    def __len__(self) -> int:
+        return len(self.generators)
+
+    def add_rows(
+        self,
+        previous_tokens: torch.Tensor,
+        top_k: Optional[int] = None,
+        top_p: float = 1.0,
+        temperature: float = 1.0,
+        repetition_penalty: float = 1.0,
+        generator: Union[torch.Generator, Sequence[Optional[torch.Generator]], None] = None,
+    ):
+        """
+        Append rows that share the same sampling parameters.
+        Args:
+            previous_tokens: torch.Tensor, (B, L) tokens seen so far by each new row.
+            top_k: int, top k sampling, None or <= 0 for the whole vocabulary.
+            top_p: float, top p sampling.
+            temperature: float, temperature for sampling.
+            repetition_penalty: float, repetition penalty.
+            generator: torch.Generator, random generator of the rows, None for the global one,
+                or a list with one generator per row.
+        """
+        num_rows = previous_tokens.shape[0]
+        occurrence = torch.zeros((num_rows, self.vocab_size), dtype=torch.bool, device=self.device)
+        occurrence.scatter_(1, previous_tokens.long().to(self.device), True)
+        top_k = top_k if top_k is not None and top_k > 0 else self.vocab_size
+
+        def _full(value, dtype):
+            return torch.full((num_rows,), value, dtype=dtype, device=self.device)
+
+        self.occurrence = torch.concat([self.occurrence, occurrence], dim=0)
+        self.top_k = torch.concat([self.top_k, _full(top_k, torch.long)])
+        self.top_p = torch.concat([self.top_p, _full(top_p, torch.float32)])
+        self.temperature = torch.concat([self.temperature, _full(temperature, torch.float32)])
+        self.repetition_penalty = torch.concat([self.repetition_penalty, _full(repetition_penalty, torch.float32)])
+        if isinstance(generator, (list, tuple)):
+            assert len(generator) == num_rows
+            self.generators.extend(generator)
+        else:
+            self.generators.extend([generator] * num_rows)
+        self._params.extend([(top_k, top_p, temperature, repetition_penalty)] * num_rows)
+
+    def select_rows(self, rows: Sequence[int]):
+        """
+        Keep only the given rows, in the given order.
+        """
+        rows = [int(row) for row in rows]
+        index = torch.tensor(rows, dtype=torch.long, device=self.device)
+        self.occurrence = self.occurrence[index]
+        self.top_k = self.top_k[index]
+        self.top_p = self.top_p[index]
+        self.temperature = self.temperature[index]
+        self.repetition_penalty = self.repetition_penalty[index]
+        self.generators = [self.generators[row] for row in rows]
+        self._params = [self._params[row] for row in rows]
+
+    def _exponential(self, generators: list, widths: List[int], width: int, dtype: torch.dtype) -> torch.Tensor:
+        # 与 multinomial_sample_one_no_sync 相同的指数分布噪声: 共用一个生成器时一次生成整个 batch,
+        # 否则每行用自己的生成器, 生成与该行词表大小相同的噪声, 随机数序列与逐行调用 sample() 一致
+        if len(set(map(id, generators))) == 1 and len(set(widths)) == 1:
+            return torch.empty((len(widths), widths[0]), dtype=dtype, device=self.device).exponential_(
+                1, generator=generators[0]
+            )
+        q = torch.ones((len(widths), width), dtype=dtype, device=self.device)
+        for i, (generator, width) in enumerate(zip(generators, widths)):
+            q[i, :width].exponential_(1, generator=generator)
+        return q
+
+    def _filter(
+        self,
+        logits: torch.Tensor,
+        widths: List[int],
+        occurrence: torch.Tensor,
+        top_k: torch.Tensor,
+        top_p: torch.Tensor,
+        temperature: torch.Tensor,
+        penalty: torch.Tensor,
+        params: List[Tuple[int, float, float, float]],
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        # 重复惩罚、top-p、温度和 top-k, 返回候选 token 的 logits 与下标, 以及惩罚后的 logits
+        width = logits.shape[-1]
+        if min(widths) < width:
+            cut = torch.arange(width, device=logits.device) >= torch.tensor(widths, device=logits.device).unsqueeze(1)
+            logits = logits.masked_fill(cut, -float("Inf"))
+
+        top_ks, top_ps, temperatures, penalties = zip(*params)
+        if any(value != 1.0 for value in penalties):
+            penalty = penalty.to(dtype=logits.dtype).unsqueeze(1)
+            logits = torch.where(
+                occurrence[:, :width],
+                torch.where(logits < 0, logits * penalty, logits / penalty),
+                logits,
+            )
+
+        num_candidates = min(max(top_ks), width)
+        values, indices = torch.topk(logits, num_candidates)
+        remove = None
+        if any(value < 1.0 for value in top_ps):
+            cum_probs = torch.cumsum(torch.exp(values - torch.logsumexp(logits, dim=-1, keepdim=True)), dim=-1)
+            remove = (cum_probs > top_p.unsqueeze(1)) & (top_p < 1.0).unsqueeze(1)
+            remove[:, 0] = False  # keep at least one option
+        if min(top_ks) < num_candidates:
+            beyond_top_k = torch.arange(num_candidates, device=values.device) >= top_k.unsqueeze(1)
+            remove = beyond_top_k if remove is None else remove.logical_or(beyond_top_k)
+        if any(value != 1.0 for value in temperatures):
+            values = values / temperature.clamp(min=1e-5).to(dtype=values.dtype).unsqueeze(1)
+        if remove is not None:
+            values = values.masked_fill(remove, -float("Inf"))
+        return values, indices, logits
+
+    def sample(
+        self,
+        logits: torch.Tensor,
+        rows: Optional[Sequence[int]] = None,
+        vocab_sizes: Optional[Sequence[int]] = None,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Sample the next token of every row and add it to the occurrence table.
+        Args:
+            logits: torch.Tensor, (B, V) logits, V may be smaller than vocab_size.
+            rows: list of int, optional, the rows the logits belong to (default: all rows).
+            vocab_sizes: list of int, optional, per row only the first vocab_sizes[i] tokens
+                can be sampled, as if the logits were sliced to that width.
+        Returns:
+            torch.Tensor: (B, 1) sampled tokens, dtype int.
+            torch.Tensor: (B, V) logits after the repetition penalty (sample() changes the
+                logits passed to it in place in the same way).
+        """
+        if rows is not None and [int(row) for row in rows] == list(range(len(self.generators))):
+            rows = None
+        if rows is None:
+            index = None
+            occurrence, top_k, top_p = self.occurrence, self.top_k, self.top_p
+            temperature, penalty = self.temperature, self.repetition_penalty
+            generators, params = self.generators, self._params
+        else:
+            rows = [int(row) for row in rows]
+            index = torch.tensor(rows, dtype=torch.long, device=self.device)
+            occurrence, top_k, top_p = self.occurrence[index], self.top_k[index], self.top_p[index]
+            temperature, penalty = self.temperature[index], self.repetition_penalty[index]
+            generators, params = [self.generators[row] for row in rows], [self._params[row] for row in rows]
+        width = logits.shape[-1]
+        widths = [width] * logits.shape[0] if vocab_sizes is None else [min(int(size), width) for size in vocab_sizes]
+        values, indices, logits = self._filter(logits, widths, occurrence, top_k, top_p, temperature, penalty, params)
+        probs = torch.nn.functional.softmax(values, dim=-1)
+
+        q = self._exponential(generators, widths, width, probs.dtype)
+        choice = torch.argmax(probs / torch.gather(q, 1, indices), dim=-1, keepdim=True)
+        tokens = torch.gather(indices, 1, choice)
+        if index is None:
+            self.occurrence.scatter_(1, tokens, True)
+        else:
+            self.occurrence[index, tokens[:, 0]] = True
+        return tokens.to(dtype=torch.int), logits
+
+    def probs(
+        self,
+        logits: torch.Tensor,
+        row: int = 0,
+        pending: Optional[torch.Tensor] = None,
+        vocab_sizes: Optional[Sequence[int]] = None,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        The distributions sample() draws from, for consecutive positions of one row.
+            Used by speculative decoding, which scores several positions at once before the
+            tokens are accepted; the occurrence table is not changed (see observe()).
+        Args:
+            logits: torch.Tensor, (N, V) logits of N consecutive positions of the row.
+            row: int, the row.
+            pending: torch.Tensor, optional, (M,) tokens after the ones in the occurrence table,
+                M >= N - 1; position i also sees the first M - N + 1 + i of them.
+            vocab_sizes: list of int, optional, as for sample(), per position.
+        Returns:
+            torch.Tensor: (N, V) probabilities, float32.
+            torch.Tensor: (N, V) logits after the repetition penalty.
+        """
+        num_positions, width = logits.shape
+        occurrence = self.occurrence[row, :width].unsqueeze(0).expand(num_positions, -1)
+        if pending is not None and pending.numel() > 0:
+            num_pending = pending.shape[0]
+            visible = torch.arange(num_pending, device=self.device).unsqueeze(0) < (
+                torch.arange(num_positions, device=self.device) + (num_pending - num_positions + 1)
+            ).unsqueeze(1)
+            seen = torch.zeros((num_positions, width), dtype=torch.int, device=self.device)
+            seen.scatter_add_(1, pending.long().view(1, -1).expand(num_positions, -1), visible.int())
+            occurrence = occurrence.logical_or(seen > 0)
+
+        def _expand(tensor):
+            return tensor[row].expand(num_positions)
+
+        widths = [width] * num_positions if vocab_sizes is None else [min(int(size), width) for size in vocab_sizes]
+        values, indices, logits = self._filter(
+            logits,
+            widths,
+            occurrence,
+            _expand(self.top_k),
+            _expand(self.top_p),
+            _expand(self.temperature),
+            _expand(self.repetition_penalty),
+            [self._params[row]],
+        )
+        probs = torch.zeros((num_positions, width), dtype=torch.float32, device=self.device)
+        probs.scatter_(1, indices, torch.nn.functional.softmax(values.float(), dim=-1))
+        return probs, logits
+
+    def observe(self, tokens: torch.Tensor, row: int = 0):
+        """
+        Add tokens sampled outside of sample() to the occurrence table of a row.
+        """
+        self.occurrence[row, tokens.long().view(-1)] = True
+
+
 def dpo_loss(
     policy_chosen_logps: torch.FloatTensor,
     policy_rejected_logps: torch.FloatTensor,
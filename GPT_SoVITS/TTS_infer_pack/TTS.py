@@ -1,8 +1,9 @@
 import gc
+import hashlib
 import math
 import os
-import random
 import sys
+import threading
 import time
 import traceback
 from copy import deepcopy
@@ -13,14 +14,16 @@ from tqdm import tqdm
 now_dir = os.getcwd()
 sys.path.append(now_dir)
 import os
-from typing import List, Tuple, Union
+from typing import Callable, List, Optional, Tuple, Union
 
 import librosa
 import numpy as np
 import torch
 import torch.nn.functional as F
 import yaml
+from AR.models.t2s_engine import T2SDecodeEngine, T2SRequest
 from AR.models.t2s_lightning_module import Text2SemanticLightningModule
+from AR.models.t2s_model import T2SPrefix
 from feature_extractor.cnhubert import CNHubert
 from module.mel_processing import spectrogram_torch
 from module.models import SynthesizerTrn
@@ -29,6 +32,9 @@ from transformers import AutoModelForMaskedLM, AutoTokenizer
 
 from tools.audio_sr import AP_BWE
 from tools.i18n.i18n import I18nAuto, scan_language_list
+from TTS_infer_pack.cancellation import CancellationToken, SynthesisCancelled, is_cancelled
+from TTS_infer_pack.feature_cache import LRUCache, SegmentCache, file_digest, tensor_digest, weights_digest
+from TTS_infer_pack.session import SynthesisSession, copy_prompt
 from TTS_infer_pack.text_segmentation_method import splits
 from TTS_infer_pack.TextPreprocessor import TextPreprocessor
 from sv import SV
@@ -48,6 +54,15 @@ language = os.environ.get("language", "Auto")
 language = sys.argv[-1] if sys.argv[-1] in scan_language_list() else language
 i18n = I18nAuto(language=language)
 
+# 预热用的短文本, 每种语言会加载各自的分词/g2p 资源 (jieba, g2pW, pyopenjtalk 等)
+WARMUP_TEXTS = {
+    "zh": "你好，欢迎使用语音合成。",
+    "en": "Hello, and welcome.",
+    "ja": "こんにちは、ようこそ。",
+    "ko": "안녕하세요, 환영합니다.",
+    "yue": "你好，歡迎使用語音合成。",
+}
+
 
 class DictToAttrRecursive(dict):
     def __init__(self, input_dict):
@@ -84,27 +99,14 @@ class NO_PROMPT_ERROR(Exception):
 # configs/tts_infer.yaml (legacy reference removed – v2ProPlus only)
 
 
-def set_seed(seed: int):
-    seed = int(seed)
-    seed = seed if seed != -1 else random.randint(0, 2**32 - 1)
-    print(f"Set seed to {seed}")
-    os.environ["PYTHONHASHSEED"] = str(seed)
-    random.seed(seed)
-    np.random.seed(seed)
-    torch.manual_seed(seed)
-    try:
-        if torch.cuda.is_available():
-            torch.cuda.manual_seed(seed)
-            torch.cuda.manual_seed_all(seed)
-            # torch.backends.cudnn.deterministic = True
-            # torch.backends.cudnn.benchmark = False
-            # torch.backends.cudnn.enabled = True
-            # 开启后会影响精度
-            torch.backends.cuda.matmul.allow_tf32 = False
-            torch.backends.cudnn.allow_tf32 = False
-    except:
-        pass
-    return seed
+def _add_stat(stats: dict, key: str, value):
+    # stats 为 None 时不统计
+    if stats is None:
+        return
+    if isinstance(value, list):
+        stats.setdefault(key, []).extend(value)
+    else:
+        stats[key] = stats.get(key, 0) + value
 
 
 class TTS_Config:
@@ -117,6 +119,9 @@ class TTS_Config:
             "vits_weights_path": "GPT_SoVITS/pretrained_models/v2Pro/s2Gv2ProPlus.pth",
             "cnhuhbert_base_path": "GPT_SoVITS/pretrained_models/chinese-hubert-base",
             "bert_base_path": "GPT_SoVITS/pretrained_models/chinese-roberta-wwm-ext-large",
+            # 投机解码用的小型 GPT 模型 (例如用 s1_train.py 训练的少层模型), 为空时不使用
+            "t2s_draft_weights_path": "",
+            "num_draft_tokens": 4,
         }
     }
     configs: dict = None
@@ -175,6 +180,8 @@ class TTS_Config:
         self.vits_weights_path = self.configs.get("vits_weights_path", None)
         self.bert_base_path = self.configs.get("bert_base_path", None)
         self.cnhuhbert_base_path = self.configs.get("cnhuhbert_base_path", None)
+        self.t2s_draft_weights_path = self.configs.get("t2s_draft_weights_path", "") or ""
+        self.num_draft_tokens = int(self.configs.get("num_draft_tokens", 4))
         self.languages = self.v1_languages if self.version == "v1" else self.v2_languages
 
         self.use_vocoder: bool = False
@@ -191,6 +198,9 @@ class TTS_Config:
         if (self.cnhuhbert_base_path in [None, ""]) or (not os.path.exists(self.cnhuhbert_base_path)):
             self.cnhuhbert_base_path = self.default_configs["v2ProPlus"]["cnhuhbert_base_path"]
             print(f"fall back to default cnhuhbert_base_path: {self.cnhuhbert_base_path}")
+        if self.t2s_draft_weights_path and not os.path.exists(self.t2s_draft_weights_path):
+            print(f"t2s_draft_weights_path not found, speculative decoding disabled: {self.t2s_draft_weights_path}")
+            self.t2s_draft_weights_path = ""
         self.update_configs()
 
         self.max_sec = None
@@ -233,6 +243,8 @@ class TTS_Config:
             "vits_weights_path": self.vits_weights_path,
             "bert_base_path": self.bert_base_path,
             "cnhuhbert_base_path": self.cnhuhbert_base_path,
+            "t2s_draft_weights_path": self.t2s_draft_weights_path,
+            "num_draft_tokens": self.num_draft_tokens,
         }
         return self.config
 
@@ -266,6 +278,15 @@ class TTS:
             self.configs: TTS_Config = TTS_Config(configs)
 
         self.t2s_model: Text2SemanticLightningModule = None
+        # 投机解码的草稿模型, 见 init_t2s_draft_weights()
+        self.t2s_draft_model: Text2SemanticLightningModule = None
+        # 投机解码的统计: 草稿 token 数、被接受数、主模型前向次数、生成的 token 数
+        self.speculative_stats: dict = {"proposed": 0, "accepted": 0, "steps": 0, "tokens": 0}
+        self._speculative_stats_lock = threading.Lock()
+        # 连续批处理的语义 token 解码引擎, 见 enable_continuous_batching(), 默认关闭 (在 _init_models() 之前, 加载草稿模型时会检查)
+        self.t2s_engine: T2SDecodeEngine = None
+        self._t2s_engine_options: dict = None
+        self._t2s_engine_lock = threading.Lock()
         self.vits_model: Union[SynthesizerTrn, SynthesizerTrnV3] = None
         self.bert_tokenizer: AutoTokenizer = None
         self.bert_model: AutoModelForMaskedLM = None
@@ -291,15 +312,33 @@ class TTS:
             "bert_features": None,
             "norm_text": None,
             "aux_ref_audio_paths": [],
+            "sv_emb": [],
+            "ge": None,
         }
-
-        self.stop_flag: bool = False
+        # 预先计算好的音色(voice profile)，见 register_voice()
+        self.voices: dict = {}
+        # 按音频内容缓存参考音频的特征(prompt_semantic, refer_spec, SV embedding)
+        self.reference_cache: LRUCache = LRUCache(max_entries=16)
+        # 按句缓存合成结果(固定 seed 时生效), 默认关闭
+        self.segment_cache: SegmentCache = None
+        # 缓存参考提示的 T2S 前缀状态(前缀模式, 输出与默认方式不同), 见 enable_prefix_cache(), 默认关闭
+        self.prefix_cache: LRUCache = None
+
+        # 正在运行的请求, stop() 会停止所有请求
+        self.sessions: set = set()
+        self._sessions_lock = threading.Lock()
         self.precision: torch.dtype = torch.float16 if self.configs.is_half else torch.float32
+        if torch.cuda.is_available():
+            # 开启后会影响精度
+            torch.backends.cuda.matmul.allow_tf32 = False
+            torch.backends.cudnn.allow_tf32 = False
 
     def _init_models(
         self,
     ):
         self.init_t2s_weights(self.configs.t2s_weights_path)
+        if self.configs.t2s_draft_weights_path:
+            self.init_t2s_draft_weights(self.configs.t2s_draft_weights_path)
         self.init_vits_weights(self.configs.vits_weights_path)
         self.init_bert_weights(self.configs.bert_base_path)
         self.init_cnhuhbert_weights(self.configs.cnhuhbert_base_path)
@@ -322,68 +361,166 @@ class TTS:
         if self.configs.is_half and str(self.configs.device) != "cpu":
             self.bert_model = self.bert_model.half()
 
-    def init_vits_weights(self, weights_path: str):
-        self.configs.vits_weights_path = weights_path
+    def _load_vits_model(self, weights_path: str):
         version, model_version, if_lora_v3 = get_sovits_version_from_path_fast(weights_path)
         if model_version != "v2ProPlus":
             raise ValueError("Unsupported SoVITS model version: only v2ProPlus is supported.")
         if if_lora_v3:
             raise ValueError("LoRA-enhanced SoVITS checkpoints are not supported in this build.")
 
-        self.init_sv_model()
-
         dict_s2 = load_sovits_new(weights_path)
         hps = dict_s2["config"]
         hps["model"]["semantic_frame_rate"] = "25hz"
         hps["model"]["version"] = "v2ProPlus"
-
-        self.configs.filter_length = hps["data"]["filter_length"]
-        self.configs.segment_size = hps["train"]["segment_size"]
-        self.configs.sampling_rate = hps["data"]["sampling_rate"]
-        self.configs.hop_length = hps["data"]["hop_length"]
-        self.configs.win_length = hps["data"]["win_length"]
-        self.configs.n_speakers = hps["data"]["n_speakers"]
-        self.configs.semantic_frame_rate = hps["model"]["semantic_frame_rate"]
         kwargs = hps["model"]
-        self.configs.update_version("v2ProPlus")
-        self.configs.use_vocoder = False
 
         vits_model = SynthesizerTrn(
-            self.configs.filter_length // 2 + 1,
-            self.configs.segment_size // self.configs.hop_length,
-            n_speakers=self.configs.n_speakers,
+            hps["data"]["filter_length"] // 2 + 1,
+            hps["train"]["segment_size"] // hps["data"]["hop_length"],
+            n_speakers=hps["data"]["n_speakers"],
             **kwargs,
         )
-        self.is_v2pro = True
 
         print(f"Loading VITS weights from {weights_path}. {vits_model.load_state_dict(dict_s2['weight'], strict=False)}")
 
         vits_model = vits_model.to(self.configs.device)
         vits_model = vits_model.eval()
-
-        self.vits_model = vits_model
         if self.configs.is_half and str(self.configs.device) != "cpu":
-            self.vits_model = self.vits_model.half()
+            vits_model = vits_model.half()
+        return vits_model, hps
 
-        self.configs.save_configs()
+    def init_vits_weights(self, weights_path: str):
+        self.configs.vits_weights_path = weights_path
+        self.init_sv_model()
 
+        vits_model, hps = self._load_vits_model(weights_path)
 
+        self.configs.filter_length = hps["data"]["filter_length"]
+        self.configs.segment_size = hps["train"]["segment_size"]
+        self.configs.sampling_rate = hps["data"]["sampling_rate"]
+        self.configs.hop_length = hps["data"]["hop_length"]
+        self.configs.win_length = hps["data"]["win_length"]
+        self.configs.n_speakers = hps["data"]["n_speakers"]
+        self.configs.semantic_frame_rate = hps["model"]["semantic_frame_rate"]
+        self.configs.update_version("v2ProPlus")
+        self.configs.use_vocoder = False
+        self.is_v2pro = True
+
+        self.vits_model = vits_model
 
-    def init_t2s_weights(self, weights_path: str):
-        print(f"Loading Text2Semantic weights from {weights_path}")
-        self.configs.t2s_weights_path = weights_path
         self.configs.save_configs()
-        self.configs.hz = 50
+
+    def _load_t2s_model(self, weights_path: str):
         dict_s1 = torch.load(weights_path, map_location=self.configs.device, weights_only=False)
         config = dict_s1["config"]
-        self.configs.max_sec = config["data"]["max_sec"]
         t2s_model = Text2SemanticLightningModule(config, "****", is_train=False)
         t2s_model.load_state_dict(dict_s1["weight"])
         t2s_model = t2s_model.to(self.configs.device)
         t2s_model = t2s_model.eval()
-        self.t2s_model = t2s_model
         if self.configs.is_half and str(self.configs.device) != "cpu":
-            self.t2s_model = self.t2s_model.half()
+            t2s_model = t2s_model.half()
+        return t2s_model, config["data"]["max_sec"]
+
+    def init_t2s_weights(self, weights_path: str):
+        print(f"Loading Text2Semantic weights from {weights_path}")
+        self.configs.t2s_weights_path = weights_path
+        self.configs.save_configs()
+        self.configs.hz = 50
+        self.t2s_model, self.configs.max_sec = self._load_t2s_model(weights_path)
+
+    def init_t2s_draft_weights(self, weights_path: str, num_draft_tokens: int = None):
+        """
+        Load the draft GPT model of speculative decoding.
+            The draft model proposes num_draft_tokens semantic tokens that the GPT model checks in
+            one forward pass; the output distribution is that of the GPT model alone. The draft
+            must have the same phoneme and semantic vocabularies, e.g. a GPT model with a few
+            layers trained with s1_train.py on the same data.
+            Speculative decoding runs row by row: with a draft model parallel_infer is ignored,
+            and the continuous-batching engine (enable_continuous_batching()) decodes without
+            the draft model. The first is logged per request, the second once when the draft
+            model or the engine is configured.
+        Args:
+            weights_path: str, the path of the draft GPT (.ckpt) weights, "" or None to disable.
+            num_draft_tokens: int, optional, tokens proposed per step.
+        """
+        if num_draft_tokens is not None:
+            self.configs.num_draft_tokens = int(num_draft_tokens)
+        if weights_path in [None, ""]:
+            self.t2s_draft_model = None
+            self.configs.t2s_draft_weights_path = ""
+            return
+        print(f"Loading draft Text2Semantic weights from {weights_path}")
+        draft_model, _ = self._load_t2s_model(weights_path)
+        model = self.t2s_model.model
+        for key in ("vocab_size", "phoneme_vocab_size", "EOS"):
+            if getattr(draft_model.model, key) != getattr(model, key):
+                raise ValueError(
+                    f"The draft model does not match the GPT model: {key} {getattr(draft_model.model, key)} != {getattr(model, key)}"
+                )
+        self.t2s_draft_model = draft_model
+        self.configs.t2s_draft_weights_path = weights_path
+        self._warn_draft_with_engine()
+
+    def load_voice_models(
+        self,
+        t2s_weights_path: str,
+        vits_weights_path: str,
+        progress: Optional[Callable[[str, float], None]] = None,
+    ) -> dict:
+        """
+        Load a GPT/SoVITS weight pair without replacing the active models.
+            BERT, CNHuBERT and the SV model are shared by all voices and are not reloaded.
+        Args:
+            t2s_weights_path: str, the path of the GPT (.ckpt) weights.
+            vits_weights_path: str, the path of the SoVITS (.pth) weights.
+            progress: callable, called with (stage, seconds) after each model is loaded.
+        Returns:
+            dict: the loaded models, to be activated with set_voice_models().
+        """
+        print(f"Loading Text2Semantic weights from {t2s_weights_path}")
+        t0 = time.perf_counter()
+        t2s_model, max_sec = self._load_t2s_model(t2s_weights_path)
+        if progress is not None:
+            progress("load_gpt", time.perf_counter() - t0)
+        t0 = time.perf_counter()
+        vits_model, _ = self._load_vits_model(vits_weights_path)
+        if progress is not None:
+            progress("load_sovits", time.perf_counter() - t0)
+        return {
+            "t2s_weights_path": t2s_weights_path,
+            "vits_weights_path": vits_weights_path,
+            "t2s_model": t2s_model,
+            "vits_model": vits_model,
+            "max_sec": max_sec,
+        }
+
+    def get_voice_models(self) -> dict:
+        """
+        Return the active GPT/SoVITS models in the format of load_voice_models().
+        """
+        return {
+            "t2s_weights_path": self.configs.t2s_weights_path,
+            "vits_weights_path": self.configs.vits_weights_path,
+            "t2s_model": self.t2s_model,
+            "vits_model": self.vits_model,
+            "max_sec": self.configs.max_sec,
+        }
+
+    def set_voice_models(self, voice: dict):
+        """
+        Activate a GPT/SoVITS pair returned by load_voice_models().
+        Args:
+            voice: dict, the models to activate.
+        """
+        if voice["vits_model"] is not self.vits_model:
+            # prompt_semantic 和 ge 依赖于 SoVITS 模型, 需要重新提取
+            self.prompt_cache["ref_audio_path"] = None
+            self.prompt_cache["ge"] = None
+        self.t2s_model = voice["t2s_model"]
+        self.vits_model = voice["vits_model"]
+        self.configs.t2s_weights_path = voice["t2s_weights_path"]
+        self.configs.vits_weights_path = voice["vits_weights_path"]
+        self.configs.max_sec = voice["max_sec"]
 
     def init_sr_model(self):
         if self.sr_model is not None:
@@ -418,6 +555,8 @@ class TTS:
         if enable:
             if self.t2s_model is not None:
                 self.t2s_model = self.t2s_model.half()
+            if self.t2s_draft_model is not None:
+                self.t2s_draft_model = self.t2s_draft_model.half()
             if self.vits_model is not None:
                 self.vits_model = self.vits_model.half()
             if self.bert_model is not None:
@@ -429,6 +568,8 @@ class TTS:
         else:
             if self.t2s_model is not None:
                 self.t2s_model = self.t2s_model.float()
+            if self.t2s_draft_model is not None:
+                self.t2s_draft_model = self.t2s_draft_model.float()
             if self.vits_model is not None:
                 self.vits_model = self.vits_model.float()
             if self.bert_model is not None:
@@ -449,6 +590,8 @@ class TTS:
             self.configs.save_configs()
         if self.t2s_model is not None:
             self.t2s_model = self.t2s_model.to(device)
+        if self.t2s_draft_model is not None:
+            self.t2s_draft_model = self.t2s_draft_model.to(device)
         if self.vits_model is not None:
             self.vits_model = self.vits_model.to(device)
         if self.bert_model is not None:
@@ -460,32 +603,269 @@ class TTS:
         if self.sr_model is not None:
             self.sr_model = self.sr_model.to(device)
 
-    def set_ref_audio(self, ref_audio_path: str):
+    def set_ref_audio(self, ref_audio_path: str, prompt: dict = None):
         """
         To set the reference audio for the TTS model,
             including the prompt_semantic and refer_spepc.
         Args:
             ref_audio_path: str, the path of the reference audio.
+            prompt: dict, the reference/prompt state to update, defaults to self.prompt_cache.
+        """
+        prompt = self.prompt_cache if prompt is None else prompt
+        digest = file_digest(ref_audio_path)
+        self._set_prompt_semantic(ref_audio_path, digest, prompt)
+        self._set_ref_spec(ref_audio_path, digest, prompt)
+        self._set_ref_audio_path(ref_audio_path, prompt)
+
+    def snapshot_prompt_cache(self) -> dict:
+        """
+        Take a copy of the current reference/prompt state,
+            so that it can be restored later with restore_prompt_cache().
+        """
+        return copy_prompt(self.prompt_cache)
+
+    def restore_prompt_cache(self, cache: dict):
+        """
+        Restore a reference/prompt state taken with snapshot_prompt_cache().
+        Args:
+            cache: dict, the snapshot to restore.
+        """
+        self.prompt_cache = copy_prompt(cache)
+
+    def create_session(self, inputs: dict) -> SynthesisSession:
+        """
+        Create the per-request state of run() from its inputs.
+            The session starts from a copy of self.prompt_cache, so the reference audio of
+            the previous request is reused if it is the same.
+        Args:
+            inputs: dict, the inputs of run(); "seed", "top_k", "top_p", "temperature",
+                "repetition_penalty", "parallel_infer" and "cancel_token" are used.
+        Returns:
+            SynthesisSession: the session to pass to run().
+        """
+        session = SynthesisSession(
+            self.prompt_cache,
+            self.configs.device,
+            seed=inputs.get("seed", -1),
+            top_k=inputs.get("top_k", 5),
+            top_p=inputs.get("top_p", 1),
+            temperature=inputs.get("temperature", 1),
+            repetition_penalty=inputs.get("repetition_penalty", 1.35),
+            parallel_infer=inputs.get("parallel_infer", True),
+            cancel_token=inputs.get("cancel_token", None),
+        )
+        print(f"Set seed to {session.seed}")
+        return session
+
+    def register_voice(
+        self,
+        voice_id: str,
+        ref_audio_path: str,
+        prompt_text: str = "",
+        prompt_lang: str = "",
+        aux_ref_audio_paths: list = None,
+    ) -> dict:
+        """
+        Precompute everything run() derives from the reference audio and prompt text,
+            so that later requests only need to pass "voice_id".
+        Args:
+            voice_id: str, the name of the voice.
+            ref_audio_path: str, the path of the reference audio.
+            prompt_text: str, the transcript of the reference audio, empty if unknown.
+            prompt_lang: str, the language of the prompt text.
+            aux_ref_audio_paths: list, auxiliary reference audio paths for tone fusion.
+        Returns:
+            dict: the voice profile, also kept in self.voices.
         """
-        self._set_prompt_semantic(ref_audio_path)
-        self._set_ref_spec(ref_audio_path)
-        self._set_ref_audio_path(ref_audio_path)
+        paths = [ref_audio_path] + [path for path in (aux_ref_audio_paths or []) if path not in [None, ""]]
+        for path in paths:
+            if not os.path.exists(path):
+                raise ValueError(f"{path} not exists")
+        digest = hashlib.sha1(
+            "|".join([file_digest(path) for path in paths] + [prompt_text or "", prompt_lang]).encode("utf-8")
+        ).hexdigest()
+        voice = {
+            "voice_id": voice_id,
+            "digest": digest,
+            "prompt_text": "",
+            "prompt_lang": prompt_lang,
+            "phones": None,
+            "bert_features": None,
+            "norm_text": None,
+            "wav16k": self._load_wav16k(ref_audio_path),
+            "refer_spec": [],
+            "sv_emb": [],
+            "vits_weights_path": None,
+            "prompt_semantic": None,
+            "ge": None,
+        }
+        for path in paths:
+            (spec, _), sv_emb = self._get_ref_features(path)
+            voice["refer_spec"].append((spec, None))
+            voice["sv_emb"].append(sv_emb)
+        if prompt_text not in [None, ""]:
+            assert prompt_lang in self.configs.languages
+            prompt_text = self._normalize_prompt_text(prompt_text, prompt_lang)
+            phones, bert_features, norm_text = self.text_preprocessor.segment_and_extract_feature_for_text(
+                prompt_text, prompt_lang, self.configs.version
+            )
+            voice.update(prompt_text=prompt_text, phones=phones, bert_features=bert_features, norm_text=norm_text)
+        self._update_voice_conditioning(voice)
+        self.voices[voice_id] = voice
+        return voice
+
+    def use_voice(self, voice_id: str, prompt: dict = None) -> dict:
+        """
+        Load a voice registered with register_voice() into the prompt cache.
+        Args:
+            voice_id: str, the name of the voice.
+            prompt: dict, the reference/prompt state to load it into, defaults to self.prompt_cache.
+        """
+        prompt = self.prompt_cache if prompt is None else prompt
+        voice = self.voices.get(voice_id, None)
+        if voice is None:
+            raise ValueError(f"voice {voice_id} is not registered")
+        self._update_voice_conditioning(voice)
+        # 用不存在的路径占位, 之后指定参考音频的请求会重新提取特征
+        prompt["ref_audio_path"] = f"voice:{voice_id}"
+        prompt["aux_ref_audio_paths"] = [f"voice:{voice_id}:{i}" for i in range(1, len(voice["refer_spec"]))]
+        prompt["refer_spec"] = list(voice["refer_spec"])
+        prompt["sv_emb"] = list(voice["sv_emb"])
+        for key in ["prompt_semantic", "ge", "prompt_text", "prompt_lang", "phones", "bert_features", "norm_text"]:
+            prompt[key] = voice[key]
+        return voice
+
+    def save_voice(self, voice_id: str, path: str):
+        """
+        Save a registered voice as safetensors, float tensors are stored in float16.
+        Args:
+            voice_id: str, the name of the voice.
+            path: str, the output file path.
+        """
+        from safetensors.torch import save_file
+
+        voice = self.voices[voice_id]
+        wav16k = np.clip(voice["wav16k"] * 32768, -32768, 32767).astype(np.int16)
+        tensors = {
+            "wav16k": torch.from_numpy(wav16k),
+            "prompt_semantic": voice["prompt_semantic"].to(torch.int16),
+            "ge": voice["ge"].half(),
+        }
+        for i, ((spec, _), sv_emb) in enumerate(zip(voice["refer_spec"], voice["sv_emb"])):
+            tensors[f"refer_spec.{i}"] = spec.half()
+            if sv_emb is not None:
+                tensors[f"sv_emb.{i}"] = sv_emb.half()
+        if voice["phones"] is not None:
+            tensors["phones"] = torch.IntTensor(voice["phones"])
+            tensors["bert_features"] = voice["bert_features"].half()
+        metadata = {
+            "voice_id": voice_id,
+            "digest": voice["digest"],
+            "prompt_text": voice["prompt_text"],
+            "prompt_lang": voice["prompt_lang"],
+            "norm_text": voice["norm_text"] or "",
+            "vits_weights_path": voice["vits_weights_path"],
+            "version": self.configs.version,
+        }
+        save_file({key: value.detach().cpu().contiguous() for key, value in tensors.items()}, path, metadata=metadata)
 
-    def _set_ref_audio_path(self, ref_audio_path):
-        self.prompt_cache["ref_audio_path"] = ref_audio_path
+    def load_voice(self, path: str) -> str:
+        """
+        Load a voice saved with save_voice().
+        Args:
+            path: str, the safetensors file path.
+        Returns:
+            str: the voice_id.
+        """
+        from safetensors import safe_open
+
+        with safe_open(path, framework="pt", device="cpu") as f:
+            metadata = f.metadata()
+            tensors = {key: f.get_tensor(key) for key in f.keys()}
+        device = self.configs.device
+        refer_spec, sv_emb = [], []
+        i = 0
+        while f"refer_spec.{i}" in tensors:
+            refer_spec.append((tensors[f"refer_spec.{i}"].to(dtype=self.precision, device=device), None))
+            emb = tensors.get(f"sv_emb.{i}", None)
+            sv_emb.append(emb.to(dtype=self.precision, device=device) if emb is not None else None)
+            i += 1
+        voice = {
+            "voice_id": metadata["voice_id"],
+            "digest": metadata.get("digest", ""),
+            "prompt_text": metadata["prompt_text"],
+            "prompt_lang": metadata["prompt_lang"],
+            "phones": tensors["phones"].tolist() if "phones" in tensors else None,
+            "bert_features": (
+                tensors["bert_features"].to(dtype=self.precision, device=device) if "bert_features" in tensors else None
+            ),
+            "norm_text": metadata["norm_text"] or None,
+            "wav16k": tensors["wav16k"].numpy().astype(np.float32) / 32768,
+            "refer_spec": refer_spec,
+            "sv_emb": sv_emb,
+            "vits_weights_path": metadata["vits_weights_path"],
+            "prompt_semantic": tensors["prompt_semantic"].long().to(device),
+            "ge": tensors["ge"].to(dtype=self.precision, device=device),
+        }
+        self.voices[voice["voice_id"]] = voice
+        return voice["voice_id"]
 
-    def _set_ref_spec(self, ref_audio_path):
-        spec_audio = self._get_ref_spec(ref_audio_path)
-        if self.prompt_cache["refer_spec"] in [[], None]:
-            self.prompt_cache["refer_spec"] = [spec_audio]
+    def _update_voice_conditioning(self, voice: dict):
+        # prompt_semantic 和 ge 依赖于 SoVITS 模型, 切换模型后重新计算
+        if voice["vits_weights_path"] == self.configs.vits_weights_path:
+            return
+        voice["prompt_semantic"] = self._extract_prompt_semantic(voice["wav16k"])
+        refer = [spec.to(dtype=self.precision, device=self.configs.device) for spec, _ in voice["refer_spec"]]
+        voice["ge"] = self.vits_model.get_ge(refer, voice["sv_emb"] if self.is_v2pro else None)
+        voice["vits_weights_path"] = self.configs.vits_weights_path
+
+    def _normalize_prompt_text(self, prompt_text: str, prompt_lang: str) -> str:
+        prompt_text = prompt_text.strip("\n")
+        if prompt_text[-1] not in splits:
+            prompt_text += "。" if prompt_lang != "en" else "."
+        return prompt_text
+
+    def _set_ref_audio_path(self, ref_audio_path, prompt: dict):
+        prompt["ref_audio_path"] = ref_audio_path
+
+    def _set_ref_spec(self, ref_audio_path, digest: str, prompt: dict):
+        spec_audio, sv_emb = self._get_ref_features(ref_audio_path, digest)
+        if prompt["refer_spec"] in [[], None]:
+            prompt["refer_spec"] = [spec_audio]
+            prompt["sv_emb"] = [sv_emb]
         else:
-            self.prompt_cache["refer_spec"][0] = spec_audio
+            prompt["refer_spec"][0] = spec_audio
+            prompt["sv_emb"][0] = sv_emb
+        prompt["ge"] = None
+
+    def _get_ref_features(self, ref_audio_path, digest: str = None):
+        """
+        Get (spec, 16k audio) and the SV embedding of a reference audio,
+            reusing the cached results for audio with the same content.
+        """
+        digest = digest or file_digest(ref_audio_path)
+        key = (
+            digest,
+            "refer_spec",
+            self.configs.sampling_rate,
+            self.configs.filter_length,
+            self.configs.hop_length,
+            self.configs.win_length,
+            self.configs.is_half,
+        )
+        features = self.reference_cache.get(key)
+        if features is None:
+            spec_audio = self._get_ref_spec(ref_audio_path)
+            sv_emb = None
+            if self.is_v2pro:
+                sv_emb = self.sv_model.compute_embedding3(spec_audio[1])
+            features = (spec_audio, sv_emb)
+            self.reference_cache.put(key, features)
+        return features
 
     def _get_ref_spec(self, ref_audio_path):
         raw_audio, raw_sr = torchaudio.load(ref_audio_path, backend="soundfile")
         raw_audio = raw_audio.to(self.configs.device).float()
-        self.prompt_cache["raw_audio"] = raw_audio
-        self.prompt_cache["raw_sr"] = raw_sr
 
         if raw_sr != self.configs.sampling_rate:
             audio = raw_audio.to(self.configs.device)
@@ -518,15 +898,27 @@ class TTS:
             audio = None
         return spec, audio
 
-    def _set_prompt_semantic(self, ref_wav_path: str):
+    def _set_prompt_semantic(self, ref_wav_path: str, digest: str, prompt: dict):
+        # prompt_semantic 依赖于 SoVITS 模型
+        key = (digest or file_digest(ref_wav_path), "prompt_semantic", self.configs.vits_weights_path)
+        prompt_semantic = self.reference_cache.get(key)
+        if prompt_semantic is None:
+            prompt_semantic = self._extract_prompt_semantic(self._load_wav16k(ref_wav_path))
+            self.reference_cache.put(key, prompt_semantic)
+        prompt["prompt_semantic"] = prompt_semantic
+
+    def _load_wav16k(self, ref_wav_path: str) -> np.ndarray:
+        wav16k, sr = librosa.load(ref_wav_path, sr=16000)
+        if wav16k.shape[0] > 160000 or wav16k.shape[0] < 48000:
+            raise OSError(i18n("参考音频在3~10秒范围外，请更换！"))
+        return wav16k
+
+    def _extract_prompt_semantic(self, wav16k: np.ndarray) -> torch.Tensor:
         zero_wav = np.zeros(
             int(self.configs.sampling_rate * 0.3),
             dtype=np.float16 if self.configs.is_half else np.float32,
         )
         with torch.no_grad():
-            wav16k, sr = librosa.load(ref_wav_path, sr=16000)
-            if wav16k.shape[0] > 160000 or wav16k.shape[0] < 48000:
-                raise OSError(i18n("参考音频在3~10秒范围外，请更换！"))
             wav16k = torch.from_numpy(wav16k)
             zero_wav_torch = torch.from_numpy(zero_wav)
             wav16k = wav16k.to(self.configs.device)
@@ -542,7 +934,7 @@ class TTS:
             codes = self.vits_model.extract_latent(hubert_feature)
 
             prompt_semantic = codes[0, 0].to(self.configs.device)
-            self.prompt_cache["prompt_semantic"] = prompt_semantic
+        return prompt_semantic
 
     def batch_sequences(self, sequences: List[torch.Tensor], axis: int = 0, pad_value: int = 0, max_length: int = None):
         seq = sequences[0]
@@ -698,18 +1090,530 @@ class TTS:
                 _data[index] = data[i][j]
         return _data
 
+    def _prepare_prompt(
+        self,
+        prompt: dict,
+        ref_audio_path: str,
+        aux_ref_audio_paths: list,
+        prompt_text: str,
+        prompt_lang: str,
+        no_prompt_text: bool,
+    ):
+        if (ref_audio_path is not None) and (
+            ref_audio_path != prompt["ref_audio_path"]
+            or (self.is_v2pro and prompt["refer_spec"][0][1] is None)
+        ):
+            if not os.path.exists(ref_audio_path):
+                raise ValueError(f"{ref_audio_path} not exists")
+            self.set_ref_audio(ref_audio_path, prompt)
+
+        aux_ref_audio_paths = aux_ref_audio_paths if aux_ref_audio_paths is not None else []
+        paths = set(aux_ref_audio_paths) & set(prompt["aux_ref_audio_paths"])
+        if not (len(list(paths)) == len(aux_ref_audio_paths) == len(prompt["aux_ref_audio_paths"])):
+            prompt["aux_ref_audio_paths"] = aux_ref_audio_paths
+            prompt["refer_spec"] = [prompt["refer_spec"][0]]
+            prompt["sv_emb"] = [prompt["sv_emb"][0]]
+            prompt["ge"] = None
+            for path in aux_ref_audio_paths:
+                if path in [None, ""]:
+                    continue
+                if not os.path.exists(path):
+                    print(i18n("音频文件不存在，跳过："), path)
+                    continue
+                spec_audio, sv_emb = self._get_ref_features(path)
+                prompt["refer_spec"].append(spec_audio)
+                prompt["sv_emb"].append(sv_emb)
+
+        if not no_prompt_text:
+            prompt_text = self._normalize_prompt_text(prompt_text, prompt_lang)
+            print(i18n("实际输入的参考文本:"), prompt_text)
+            if prompt["prompt_text"] != prompt_text:
+                phones, bert_features, norm_text = self.text_preprocessor.segment_and_extract_feature_for_text(
+                    prompt_text, prompt_lang, self.configs.version
+                )
+                prompt["prompt_text"] = prompt_text
+                prompt["prompt_lang"] = prompt_lang
+                prompt["phones"] = phones
+                prompt["bert_features"] = bert_features
+                prompt["norm_text"] = norm_text
+
+    def enable_continuous_batching(self, max_batch_size: int = 16, kv_cache_mb: float = 512, block_size: int = 16):
+        """
+        Decode the semantic tokens of all requests with one shared T2SDecodeEngine.
+            The rows of concurrent run()/run_batched() calls (from several threads) are then
+            batched per token, and a row starts as soon as another one finishes instead of
+            waiting for the whole batch.
+        Args:
+            max_batch_size: int, maximum number of rows decoded together.
+            kv_cache_mb: float, memory of the paged kv cache in MB.
+            block_size: int, number of positions per kv cache block.
+        """
+        with self._t2s_engine_lock:
+            self._t2s_engine_options = {
+                "max_batch_size": max_batch_size,
+                "kv_cache_mb": kv_cache_mb,
+                "block_size": block_size,
+            }
+            if self.t2s_engine is not None:
+                self.t2s_engine.close()
+                self.t2s_engine = None
+        self._warn_draft_with_engine()
+
+    def _warn_draft_with_engine(self):
+        # 引擎不支持投机解码, 在配置时提示一次, 不在每个 batch 中重复
+        if self.t2s_draft_model is not None and self._t2s_engine_options is not None:
+            print("continuous batching is enabled: the draft model is not used, speculative decoding disabled")
+
+    def enable_prefix_cache(self, max_entries: int = 8):
+        """
+        Prefill the T2S model from cached reference-prompt states (the prefix mode).
+            The transformer states of the prompt phones and prompt semantic tokens are computed
+            once per reference and reused by every segment, so the prefill of a segment only
+            covers its own text. In this mode the prompt does not attend to the target text,
+            so the semantic tokens differ from those of the default layout; check the difference
+            on your models with tools/compare_prefix_mode.py before enabling it.
+            The cache is keyed by the content of the prompt, not by the tensor objects.
+        Args:
+            max_entries: int, number of cached references, 0 disables the prefix mode.
+        """
+        self.prefix_cache = LRUCache(max_entries=max_entries) if max_entries > 0 else None
+
+    def _get_t2s_prefix(self, prompt: dict) -> T2SPrefix:
+        model = self.t2s_model.model
+        phones = torch.LongTensor(prompt["phones"])
+        # 按内容作为键: 重新提取或从其他音色得到的相同参考也能命中, 对象被释放后 id 被复用也不会误命中
+        key = (
+            weights_digest(self.configs.t2s_weights_path),
+            tensor_digest(phones, prompt["bert_features"], prompt["prompt_semantic"]),
+            self.precision,
+            str(self.configs.device),
+        )
+        prefix = self.prefix_cache.get(key)
+        if prefix is None:
+            with torch.no_grad():
+                prefix = model.build_prefix(
+                    phones.to(self.configs.device),
+                    prompt["bert_features"].to(dtype=self.precision, device=self.configs.device),
+                    prompt["prompt_semantic"].to(self.configs.device),
+                )
+            self.prefix_cache.put(key, prefix)
+        return prefix
+
+    def _get_t2s_engine(self) -> Optional[T2SDecodeEngine]:
+        # T2S 模型被替换或转换精度/设备后重新创建引擎, 旧引擎解码完已提交的序列后退出
+        with self._t2s_engine_lock:
+            if self._t2s_engine_options is None:
+                return None
+            model = self.t2s_model.model
+            param = next(model.parameters())
+            engine = self.t2s_engine
+            if engine is not None:
+                pool = engine.cache.k_pool[0]
+                if engine.model is model and pool.dtype == param.dtype and pool.device == param.device:
+                    return engine
+                engine.close()
+            options = self._t2s_engine_options
+            num_blocks = T2SDecodeEngine.blocks_for_memory(model, options["kv_cache_mb"], options["block_size"])
+            self.t2s_engine = T2SDecodeEngine(model, options["max_batch_size"], num_blocks, options["block_size"])
+            return self.t2s_engine
+
+    def _predict_semantic(
+        self,
+        item: dict,
+        no_prompt_text: bool,
+        session: SynthesisSession,
+        cancel_tokens: list = None,
+    ):
+        all_phoneme_ids: List[torch.LongTensor] = item["all_phones"]
+        all_phoneme_lens: torch.LongTensor = item["all_phones_len"]
+        all_bert_features: List[torch.Tensor] = item["all_bert_features"]
+        max_len = item["max_len"]
+        # 启用分句缓存时每行有自己的生成器, 见 _segment_generators()
+        generators: list = item.get("generators", None)
+
+        if no_prompt_text:
+            prompt = None
+        else:
+            prompt = (
+                session.prompt["prompt_semantic"].expand(len(all_phoneme_ids), -1).to(self.configs.device)
+            )
+
+        prefix = None
+        if prompt is not None and self.prefix_cache is not None:
+            # all_phones 中只有目标文本, 参考文本在前缀中
+            prefix = self._get_t2s_prefix(session.prompt)
+
+        engine = self._get_t2s_engine()
+        if engine is not None:
+            print(f"############ {i18n('预测语义Token')} ############")
+            requests = []
+            for i in range(len(all_phoneme_ids)):
+                if generators is not None:
+                    generator = generators[i]
+                else:
+                    # 每行一个由会话的生成器派生的生成器, 结果不受与其他请求交错解码的影响
+                    device = session.generator.device
+                    generator = torch.Generator(device=device)
+                    generator.manual_seed(int(torch.randint(0, 2**62, (1,), generator=session.generator, device=device)))
+                requests.append(
+                    T2SRequest(
+                        all_phoneme_ids[i],
+                        all_bert_features[i],
+                        prompt[i] if prompt is not None else None,
+                        top_k=session.top_k,
+                        top_p=session.top_p,
+                        temperature=session.temperature,
+                        repetition_penalty=session.repetition_penalty,
+                        early_stop_num=self.configs.hz * self.configs.max_sec,
+                        generator=generator,
+                        cancel_token=cancel_tokens[i] if cancel_tokens is not None else None,
+                        prefix=prefix,
+                    )
+                )
+            return engine.decode(requests)
+
+        # 按请求选择解码方式, 不修改共享的模型
+        speculative = {}
+        if self.t2s_draft_model is not None:
+            # 投机解码逐行进行, 代替整个 batch 一起解码
+            if session.parallel_infer and len(all_phoneme_ids) > 1:
+                print("speculative decoding decodes row by row: parallel_infer is ignored")
+            infer_panel = self.t2s_model.model.infer_panel_naive_batched
+            speculative = {
+                "draft_model": self.t2s_draft_model.model,
+                "num_draft_tokens": self.configs.num_draft_tokens,
+                "stats": {},
+            }
+        elif session.parallel_infer:
+            infer_panel = self.t2s_model.model.infer_panel_batch_infer
+        else:
+            infer_panel = self.t2s_model.model.infer_panel_naive_batched
+        sampling_kwargs = session.sampling_kwargs()
+        if generators is not None:
+            sampling_kwargs["generator"] = generators
+        print(f"############ {i18n('预测语义Token')} ############")
+        t0 = time.perf_counter()
+        pred_semantic_list, idx_list = infer_panel(
+            all_phoneme_ids,
+            all_phoneme_lens,
+            prompt,
+            all_bert_features,
+            # prompt_phone_len=ph_offset,
+            early_stop_num=self.configs.hz * self.configs.max_sec,
+            max_len=max_len,
+            cancel_tokens=cancel_tokens,
+            prefix=prefix,
+            **speculative,
+            **sampling_kwargs,
+        )
+        if speculative:
+            self._report_speculative(speculative["stats"], time.perf_counter() - t0)
+        return pred_semantic_list, idx_list
+
+    def _report_speculative(self, stats: dict, seconds: float):
+        if not stats:
+            return
+        with self._speculative_stats_lock:
+            for key, value in stats.items():
+                self.speculative_stats[key] += value
+        acceptance = stats["accepted"] / max(stats["proposed"], 1)
+        # 不用草稿模型时每次前向生成 1 个 token, 即 T2S 主模型前向次数的减少倍数
+        tokens_per_step = stats["tokens"] / max(stats["steps"], 1)
+        print(
+            f"speculative decoding: acceptance {acceptance:.1%}, {tokens_per_step:.2f} tokens per GPT forward, "
+            f"{stats['tokens'] / max(seconds, 1e-6):.1f} tokens/s"
+        )
+
+    def _decode_audio(
+        self,
+        item: dict,
+        pred_semantic_list: list,
+        idx_list: list,
+        speed_factor: float,
+        session: SynthesisSession,
+        cancel_tokens: list = None,
+    ):
+        """
+        Decode the semantic tokens of a batch with VITS.
+            Rows whose cancel token is cancelled are skipped and get an empty fragment.
+            Rows with their own generator (item["generators"]) are decoded one by one.
+        """
+        batch_phones: List[torch.LongTensor] = item["phones"]
+        generators: list = item.get("generators", None)
+        refer_audio_spec = []
+        prompt = session.prompt
+        for spec, audio_tensor in prompt["refer_spec"]:
+            spec = spec.to(dtype=self.precision, device=self.configs.device)
+            refer_audio_spec.append(spec)
+        if self.is_v2pro:
+            sv_emb = list(prompt["sv_emb"])
+        # 参考音频的全局特征 ge 对同一组参考音频是固定的，只计算一次
+        if prompt["ge"] is None:
+            prompt["ge"] = self.vits_model.get_ge(refer_audio_spec, sv_emb if self.is_v2pro else None)
+        ge = prompt["ge"]
+
+        batch_audio_fragment = []
+
+        # ## vits并行推理 method 1
+        # pred_semantic_list = [item[-idx:] for item, idx in zip(pred_semantic_list, idx_list)]
+        # pred_semantic_len = torch.LongTensor([item.shape[0] for item in pred_semantic_list]).to(self.configs.device)
+        # pred_semantic = self.batch_sequences(pred_semantic_list, axis=0, pad_value=0).unsqueeze(0)
+        # max_len = 0
+        # for i in range(0, len(batch_phones)):
+        #     max_len = max(max_len, batch_phones[i].shape[-1])
+        # batch_phones = self.batch_sequences(batch_phones, axis=0, pad_value=0, max_length=max_len)
+        # batch_phones = batch_phones.to(self.configs.device)
+        # batch_audio_fragment = (self.vits_model.batched_decode(
+        #         pred_semantic, pred_semantic_len, batch_phones, batch_phones_len,refer_audio_spec
+        #     ))
+        print(f"############ {i18n('合成音频')} ############")
+        empty_fragment = torch.zeros(0, dtype=self.precision, device=self.configs.device)
+        if cancel_tokens is not None and speed_factor == 1.0:
+            keep = [i for i, token in enumerate(cancel_tokens) if not is_cancelled(token)]
+            if len(keep) < len(idx_list):
+                # 只合成未被取消的行
+                fragments = [empty_fragment] * len(idx_list)
+                if len(keep) > 0:
+                    kept_item = dict(item, phones=[batch_phones[i] for i in keep])
+                    if generators is not None:
+                        kept_item["generators"] = [generators[i] for i in keep]
+                    kept_fragments = self._decode_audio(
+                        kept_item,
+                        [pred_semantic_list[i] for i in keep],
+                        [idx_list[i] for i in keep],
+                        speed_factor,
+                        session,
+                    )
+                    for i, fragment in zip(keep, kept_fragments):
+                        fragments[i] = fragment
+                return fragments
+        if speed_factor == 1.0 and generators is None:
+            print(f"{i18n('并行合成中')}...")
+            # ## vits并行推理 method 2
+            pred_semantic_list = [item[-idx:] for item, idx in zip(pred_semantic_list, idx_list)]
+            upsample_rate = math.prod(self.vits_model.upsample_rates)
+            audio_frag_idx = [
+                pred_semantic_list[i].shape[0] * 2 * upsample_rate
+                for i in range(0, len(pred_semantic_list))
+            ]
+            audio_frag_end_idx = [sum(audio_frag_idx[: i + 1]) for i in range(0, len(audio_frag_idx))]
+            all_pred_semantic = (
+                torch.cat(pred_semantic_list).unsqueeze(0).unsqueeze(0).to(self.configs.device)
+            )
+            _batch_phones = torch.cat(batch_phones).unsqueeze(0).to(self.configs.device)
+            if self.is_v2pro != True:
+                _batch_audio_fragment = self.vits_model.decode(
+                    all_pred_semantic,
+                    _batch_phones,
+                    refer_audio_spec,
+                    speed=speed_factor,
+                    ge=ge,
+                    generator=session.generator,
+                ).detach()[0, 0, :]
+            else:
+                _batch_audio_fragment = self.vits_model.decode(
+                    all_pred_semantic,
+                    _batch_phones,
+                    refer_audio_spec,
+                    speed=speed_factor,
+                    sv_emb=sv_emb,
+                    ge=ge,
+                    generator=session.generator,
+                ).detach()[0, 0, :]
+            audio_frag_end_idx.insert(0, 0)
+            batch_audio_fragment = [
+                _batch_audio_fragment[audio_frag_end_idx[i - 1] : audio_frag_end_idx[i]]
+                for i in range(1, len(audio_frag_end_idx))
+            ]
+        else:
+            # ## vits串行推理
+            for i, idx in enumerate(tqdm(idx_list)):
+                if cancel_tokens is not None and is_cancelled(cancel_tokens[i]):
+                    batch_audio_fragment.append(empty_fragment)
+                    continue
+                generator = generators[i] if generators is not None else session.generator
+                phones = batch_phones[i].unsqueeze(0).to(self.configs.device)
+                _pred_semantic = (
+                    pred_semantic_list[i][-idx:].unsqueeze(0).unsqueeze(0)
+                )  # .unsqueeze(0)#mq要多unsqueeze一次
+                if self.is_v2pro != True:
+                    audio_fragment = self.vits_model.decode(
+                        _pred_semantic, phones, refer_audio_spec, speed=speed_factor, ge=ge, generator=generator
+                    ).detach()[0, 0, :]
+                else:
+                    audio_fragment = self.vits_model.decode(
+                        _pred_semantic,
+                        phones,
+                        refer_audio_spec,
+                        speed=speed_factor,
+                        sv_emb=sv_emb,
+                        ge=ge,
+                        generator=generator,
+                    ).detach()[0, 0, :]
+                batch_audio_fragment.append(audio_fragment)  ###试试重建不带上prompt部分
+
+        return batch_audio_fragment
+
+    def _super_sampling(self, inputs: dict) -> bool:
+        # 超采样只用于输出 24k 的 v3 (vocoder) 模型
+        return bool(inputs.get("super_sampling", False)) and self.configs.use_vocoder
+
+    def _check_reference(
+        self, session: SynthesisSession, voice_id: str, ref_audio_path: str, prompt_text: str, prompt_lang: str
+    ):
+        """
+        Validate the reference of a request.
+        Returns:
+            the prompt text and language (those of the voice if voice_id is given), and
+            whether there is no prompt text.
+        """
+        if voice_id not in [None, ""]:
+            # 使用 register_voice() 注册的音色, 参考音频和参考文本都取自音色
+            if voice_id not in self.voices:
+                raise ValueError(f"voice {voice_id} is not registered")
+            prompt_text = self.voices[voice_id]["prompt_text"]
+            prompt_lang = self.voices[voice_id]["prompt_lang"]
+
+        no_prompt_text = prompt_text in [None, ""]
+        if not no_prompt_text:
+            assert prompt_lang in self.configs.languages
+
+        if voice_id in [None, ""] and ref_audio_path in [None, ""] and (
+            (session.prompt["prompt_semantic"] is None) or (session.prompt["refer_spec"] in [None, []])
+        ):
+            raise ValueError(
+                "ref_audio_path cannot be empty, when the reference audio is not set using set_ref_audio()"
+            )
+        return prompt_text, prompt_lang, no_prompt_text
+
+    def _set_reference(
+        self,
+        session: SynthesisSession,
+        voice_id: str,
+        ref_audio_path: str,
+        aux_ref_audio_paths: list,
+        prompt_text: str,
+        prompt_lang: str,
+        no_prompt_text: bool,
+    ):
+        if voice_id not in [None, ""]:
+            self.use_voice(voice_id, session.prompt)
+        else:
+            self._prepare_prompt(
+                session.prompt, ref_audio_path, aux_ref_audio_paths, prompt_text, prompt_lang, no_prompt_text
+            )
+
+    def _batch_prompt_data(self, session: SynthesisSession, no_prompt_text: bool):
+        # 前缀模式下参考文本在前缀中, 不拼接到每一行
+        return session.prompt if not (no_prompt_text or self.prefix_cache is not None) else None
+
+    def _synthesize_batch(
+        self,
+        item: dict,
+        no_prompt_text: bool,
+        session: SynthesisSession,
+        speed_factor: float,
+        cancel_tokens: list = None,
+        stats: dict = None,
+    ):
+        """
+        Decode one batch of to_batch() with T2S and VITS.
+            Raises SynthesisCancelled between the stages when the session is cancelled.
+        Returns:
+            the audio fragment of every row, and the seconds spent in T2S and in VITS.
+        """
+        cancel_token: CancellationToken = session.cancel_token
+        t3 = time.perf_counter()
+        pred_semantic_list, idx_list = self._predict_semantic(item, no_prompt_text, session, cancel_tokens)
+        t4 = time.perf_counter()
+        _add_stat(stats, "t2s_seconds", t4 - t3)
+        _add_stat(stats, "t2s_tokens", sum(int(semantic.shape[-1]) for semantic in pred_semantic_list))
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+
+        batch_audio_fragment = self._decode_audio(item, pred_semantic_list, idx_list, speed_factor, session, cancel_tokens)
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        t5 = time.perf_counter()
+        _add_stat(stats, "vits_seconds", t5 - t4)
+        return batch_audio_fragment, t4 - t3, t5 - t4
+
+    def _segment_cache_keys(
+        self,
+        texts: List[str],
+        text_lang: str,
+        voice_id: str,
+        ref_audio_path: str,
+        aux_ref_audio_paths: list,
+        prompt_text: str,
+        prompt_lang: str,
+        params: tuple,
+    ):
+        """
+        Build the segment cache key of every text segment,
+            or return None if the voice of the request cannot be identified.
+        """
+        if voice_id not in [None, ""]:
+            voice = ("voice", voice_id, self.voices[voice_id]["digest"])
+        else:
+            if ref_audio_path in [None, ""] or not os.path.exists(ref_audio_path):
+                return None
+            aux = tuple(
+                file_digest(path) for path in (aux_ref_audio_paths or []) if path not in [None, ""] and os.path.exists(path)
+            )
+            voice = (file_digest(ref_audio_path), aux, prompt_text or "", prompt_lang if prompt_text else "")
+        models = (weights_digest(self.configs.t2s_weights_path), weights_digest(self.configs.vits_weights_path))
+        # 前缀模式的结果与默认方式不同, 投机解码的分布不变但随机数的用法不同
+        draft = None
+        if self.t2s_draft_model is not None:
+            draft = (weights_digest(self.configs.t2s_draft_weights_path), self.configs.num_draft_tokens)
+        params = params + (self.prefix_cache is not None, draft)
+        return [(text, text_lang, voice, models, params) for text in texts]
+
+    def _segment_generators(self, segment_keys: list, segments: list) -> list:
+        # 共用会话的生成器时一句的结果取决于同一 batch 中的其他句子, 缓存的结果就无法复现;
+        # 每句用由其缓存键派生的生成器, 缓存命中与不经过缓存的结果相同
+        generators = []
+        for segment in segments:
+            generator = torch.Generator(device=self.configs.device)
+            generator.manual_seed(SegmentCache.seed(segment_keys[segment]))
+            generators.append(generator)
+        return generators
+
+    def _store_segments(self, segment_keys: list, segments: list, audio_fragments: List[torch.Tensor]):
+        for segment, audio_fragment in zip(segments, audio_fragments):
+            audio = audio_fragment.float()
+            max_audio = torch.abs(audio).max()  # 与 audio_postprocess 相同的归一化
+            if max_audio > 1:
+                audio = audio / max_audio
+            self.segment_cache.put(segment_keys[segment], (audio.cpu().numpy() * 32768).astype(np.int16))
+
+    def _cached_fragment(self, audio: np.ndarray) -> torch.Tensor:
+        return torch.from_numpy(audio.astype(np.float32) / 32768).to(dtype=self.precision, device=self.configs.device)
+
+    def _save_prompt(self, session: SynthesisSession, vits_model):
+        # 下一个请求从这次的参考音频状态开始, 参考音频相同时不用重新提取特征;
+        # 期间切换了 SoVITS 模型的话特征已失效, 不保存
+        if vits_model is self.vits_model:
+            self.prompt_cache = copy_prompt(session.prompt)
+
     def stop(
         self,
     ):
         """
-        Stop the inference process.
+        Stop the inference process of every running request.
         """
-        self.stop_flag = True
+        with self._sessions_lock:
+            sessions = list(self.sessions)
+        for session in sessions:
+            session.stop()
 
     @torch.no_grad()
-    def run(self, inputs: dict):
+    def run(self, inputs: dict, session: SynthesisSession = None):
         """
         Text to speech inference.
+            Everything the request changes is kept in its session, so several run() calls
+            may share the models from different threads.
 
         Args:
             inputs (dict):
@@ -718,6 +1622,7 @@ class TTS:
                     "text_lang: "",               # str.(required) language of the text to be synthesized
                     "ref_audio_path": "",         # str.(required) reference audio path
                     "aux_ref_audio_paths": [],    # list.(optional) auxiliary reference audio paths for multi-speaker tone fusion
+                    "voice_id": None,             # str.(optional) a voice registered with register_voice(), replaces the reference audio and prompt text
                     "prompt_text": "",            # str.(optional) prompt text for the reference audio
                     "prompt_lang": "",            # str.(required) language of the prompt text for the reference audio
                     "top_k": 5,                   # int. top k sampling
@@ -735,21 +1640,23 @@ class TTS:
                     "repetition_penalty": 1.35    # float. repetition penalty for T2S model.
                     "sample_steps": 32,           # int. number of sampling steps for VITS model V3.
                     "super_sampling": False,       # bool. whether to use super-sampling for audio when using VITS model V3.
+                    "cancel_token": None,         # CancellationToken.(optional) stops the request, run() then raises SynthesisCancelled.
+                    "stats": None,                # dict.(optional) filled with the seconds spent in each stage ("reference_seconds",
+                                                  #     "frontend_seconds", "bert_seconds", "t2s_seconds", "vits_seconds",
+                                                  #     "postprocess_seconds"), "t2s_tokens" and "batch_sizes".
                 }
+            session (SynthesisSession, optional): the state of the request, created from inputs with
+                create_session() if not given; its sampling parameters replace those of inputs.
         returns:
             Tuple[int, np.ndarray]: sampling rate and audio data.
         """
         ########## variables initialization ###########
-        self.stop_flag: bool = False
         text: str = inputs.get("text", "")
         text_lang: str = inputs.get("text_lang", "")
         ref_audio_path: str = inputs.get("ref_audio_path", "")
         aux_ref_audio_paths: list = inputs.get("aux_ref_audio_paths", [])
         prompt_text: str = inputs.get("prompt_text", "")
         prompt_lang: str = inputs.get("prompt_lang", "")
-        top_k: int = inputs.get("top_k", 5)
-        top_p: float = inputs.get("top_p", 1)
-        temperature: float = inputs.get("temperature", 1)
         text_split_method: str = inputs.get("text_split_method", "cut0")
         batch_size = inputs.get("batch_size", 1)
         batch_threshold = inputs.get("batch_threshold", 0.75)
@@ -759,18 +1666,27 @@ class TTS:
         fragment_interval = inputs.get("fragment_interval", 0.3)
         seed = inputs.get("seed", -1)
         seed = -1 if seed in ["", None] else seed
-        actual_seed = set_seed(seed)
-        parallel_infer = inputs.get("parallel_infer", True)
-        repetition_penalty = inputs.get("repetition_penalty", 1.35)
         sample_steps = inputs.get("sample_steps", 32)
-        super_sampling = inputs.get("super_sampling", False)
-
-        if parallel_infer:
+        super_sampling = self._super_sampling(inputs)
+        voice_id = inputs.get("voice_id", None)
+        stats: dict = inputs.get("stats", None)
+        if session is None:
+            session = self.create_session(inputs)
+        vits_model = self.vits_model
+        cancel_token: CancellationToken = session.cancel_token
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+
+        def postprocess(*args):
+            t_post = time.perf_counter()
+            result = self.audio_postprocess(*args)
+            _add_stat(stats, "postprocess_seconds", time.perf_counter() - t_post)
+            return result
+
+        if session.parallel_infer:
             print(i18n("并行推理模式已开启"))
-            self.t2s_model.model.infer_panel = self.t2s_model.model.infer_panel_batch_infer
         else:
             print(i18n("并行推理模式已关闭"))
-            self.t2s_model.model.infer_panel = self.t2s_model.model.infer_panel_naive_batched
 
         if return_fragment:
             print(i18n("分段返回模式已开启"))
@@ -790,93 +1706,126 @@ class TTS:
             fragment_interval = 0.01
             print(i18n("分段间隔过小，已自动设置为0.01"))
 
-        no_prompt_text = False
-        if prompt_text in [None, ""]:
-            no_prompt_text = True
-
+        prompt_text, prompt_lang, no_prompt_text = self._check_reference(
+            session, voice_id, ref_audio_path, prompt_text, prompt_lang
+        )
         assert text_lang in self.configs.languages
-        if not no_prompt_text:
-            assert prompt_lang in self.configs.languages
 
-        if ref_audio_path in [None, ""] and (
-            (self.prompt_cache["prompt_semantic"] is None) or (self.prompt_cache["refer_spec"] in [None, []])
-        ):
-            raise ValueError(
-                "ref_audio_path cannot be empty, when the reference audio is not set using set_ref_audio()"
+        ###### segment cache ########
+        # 固定 seed 时按句缓存合成结果, 全部命中时不经过任何模型直接拼接
+        segment_keys: list = None
+        cached_segments: list = None
+        if self.segment_cache is not None and seed != -1:
+            if return_fragment:
+                texts = self.text_preprocessor.pre_seg_text(text, text_lang, text_split_method)
+            else:
+                texts = self.text_preprocessor.pre_seg_text(
+                    self.text_preprocessor.replace_consecutive_punctuation(text), text_lang, text_split_method
+                )
+            params = (
+                session.top_k,
+                session.top_p,
+                session.temperature,
+                session.repetition_penalty,
+                speed_factor,
+                seed,
+                session.parallel_infer,
+            )
+            segment_keys = self._segment_cache_keys(
+                texts, text_lang, voice_id, ref_audio_path, aux_ref_audio_paths, prompt_text, prompt_lang, params
             )
+        if segment_keys:
+            cached_segments = [self.segment_cache.get(key) for key in segment_keys]
+            if all(audio is not None for audio in cached_segments):
+                print(i18n("所有句子均命中缓存"))
+                fragments = [self._cached_fragment(audio) for audio in cached_segments]
+                if return_fragment:
+                    for fragment in fragments:
+                        yield postprocess(
+                            [[fragment]],
+                            self.configs.sampling_rate,
+                            None,
+                            speed_factor,
+                            False,
+                            fragment_interval,
+                            super_sampling,
+                        )
+                else:
+                    yield postprocess(
+                        [fragments],
+                        self.configs.sampling_rate,
+                        None,
+                        speed_factor,
+                        False,
+                        fragment_interval,
+                        super_sampling,
+                    )
+                return
+        else:
+            segment_keys = None
 
         ###### setting reference audio and prompt text preprocessing ########
         t0 = time.perf_counter()
-        if (ref_audio_path is not None) and (
-            ref_audio_path != self.prompt_cache["ref_audio_path"]
-            or (self.is_v2pro and self.prompt_cache["refer_spec"][0][1] is None)
-        ):
-            if not os.path.exists(ref_audio_path):
-                raise ValueError(f"{ref_audio_path} not exists")
-            self.set_ref_audio(ref_audio_path)
-
-        aux_ref_audio_paths = aux_ref_audio_paths if aux_ref_audio_paths is not None else []
-        paths = set(aux_ref_audio_paths) & set(self.prompt_cache["aux_ref_audio_paths"])
-        if not (len(list(paths)) == len(aux_ref_audio_paths) == len(self.prompt_cache["aux_ref_audio_paths"])):
-            self.prompt_cache["aux_ref_audio_paths"] = aux_ref_audio_paths
-            self.prompt_cache["refer_spec"] = [self.prompt_cache["refer_spec"][0]]
-            for path in aux_ref_audio_paths:
-                if path in [None, ""]:
-                    continue
-                if not os.path.exists(path):
-                    print(i18n("音频文件不存在，跳过："), path)
-                    continue
-                self.prompt_cache["refer_spec"].append(self._get_ref_spec(path))
-
-        if not no_prompt_text:
-            prompt_text = prompt_text.strip("\n")
-            if prompt_text[-1] not in splits:
-                prompt_text += "。" if prompt_lang != "en" else "."
-            print(i18n("实际输入的参考文本:"), prompt_text)
-            if self.prompt_cache["prompt_text"] != prompt_text:
-                phones, bert_features, norm_text = self.text_preprocessor.segment_and_extract_feature_for_text(
-                    prompt_text, prompt_lang, self.configs.version
-                )
-                self.prompt_cache["prompt_text"] = prompt_text
-                self.prompt_cache["prompt_lang"] = prompt_lang
-                self.prompt_cache["phones"] = phones
-                self.prompt_cache["bert_features"] = bert_features
-                self.prompt_cache["norm_text"] = norm_text
+        self._set_reference(
+            session, voice_id, ref_audio_path, aux_ref_audio_paths, prompt_text, prompt_lang, no_prompt_text
+        )
 
         ###### text preprocessing ########
         t1 = time.perf_counter()
+        bert_t1 = self.text_preprocessor.bert_seconds()
+        _add_stat(stats, "reference_seconds", t1 - t0)
         data: list = None
         if not return_fragment:
-            data = self.text_preprocessor.preprocess(text, text_lang, text_split_method, self.configs.version)
-            if len(data) == 0:
-                yield 16000, np.zeros(int(16000), dtype=np.int16)
-                return
+            if segment_keys is not None:
+                # 只处理缓存中没有的句子
+                missing = [i for i, audio in enumerate(cached_segments) if audio is None]
+                data = self.text_preprocessor.extract_features(texts, text_lang, self.configs.version, missing)
+                if len(data) == 0 and len(missing) == len(texts):
+                    yield 16000, np.zeros(int(16000), dtype=np.int16)
+                    return
+            else:
+                data = self.text_preprocessor.preprocess(text, text_lang, text_split_method, self.configs.version)
+                if len(data) == 0:
+                    yield 16000, np.zeros(int(16000), dtype=np.int16)
+                    return
+            data_segments = [item["segment"] for item in data]
 
             batch_index_list: list = None
             data, batch_index_list = self.to_batch(
                 data,
-                prompt_data=self.prompt_cache if not no_prompt_text else None,
+                prompt_data=self._batch_prompt_data(session, no_prompt_text),
                 batch_size=batch_size,
                 threshold=batch_threshold,
                 split_bucket=split_bucket,
                 device=self.configs.device,
                 precision=self.precision,
             )
+            if segment_keys is not None:
+                for item, index_list in zip(data, batch_index_list):
+                    item["generators"] = self._segment_generators(
+                        segment_keys, [data_segments[i] for i in index_list]
+                    )
         else:
             print(f"############ {i18n('切分文本')} ############")
-            texts = self.text_preprocessor.pre_seg_text(text, text_lang, text_split_method)
+            if segment_keys is None:
+                texts = self.text_preprocessor.pre_seg_text(text, text_lang, text_split_method)
+
+            def is_cached(i):
+                return cached_segments is not None and cached_segments[i] is not None
+
+            # data 中的每一项为句子序号的列表, 命中缓存的句子单独成一项
             data = []
             for i in range(len(texts)):
-                if i % batch_size == 0:
+                if is_cached(i) or len(data) == 0 or len(data[-1]) == batch_size or is_cached(data[-1][0]):
                     data.append([])
-                data[-1].append(texts[i])
+                data[-1].append(i)
 
-            def make_batch(batch_texts):
+            def make_batch(batch_segments):
                 batch_data = []
                 print(f"############ {i18n('提取文本Bert特征')} ############")
-                for text in tqdm(batch_texts):
+                for i in tqdm(batch_segments):
                     phones, bert_features, norm_text = self.text_preprocessor.segment_and_extract_feature_for_text(
-                        text, text_lang, self.configs.version
+                        texts[i], text_lang, self.configs.version
                     )
                     if phones is None:
                         continue
@@ -884,22 +1833,31 @@ class TTS:
                         "phones": phones,
                         "bert_features": bert_features,
                         "norm_text": norm_text,
+                        "segment": i,
                     }
                     batch_data.append(res)
                 if len(batch_data) == 0:
                     return None
                 batch, _ = self.to_batch(
                     batch_data,
-                    prompt_data=self.prompt_cache if not no_prompt_text else None,
+                    prompt_data=self._batch_prompt_data(session, no_prompt_text),
                     batch_size=batch_size,
                     threshold=batch_threshold,
                     split_bucket=False,
                     device=self.configs.device,
                     precision=self.precision,
                 )
+                batch[0]["segments"] = [res["segment"] for res in batch_data]
+                if segment_keys is not None:
+                    batch[0]["generators"] = self._segment_generators(segment_keys, batch[0]["segments"])
                 return batch[0]
 
         t2 = time.perf_counter()
+        bert_t2 = self.text_preprocessor.bert_seconds()
+        _add_stat(stats, "bert_seconds", bert_t2 - bert_t1)
+        _add_stat(stats, "frontend_seconds", t2 - t1 - (bert_t2 - bert_t1))
+        with self._sessions_lock:
+            self.sessions.add(session)
         try:
             print("############ 推理 ############")
             ###### inference ######
@@ -910,162 +1868,329 @@ class TTS:
             for item in data:
                 t3 = time.perf_counter()
                 if return_fragment:
+                    if is_cached(item[0]):
+                        yield postprocess(
+                            [[self._cached_fragment(cached_segments[item[0]])]],
+                            output_sr,
+                            None,
+                            speed_factor,
+                            False,
+                            fragment_interval,
+                            super_sampling,
+                        )
+                        continue
+                    bert_t3 = self.text_preprocessor.bert_seconds()
                     item = make_batch(item)
+                    t_batch = time.perf_counter()
+                    bert_batch = self.text_preprocessor.bert_seconds() - bert_t3
+                    _add_stat(stats, "bert_seconds", bert_batch)
+                    _add_stat(stats, "frontend_seconds", t_batch - t3 - bert_batch)
                     if item is None:
                         continue
 
-                batch_phones: List[torch.LongTensor] = item["phones"]
-                # batch_phones:torch.LongTensor = item["phones"]
-                batch_phones_len: torch.LongTensor = item["phones_len"]
-                all_phoneme_ids: torch.LongTensor = item["all_phones"]
-                all_phoneme_lens: torch.LongTensor = item["all_phones_len"]
-                all_bert_features: torch.LongTensor = item["all_bert_features"]
                 norm_text: str = item["norm_text"]
-                max_len = item["max_len"]
-
                 print(i18n("前端处理后的文本(每句):"), norm_text)
-                if no_prompt_text:
-                    prompt = None
-                else:
-                    prompt = (
-                        self.prompt_cache["prompt_semantic"].expand(len(all_phoneme_ids), -1).to(self.configs.device)
-                    )
-
-                print(f"############ {i18n('预测语义Token')} ############")
-                pred_semantic_list, idx_list = self.t2s_model.model.infer_panel(
-                    all_phoneme_ids,
-                    all_phoneme_lens,
-                    prompt,
-                    all_bert_features,
-                    # prompt_phone_len=ph_offset,
-                    top_k=top_k,
-                    top_p=top_p,
-                    temperature=temperature,
-                    early_stop_num=self.configs.hz * self.configs.max_sec,
-                    max_len=max_len,
-                    repetition_penalty=repetition_penalty,
+                row_tokens = None if cancel_token is None else [cancel_token] * len(item["phones"])
+                _add_stat(stats, "batch_sizes", [len(item["phones"])])
+                batch_audio_fragment, t2s_seconds, vits_seconds = self._synthesize_batch(
+                    item, no_prompt_text, session, speed_factor, row_tokens, stats
                 )
-                t4 = time.perf_counter()
-                t_34 += t4 - t3
-
-                refer_audio_spec = []
-                if self.is_v2pro:
-                    sv_emb = []
-                for spec, audio_tensor in self.prompt_cache["refer_spec"]:
-                    spec = spec.to(dtype=self.precision, device=self.configs.device)
-                    refer_audio_spec.append(spec)
-                    if self.is_v2pro:
-                        sv_emb.append(self.sv_model.compute_embedding3(audio_tensor))
-
-                batch_audio_fragment = []
-
-                # ## vits并行推理 method 1
-                # pred_semantic_list = [item[-idx:] for item, idx in zip(pred_semantic_list, idx_list)]
-                # pred_semantic_len = torch.LongTensor([item.shape[0] for item in pred_semantic_list]).to(self.configs.device)
-                # pred_semantic = self.batch_sequences(pred_semantic_list, axis=0, pad_value=0).unsqueeze(0)
-                # max_len = 0
-                # for i in range(0, len(batch_phones)):
-                #     max_len = max(max_len, batch_phones[i].shape[-1])
-                # batch_phones = self.batch_sequences(batch_phones, axis=0, pad_value=0, max_length=max_len)
-                # batch_phones = batch_phones.to(self.configs.device)
-                # batch_audio_fragment = (self.vits_model.batched_decode(
-                #         pred_semantic, pred_semantic_len, batch_phones, batch_phones_len,refer_audio_spec
-                #     ))
-                print(f"############ {i18n('合成音频')} ############")
-                if speed_factor == 1.0:
-                        print(f"{i18n('并行合成中')}...")
-                        # ## vits并行推理 method 2
-                        pred_semantic_list = [item[-idx:] for item, idx in zip(pred_semantic_list, idx_list)]
-                        upsample_rate = math.prod(self.vits_model.upsample_rates)
-                        audio_frag_idx = [
-                            pred_semantic_list[i].shape[0] * 2 * upsample_rate
-                            for i in range(0, len(pred_semantic_list))
-                        ]
-                        audio_frag_end_idx = [sum(audio_frag_idx[: i + 1]) for i in range(0, len(audio_frag_idx))]
-                        all_pred_semantic = (
-                            torch.cat(pred_semantic_list).unsqueeze(0).unsqueeze(0).to(self.configs.device)
-                        )
-                        _batch_phones = torch.cat(batch_phones).unsqueeze(0).to(self.configs.device)
-                        if self.is_v2pro != True:
-                            _batch_audio_fragment = self.vits_model.decode(
-                                all_pred_semantic, _batch_phones, refer_audio_spec, speed=speed_factor
-                            ).detach()[0, 0, :]
-                        else:
-                            _batch_audio_fragment = self.vits_model.decode(
-                                all_pred_semantic, _batch_phones, refer_audio_spec, speed=speed_factor, sv_emb=sv_emb
-                            ).detach()[0, 0, :]
-                        audio_frag_end_idx.insert(0, 0)
-                        batch_audio_fragment = [
-                            _batch_audio_fragment[audio_frag_end_idx[i - 1] : audio_frag_end_idx[i]]
-                            for i in range(1, len(audio_frag_end_idx))
-                        ]
-                else:
-                        # ## vits串行推理
-                        for i, idx in enumerate(tqdm(idx_list)):
-                            phones = batch_phones[i].unsqueeze(0).to(self.configs.device)
-                            _pred_semantic = (
-                                pred_semantic_list[i][-idx:].unsqueeze(0).unsqueeze(0)
-                            )  # .unsqueeze(0)#mq要多unsqueeze一次
-                            if self.is_v2pro != True:
-                                audio_fragment = self.vits_model.decode(
-                                    _pred_semantic, phones, refer_audio_spec, speed=speed_factor
-                                ).detach()[0, 0, :]
-                            else:
-                                audio_fragment = self.vits_model.decode(
-                                    _pred_semantic, phones, refer_audio_spec, speed=speed_factor, sv_emb=sv_emb
-                                ).detach()[0, 0, :]
-                            batch_audio_fragment.append(audio_fragment)  ###试试重建不带上prompt部分
-
-                t5 = time.perf_counter()
-                t_45 += t5 - t4
+                t_34 += t2s_seconds
+                t_45 += vits_seconds
                 if return_fragment:
-                    print("%.3f\t%.3f\t%.3f\t%.3f" % (t1 - t0, t2 - t1, t4 - t3, t5 - t4))
-                    yield self.audio_postprocess(
+                    print("%.3f\t%.3f\t%.3f\t%.3f" % (t1 - t0, t2 - t1, t2s_seconds, vits_seconds))
+                    if segment_keys is not None:
+                        self._store_segments(segment_keys, item["segments"], batch_audio_fragment)
+                    yield postprocess(
                         [batch_audio_fragment],
                         output_sr,
                         None,
                         speed_factor,
                         False,
                         fragment_interval,
-                        False,
+                        super_sampling,
                     )
                 else:
                     audio.append(batch_audio_fragment)
 
-                if self.stop_flag:
+                if session.stopped:
                     yield 16000, np.zeros(int(16000), dtype=np.int16)
                     return
 
             if not return_fragment:
                 print("%.3f\t%.3f\t%.3f\t%.3f" % (t1 - t0, t2 - t1, t_34, t_45))
+                if segment_keys is not None:
+                    # 按原顺序拼接新合成的句子和命中缓存的句子
+                    fragments = self.recovery_order(audio, batch_index_list) if split_bucket else sum(audio, [])
+                    self._store_segments(segment_keys, data_segments, fragments)
+                    computed = dict(zip(data_segments, fragments))
+                    audio = [[]]
+                    for i, cached_audio in enumerate(cached_segments):
+                        if cached_audio is not None:
+                            audio[0].append(self._cached_fragment(cached_audio))
+                        elif i in computed:
+                            audio[0].append(computed[i])
+                    batch_index_list = None
+                    split_bucket = False
+                    if len(audio[0]) == 0:
+                        audio = []
                 if len(audio) == 0:
                     yield 16000, np.zeros(int(16000), dtype=np.int16)
                     return
-                yield self.audio_postprocess(
+                yield postprocess(
                     audio,
                     output_sr,
                     batch_index_list,
                     speed_factor,
                     split_bucket,
                     fragment_interval,
-                    False,
+                    super_sampling,
                 )
 
+        except SynthesisCancelled:
+            # 取消不是错误, 不需要重置模型
+            print(i18n("推理已取消"))
+            raise
         except Exception as e:
             traceback.print_exc()
             # 必须返回一个空音频, 否则会导致显存不释放。
             yield 16000, np.zeros(int(16000), dtype=np.int16)
-            # 重置模型, 否则会导致显存释放不完全。
-            del self.t2s_model
-            del self.vits_model
-            self.t2s_model = None
-            self.vits_model = None
-            self.init_t2s_weights(self.configs.t2s_weights_path)
-            self.init_vits_weights(self.configs.vits_weights_path)
+            self.reload_models()
             raise e
         finally:
+            with self._sessions_lock:
+                self.sessions.discard(session)
+            self._save_prompt(session, vits_model)
             self.empty_cache()
 
+    @torch.no_grad()
+    def run_batched(
+        self,
+        inputs_list: List[dict],
+        batch_size: int = 8,
+        stats: dict = None,
+        reload_on_error: bool = True,
+    ) -> List[Tuple[int, np.ndarray]]:
+        """
+        Synthesize several requests at once, merging their segments into shared T2S batches.
+
+        Args:
+            inputs_list (List[dict]): requests in the same format as run().
+                All of them must share the reference audio, the prompt text, the sampling
+                parameters and "super_sampling"; "text", "text_lang", "text_split_method",
+                "fragment_interval" and "batch_size" may differ. "return_fragment" is ignored.
+            batch_size (int): maximum number of segments per T2S batch. A batch holds at most the
+                sum of the "batch_size" of the requests, so a single request is batched as by run().
+            stats (dict, optional): filled with "batch_sizes", the number of segments of each T2S batch,
+                and the same stage timings as the "stats" input of run(), for the whole call.
+            reload_on_error (bool): reload the models when synthesis fails, as run() does. Callers
+                that retry the failed requests can pass False and call reload_models() once afterwards.
+        returns:
+            List[Tuple[int, np.ndarray]]: sampling rate and audio data for every request, in order.
+                None for the requests whose "cancel_token" was cancelled; their rows leave the batch
+                without affecting the other requests. After stop(), silence for every request, as run().
+        """
+        inputs: dict = inputs_list[0]
+        ref_audio_path: str = inputs.get("ref_audio_path", "")
+        prompt_text: str = inputs.get("prompt_text", "")
+        prompt_lang: str = inputs.get("prompt_lang", "")
+        batch_threshold = inputs.get("batch_threshold", 0.75)
+        speed_factor = inputs.get("speed_factor", 1.0)
+        super_sampling = self._super_sampling(inputs)
+        # 每个请求向共用的 batch 提供它自己的 batch_size 个位置
+        batch_size = min(batch_size, sum(_inputs.get("batch_size", batch_size) for _inputs in inputs_list))
+        # 所有请求共用第一个请求的采样参数和随机数生成器, 取消令牌按行区分
+        session = self.create_session(dict(inputs, cancel_token=None))
+        vits_model = self.vits_model
+        voice_id = inputs.get("voice_id", None)
+        prompt_text, prompt_lang, no_prompt_text = self._check_reference(
+            session, voice_id, ref_audio_path, prompt_text, prompt_lang
+        )
+        t0 = time.perf_counter()
+        self._set_reference(
+            session,
+            voice_id,
+            ref_audio_path,
+            inputs.get("aux_ref_audio_paths", []),
+            prompt_text,
+            prompt_lang,
+            no_prompt_text,
+        )
+
+        ###### text preprocessing ########
+        t1 = time.perf_counter()
+        bert_t1 = self.text_preprocessor.bert_seconds()
+        _add_stat(stats, "reference_seconds", t1 - t0)
+        data: list = []
+        owners: list = []
+        for owner, _inputs in enumerate(inputs_list):
+            text_lang: str = _inputs.get("text_lang", "")
+            assert text_lang in self.configs.languages
+            segments = self.text_preprocessor.preprocess(
+                _inputs.get("text", ""), text_lang, _inputs.get("text_split_method", "cut0"), self.configs.version
+            )
+            data.extend(segments)
+            owners.extend([owner] * len(segments))
+
+        empty_result = (16000, np.zeros(int(16000), dtype=np.int16))
+        if len(data) == 0:
+            return [empty_result for _ in inputs_list]
+
+        data, batch_index_list = self.to_batch(
+            data,
+            prompt_data=self._batch_prompt_data(session, no_prompt_text),
+            batch_size=batch_size,
+            threshold=batch_threshold,
+            split_bucket=speed_factor == 1.0,
+            device=self.configs.device,
+            precision=self.precision,
+        )
+        t2 = time.perf_counter()
+        bert_t2 = self.text_preprocessor.bert_seconds()
+        _add_stat(stats, "bert_seconds", bert_t2 - bert_t1)
+        _add_stat(stats, "frontend_seconds", t2 - t1 - (bert_t2 - bert_t1))
+        _add_stat(stats, "batch_sizes", [len(index_list) for index_list in batch_index_list])
+
+        cancel_tokens = [_inputs.get("cancel_token", None) for _inputs in inputs_list]
+        with self._sessions_lock:
+            self.sessions.add(session)
+        try:
+            audio = []
+            for item, index_list in zip(data, batch_index_list):
+                if all(is_cancelled(token) for token in cancel_tokens):
+                    return [None for _ in inputs_list]
+                print(i18n("前端处理后的文本(每句):"), item["norm_text"])
+                row_tokens = [cancel_tokens[owners[index]] for index in index_list]
+                fragments, _, _ = self._synthesize_batch(item, no_prompt_text, session, speed_factor, row_tokens, stats)
+                audio.append(fragments)
+                if session.stopped:
+                    # 与 run() 相同, 被 stop() 停止的请求得到静音
+                    return [empty_result for _ in inputs_list]
+
+            fragments = self.recovery_order(audio, batch_index_list)
+            results = []
+            for owner, _inputs in enumerate(inputs_list):
+                if is_cancelled(cancel_tokens[owner]):
+                    results.append(None)
+                    continue
+                own_fragments = [fragment for fragment, _owner in zip(fragments, owners) if _owner == owner]
+                if len(own_fragments) == 0:
+                    results.append(empty_result)
+                    continue
+                fragment_interval = max(_inputs.get("fragment_interval", 0.3), 0.01)
+                t_post = time.perf_counter()
+                results.append(
+                    self.audio_postprocess(
+                        [own_fragments],
+                        self.configs.sampling_rate,
+                        None,
+                        speed_factor,
+                        False,
+                        fragment_interval,
+                        super_sampling,
+                    )
+                )
+                _add_stat(stats, "postprocess_seconds", time.perf_counter() - t_post)
+            return results
+        except Exception:
+            traceback.print_exc()
+            if reload_on_error:
+                self.reload_models()
+            raise
+        finally:
+            with self._sessions_lock:
+                self.sessions.discard(session)
+            self._save_prompt(session, vits_model)
+            self.empty_cache()
+
+    def warmup(
+        self,
+        languages: List[str] = None,
+        voice_ids: List[str] = None,
+        ref_audio_path: str = None,
+        prompt_text: str = "",
+        prompt_lang: str = "zh",
+        parallel_infer: bool = True,
+    ) -> List[dict]:
+        """
+        Load the lazily initialized resources before the first request.
+            Runs the text frontend once per language, then one short synthesis per voice
+            (or with ref_audio_path when no voice is given), so that allocator and kernel
+            warm-up are not paid by the first real request. A failing stage is reported
+            and does not stop the others.
+        Args:
+            languages: list, languages of the frontends to load, defaults to all of WARMUP_TEXTS supported by the model.
+            voice_ids: list, voices registered with register_voice() to synthesize with, defaults to all of them.
+            ref_audio_path: str, optional reference audio used when there is no voice.
+            prompt_text: str, transcript of ref_audio_path.
+            prompt_lang: str, language of prompt_text.
+            parallel_infer: bool, whether to warm up the parallel T2S decoder (else the naive one).
+        Returns:
+            list: one dict per stage with "stage", "seconds" and "error" (None on success).
+        """
+        if languages is None:
+            languages = [lang for lang in WARMUP_TEXTS if lang in self.configs.languages]
+        if voice_ids is None:
+            voice_ids = list(self.voices.keys())
+
+        stages = []
+
+        def timed(stage: str, func):
+            t0 = time.perf_counter()
+            error = None
+            try:
+                func()
+            except Exception as e:
+                traceback.print_exc()
+                error = f"{type(e).__name__}: {e}"
+            stages.append({"stage": stage, "seconds": time.perf_counter() - t0, "error": error})
+            print(f"{i18n('预热')} {stage}: {stages[-1]['seconds']:.3f}s" + ("" if error is None else f" ({error})"))
+
+        for lang in languages:
+            timed(
+                f"frontend.{lang}",
+                lambda lang=lang: self.text_preprocessor.segment_and_extract_feature_for_text(
+                    WARMUP_TEXTS[lang], lang, self.configs.version
+                ),
+            )
+
+        synth_inputs = []
+        for voice_id in voice_ids:
+            text_lang = self.voices[voice_id]["prompt_lang"] or "zh"
+            synth_inputs.append((f"synthesis.{voice_id}", {"voice_id": voice_id, "text_lang": text_lang}))
+        if not synth_inputs and ref_audio_path not in [None, ""]:
+            synth_inputs.append(
+                (
+                    "synthesis.reference",
+                    {
+                        "ref_audio_path": ref_audio_path,
+                        "prompt_text": prompt_text,
+                        "prompt_lang": prompt_lang,
+                        "text_lang": prompt_lang,
+                    },
+                )
+            )
+        for stage, inputs in synth_inputs:
+            inputs.update(
+                text=WARMUP_TEXTS.get(inputs["text_lang"].replace("all_", ""), WARMUP_TEXTS["zh"]),
+                text_split_method="cut0",
+                parallel_infer=parallel_infer,
+            )
+            timed(stage, lambda inputs=inputs: list(self.run(inputs)))
+        return stages
+
+    def reload_models(self):
+        """
+        Reload the T2S and VITS weights after a failed synthesis.
+        """
+        # 重置模型, 否则会导致显存释放不完全。
+        del self.t2s_model
+        del self.vits_model
+        self.t2s_model = None
+        self.vits_model = None
+        self.init_t2s_weights(self.configs.t2s_weights_path)
+        self.init_vits_weights(self.configs.vits_weights_path)
+
     def empty_cache(self):
         try:
             gc.collect()  # 触发gc的垃圾回收。避免内存一直增长。
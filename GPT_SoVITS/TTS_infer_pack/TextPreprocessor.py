@@ -1,6 +1,7 @@
 import os
 import sys
 import threading
+import time
 
 from tqdm import tqdm
 
@@ -55,21 +56,32 @@ class TextPreprocessor:
         self.tokenizer = tokenizer
         self.device = device
         self.bert_lock = threading.RLock()
+        # 每个线程累计的 BERT 耗时, 用于统计各阶段耗时
+        self._timing = threading.local()
+
+    def bert_seconds(self) -> float:
+        """Total time spent in BERT by the calling thread."""
+        return getattr(self._timing, "bert_seconds", 0.0)
 
     def preprocess(self, text: str, lang: str, text_split_method: str, version: str = "v2") -> List[Dict]:
         print(f"############ {i18n('切分文本')} ############")
         text = self.replace_consecutive_punctuation(text)
         texts = self.pre_seg_text(text, lang, text_split_method)
+        return self.extract_features(texts, lang, version)
+
+    def extract_features(self, texts: List[str], lang: str, version: str = "v2", indices: List[int] = None) -> List[Dict]:
+        # indices 指定只处理其中的部分句子, 结果中的 "segment" 为句子在 texts 中的序号
         result = []
         print(f"############ {i18n('提取文本Bert特征')} ############")
-        for text in tqdm(texts):
-            phones, bert_features, norm_text = self.segment_and_extract_feature_for_text(text, lang, version)
+        for i in tqdm(range(len(texts)) if indices is None else indices):
+            phones, bert_features, norm_text = self.segment_and_extract_feature_for_text(texts[i], lang, version)
             if phones is None or norm_text == "":
                 continue
             res = {
                 "phones": phones,
                 "bert_features": bert_features,
                 "norm_text": norm_text,
+                "segment": i,
             }
             result.append(res)
         return result
@@ -189,6 +201,7 @@ class TextPreprocessor:
             return phones, bert, norm_text
 
     def get_bert_feature(self, text: str, word2ph: list) -> torch.Tensor:
+        t0 = time.perf_counter()
         with torch.no_grad():
             inputs = self.tokenizer(text, return_tensors="pt")
             for i in inputs:
@@ -201,6 +214,7 @@ class TextPreprocessor:
             repeat_feature = res[i].repeat(word2ph[i], 1)
             phone_level_feature.append(repeat_feature)
         phone_level_feature = torch.cat(phone_level_feature, dim=0)
+        self._timing.bert_seconds = self.bert_seconds() + time.perf_counter() - t0
         return phone_level_feature.T
 
     def clean_text_inf(self, text: str, language: str, version: str = "v2"):
@@ -0,0 +1,59 @@
+import threading
+import time
+from typing import Callable, List, Optional
+
+
+class SynthesisCancelled(Exception):
+    pass
+
+
+class CancellationToken:
+    """
+    Cancellation flag of a single request.
+        It is checked on every step of the T2S decoding loop and between VITS fragments,
+        so a cancelled request leaves its batch without affecting the other rows.
+    Args:
+        deadline: float, optional time.monotonic() value after which the request counts as cancelled.
+    """
+
+    def __init__(self, deadline: Optional[float] = None):
+        self.deadline = deadline
+        self.reason: Optional[str] = None
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+
+    def cancel(self, reason: str = "cancelled"):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def add_callback(self, callback: Callable[[], None]):
+        # 已经取消的话立即调用
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    @property
+    def cancelled(self) -> bool:
+        if self._event.is_set():
+            return True
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancel("deadline")
+            return True
+        return False
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise SynthesisCancelled(self.reason)
+
+
+def is_cancelled(token: Optional[CancellationToken]) -> bool:
+    return token is not None and token.cancelled
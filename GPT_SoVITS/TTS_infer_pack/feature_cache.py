@@ -0,0 +1,154 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, Hashable, Optional
+
+import numpy as np
+import torch
+
+
+def file_digest(path: str) -> str:
+    # 按文件内容计算哈希，同一段音频即使写入不同的临时文件也能命中缓存
+    if not path:
+        return ""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@lru_cache(maxsize=64)
+def _weights_digest(path: str, size: int, mtime_ns: int) -> str:
+    return file_digest(path)
+
+
+def weights_digest(path: str) -> str:
+    # 模型文件较大，按 (路径, 大小, 修改时间) 记住哈希结果
+    if not path or not os.path.exists(path):
+        return ""
+    stat = os.stat(path)
+    return _weights_digest(path, stat.st_size, stat.st_mtime_ns)
+
+
+def tensor_digest(*tensors: torch.Tensor) -> str:
+    # 按张量内容(形状、类型和数据)计算哈希, 内容相同的不同张量对象得到相同的结果
+    digest = hashlib.sha1()
+    for tensor in tensors:
+        tensor = tensor.detach().cpu()
+        digest.update(f"{tuple(tensor.shape)}{tensor.dtype}".encode("utf-8"))
+        digest.update(tensor.contiguous().reshape(-1).view(torch.uint8).numpy().tobytes())
+    return digest.hexdigest()
+
+
+class LRUCache:
+    """
+    A thread-safe LRU cache with hit/miss counters.
+    Args:
+        max_entries: int, the maximum number of entries, 0 disables the cache.
+    """
+
+    def __init__(self, max_entries: int = 16):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SegmentCache:
+    """
+    Cache of synthesized int16 audio per text segment.
+        Entries are kept in an in-memory LRU and, if disk_dir is set, also written to disk
+        so that they survive restarts and memory evictions. While the cache is enabled every
+        segment is sampled with its own generator (see seed()) and decoded by VITS on its own,
+        so a cached segment is the audio an uncached run would produce for it.
+    Args:
+        max_entries: int, the maximum number of in-memory entries.
+        disk_dir: str, optional directory of the on-disk store.
+    """
+
+    def __init__(self, max_entries: int = 256, disk_dir: str = None):
+        self.memory = LRUCache(max_entries=max_entries)
+        self.disk_dir = disk_dir
+        self.disk_hits = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @staticmethod
+    def _digest(key: Hashable) -> str:
+        return hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+
+    @classmethod
+    def seed(cls, key: Hashable) -> int:
+        """
+        Seed of the random generator of a segment, derived from its key (which contains the
+            seed of the request), so that a segment decodes the same whatever the other
+            segments of its batch are.
+        """
+        return int(cls._digest(key)[:15], 16)
+
+    def get(self, key: Hashable) -> Optional[np.ndarray]:
+        digest = self._digest(key)
+        audio = self.memory.get(digest)
+        if audio is None and self.disk_dir:
+            path = os.path.join(self.disk_dir, digest + ".npy")
+            if os.path.exists(path):
+                audio = np.load(path)
+                self.disk_hits += 1
+                self.memory.put(digest, audio)
+        return audio
+
+    def put(self, key: Hashable, audio: np.ndarray):
+        digest = self._digest(key)
+        self.memory.put(digest, audio)
+        if self.disk_dir:
+            path = os.path.join(self.disk_dir, digest + ".npy")
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, audio)
+            os.replace(tmp_path, path)
+
+    def stats(self) -> Dict[str, int]:
+        stats = self.memory.stats()
+        stats["disk_hits"] = self.disk_hits
+        # 内存未命中但磁盘命中的也算作命中
+        stats["hits"] += self.disk_hits
+        stats["misses"] -= self.disk_hits
+        return stats
@@ -0,0 +1,79 @@
+import random
+from typing import Optional
+
+import torch
+
+from TTS_infer_pack.cancellation import CancellationToken
+
+
+def copy_prompt(prompt: dict) -> dict:
+    """
+    Copy a reference/prompt state (see TTS.prompt_cache).
+        The tensors are shared, only the containers that run() modifies are copied.
+    """
+    prompt = dict(prompt)
+    prompt["refer_spec"] = list(prompt["refer_spec"])
+    prompt["aux_ref_audio_paths"] = list(prompt["aux_ref_audio_paths"])
+    prompt["sv_emb"] = list(prompt["sv_emb"])
+    return prompt
+
+
+class SynthesisSession:
+    """
+    Per-request state of TTS.run().
+        The models of the TTS instance are shared and only read; what a request changes lives
+        here: its own copy of the reference/prompt state, the sampling parameters, a private
+        random generator and a stop flag. Requests with separate sessions can therefore run in
+        parallel threads without seeing each other's reference audio or random numbers.
+    Args:
+        prompt: dict, the reference/prompt state to start from, copied.
+        device: torch.device, device of the random generator (the device of the models).
+        seed: int, seed of the random generator, -1 for a random one.
+        top_k: int, top k sampling.
+        top_p: float, top p sampling.
+        temperature: float, temperature for sampling.
+        repetition_penalty: float, repetition penalty for the T2S model.
+        parallel_infer: bool, decode the rows of a batch together (else one after another).
+        cancel_token: CancellationToken, optional, cancels the request.
+    """
+
+    def __init__(
+        self,
+        prompt: dict,
+        device: torch.device,
+        seed: int = -1,
+        top_k: int = 5,
+        top_p: float = 1,
+        temperature: float = 1,
+        repetition_penalty: float = 1.35,
+        parallel_infer: bool = True,
+        cancel_token: Optional[CancellationToken] = None,
+    ):
+        self.prompt: dict = copy_prompt(prompt)
+        seed = -1 if seed in ["", None] else int(seed)
+        self.seed: int = seed if seed != -1 else random.randint(0, 2**32 - 1)
+        self.generator: torch.Generator = torch.Generator(device=device)
+        self.generator.manual_seed(self.seed)
+        self.top_k = top_k
+        self.top_p = top_p
+        self.temperature = temperature
+        self.repetition_penalty = repetition_penalty
+        self.parallel_infer = parallel_infer
+        self.cancel_token = cancel_token
+        self.stopped: bool = False
+
+    def stop(self):
+        """
+        Stop after the current batch; run() then returns silence instead of raising.
+        """
+        self.stopped = True
+
+    def sampling_kwargs(self) -> dict:
+        # 传给 T2S 模型 infer_panel_* 的采样参数
+        return {
+            "top_k": self.top_k,
+            "top_p": self.top_p,
+            "temperature": self.temperature,
+            "repetition_penalty": self.repetition_penalty,
+            "generator": self.generator,
+        }
@@ -67,6 +67,27 @@ def split_big_text(text, max_len=510):
     return result
 
 
+# 流式输入用：切出已经以标点结尾的句子，返回(句子列表, 尚未结束的剩余文本)
+def split_completed(text, min_len=5):
+    sentences = []
+    start = 0
+    for i, char in enumerate(text):
+        if char not in splits:
+            continue
+        if i == len(text) - 1:
+            # 末尾的标点可能是省略号或小数点的一部分，等下一个字符到达后再判断
+            break
+        if text[i + 1] in splits:
+            continue
+        if char == "." and text[i - 1 : i].isdigit() and text[i + 1].isdigit():
+            continue
+        if len(text[start : i + 1].strip()) < min_len:
+            continue
+        sentences.append(text[start : i + 1])
+        start = i + 1
+    return sentences, text[start:]
+
+
 def split(todo_text):
     todo_text = todo_text.replace("……", "。").replace("——", "，")
     if todo_text[-1] not in splits:
@@ -14,6 +14,7 @@ from transformers import AutoModelForMaskedLM, AutoTokenizer
 from feature_extractor import cnhubert
 
 from AR.models.t2s_lightning_module import Text2SemanticLightningModule
+from AR.models.t2s_model import grow_kv_cache, kv_cache_len
 from module.models_onnx import SynthesizerTrn
 
 from inference_webui import get_phones_and_bert
@@ -298,12 +299,38 @@ class T2SBlock:
             )
         return x, k_cache, v_cache
 
+    def process_prompt_static(
+        self,
+        x: torch.Tensor,
+        attn_mask: torch.Tensor,
+        k_cache: torch.Tensor,
+        v_cache: torch.Tensor,
+        padding_mask: Optional[torch.Tensor] = None,
+    ):
+        x, k, v = self.process_prompt(x, attn_mask, padding_mask)
+        kv_len = k.shape[1]
+        k_cache[:, :kv_len] = k
+        v_cache[:, :kv_len] = v
+        return x
+
     def decode_next_token(self, x: torch.Tensor, k_cache: torch.Tensor, v_cache: torch.Tensor):
         q, k, v = F.linear(x, self.qkv_w, self.qkv_b).chunk(3, dim=-1)
 
         k_cache = torch.cat([k_cache, k], dim=1)
         v_cache = torch.cat([v_cache, v], dim=1)
 
+        return self.attend_next_token(x, q, k_cache, v_cache), k_cache, v_cache
+
+    def decode_next_token_static(self, x: torch.Tensor, k_cache: torch.Tensor, v_cache: torch.Tensor, cache_len: int):
+        q, k, v = F.linear(x, self.qkv_w, self.qkv_b).chunk(3, dim=-1)
+
+        # 原地写入预先分配的缓存, 只读取有效的前缀
+        k_cache[:, cache_len : cache_len + 1] = k
+        v_cache[:, cache_len : cache_len + 1] = v
+
+        return self.attend_next_token(x, q, k_cache[:, : cache_len + 1], v_cache[:, : cache_len + 1])
+
+    def attend_next_token(self, x: torch.Tensor, q: torch.Tensor, k_cache: torch.Tensor, v_cache: torch.Tensor):
         batch_size = q.shape[0]
         q_len = q.shape[1]
         kv_len = k_cache.shape[1]
@@ -329,7 +356,7 @@ class T2SBlock:
             self.norm_b2,
             self.norm_eps2,
         )
-        return x, k_cache, v_cache
+        return x
 
 
 @torch.jit.script
@@ -352,6 +379,26 @@ class T2STransformer:
             x, k_cache[i], v_cache[i] = self.blocks[i].decode_next_token(x, k_cache[i], v_cache[i])
         return x, k_cache, v_cache
 
+    def process_prompt_static(
+        self, x: torch.Tensor, attn_mask: torch.Tensor, max_len: int, padding_mask: Optional[torch.Tensor] = None
+    ):
+        k_cache: list[torch.Tensor] = []
+        v_cache: list[torch.Tensor] = []
+        for i in range(self.num_blocks):
+            k_buffer = x.new_empty((x.shape[0], max_len, self.blocks[i].hidden_dim))
+            v_buffer = x.new_empty((x.shape[0], max_len, self.blocks[i].hidden_dim))
+            x = self.blocks[i].process_prompt_static(x, attn_mask, k_buffer, v_buffer, padding_mask)
+            k_cache.append(k_buffer)
+            v_cache.append(v_buffer)
+        return x, k_cache, v_cache
+
+    def decode_next_token_static(
+        self, x: torch.Tensor, k_cache: list[torch.Tensor], v_cache: list[torch.Tensor], cache_len: int
+    ):
+        for i in range(self.num_blocks):
+            x = self.blocks[i].decode_next_token_static(x, k_cache[i], v_cache[i], cache_len)
+        return x
+
 
 class VitsModel(nn.Module):
     def __init__(self, vits_path, version=None, is_half=True, device="cpu"):
@@ -520,7 +567,10 @@ class T2SModel(nn.Module):
         idx = 0
         top_k = int(top_k)
 
-        xy_dec, k_cache, v_cache = self.t2s_transformer.process_prompt(xy_pos, xy_attn_mask, None)
+        # kv cache 按参考音频加预估的生成长度预先分配, 解码时原地写入
+        cache_size = kv_cache_len(src_len, text_seq.shape[1], int(early_stop_num))
+        cache_len = src_len
+        xy_dec, k_cache, v_cache = self.t2s_transformer.process_prompt_static(xy_pos, xy_attn_mask, cache_size, None)
 
         logits = self.ar_predict_layer(xy_dec[:, -1])
         logits = logits[:, :-1]
@@ -536,7 +586,12 @@ class T2SModel(nn.Module):
         for idx in range(1, 1500):
             # [1, N] [N_layer, N, 1, 512] [N_layer, N, 1, 512] [1, N, 512] [1] [1, N, 512] [1, N]
             # y, k, v, y_emb, logits, samples = self.stage_decoder(y, k, v, y_emb, x_example)
-            xy_dec, k_cache, v_cache = self.t2s_transformer.decode_next_token(xy_pos, k_cache, v_cache)
+            if cache_len == cache_size:
+                cache_size = min(cache_size * 2, src_len + 1500)
+                k_cache = grow_kv_cache(k_cache, cache_size)
+                v_cache = grow_kv_cache(v_cache, cache_size)
+            xy_dec = self.t2s_transformer.decode_next_token_static(xy_pos, k_cache, v_cache, cache_len)
+            cache_len += 1
             logits = self.ar_predict_layer(xy_dec[:, -1])
 
             if idx < 11:  ###至少预测出10个token不然不给停止（0.4s）
@@ -4,6 +4,7 @@
 import json
 import os
 import warnings
+import weakref
 import zipfile
 from typing import Any, Dict, List, Tuple
 
@@ -79,6 +80,17 @@ def download_and_decompress(model_dir: str = "G2PWModel/"):
     return model_dir
 
 
+# fork 前创建的会话. 其线程池在子进程中不存在, 析构时会等待这些线程, 所以只保留引用
+_stale_sessions = []
+
+
+def _drop_session(converter: "weakref.ref[G2PWOnnxConverter]"):
+    instance = converter()
+    if instance is not None and instance.session_g2pW is not None:
+        _stale_sessions.append(instance.session_g2pW)
+        instance.session_g2pW = None
+
+
 class G2PWOnnxConverter:
     def __init__(
         self,
@@ -89,22 +101,12 @@ class G2PWOnnxConverter:
     ):
         uncompress_path = download_and_decompress(model_dir)
 
-        sess_options = onnxruntime.SessionOptions()
-        sess_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
-        sess_options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
-        sess_options.intra_op_num_threads = 2 if torch.cuda.is_available() else 0
-        if "CUDAExecutionProvider" in onnxruntime.get_available_providers():
-            self.session_g2pW = onnxruntime.InferenceSession(
-                os.path.join(uncompress_path, "g2pW.onnx"),
-                sess_options=sess_options,
-                providers=["CUDAExecutionProvider", "CPUExecutionProvider"],
-            )
-        else:
-            self.session_g2pW = onnxruntime.InferenceSession(
-                os.path.join(uncompress_path, "g2pW.onnx"),
-                sess_options=sess_options,
-                providers=["CPUExecutionProvider"],
-            )
+        self.model_path = os.path.join(uncompress_path, "g2pW.onnx")
+        self.session_g2pW = self._new_session()
+        if hasattr(os, "register_at_fork"):
+            # fork 出的子进程不会继承父进程的线程池, 在子进程中按其 ORT_NUM_THREADS 重新创建会话
+            converter = weakref.ref(self)
+            os.register_at_fork(after_in_child=lambda: _drop_session(converter))
         self.config = load_config(config_path=os.path.join(uncompress_path, "config.py"), use_default=True)
 
         self.model_source = model_source if model_source else self.config.model_source
@@ -175,6 +177,20 @@ class G2PWOnnxConverter:
         if self.enable_opencc:
             self.cc = OpenCC("s2tw")
 
+    def _new_session(self) -> onnxruntime.InferenceSession:
+        sess_options = onnxruntime.SessionOptions()
+        sess_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        sess_options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+        # 多进程部署时通过 ORT_NUM_THREADS 为每个进程分配线程数，避免抢占 CPU
+        sess_options.intra_op_num_threads = int(
+            os.environ.get("ORT_NUM_THREADS", 2 if torch.cuda.is_available() else 0)
+        )
+        if "CUDAExecutionProvider" in onnxruntime.get_available_providers():
+            providers = ["CUDAExecutionProvider", "CPUExecutionProvider"]
+        else:
+            providers = ["CPUExecutionProvider"]
+        return onnxruntime.InferenceSession(self.model_path, sess_options=sess_options, providers=providers)
+
     def _convert_bopomofo_to_pinyin(self, bopomofo: str) -> str:
         tone = bopomofo[-1]
         assert tone in "12345"
@@ -213,6 +229,8 @@ class G2PWOnnxConverter:
             window_size=None,
         )
 
+        if self.session_g2pW is None:
+            self.session_g2pW = self._new_session()
         preds, confidences = predict(session=self.session_g2pW, onnx_input=onnx_input, labels=self.labels)
         if self.config.use_char_phoneme:
             preds = [pred.split(" ")[1] for pred in preds]
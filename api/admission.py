@@ -0,0 +1,185 @@
+"""Bounded, priority-ordered admission of synthesis requests."""
+
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+# 値が小さいほど優先される
+PRIORITY_CLASSES = {"interactive": 0, "batch": 1}
+QUEUE_POLICIES = ("edf", "sjf")
+# 文ごとに T2S のプレフィルと VITS の復号が走る分の固定コスト (文字数換算)
+SEGMENT_OVERHEAD = 8
+
+
+class QueueFullError(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f"Too many queued requests, retry after {retry_after}s.")
+        self.retry_after = retry_after
+
+
+class DeadlineExceededError(Exception):
+    pass
+
+
+@dataclass
+class Ticket:
+    priority: str = "interactive"
+    deadline: Optional[float] = None
+    cost: float = 0.0
+    rank: Tuple = ()
+    enqueued_at: float = field(default_factory=time.monotonic)
+    started_at: Optional[float] = None
+
+    def expired(self, now: Optional[float] = None) -> bool:
+        return self.deadline is not None and (now or time.monotonic()) >= self.deadline
+
+
+def estimate_cost(segments: List[str]) -> float:
+    """Rough synthesis cost of the segments returned by ``TextPreprocessor.pre_seg_text``.
+
+    The number of phones is approximated by the number of characters, which is close
+    enough to order jobs by length without running g2p.
+    """
+    return float(sum(len(segment) for segment in segments) + SEGMENT_OVERHEAD * len(segments))
+
+
+class AdmissionController:
+    """Admit at most ``max_depth`` waiting requests and run ``capacity`` of them at once.
+
+    Requests are ordered by priority class first and then either by deadline (``edf``,
+    requests without a deadline last, shortest first among them) or by estimated cost
+    (``sjf``). Waiting requests whose deadline passes are dropped with
+    ``DeadlineExceededError``. Requests beyond ``max_depth`` are rejected right away with
+    ``QueueFullError`` carrying a Retry-After estimate based on recent service times.
+    """
+
+    def __init__(self, max_depth: int = 64, capacity: int = 1, policy: str = "edf"):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f"Unknown queue policy '{policy}'. Options: {list(QUEUE_POLICIES)}")
+        self.max_depth = max_depth
+        self.capacity = max(1, capacity)
+        self.policy = policy
+        self._waiters: List[list] = []
+        self._seq = itertools.count()
+        self._reserved = 0
+        self._in_flight = 0
+        self._service_seconds = 1.0
+        self._recent_waits: deque = deque(maxlen=1024)
+        self._stats = {
+            "admitted": 0,
+            "rejected": 0,
+            "expired": 0,
+            "completed": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+        }
+
+    def ticket(self, priority: str = "interactive", deadline_ms: Optional[float] = None, cost: float = 0.0) -> Ticket:
+        if priority not in PRIORITY_CLASSES:
+            raise ValueError(f"Unknown priority '{priority}'. Options: {list(PRIORITY_CLASSES.keys())}")
+        now = time.monotonic()
+        deadline = None if deadline_ms is None else now + deadline_ms / 1000.0
+        if self.policy == "edf":
+            order = (math.inf if deadline is None else deadline, cost)
+        else:
+            order = (cost, math.inf if deadline is None else deadline)
+        return Ticket(priority=priority, deadline=deadline, cost=cost, rank=(PRIORITY_CLASSES[priority],) + order, enqueued_at=now)
+
+    def admit(self, ticket: Ticket) -> None:
+        """Reserve a place in the queue or raise ``QueueFullError``."""
+        if self._reserved - self._in_flight >= self.max_depth:
+            self._stats["rejected"] += 1
+            raise QueueFullError(self.retry_after())
+        self._reserved += 1
+        self._stats["admitted"] += 1
+        ticket.enqueued_at = time.monotonic()
+
+    async def acquire(self, ticket: Ticket) -> None:
+        """Wait for a slot. ``admit`` must have been called for ``ticket``."""
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, [ticket.rank, next(self._seq), ticket, future])
+        # 空きがあればすぐに枠が割り当てられる
+        self._wake()
+        timeout = None if ticket.deadline is None else max(0.0, ticket.deadline - time.monotonic())
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self._expire()
+            raise DeadlineExceededError("The request deadline passed while it was queued.") from None
+        except DeadlineExceededError:
+            # _wake() で期限切れとして処理済み
+            raise
+        except BaseException:
+            if future.done() and not future.cancelled():
+                # 枠を得た直後に取り消された
+                self.release(ticket)
+            else:
+                self._reserved -= 1
+                self._wake()
+            raise
+
+    def release(self, ticket: Ticket) -> None:
+        """Give back the slot taken by ``acquire``."""
+        if ticket.started_at is not None:
+            # Retry-After の見積もりに使う処理時間の指数移動平均
+            self._service_seconds = 0.8 * self._service_seconds + 0.2 * (time.monotonic() - ticket.started_at)
+        self._in_flight -= 1
+        self._reserved -= 1
+        self._stats["completed"] += 1
+        self._wake()
+
+    def retry_after(self) -> int:
+        queued = max(self._reserved - self._in_flight, 0)
+        return max(1, math.ceil(self._service_seconds * (queued + 1) / self.capacity))
+
+    def stats(self) -> Dict[str, float]:
+        stats = dict(self._stats)
+        waits = sorted(self._recent_waits)
+        stats["queue_depth"] = max(self._reserved - self._in_flight, 0)
+        stats["in_flight"] = self._in_flight
+        stats["max_depth"] = self.max_depth
+        stats["capacity"] = self.capacity
+        stats["policy"] = self.policy
+        for name, rank in PRIORITY_CLASSES.items():
+            stats[f"waiting_{name}"] = sum(
+                1 for entry in self._waiters if entry[0][0] == rank and not entry[3].done()
+            )
+        stats["mean_wait_seconds"] = stats["wait_seconds_total"] / max(stats["completed"] + self._in_flight, 1)
+        stats["p50_wait_seconds"] = waits[len(waits) // 2] if waits else 0.0
+        stats["p95_wait_seconds"] = waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0
+        stats["mean_service_seconds"] = self._service_seconds
+        return stats
+
+    def _grant(self, ticket: Ticket) -> None:
+        self._in_flight += 1
+        now = time.monotonic()
+        wait = now - ticket.enqueued_at
+        ticket.started_at = now
+        self._recent_waits.append(wait)
+        self._stats["wait_seconds_total"] += wait
+        self._stats["wait_seconds_max"] = max(self._stats["wait_seconds_max"], wait)
+
+    def _expire(self) -> None:
+        self._reserved -= 1
+        self._stats["expired"] += 1
+
+    def _wake(self) -> None:
+        now = time.monotonic()
+        while self._waiters and self._in_flight < self.capacity:
+            _, _, ticket, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            if ticket.expired(now):
+                self._expire()
+                future.set_exception(DeadlineExceededError("The request deadline passed while it was queued."))
+                continue
+            self._grant(ticket)
+            future.set_result(None)
+
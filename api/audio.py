@@ -0,0 +1,128 @@
+"""Encoding of synthesized 16-bit mono audio into HTTP response bodies."""
+
+from __future__ import annotations
+
+import io
+from typing import Iterator, Optional
+
+import numpy as np
+import torch
+
+# response_format -> Content-Type
+AUDIO_FORMATS = {
+    "pcm": "audio/L16",
+    "wav": "audio/wav",
+    "flac": "audio/flac",
+    "ogg": "audio/ogg",
+}
+
+# Accept ヘッダーで受け付けるメディアタイプ
+MEDIA_TYPE_FORMATS = {
+    "application/json": "json",
+    "audio/l16": "pcm",
+    "audio/pcm": "pcm",
+    "audio/wav": "wav",
+    "audio/wave": "wav",
+    "audio/x-wav": "wav",
+    "audio/*": "wav",
+    "audio/flac": "flac",
+    "audio/x-flac": "flac",
+    "audio/ogg": "ogg",
+    "audio/opus": "ogg",
+}
+
+# libopus が扱えるサンプリングレート
+OPUS_SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)
+
+
+def to_int16(audio) -> np.ndarray:
+    if isinstance(audio, torch.Tensor):
+        audio = audio.detach().cpu().numpy()
+    audio = np.asarray(audio, dtype=np.int16)
+    if audio.ndim > 1:
+        audio = audio.reshape(-1)
+    return audio
+
+
+def wav_header(sample_rate: int, num_frames: Optional[int] = None) -> bytes:
+    """Build a 16-bit mono WAV header. Without ``num_frames`` the sizes are set to the
+    maximum value so that players treat the stream as having an unknown length."""
+    if num_frames is None:
+        data_size = 0xFFFFFFFF - 36
+    else:
+        data_size = num_frames * 2
+    riff_size = min(36 + data_size, 0xFFFFFFFF)
+    return b"".join(
+        [
+            b"RIFF",
+            riff_size.to_bytes(4, "little"),
+            b"WAVEfmt ",
+            (16).to_bytes(4, "little"),
+            (1).to_bytes(2, "little"),  # PCM
+            (1).to_bytes(2, "little"),  # mono
+            sample_rate.to_bytes(4, "little"),
+            (sample_rate * 2).to_bytes(4, "little"),
+            (2).to_bytes(2, "little"),
+            (16).to_bytes(2, "little"),
+            b"data",
+            data_size.to_bytes(4, "little"),
+        ]
+    )
+
+
+def resample(pcm: np.ndarray, orig_sr: int, target_sr: int) -> np.ndarray:
+    """Resample int16 audio with a band-limited sinc filter."""
+    if orig_sr == target_sr or pcm.size == 0:
+        return pcm
+    import torchaudio.functional
+
+    audio = torch.from_numpy(pcm.astype(np.float32) / 32768.0)
+    audio = torchaudio.functional.resample(audio, orig_sr, target_sr)
+    return (audio * 32768.0).round().clamp(-32768, 32767).to(torch.int16).numpy()
+
+
+def iter_pcm_chunks(pcm: np.ndarray, chunk_bytes: int = 1 << 16) -> Iterator[memoryview]:
+    """Slice the sample buffer into response chunks without copying it."""
+    view = memoryview(np.ascontiguousarray(pcm)).cast("B")
+    for start in range(0, len(view), chunk_bytes):
+        yield view[start : start + chunk_bytes]
+
+
+def opus_sample_rate(sample_rate: int) -> int:
+    # Opus は決まったレートでしか符号化できないので、それ以上で最も近いレートに揃える
+    for rate in OPUS_SAMPLE_RATES:
+        if rate >= sample_rate:
+            return rate
+    return OPUS_SAMPLE_RATES[-1]
+
+
+def encode_compressed(pcm: np.ndarray, sample_rate: int, response_format: str) -> bytes:
+    """Encode int16 mono audio as FLAC or Ogg/Opus with PyAV.
+
+    Opus only supports a few sample rates, so the audio is resampled to the nearest
+    supported rate first when needed.
+    """
+    import av
+
+    if response_format == "flac":
+        container_format, codec = "flac", "flac"
+    elif response_format == "ogg":
+        container_format, codec = "ogg", "libopus"
+        target_sr = opus_sample_rate(sample_rate)
+        pcm = resample(pcm, sample_rate, target_sr)
+        sample_rate = target_sr
+    else:
+        raise ValueError(f"Unsupported compressed format: {response_format}")
+
+    buffer = io.BytesIO()
+    with av.open(buffer, mode="w", format=container_format) as container:
+        stream = container.add_stream(codec, rate=sample_rate)
+        stream.codec_context.layout = "mono"
+        stream.codec_context.format = "s16"
+        frame = av.AudioFrame.from_ndarray(np.ascontiguousarray(pcm).reshape(1, -1), format="s16", layout="mono")
+        frame.sample_rate = sample_rate
+        for packet in stream.encode(frame):
+            container.mux(packet)
+        for packet in stream.encode(None):
+            container.mux(packet)
+    return buffer.getvalue()
@@ -0,0 +1,232 @@
+"""gRPC server that shares the pipeline, queue and caches of the HTTP API.
+
+Started next to the HTTP server when ``TTS_GRPC_PORT`` is set, or on its own with
+``python -m api.grpc_server``. The interface is defined in ``api/tts.proto``.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+from typing import Dict, List, Tuple, Type
+
+import grpc
+import numpy as np
+from fastapi import HTTPException, status
+from pydantic import ValidationError
+
+from GPT_SoVITS.TTS_infer_pack.TTS import CancellationToken, SynthesisCancelled
+from . import tts_pb2, tts_pb2_grpc
+from .audio import AUDIO_FORMATS, encode_compressed, resample, wav_header
+from .main import (
+    TTS_GRPC_PORT,
+    StreamingSynthesisRequest,
+    SynthesisRequest,
+    _admitted_fragments,
+    _admitted_synthesis,
+    _cancelled_exception,
+    _close_workers,
+    _coalescer,
+    _ensure_tts_pipeline,
+    _flight_ticket,
+    _load_on_startup,
+    _prepare_inputs,
+    _stream_synthesis,
+    _ticket_for,
+    _unlink,
+    _write_temp_audio,
+)
+from .metrics import STAGES
+from .singleflight import coalesce_key
+
+# HTTP の状態コード -> gRPC の状態コード
+_STATUS_CODES = {
+    status.HTTP_400_BAD_REQUEST: grpc.StatusCode.INVALID_ARGUMENT,
+    status.HTTP_404_NOT_FOUND: grpc.StatusCode.NOT_FOUND,
+    status.HTTP_409_CONFLICT: grpc.StatusCode.FAILED_PRECONDITION,
+    status.HTTP_429_TOO_MANY_REQUESTS: grpc.StatusCode.RESOURCE_EXHAUSTED,
+    499: grpc.StatusCode.CANCELLED,
+    status.HTTP_501_NOT_IMPLEMENTED: grpc.StatusCode.UNIMPLEMENTED,
+    status.HTTP_503_SERVICE_UNAVAILABLE: grpc.StatusCode.UNAVAILABLE,
+    status.HTTP_504_GATEWAY_TIMEOUT: grpc.StatusCode.DEADLINE_EXCEEDED,
+}
+
+
+async def _abort(context: grpc.aio.ServicerContext, exc: HTTPException) -> None:
+    if exc.headers and "Retry-After" in exc.headers:
+        context.set_trailing_metadata((("retry-after", exc.headers["Retry-After"]),))
+    await context.abort(_STATUS_CODES.get(exc.status_code, grpc.StatusCode.INTERNAL), str(exc.detail))
+
+
+def _parse(
+    message: tts_pb2.SynthesizeRequest, model: Type[SynthesisRequest], context: grpc.aio.ServicerContext, **overrides
+) -> SynthesisRequest:
+    """Validate ``message`` as the HTTP request ``model``; unset fields take its defaults.
+
+    The raw reference audios are left out and handled by ``_prepare``.
+    """
+    fields = {descriptor.name: value for descriptor, value in message.ListFields()}
+    fields.pop("reference_audio", None)
+    fields.pop("auxiliary_reference_audios", None)
+    if "deadline_ms" not in fields and context.time_remaining() is not None:
+        # 呼び出しの期限をそのまま合成の期限にする
+        fields["deadline_ms"] = max(1, int(context.time_remaining() * 1000))
+    fields.update(overrides)
+    try:
+        return model(**fields)
+    except ValidationError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc)) from exc
+
+
+def _prepare(
+    request: SynthesisRequest, message: tts_pb2.SynthesizeRequest, return_fragment: bool = False
+) -> Tuple[Dict, List[str]]:
+    """``_prepare_inputs`` with the reference audios of ``message`` written to temporary
+    files as-is, without the base64 round trip of the HTTP API."""
+    own_paths: List[str] = []
+    try:
+        if message.reference_audio and not request.reference_audio_path:
+            own_paths.append(_write_temp_audio(message.reference_audio, ".wav"))
+            request = request.model_copy(update={"reference_audio_path": own_paths[0]})
+        inputs, temp_paths = _prepare_inputs(request, return_fragment=return_fragment)
+        if message.auxiliary_reference_audios and not request.voice_id:
+            aux_paths = [_write_temp_audio(data, ".wav") for data in message.auxiliary_reference_audios]
+            own_paths.extend(aux_paths)
+            inputs["aux_ref_audio_paths"] = aux_paths
+    except BaseException:
+        _unlink(own_paths)
+        raise
+    return inputs, temp_paths + own_paths
+
+
+def _encode(pcm: np.ndarray, sample_rate: int, response_format: str) -> bytes:
+    if response_format == "pcm":
+        return pcm.tobytes()
+    if response_format == "wav":
+        return wav_header(sample_rate, pcm.shape[0]) + pcm.tobytes()
+    try:
+        return encode_compressed(pcm, sample_rate, response_format)
+    except ImportError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_501_NOT_IMPLEMENTED,
+            detail=f"'{response_format}' encoding requires PyAV (pip install av).",
+        ) from exc
+
+
+class TextToSpeechServicer(tts_pb2_grpc.TextToSpeechServicer):
+    """The /tts and /tts/stream endpoints over gRPC.
+
+    Requests go through the same admission queue, batching scheduler and single-flight
+    coalescing as their HTTP counterparts. Errors map to gRPC status codes (429 to
+    RESOURCE_EXHAUSTED with a ``retry-after`` trailer, 504 to DEADLINE_EXCEEDED, ...). A
+    client that cancels the call only leaves its flight; the synthesis stops once no
+    caller of the flight is left.
+    """
+
+    async def Synthesize(
+        self, message: tts_pb2.SynthesizeRequest, context: grpc.aio.ServicerContext
+    ) -> tts_pb2.SynthesizeResponse:
+        try:
+            request = _parse(message, SynthesisRequest, context)
+            response_format = request.response_format or "pcm"
+            if response_format not in AUDIO_FORMATS:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Unsupported response_format '{response_format}'. Options: {list(AUDIO_FORMATS.keys())}",
+                )
+            inputs, temp_paths = _prepare(request, message)
+            try:
+                ticket = await _ticket_for(request, inputs)
+            except BaseException:
+                _unlink(temp_paths)
+                raise
+            cancel_token = CancellationToken(ticket.deadline)
+            subscription = _coalescer.join(coalesce_key(inputs), cancel_token)
+            if subscription.leading:
+                flight_ticket = _flight_ticket(ticket, subscription)
+                subscription.start(lambda token: _admitted_synthesis(inputs, flight_ticket, token, temp_paths))
+            else:
+                _unlink(temp_paths)
+            try:
+                sample_rate, pcm, stats = await subscription.result()
+            except SynthesisCancelled as exc:
+                raise _cancelled_exception(cancel_token) from exc
+            if request.sample_rate and request.sample_rate != sample_rate:
+                pcm = await asyncio.to_thread(resample, pcm, sample_rate, request.sample_rate)
+                sample_rate = request.sample_rate
+            audio = await asyncio.to_thread(_encode, pcm, sample_rate, response_format)
+        except HTTPException as exc:
+            await _abort(context, exc)
+        stage_seconds = {stage: stats[key] for key, stage in STAGES.items() if key in stats}
+        stage_seconds["total"] = stats["synthesis_seconds"]
+        return tts_pb2.SynthesizeResponse(
+            audio=audio,
+            response_format=response_format,
+            sample_rate=sample_rate,
+            duration_seconds=pcm.shape[0] / sample_rate,
+            stage_seconds=stage_seconds,
+            coalesced=not subscription.leading,
+        )
+
+    async def SynthesizeStream(self, message: tts_pb2.SynthesizeRequest, context: grpc.aio.ServicerContext):
+        try:
+            request = _parse(message, StreamingSynthesisRequest, context, response_format="pcm")
+            inputs, temp_paths = _prepare(request, message, return_fragment=True)
+            try:
+                ticket = await _ticket_for(request, inputs)
+            except BaseException:
+                _unlink(temp_paths)
+                raise
+            cancel_token = CancellationToken(ticket.deadline)
+            subscription = _coalescer.join(coalesce_key(inputs), cancel_token)
+            if subscription.leading:
+                # 合成はフライトのトークンで走り、呼び出しが取り消されてもこの購読者が抜けるだけになる
+                flight_ticket = _flight_ticket(ticket, subscription)
+                subscription.start(lambda token: _admitted_fragments(inputs, flight_ticket, token, temp_paths))
+            else:
+                _unlink(temp_paths)
+        except HTTPException as exc:
+            await _abort(context, exc)
+        sample_rate = request.sample_rate or int(_ensure_tts_pipeline().configs.sampling_rate)
+        stream = _stream_synthesis(subscription.items(), "pcm", sample_rate=request.sample_rate)
+        try:
+            async for pcm in stream:
+                yield tts_pb2.AudioChunk(pcm=pcm, sample_rate=sample_rate)
+        except HTTPException as exc:
+            # HTTP と違い、途中で失敗した場合も状態コードを返せる
+            await _abort(context, exc)
+        finally:
+            await stream.aclose()
+            subscription.close()
+
+
+async def start_grpc_server(port: int) -> grpc.aio.Server:
+    """Start serving ``TextToSpeech`` on ``port`` in the running event loop."""
+    # 1 回の応答に長い音声全体が入るので、既定の 4MB より大きくする
+    max_message = int(float(os.environ.get("TTS_GRPC_MAX_MESSAGE_MB", "64")) * 1024 * 1024)
+    server = grpc.aio.server(
+        options=[
+            ("grpc.max_send_message_length", max_message),
+            ("grpc.max_receive_message_length", max_message),
+        ]
+    )
+    tts_pb2_grpc.add_TextToSpeechServicer_to_server(TextToSpeechServicer(), server)
+    server.add_insecure_port(f"[::]:{port}")
+    await server.start()
+    print(f"gRPC server listening on port {port}.")
+    return server
+
+
+async def serve(port: int) -> None:
+    """Load the models as the HTTP server does and serve gRPC only."""
+    await _load_on_startup()
+    server = await start_grpc_server(port)
+    try:
+        await server.wait_for_termination()
+    finally:
+        await server.stop(grace=5)
+        await _close_workers()
+
+
+if __name__ == "__main__":
+    asyncio.run(serve(TTS_GRPC_PORT or 9881))
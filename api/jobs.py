@@ -0,0 +1,217 @@
+"""Asynchronous long-form synthesis jobs that spool their audio to disk."""
+
+from __future__ import annotations
+
+import asyncio
+import time
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from GPT_SoVITS.TTS_infer_pack.TTS import CancellationToken, SynthesisCancelled
+from .admission import AdmissionController, QueueFullError, Ticket, estimate_cost
+from .audio import resample, wav_header
+
+JOB_STATES = ("queued", "running", "done", "failed", "cancelled")
+
+
+class _SpoolWriter:
+    """Append 16-bit mono PCM to a WAV file whose header always describes the samples
+    written so far, so the file can be served while the job is still running."""
+
+    def __init__(self, path: Path, sample_rate: int):
+        self.sample_rate = sample_rate
+        self.num_frames = 0
+        self._file = open(path, "wb")
+        self._file.write(wav_header(sample_rate, 0))
+        self._file.flush()
+
+    def append(self, pcm: np.ndarray) -> None:
+        self._file.seek(0, 2)
+        self._file.write(pcm.tobytes())
+        self.num_frames += pcm.shape[0]
+        self._file.seek(0)
+        self._file.write(wav_header(self.sample_rate, self.num_frames))
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+@dataclass
+class Job:
+    job_id: str
+    path: Path
+    sample_rate: int
+    priority: str = "batch"
+    status: str = "queued"
+    segments_total: int = 0
+    segments_done: int = 0
+    audio_seconds: float = 0.0
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    cancel_token: CancellationToken = field(default_factory=CancellationToken)
+    task: Optional[asyncio.Task] = None
+
+    @property
+    def eta_seconds(self) -> Optional[float]:
+        # 完了済みの文の平均処理時間から残り時間を見積もる
+        if self.status != "running" or self.segments_done == 0 or self.started_at is None:
+            return None
+        elapsed = time.time() - self.started_at
+        return elapsed / self.segments_done * (self.segments_total - self.segments_done)
+
+
+class JobManager:
+    """Run long texts segment by segment in the background.
+
+    The text is split with ``TextPreprocessor.pre_seg_text`` (through ``segment_text``) and
+    the segments are submitted ``chunk_size`` at a time to ``synthesize``, which merges them
+    into shared T2S batches. Each chunk waits for an admission slot with the job's priority,
+    so low-priority jobs yield to interactive requests. Finished segments are appended in
+    order to ``<spool_dir>/<job_id>.wav``. At most ``max_running`` jobs run at once.
+
+    Finished jobs and their audio are kept for ``retention_seconds``, and at most
+    ``max_finished`` of them (the oldest are dropped first).
+    """
+
+    def __init__(
+        self,
+        spool_dir: str,
+        synthesize: Callable[[Dict, Ticket], Awaitable[Tuple[int, np.ndarray]]],
+        segment_text: Callable[[Dict], List[str]],
+        admission: AdmissionController,
+        max_running: int = 1,
+        chunk_size: int = 8,
+        retention_seconds: float = 3600.0,
+        max_finished: int = 1000,
+    ):
+        self.spool_dir = Path(spool_dir)
+        self.synthesize = synthesize
+        self.segment_text = segment_text
+        self.admission = admission
+        self.max_running = max_running
+        self.chunk_size = chunk_size
+        self.retention_seconds = retention_seconds
+        self.max_finished = max_finished
+        self.jobs: Dict[str, Job] = {}
+        self._running: Optional[asyncio.Semaphore] = None
+
+    def submit(self, inputs: Dict, sample_rate: int, priority: str = "batch", cleanup: List[str] = ()) -> Job:
+        """Start a job for ``inputs`` (the ``TTS.run`` inputs of the whole text).
+
+        ``cleanup`` lists temporary files (e.g. uploaded references) to remove once the
+        job has finished.
+        """
+        if self._running is None:
+            self._running = asyncio.Semaphore(self.max_running)
+        self.evict_expired()
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        job_id = uuid.uuid4().hex
+        job = Job(job_id=job_id, path=self.spool_dir / f"{job_id}.wav", sample_rate=sample_rate, priority=priority)
+        self.jobs[job_id] = job
+        job.task = asyncio.create_task(self._run(job, inputs, sample_rate, list(cleanup)))
+        return job
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """Cancel the job and delete its audio."""
+        job = self.jobs.pop(job_id, None)
+        if job is None:
+            return None
+        job.cancel_token.cancel()
+        if job.task is not None and job.status == "queued":
+            job.task.cancel()
+        if job.status != "running":
+            job.path.unlink(missing_ok=True)
+        return job
+
+    def expires_at(self, job: Job) -> Optional[float]:
+        """When the finished ``job`` and its audio will be deleted (unix time)."""
+        if job.finished_at is None:
+            return None
+        return job.finished_at + self.retention_seconds
+
+    def evict_expired(self) -> int:
+        """Delete the finished jobs past their retention or beyond ``max_finished``."""
+        now = time.time()
+        finished = sorted(
+            (job for job in self.jobs.values() if job.finished_at is not None), key=lambda job: job.finished_at
+        )
+        excess = len(finished) - self.max_finished
+        evicted = 0
+        for index, job in enumerate(finished):
+            if index >= excess and now < self.expires_at(job):
+                # 古い順に並んでいるので、これ以降は保持期間内
+                break
+            self.jobs.pop(job.job_id, None)
+            job.path.unlink(missing_ok=True)
+            evicted += 1
+        return evicted
+
+    def stats(self) -> Dict[str, int]:
+        stats = {state: 0 for state in JOB_STATES}
+        for job in self.jobs.values():
+            stats[job.status] += 1
+        return stats
+
+    async def _run(self, job: Job, inputs: Dict, sample_rate: int, cleanup: List[str]) -> None:
+        writer: Optional[_SpoolWriter] = None
+        try:
+            async with self._running:
+                job.status = "running"
+                job.started_at = time.time()
+                segments = await asyncio.to_thread(self.segment_text, inputs)
+                job.segments_total = len(segments)
+                writer = await asyncio.to_thread(_SpoolWriter, job.path, sample_rate)
+                for start in range(0, len(segments), self.chunk_size):
+                    job.cancel_token.raise_if_cancelled()
+                    chunk = segments[start : start + self.chunk_size]
+                    results = await self._synthesize_chunk(job, inputs, chunk)
+                    for model_rate, pcm in results:
+                        pcm = await asyncio.to_thread(resample, pcm, model_rate, sample_rate)
+                        await asyncio.to_thread(writer.append, pcm)
+                        job.segments_done += 1
+                        job.audio_seconds += pcm.shape[0] / sample_rate
+                job.status = "done"
+        except (SynthesisCancelled, asyncio.CancelledError):
+            job.status = "cancelled"
+        except Exception as exc:
+            job.status = "failed"
+            job.error = f"{type(exc).__name__}: {exc}"
+        finally:
+            job.finished_at = time.time()
+            if writer is not None:
+                writer.close()
+            if job.status == "cancelled":
+                job.path.unlink(missing_ok=True)
+            for path in cleanup:
+                Path(path).unlink(missing_ok=True)
+            self.evict_expired()
+
+    async def _synthesize_chunk(self, job: Job, inputs: Dict, chunk: List[str]) -> List[Tuple[int, np.ndarray]]:
+        ticket = self.admission.ticket(job.priority, None, estimate_cost(chunk))
+        while True:
+            try:
+                self.admission.admit(ticket)
+                break
+            except QueueFullError as exc:
+                # ジョブは急がないので、キューが空くまで待つ
+                await asyncio.sleep(exc.retry_after)
+        await self.admission.acquire(ticket)
+        try:
+            # 文ごとのリクエストを同時に投入し、スケジューラに T2S のバッチへまとめさせる
+            return await asyncio.gather(
+                *[
+                    self.synthesize(
+                        dict(inputs, text=text, text_split_method="cut0", cancel_token=job.cancel_token), ticket
+                    )
+                    for text in chunk
+                ]
+            )
+        finally:
+            self.admission.release(ticket)
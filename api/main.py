@@ -4,20 +4,44 @@ from __future__ import annotations
 
 import asyncio
 import base64
-import io
+import dataclasses
+import functools
 import os
+from contextlib import asynccontextmanager
+import re
 import tempfile
-import wave
+import time
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 
 import numpy as np
 import torch
-from fastapi import FastAPI, HTTPException, status
+from fastapi import FastAPI, Header, HTTPException, Request, WebSocket, WebSocketDisconnect, status
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+from pydantic import BaseModel, Field, ValidationError
 
-from GPT_SoVITS.TTS_infer_pack.TTS import TTS, TTS_Config
+from GPT_SoVITS.TTS_infer_pack.TTS import TTS, CancellationToken, SynthesisCancelled, TTS_Config
+# TTS.py と同じ名前で import する (GPT_SoVITS.TTS_infer_pack.* で import すると別のモジュールとして二重に読み込まれる)
+from TTS_infer_pack.feature_cache import SegmentCache
+from TTS_infer_pack.text_segmentation_method import split_completed
+from .admission import (
+    PRIORITY_CLASSES,
+    AdmissionController,
+    DeadlineExceededError,
+    QueueFullError,
+    Ticket,
+    estimate_cost,
+)
+from .jobs import Job, JobManager
+from .metrics import CONTENT_TYPE_LATEST, Metrics, server_timing
+from .audio import AUDIO_FORMATS, MEDIA_TYPE_FORMATS, encode_compressed, iter_pcm_chunks, resample, to_int16, wav_header
+from .registry import VoiceKey, VoiceModelRegistry
+from .scheduler import BatchScheduler
+from .singleflight import SingleFlight, Subscription, coalesce_key
+from .swap import ModelSwapper, SwapInProgressError
+from .workers import WorkerPool
 
 
 # -----------------------------------------------------------------------------
@@ -40,13 +64,44 @@ app.add_middleware(
 _pipeline_lock = asyncio.Lock()
 _tts_pipeline: Optional[TTS] = None
 
+# GPT/SoVITS の組ごとにモデルを保持し、BERT・HuBERT・SV は全音声で共有する
+_voice_registry = VoiceModelRegistry(
+    max_voices=int(os.environ.get("TTS_MAX_VOICES", "4")),
+    memory_budget_mb=float(os.environ.get("TTS_VOICE_MEMORY_MB", "0")),
+)
+
+# 登録済みの音色(voice profile)の保存先
+TTS_VOICES_DIR = os.environ.get("TTS_VOICES_DIR", "voices")
+VOICE_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# TTS_WORKERS > 1 の場合は起動時にプロセスをフォークして並列に合成する
+TTS_WORKERS = int(os.environ.get("TTS_WORKERS", "1"))
+# ワーカーモードでリクエストごとに指定できる音声 ("gpt.ckpt|sovits.pth" をカンマ区切り)。フォーク前に読み込む
+TTS_WORKER_VOICES = os.environ.get("TTS_WORKER_VOICES", "")
+_worker_pool: Optional[WorkerPool] = None
+
+# T2S のデコードを連続バッチングで行う。行はトークン単位で合流し、空いた行にすぐ次の文が入る
+# 草稿モデル (GPT_DRAFT_MODEL_PATH) とは併用できず、有効にすると投機的デコーディングは行われない
+TTS_CONTINUOUS_BATCHING = os.environ.get("TTS_CONTINUOUS_BATCHING", "0") != "0"
+
+# 起動時に各言語のフロントエンドと音声ごとの短い合成を一度走らせ、終わるまで /ready は 503 を返す
+TTS_WARMUP = os.environ.get("TTS_WARMUP", "1") != "0"
+_readiness: Dict = {"status": "starting", "stages": []}
+_warmup_task: Optional[asyncio.Task] = None
+
+# TTS_GRPC_PORT を指定すると同じプロセスで gRPC サーバーも起動し、パイプライン・キュー・キャッシュを共有する
+TTS_GRPC_PORT = int(os.environ.get("TTS_GRPC_PORT", "0"))
+_grpc_server = None
+
 TEXT_SPLIT_METHODS = {"none": "cut0", "sentences": "cut1", "balanced": "cut2", "zh_punctuation": "cut3", "en_punctuation": "cut4", "all_punctuation": "cut5"}
+STREAM_FORMATS = {"wav": "audio/wav", "pcm": "audio/L16"}
 
 
 class SynthesisRequest(BaseModel):
     text: str = Field(..., description="Target text to be synthesized.")
     reference_audio: Optional[str] = Field(None, description="Base64-encoded reference audio (mono WAV recommended).")
     reference_audio_path: Optional[str] = Field(None, description="Path to reference audio file.")
+    voice_id: Optional[str] = Field(None, description="Voice registered with POST /voices. Replaces the reference audio and prompt text.")
     gpt_model_path: Optional[str] = Field(None, description="Path to GPT model file (.ckpt)")
     sovits_model_path: Optional[str] = Field(None, description="Path to SoVITS model file (.pth)")
     text_language: str = Field("auto", description="Language of the target text (e.g. auto, zh, en, ja, yue, ko, all_zh, all_ja, all_yue, all_ko, auto_yue).")
@@ -65,6 +120,36 @@ class SynthesisRequest(BaseModel):
     parallel_infer: Optional[bool] = Field(None, description="Override for parallel inference. Defaults to GPU availability.")
     repetition_penalty: float = Field(1.35, ge=0.5, le=2.5, description="Repetition penalty for GPT decoder.")
     sample_steps: int = Field(32, ge=4, le=128, description="Diffusion sample steps for vocoder when applicable.")
+    response_format: Optional[str] = Field(None, description=f"Response body. Options: json, {', '.join(AUDIO_FORMATS.keys())} (ogg is Opus). Overrides the Accept header.")
+    sample_rate: Optional[int] = Field(None, ge=8000, le=48000, description="Resample the output to this rate (e.g. 8000 or 16000 for telephony).")
+    priority: str = Field("interactive", description=f"Queue priority class. Options: {', '.join(PRIORITY_CLASSES.keys())}.")
+    deadline_ms: Optional[int] = Field(None, ge=1, description="Give up with 504 if the audio is not ready within this many milliseconds.")
+
+
+class StreamingSynthesisRequest(SynthesisRequest):
+    text_split_method: str = Field("sentences", description=f"Text split heuristic. Each segment is streamed as soon as it is synthesized. Options: {', '.join(TEXT_SPLIT_METHODS.keys())}.")
+    response_format: str = Field("wav", description=f"Container of the streamed audio. Options: {', '.join(STREAM_FORMATS.keys())}.")
+
+
+class StreamingSessionRequest(SynthesisRequest):
+    text: str = Field("", description="Optional initial text. More text is sent incrementally with `text` messages.")
+
+
+class JobRequest(SynthesisRequest):
+    text_split_method: str = Field("sentences", description=f"Text split heuristic. The job progresses segment by segment. Options: {', '.join(TEXT_SPLIT_METHODS.keys())}.")
+    priority: str = Field("batch", description=f"Queue priority class of the job's segments. Options: {', '.join(PRIORITY_CLASSES.keys())}.")
+
+
+class JobInfo(BaseModel):
+    job_id: str
+    status: str
+    segments_total: int
+    segments_done: int
+    audio_seconds: float
+    sample_rate: int
+    eta_seconds: Optional[float] = None
+    error: Optional[str] = None
+    expires_at: Optional[float] = Field(None, description="Unix time at which the finished job and its audio are deleted.")
 
 
 class SynthesisResponse(BaseModel):
@@ -82,22 +167,82 @@ class MetadataResponse(BaseModel):
     text_split_methods: List[str]
 
 
+class WarmupStage(BaseModel):
+    stage: str
+    seconds: float
+    error: Optional[str] = None
+
+
+class ReadinessResponse(BaseModel):
+    status: str
+    stages: List[WarmupStage]
+    total_seconds: float
+
+
+class VoiceRegisterRequest(BaseModel):
+    voice_id: str = Field(..., description="Name of the voice (letters, digits, '-' and '_').")
+    reference_audio: Optional[str] = Field(None, description="Base64-encoded reference audio (mono WAV recommended).")
+    reference_audio_path: Optional[str] = Field(None, description="Path to reference audio file.")
+    prompt_text: Optional[str] = Field(None, description="Transcript of the reference audio. Leave empty if unknown.")
+    prompt_language: str = Field("zh", description="Language code for the prompt text.")
+    auxiliary_reference_audios: Optional[List[str]] = Field(None, description="Optional list of additional base64-encoded reference audios for tone fusion.")
+
+
+class VoiceInfo(BaseModel):
+    voice_id: str
+    prompt_text: str
+    prompt_language: str
+    num_references: int
+
+
 class LoadModelsRequest(BaseModel):
     gpt_model_path: str = Field(..., description="Path to GPT model file (.ckpt)")
     sovits_model_path: str = Field(..., description="Path to SoVITS model file (.pth)")
+    background: bool = Field(False, description="Return 202 right away and load in the background; poll GET /load_models/status.")
+    keep_previous: bool = Field(False, description="Keep the previous default models resident instead of freeing them.")
+
+
+class ModelSwapInfo(BaseModel):
+    state: str
+    gpt_model_path: Optional[str] = None
+    sovits_model_path: Optional[str] = None
+    previous_gpt_model_path: Optional[str] = None
+    previous_sovits_model_path: Optional[str] = None
+    stages: List[WarmupStage]
+    total_seconds: float
+    error: Optional[str] = None
 
 
 class LoadModelsResponse(BaseModel):
     success: bool
     message: str
+    swap: Optional[ModelSwapInfo] = None
+
+
+class VoiceModelsRequest(BaseModel):
+    gpt_model_path: str = Field(..., description="Path to GPT model file (.ckpt)")
+    sovits_model_path: str = Field(..., description="Path to SoVITS model file (.pth)")
+
+
+class ResidentVoice(BaseModel):
+    gpt_model_path: str
+    sovits_model_path: str
+    memory_mb: float
+    default: bool
+
+
+class VoiceModelsResponse(BaseModel):
+    voices: List[ResidentVoice]
+    stats: Dict[str, float]
 
 
 def _ensure_tts_pipeline(gpt_path: Optional[str] = None, sovits_path: Optional[str] = None) -> TTS:
-    global _tts_pipeline
+    """Build the shared pipeline on first use.
 
-    # If paths are provided, force reload
-    if gpt_path is not None and sovits_path is not None:
-        _tts_pipeline = None
+    The paths only apply to that first build; later voice switches go through the
+    voice registry and never rebuild BERT/CNHuBERT/SV.
+    """
+    global _tts_pipeline
 
     if _tts_pipeline is not None:
         return _tts_pipeline
@@ -116,45 +261,414 @@ def _ensure_tts_pipeline(gpt_path: Optional[str] = None, sovits_path: Optional[s
             "version": "v2ProPlus",
             "t2s_weights_path": gpt_model_path,
             "vits_weights_path": sovits_model_path,
-            "cnhuhbert_base_path": "GPT_SoVITS/pretrained_models/chinese-hubert-base",
-            "bert_base_path": "GPT_SoVITS/pretrained_models/chinese-roberta-wwm-ext-large",
+            "cnhuhbert_base_path": os.environ.get("CNHUBERT_BASE_PATH", "GPT_SoVITS/pretrained_models/chinese-hubert-base"),
+            "bert_base_path": os.environ.get("BERT_BASE_PATH", "GPT_SoVITS/pretrained_models/chinese-roberta-wwm-ext-large"),
+            # 投機的デコーディング用の小さな GPT モデル (空なら無効)
+            "t2s_draft_weights_path": os.environ.get("GPT_DRAFT_MODEL_PATH", ""),
+            "num_draft_tokens": int(os.environ.get("TTS_NUM_DRAFT_TOKENS", "4")),
         }
     }
 
     cfg = TTS_Config(config)
     pipeline = TTS(cfg)
+    pipeline.reference_cache.max_entries = int(os.environ.get("TTS_REF_CACHE_SIZE", "16"))
+    # 固定 seed のリクエストは文ごとに合成結果をキャッシュする (0 で無効)
+    segment_cache_size = int(os.environ.get("TTS_SEGMENT_CACHE_SIZE", "0"))
+    if segment_cache_size > 0:
+        pipeline.segment_cache = SegmentCache(
+            max_entries=segment_cache_size,
+            disk_dir=os.environ.get("TTS_SEGMENT_CACHE_DIR") or None,
+        )
+    # 参考音声ごとに T2S のプロンプト部分の状態をキャッシュする (0 で無効、出力は通常の方式と異なる)
+    prefix_cache_size = int(os.environ.get("TTS_PREFIX_CACHE_SIZE", "0"))
+    if prefix_cache_size > 0:
+        pipeline.enable_prefix_cache(prefix_cache_size)
+    if TTS_CONTINUOUS_BATCHING:
+        pipeline.enable_continuous_batching(
+            max_batch_size=int(os.environ.get("TTS_T2S_MAX_ROWS", "16")),
+            kv_cache_mb=float(os.environ.get("TTS_KV_CACHE_MB", "512")),
+            block_size=int(os.environ.get("TTS_KV_BLOCK_SIZE", "16")),
+        )
+    for path in sorted(Path(TTS_VOICES_DIR).glob("*.safetensors")):
+        try:
+            pipeline.load_voice(str(path))
+        except Exception as exc:
+            print(f"Failed to load voice {path}: {exc}")
+    _voice_registry.register(pipeline.get_voice_models(), default=True)
     _tts_pipeline = pipeline
     return pipeline
 
 
-async def _synthesize(inputs: Dict) -> SynthesisResponse:
-    async with _pipeline_lock:
-        pipeline = _ensure_tts_pipeline()
+def _request_pipeline(request: SynthesisRequest) -> TTS:
+    """The shared pipeline, built with the models of ``request`` when the server has not
+    built one yet (e.g. started without GPT_MODEL_PATH/SOVITS_MODEL_PATH)."""
+    if _tts_pipeline is None and request.gpt_model_path and request.sovits_model_path:
+        return _ensure_tts_pipeline(*_voice_key(request.gpt_model_path, request.sovits_model_path))
+    return _ensure_tts_pipeline()
+
+
+def _pipeline_for(inputs: Dict) -> TTS:
+    """Return the pipeline with the voice requested by ``inputs`` activated.
+
+    Must be called while holding ``_pipeline_lock``.
+    """
+    return _voice_registry.activate(_ensure_tts_pipeline(), inputs.get("models"))
+
+
+def _voice_key(gpt_path: str, sovits_path: str) -> VoiceKey:
+    for label, path in (("GPT", gpt_path), ("SoVITS", sovits_path)):
+        if not Path(path).exists():
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"{label} model file not found: {path}"
+            )
+    return (gpt_path, sovits_path)
+
+
+def _worker_voices() -> List[VoiceKey]:
+    keys = []
+    for entry in TTS_WORKER_VOICES.split(","):
+        if not entry.strip():
+            continue
+        gpt_path, _, sovits_path = entry.partition("|")
+        keys.append((gpt_path.strip(), sovits_path.strip()))
+    return keys
+
+
+def _reject_in_worker_mode() -> None:
+    if _worker_pool is not None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Voices cannot be changed while serving with TTS_WORKERS > 1; set them before startup."
+        )
+
+
+async def _preload_voice(inputs: Dict) -> None:
+    # 読み込みはパイプラインのロックの外で行い、他のリクエストを待たせない
+    key = inputs.get("models")
+    if key is None or _worker_pool is not None:
+        # ワーカーモードではフォーク前に読み込んだ音声しか受け付けない (_prepare_inputs)
+        return
+    try:
+        await asyncio.to_thread(_voice_registry.get, _ensure_tts_pipeline(), key)
+    except Exception as exc:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Failed to load models: {str(exc)}"
+        ) from exc
+
+
+async def _synthesize(inputs: Dict, ticket: Optional[Ticket] = None, endpoint: str = "tts") -> Tuple[int, np.ndarray]:
+    """Synthesize the whole text. ``inputs["stats"]``, if given, receives the stage timings."""
+    if inputs.get("stats") is None:
+        inputs = dict(inputs, stats={})
+    stats = inputs["stats"]
+    if ticket is not None and ticket.started_at is not None:
+        stats["queue_seconds"] = ticket.started_at - ticket.enqueued_at
+    t0 = time.perf_counter()
+    if _worker_pool is not None:
+        result = None
+        async for result in _worker_pool.run(inputs):
+            pass
+        if result is None:
+            raise RuntimeError("No audio generated.")
+        sample_rate, audio = result
+    else:
+        sample_rate, audio = await _scheduler.submit(inputs, ticket)
+
+    pcm = to_int16(audio)
+    stats["synthesis_seconds"] = time.perf_counter() - t0
+    _metrics.observe(endpoint, stats, stats["synthesis_seconds"], pcm.shape[0] / sample_rate)
+    return sample_rate, pcm
+
+
+def _response_format(requested: Optional[str], accept: Optional[str]) -> str:
+    """Pick the /tts body format from ``response_format`` or else the Accept header.
+
+    JSON stays the default so that existing clients keep receiving base64 audio.
+    """
+    if requested:
+        if requested != "json" and requested not in AUDIO_FORMATS:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unsupported response_format '{requested}'. Options: {['json'] + list(AUDIO_FORMATS.keys())}",
+            )
+        return requested
+    if not accept:
+        return "json"
+    ranges = []
+    for index, item in enumerate(accept.split(",")):
+        media_type, *params = [part.strip() for part in item.split(";")]
+        quality = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            ranges.append((-quality, index, media_type.lower()))
+    for _, _, media_type in sorted(ranges):
+        if media_type == "*/*":
+            return "json"
+        if media_type in MEDIA_TYPE_FORMATS:
+            return MEDIA_TYPE_FORMATS[media_type]
+    raise HTTPException(
+        status_code=status.HTTP_406_NOT_ACCEPTABLE,
+        detail=f"Acceptable media types: {sorted(MEDIA_TYPE_FORMATS.keys())}",
+    )
+
+
+def _json_response(sample_rate: int, pcm: np.ndarray) -> SynthesisResponse:
+    audio_b64 = base64.b64encode(wav_header(sample_rate, pcm.shape[0]) + pcm.tobytes()).decode("ascii")
+    duration = float(pcm.shape[0]) / float(sample_rate)
+    return SynthesisResponse(sample_rate=sample_rate, audio_base64=audio_b64, duration_seconds=duration)
 
-        def _run() -> SynthesisResponse:
-            result = None
-            for sr, audio in pipeline.run(inputs):
-                result = (sr, audio)
-            if result is None:
-                raise RuntimeError("No audio generated.")
-            sample_rate, audio = result
-            if isinstance(audio, torch.Tensor):
-                audio = audio.detach().cpu().numpy()
-            audio = np.asarray(audio, dtype=np.int16)
-            if audio.ndim > 1:
-                audio = audio.reshape(-1)
-            buffer = io.BytesIO()
-            with wave.open(buffer, "wb") as wf:
-                wf.setnchannels(1)
-                wf.setsampwidth(2)
-                wf.setframerate(sample_rate)
-                wf.writeframes(audio.tobytes())
-            buffer.seek(0)
-            audio_b64 = base64.b64encode(buffer.read()).decode("ascii")
-            duration = float(audio.shape[0]) / float(sample_rate)
-            return SynthesisResponse(sample_rate=sample_rate, audio_base64=audio_b64, duration_seconds=duration)
-
-        return await asyncio.to_thread(_run)
+
+async def _audio_response(
+    sample_rate: int, pcm: np.ndarray, response_format: str, headers: Optional[Dict[str, str]] = None
+) -> Response:
+    """Send the synthesized samples as a binary body.
+
+    PCM and WAV bodies are sliced straight out of the sample buffer; FLAC and Opus are
+    encoded in a worker thread.
+    """
+    headers = dict(headers or {})
+    headers.update({"X-Sample-Rate": str(sample_rate), "X-Duration-Seconds": f"{pcm.shape[0] / sample_rate:.3f}"})
+    if response_format in ("pcm", "wav"):
+        media_type = AUDIO_FORMATS[response_format]
+        chunks = iter_pcm_chunks(pcm)
+        length = pcm.nbytes
+        if response_format == "wav":
+            header = wav_header(sample_rate, pcm.shape[0])
+            chunks = _prepend(header, chunks)
+            length += len(header)
+        else:
+            media_type = f"{media_type};rate={sample_rate};channels=1"
+        headers["Content-Length"] = str(length)
+        return StreamingResponse(chunks, media_type=media_type, headers=headers)
+    try:
+        body = await asyncio.to_thread(encode_compressed, pcm, sample_rate, response_format)
+    except ImportError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_501_NOT_IMPLEMENTED,
+            detail=f"'{response_format}' encoding requires PyAV (pip install av).",
+        ) from exc
+    return Response(content=body, media_type=AUDIO_FORMATS[response_format], headers=headers)
+
+
+def _prepend(first: bytes, chunks):
+    yield first
+    yield from chunks
+
+
+async def _synthesis_fragments(
+    inputs: Dict,
+    temp_paths: List[str],
+    session_state: Optional[Dict] = None,
+    endpoint: str = "stream",
+) -> AsyncIterator[Tuple[int, np.ndarray]]:
+    """Drive ``TTS.run(return_fragment=True)`` in a worker thread and yield each fragment
+    as soon as ``audio_postprocess`` hands it back.
+
+    ``session_state`` lets a long-lived session keep its reference/prompt state loaded
+    even when other requests used the pipeline in between. Closing the iterator early
+    cancels the rest of the synthesis.
+    """
+    cancel_token = inputs.get("cancel_token")
+    if cancel_token is None:
+        cancel_token = CancellationToken()
+        inputs = dict(inputs, cancel_token=cancel_token)
+    stats: Dict = {}
+    inputs = dict(inputs, stats=stats)
+    t0 = time.perf_counter()
+    audio_seconds = 0.0
+
+    def _observe(item: Tuple[int, np.ndarray]) -> None:
+        nonlocal audio_seconds
+        if audio_seconds == 0.0:
+            _metrics.first_fragment_seconds.labels(endpoint).observe(time.perf_counter() - t0)
+        audio_seconds += len(item[1]) / item[0]
+
+    if _worker_pool is not None:
+        try:
+            async for item in _worker_pool.run(inputs):
+                _observe(item)
+                yield item
+            _metrics.observe(endpoint, stats, time.perf_counter() - t0, audio_seconds)
+        except SynthesisCancelled:
+            pass
+        finally:
+            for path in temp_paths:
+                Path(path).unlink(missing_ok=True)
+        return
+
+    loop = asyncio.get_running_loop()
+    fragments: asyncio.Queue = asyncio.Queue()
+    done = object()
+    try:
+        async with _pipeline_lock:
+            pipeline = await asyncio.to_thread(_pipeline_for, inputs)
+            if session_state is not None and session_state.get("pipeline") is pipeline:
+                pipeline.restore_prompt_cache(session_state["prompt_cache"])
+
+            def _produce() -> None:
+                try:
+                    for item in pipeline.run(inputs):
+                        if cancel_token.cancelled:
+                            break
+                        loop.call_soon_threadsafe(fragments.put_nowait, item)
+                except BaseException as exc:  # forwarded to the consumer below
+                    loop.call_soon_threadsafe(fragments.put_nowait, exc)
+                finally:
+                    loop.call_soon_threadsafe(fragments.put_nowait, done)
+
+            producer = asyncio.ensure_future(asyncio.to_thread(_produce))
+            try:
+                while True:
+                    item = await fragments.get()
+                    if item is done:
+                        break
+                    if isinstance(item, SynthesisCancelled):
+                        # 期限切れの場合はそこまでの音声で打ち切る
+                        break
+                    if isinstance(item, BaseException):
+                        raise item
+                    _observe(item)
+                    yield item
+                _metrics.observe(endpoint, stats, time.perf_counter() - t0, audio_seconds)
+            finally:
+                if not producer.done():
+                    # クライアントが切断した場合は残りの推論を打ち切る
+                    cancel_token.cancel("disconnected")
+                await asyncio.shield(producer)
+                if session_state is not None:
+                    session_state["pipeline"] = pipeline
+                    session_state["prompt_cache"] = pipeline.snapshot_prompt_cache()
+    finally:
+        for path in temp_paths:
+            Path(path).unlink(missing_ok=True)
+
+
+async def _stream_synthesis(
+    fragments: AsyncIterator[Tuple[int, np.ndarray]],
+    response_format: str,
+    sample_rate: Optional[int] = None,
+) -> AsyncIterator[bytes]:
+    """Encode the fragments of ``_synthesis_fragments`` (or of a coalesced flight) as raw
+    PCM or a WAV stream of unknown length, resampled to ``sample_rate`` if given."""
+    model_rate = int(_ensure_tts_pipeline().configs.sampling_rate)
+    out_rate = sample_rate or model_rate
+    try:
+        if response_format == "wav":
+            yield wav_header(out_rate)
+        async for _, audio in fragments:
+            # 断片の境界は無音区間なので断片ごとに変換しても問題ない
+            yield resample(to_int16(audio), model_rate, out_rate).tobytes()
+    except SynthesisCancelled:
+        # 期限切れの場合はそこまでの音声で打ち切る
+        pass
+    finally:
+        await fragments.aclose()
+
+
+# 同時に届いた /tts リクエストを短い時間窓でまとめて T2S のバッチを共有させる
+_scheduler = BatchScheduler(
+    _pipeline_for,
+    _pipeline_lock,
+    window=float(os.environ.get("TTS_BATCH_WINDOW_MS", "10")) / 1000.0,
+    max_batch_size=int(os.environ.get("TTS_MAX_BATCH_SIZE", "8")),
+    max_requests=int(os.environ.get("TTS_MAX_BATCH_REQUESTS", "16")),
+    concurrent=TTS_CONTINUOUS_BATCHING,
+)
+
+# キューの上限を超えたリクエストは 429 で断り、優先度と期限の順に処理する。
+# 同時実行数はバッチにまとめられる数 (ワーカーモードではワーカー数) を既定にする
+_admission = AdmissionController(
+    max_depth=int(os.environ.get("TTS_MAX_QUEUE_DEPTH", "64")),
+    capacity=int(os.environ.get("TTS_MAX_CONCURRENCY", "0")) or (TTS_WORKERS if TTS_WORKERS > 1 else _scheduler.max_requests),
+    policy=os.environ.get("TTS_QUEUE_POLICY", "edf"),
+)
+
+
+async def _ticket_for(request: SynthesisRequest, inputs: Dict, text: Optional[str] = None) -> Ticket:
+    """Queue ticket of a request validated by ``_prepare_inputs``, with its cost estimated
+    from the segmented text."""
+    pipeline = _request_pipeline(request)
+    segments = await asyncio.to_thread(
+        pipeline.text_preprocessor.pre_seg_text,
+        inputs["text"] if text is None else text,
+        inputs["text_lang"],
+        inputs["text_split_method"],
+    )
+    return _admission.ticket(request.priority, request.deadline_ms, estimate_cost(segments))
+
+
+def _admit(ticket: Ticket) -> None:
+    try:
+        _admission.admit(ticket)
+    except QueueFullError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=str(exc),
+            headers={"Retry-After": str(exc.retry_after)},
+        ) from exc
+
+
+async def _acquire(ticket: Ticket, cancel_token: Optional[CancellationToken] = None) -> None:
+    loop = asyncio.get_running_loop()
+    waiter = asyncio.ensure_future(_admission.acquire(ticket))
+    if cancel_token is not None:
+        # 待っている間に切断されたらキューから外す
+        cancel_token.add_callback(lambda: loop.call_soon_threadsafe(waiter.cancel))
+    try:
+        await waiter
+    except DeadlineExceededError as exc:
+        raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=str(exc)) from exc
+    except asyncio.CancelledError:
+        if cancel_token is not None and cancel_token.cancelled and not asyncio.current_task().cancelling():
+            raise SynthesisCancelled(cancel_token.reason) from None
+        raise
+
+
+@asynccontextmanager
+async def _admitted(ticket: Ticket, cancel_token: Optional[CancellationToken] = None):
+    """Hold a queue slot for ``ticket``; raises 429/504 as HTTPException."""
+    _admit(ticket)
+    await _acquire(ticket, cancel_token)
+    try:
+        yield
+    finally:
+        _admission.release(ticket)
+
+
+# 切断の確認間隔
+DISCONNECT_POLL_SECONDS = 0.2
+
+
+@asynccontextmanager
+async def _cancel_on_disconnect(http_request: Request, cancel_token: CancellationToken):
+    """Cancel ``cancel_token`` as soon as the client of ``http_request`` goes away."""
+
+    async def _watch() -> None:
+        while not cancel_token.cancelled:
+            if await http_request.is_disconnected():
+                cancel_token.cancel("disconnected")
+                return
+            await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+
+    watcher = asyncio.create_task(_watch())
+    try:
+        yield
+    finally:
+        watcher.cancel()
+
+
+def _cancelled_exception(cancel_token: CancellationToken) -> HTTPException:
+    if cancel_token.reason == "deadline":
+        return HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail="The request deadline passed.")
+    # クライアントは既にいないので、ログ用の状態コードを返す
+    return HTTPException(status_code=499, detail="Client closed request.")
 
 
 def _write_temp_audio(data: bytes, suffix: str) -> str:
@@ -172,21 +686,116 @@ def _decode_base64_audio(encoded: str) -> bytes:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid base64 audio payload.") from exc
 
 
+def _timed(stage: str, func, *args):
+    t0 = time.perf_counter()
+    result = func(*args)
+    return result, {"stage": stage, "seconds": time.perf_counter() - t0, "error": None}
+
+
+async def _warm_up(pipeline: TTS, mark_ready: bool = True) -> None:
+    """Run ``TTS.warmup`` and record its stages for /ready."""
+    _readiness["status"] = "warming_up"
+    if TTS_WARMUP:
+        languages = os.environ.get("TTS_WARMUP_LANGUAGES", "")
+        # 登録済みの音色がない場合は TTS_WARMUP_REF_AUDIO の参照音声で合成する
+        async with _pipeline_lock:
+            stages = await asyncio.to_thread(
+                pipeline.warmup,
+                languages=[lang.strip() for lang in languages.split(",") if lang.strip()] or None,
+                ref_audio_path=os.environ.get("TTS_WARMUP_REF_AUDIO") or None,
+                prompt_text=os.environ.get("TTS_WARMUP_PROMPT_TEXT", ""),
+                prompt_lang=os.environ.get("TTS_WARMUP_PROMPT_LANG", "zh"),
+                parallel_infer=torch.cuda.is_available(),
+            )
+        _readiness["stages"].extend(stages)
+    if mark_ready:
+        _mark_ready()
+
+
+def _mark_ready() -> None:
+    _readiness["status"] = "ready"
+    print(f"Ready after {sum(stage['seconds'] for stage in _readiness['stages']):.1f}s of startup.")
+
+
 @app.on_event("startup")
 async def _load_on_startup() -> None:
     # モデルは/load_modelsエンドポイントで明示的にロードする
     # 環境変数が設定されている場合のみ自動ロード
+    global _worker_pool, _warmup_task
+
     gpt_path = os.environ.get("GPT_MODEL_PATH", "")
     sovits_path = os.environ.get("SOVITS_MODEL_PATH", "")
-    if gpt_path and sovits_path:
-        await asyncio.to_thread(_ensure_tts_pipeline)
+    if TTS_WORKERS > 1:
+        # 重みを読み込み、温めてからフォークし、全ワーカーで共有する。
+        # フォーク前にできた OpenMP のスレッドプールは子プロセスに引き継がれず、並列処理が
+        # 固まる原因になるので、読み込みとウォームアップだけを行う親プロセスは 1 スレッドで動かす
+        torch.set_num_threads(1)
+        pipeline, stage = await asyncio.to_thread(_timed, "load_pipeline", _ensure_tts_pipeline)
+        _readiness["stages"].append(stage)
+        # リクエストで指定できる音声はフォーク前に読み込んだものだけ (各ワーカーで読み込むと重みが複製される)
+        for key in _worker_voices():
+            _, stage = await asyncio.to_thread(_timed, "load_voice", _voice_registry.get, pipeline, key)
+            _readiness["stages"].append(stage)
+        await _warm_up(pipeline, mark_ready=False)
+        pool = WorkerPool(
+            _pipeline_for,
+            TTS_WORKERS,
+            threads_per_worker=int(os.environ.get("TTS_WORKER_THREADS", "0")),
+        )
+        _, stage = _timed("start_workers", pool.start, pipeline)
+        _readiness["stages"].append(stage)
+        _worker_pool = pool
+        _mark_ready()
+    elif gpt_path and sovits_path:
+        pipeline, stage = await asyncio.to_thread(_timed, "load_pipeline", _ensure_tts_pipeline)
+        _readiness["stages"].append(stage)
+        # ウォームアップ中も /health には応答し、/ready だけが待たせる
+        _warmup_task = asyncio.create_task(_warm_up(pipeline))
+    else:
+        _readiness["status"] = "waiting_for_models"
+
+
+@app.on_event("startup")
+async def _start_grpc() -> None:
+    global _grpc_server
+
+    if TTS_GRPC_PORT > 0:
+        # grpcio は gRPC を使う場合だけ必要
+        from .grpc_server import start_grpc_server
+
+        _grpc_server = await start_grpc_server(TTS_GRPC_PORT)
+
+
+@app.on_event("shutdown")
+async def _close_workers() -> None:
+    if _grpc_server is not None:
+        await _grpc_server.stop(grace=5)
+    if _worker_pool is not None:
+        await asyncio.to_thread(_worker_pool.close)
 
 
 @app.get("/health")
 async def health() -> Dict[str, str]:
+    """Liveness probe. Answers as soon as the server runs; use /ready for traffic."""
     return {"status": "ok"}
 
 
+@app.get("/ready", response_model=ReadinessResponse)
+async def ready(response: Response) -> ReadinessResponse:
+    """Readiness probe with the duration of each startup stage.
+
+    Returns 503 until the models are loaded and warmed up (language frontends and one
+    short synthesis per voice), so that no user request pays the cold start.
+    """
+    if _readiness["status"] != "ready":
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return ReadinessResponse(
+        status=_readiness["status"],
+        stages=[WarmupStage(**stage) for stage in _readiness["stages"]],
+        total_seconds=sum(stage["seconds"] for stage in _readiness["stages"]),
+    )
+
+
 @app.get("/metadata", response_model=MetadataResponse)
 async def metadata() -> MetadataResponse:
     pipeline = _ensure_tts_pipeline()
@@ -201,39 +810,196 @@ async def metadata() -> MetadataResponse:
     )
 
 
+@app.get("/scheduler/stats")
+async def scheduler_stats() -> Dict[str, float]:
+    """Batch occupancy and queueing delay of the /tts batching scheduler, the state of
+    the continuous-batching T2S engine and the acceptance rate of speculative decoding
+    when they are enabled."""
+    stats = _scheduler.stats()
+    if _tts_pipeline is not None and _tts_pipeline.t2s_engine is not None:
+        stats.update({f"t2s_engine_{key}": value for key, value in _tts_pipeline.t2s_engine.stats().items()})
+    if _tts_pipeline is not None and _tts_pipeline.t2s_draft_model is not None:
+        speculative = dict(_tts_pipeline.speculative_stats)
+        stats.update({f"speculative_{key}": value for key, value in speculative.items()})
+        stats["speculative_acceptance_rate"] = speculative["accepted"] / max(speculative["proposed"], 1)
+        # GPT の 1 回の前向き計算あたりのトークン数 (草稿なしでは 1)
+        stats["speculative_tokens_per_step"] = speculative["tokens"] / max(speculative["steps"], 1)
+    return stats
+
+
+def _segment_text(inputs: Dict) -> List[str]:
+    return _ensure_tts_pipeline().text_preprocessor.pre_seg_text(
+        inputs["text"], inputs["text_lang"], inputs["text_split_method"]
+    )
+
+
+# 長文のジョブは文ごとに合成し、音声をスプールディレクトリへ書き足していく
+TTS_JOB_SPOOL_DIR = os.environ.get("TTS_JOB_SPOOL_DIR", "spool")
+_jobs = JobManager(
+    TTS_JOB_SPOOL_DIR,
+    synthesize=functools.partial(_synthesize, endpoint="jobs"),
+    segment_text=_segment_text,
+    admission=_admission,
+    max_running=int(os.environ.get("TTS_MAX_JOBS", "1")),
+    chunk_size=int(os.environ.get("TTS_JOB_CHUNK_SIZE", "8")),
+    # 終わったジョブと音声を保持する時間と件数
+    retention_seconds=float(os.environ.get("TTS_JOB_RETENTION_SECONDS", "3600")),
+    max_finished=int(os.environ.get("TTS_MAX_FINISHED_JOBS", "1000")),
+)
+
+
+# seed を固定した同一のリクエストが同時に来た場合は一度だけ合成して結果を配る
+_coalescer = SingleFlight(enabled=os.environ.get("TTS_COALESCE", "1") != "0")
+
+
+@app.get("/coalescing/stats")
+async def coalescing_stats() -> Dict[str, int]:
+    """Flights started, requests attached to a running identical flight, and flights in progress."""
+    return _coalescer.stats()
+
+
+def _metric_samples():
+    """Queue depths, cache counters and pool state exported by /metrics at scrape time."""
+    admission = _admission.stats()
+    yield ("tts_queue_depth", "Requests waiting for a slot.", {"queue": "admission"}, admission["queue_depth"], False)
+    yield ("tts_queue_depth", "Requests waiting for a slot.", {"queue": "scheduler"}, _scheduler.stats()["queue_depth"], False)
+    yield ("tts_in_flight", "Requests holding an admission slot.", {}, admission["in_flight"], False)
+    yield ("tts_admission_rejected", "Requests rejected with 429.", {}, admission["rejected"], True)
+    yield ("tts_admission_expired", "Requests whose deadline passed while queued.", {}, admission["expired"], True)
+    coalescing = _coalescer.stats()
+    yield ("tts_coalesced_requests", "Requests attached to an identical running synthesis.", {}, coalescing["coalesced"], True)
+    for state, count in _jobs.stats().items():
+        yield ("tts_jobs", "Asynchronous jobs by status.", {"status": state}, count, False)
+    caches = {"voice_models": _voice_registry.stats()}
+    if _tts_pipeline is not None:
+        caches["reference"] = _tts_pipeline.reference_cache.stats()
+        if _tts_pipeline.segment_cache is not None:
+            caches["segment"] = _tts_pipeline.segment_cache.stats()
+        if _tts_pipeline.prefix_cache is not None:
+            caches["prefix"] = _tts_pipeline.prefix_cache.stats()
+        if _tts_pipeline.t2s_engine is not None:
+            engine = _tts_pipeline.t2s_engine.stats()
+            yield ("tts_t2s_engine_rows", "Sequences in the continuous-batching T2S engine.", {"state": "running"}, engine["running"], False)
+            yield ("tts_t2s_engine_rows", "Sequences in the continuous-batching T2S engine.", {"state": "waiting"}, engine["waiting"], False)
+            yield ("tts_kv_cache_free_blocks", "Free blocks of the paged T2S kv cache.", {}, engine["free_blocks"], False)
+            yield ("tts_t2s_engine_preempted", "Sequences preempted for lack of kv cache blocks.", {}, engine["preempted"], True)
+        if _tts_pipeline.t2s_draft_model is not None:
+            speculative = dict(_tts_pipeline.speculative_stats)
+            for result in ("proposed", "accepted"):
+                yield ("tts_t2s_draft_tokens", "Draft tokens of speculative decoding.", {"result": result}, speculative[result], True)
+            yield ("tts_t2s_verify_steps", "GPT forward passes with speculative decoding.", {}, speculative["steps"], True)
+            yield ("tts_t2s_speculative_tokens", "Semantic tokens generated with speculative decoding.", {}, speculative["tokens"], True)
+    for cache, cache_stats in caches.items():
+        yield ("tts_cache_hits", "Cache hits.", {"cache": cache}, cache_stats["hits"], True)
+        yield ("tts_cache_misses", "Cache misses.", {"cache": cache}, cache_stats["misses"], True)
+    if _worker_pool is not None:
+        workers = _worker_pool.stats()
+        yield ("tts_workers_alive", "Live worker processes.", {}, workers["alive_workers"], False)
+
+
+# 各段階の処理時間・スループット・キューの状態を Prometheus 形式で公開する
+_metrics = Metrics(_metric_samples)
+
+
+@app.get("/metrics")
+async def metrics() -> Response:
+    """Prometheus metrics: stage latency histograms, T2S tokens/s, batch sizes, RTF,
+    queue depth, cache hit counters and process memory."""
+    return Response(content=_metrics.render(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/queue/stats")
+async def queue_stats() -> Dict[str, float]:
+    """Queue depth, in-flight requests and wait times of the admission queue."""
+    return _admission.stats()
+
+
+@app.get("/cache/stats")
+async def cache_stats() -> Dict[str, Dict[str, int]]:
+    """Entries and hit/miss counters of the reference-audio, segment and prompt-prefix caches."""
+    pipeline = _ensure_tts_pipeline()
+    stats = {"reference": pipeline.reference_cache.stats()}
+    if pipeline.segment_cache is not None:
+        stats["segment"] = pipeline.segment_cache.stats()
+    if pipeline.prefix_cache is not None:
+        stats["prefix"] = pipeline.prefix_cache.stats()
+    return stats
+
+
+@app.get("/workers/stats")
+async def worker_stats() -> Dict[str, float]:
+    """Process and job counters of the pre-forked worker pool (empty in single-process mode)."""
+    return _worker_pool.stats() if _worker_pool is not None else {}
+
+
+# 既定のモデルの差し替えは待機系に読み込んでから切り替え、その間も合成を止めない
+_model_swapper = ModelSwapper(_voice_registry, _pipeline_lock)
+
+
+def _swap_info() -> ModelSwapInfo:
+    swap = _model_swapper.status
+    return ModelSwapInfo(
+        state=swap["state"],
+        gpt_model_path=swap.get("gpt_model_path"),
+        sovits_model_path=swap.get("sovits_model_path"),
+        previous_gpt_model_path=swap.get("previous_gpt_model_path"),
+        previous_sovits_model_path=swap.get("previous_sovits_model_path"),
+        stages=[WarmupStage(**stage) for stage in swap["stages"]],
+        total_seconds=sum(stage["seconds"] for stage in swap["stages"]),
+        error=swap.get("error"),
+    )
+
+
+async def _warm_up_after(swap: asyncio.Task) -> None:
+    await swap
+    if _model_swapper.status["state"] != "failed":
+        await _warm_up(_ensure_tts_pipeline())
+
+
 @app.post("/load_models", response_model=LoadModelsResponse)
-async def load_models(request: LoadModelsRequest) -> LoadModelsResponse:
-    """Load or reload GPT and SoVITS models with specified paths."""
-    global _tts_pipeline
+async def load_models(request: LoadModelsRequest, response: Response) -> LoadModelsResponse:
+    """Load GPT and SoVITS models and make them the default voice.
 
+    Once the pipeline is up, the new models are loaded while the current ones keep
+    serving, and requests switch over between two dispatches; the previous default
+    models are then freed. With ``background`` the call returns 202 immediately and
+    the progress is reported by GET /load_models/status.
+    """
+    global _warmup_task
     try:
-        # Validate paths
-        if not Path(request.gpt_model_path).exists():
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"GPT model file not found: {request.gpt_model_path}"
-            )
+        _reject_in_worker_mode()
+        key = _voice_key(request.gpt_model_path, request.sovits_model_path)
 
-        if not Path(request.sovits_model_path).exists():
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"SoVITS model file not found: {request.sovits_model_path}"
+        if _tts_pipeline is None:
+            # まだ何も合成していないので、そのまま読み込んで既定にする
+            _, stage = await asyncio.to_thread(_timed, "load_pipeline", _ensure_tts_pipeline, *key)
+            _readiness["stages"].append(stage)
+        try:
+            swap = _model_swapper.start(_ensure_tts_pipeline(), key, keep_previous=request.keep_previous)
+        except SwapInProgressError as exc:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(exc)) from exc
+        if _readiness["status"] == "waiting_for_models":
+            # 起動時にモデルが指定されていなかった場合は、最初の読み込み後に温める
+            _warmup_task = asyncio.create_task(_warm_up_after(swap))
+        if request.background:
+            response.status_code = status.HTTP_202_ACCEPTED
+            return LoadModelsResponse(
+                success=True,
+                message=f"Loading models in the background: GPT={request.gpt_model_path}, SoVITS={request.sovits_model_path}",
+                swap=_swap_info(),
             )
-
-        async with _pipeline_lock:
-            # Clear existing pipeline
-            _tts_pipeline = None
-
-            # Load new models
-            await asyncio.to_thread(
-                _ensure_tts_pipeline,
-                request.gpt_model_path,
-                request.sovits_model_path
+        # クライアントが切断しても差し替えは最後まで行う
+        await asyncio.shield(swap)
+        if _model_swapper.status["state"] == "failed":
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Failed to load models: {_model_swapper.status['error']}"
             )
 
         return LoadModelsResponse(
             success=True,
-            message=f"Models loaded successfully: GPT={request.gpt_model_path}, SoVITS={request.sovits_model_path}"
+            message=f"Models loaded successfully: GPT={request.gpt_model_path}, SoVITS={request.sovits_model_path}",
+            swap=_swap_info(),
         )
 
     except HTTPException:
@@ -245,13 +1011,194 @@ async def load_models(request: LoadModelsRequest) -> LoadModelsResponse:
         )
 
 
-@app.post("/tts", response_model=SynthesisResponse)
-async def tts(request: SynthesisRequest) -> SynthesisResponse:
-    # モデルパスが指定されている場合はロード
-    if request.gpt_model_path and request.sovits_model_path:
-        pipeline = _ensure_tts_pipeline(request.gpt_model_path, request.sovits_model_path)
-    else:
+@app.get("/load_models/status", response_model=ModelSwapInfo)
+async def load_models_status() -> ModelSwapInfo:
+    """State and stage durations (load_gpt, load_sovits, drain, swap, release_previous)
+    of the last /load_models call."""
+    return _swap_info()
+
+
+@app.get("/models", response_model=VoiceModelsResponse)
+async def list_models() -> VoiceModelsResponse:
+    """List resident voices (least recently used first) and registry counters."""
+    return VoiceModelsResponse(voices=_voice_registry.list(), stats=_voice_registry.stats())
+
+
+@app.post("/models/load", response_model=VoiceModelsResponse)
+async def load_voice_models(request: VoiceModelsRequest) -> VoiceModelsResponse:
+    """Make a voice resident without changing the default voice."""
+    _reject_in_worker_mode()
+    key = _voice_key(request.gpt_model_path, request.sovits_model_path)
+    await _preload_voice({"models": key})
+    return await list_models()
+
+
+@app.post("/models/evict", response_model=VoiceModelsResponse)
+async def evict_voice_models(request: VoiceModelsRequest) -> VoiceModelsResponse:
+    """Release a resident voice. The default voice cannot be evicted."""
+    _reject_in_worker_mode()
+    key = (request.gpt_model_path, request.sovits_model_path)
+    async with _pipeline_lock:
+        try:
+            evicted = _voice_registry.evict(key)
+        except ValueError as exc:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(exc)) from exc
+        if not evicted:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Voice not resident: GPT={key[0]}, SoVITS={key[1]}"
+            )
+        # 使用中のモデルを解放するため既定の音声に戻す
         pipeline = _ensure_tts_pipeline()
+        if pipeline.configs.t2s_weights_path == key[0] and pipeline.configs.vits_weights_path == key[1]:
+            await asyncio.to_thread(_voice_registry.activate, pipeline)
+    return await list_models()
+
+
+def _reference_inputs(request) -> Tuple[str, List[str], List[str]]:
+    """Resolve the reference audio of a request into file paths.
+
+    Returns ``(ref_path, aux_paths, temp_paths)``; ``temp_paths`` must be removed by the caller.
+    """
+    temp_paths: List[str] = []
+    ref_suffix = ".wav"
+    if request.reference_audio_path:
+        # ファイルパスが指定されている場合
+        ref_path = request.reference_audio_path
+        if not Path(ref_path).exists():
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Reference audio file not found: {ref_path}"
+            )
+    elif request.reference_audio:
+        # Base64エンコードされた音声データの場合
+        ref_bytes = _decode_base64_audio(request.reference_audio)
+        ref_path = _write_temp_audio(ref_bytes, ref_suffix)
+        temp_paths.append(ref_path)
+    else:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Either reference_audio or reference_audio_path must be provided"
+        )
+
+    aux_paths: List[str] = []
+    try:
+        if request.auxiliary_reference_audios:
+            for encoded in request.auxiliary_reference_audios:
+                aux_bytes = _decode_base64_audio(encoded)
+                aux_paths.append(_write_temp_audio(aux_bytes, ref_suffix))
+    except HTTPException:
+        for path in temp_paths + aux_paths:
+            Path(path).unlink(missing_ok=True)
+        raise
+    temp_paths.extend(aux_paths)
+    return ref_path, aux_paths, temp_paths
+
+
+def _voice_info(voice: Dict) -> VoiceInfo:
+    return VoiceInfo(
+        voice_id=voice["voice_id"],
+        prompt_text=voice["prompt_text"],
+        prompt_language=voice["prompt_lang"],
+        num_references=len(voice["refer_spec"]),
+    )
+
+
+@app.get("/voices", response_model=List[VoiceInfo])
+async def list_voices() -> List[VoiceInfo]:
+    """List registered voice profiles."""
+    return [_voice_info(voice) for voice in _ensure_tts_pipeline().voices.values()]
+
+
+@app.get("/voices/{voice_id}", response_model=VoiceInfo)
+async def get_voice(voice_id: str) -> VoiceInfo:
+    voice = _ensure_tts_pipeline().voices.get(voice_id)
+    if voice is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Voice not found: {voice_id}")
+    return _voice_info(voice)
+
+
+@app.post("/voices", response_model=VoiceInfo)
+async def register_voice(request: VoiceRegisterRequest) -> VoiceInfo:
+    """Precompute the conditioning of a reference clip once and persist it under ``voice_id``.
+
+    Later requests pass ``voice_id`` instead of uploading the reference audio again.
+    """
+    _reject_in_worker_mode()
+    if not VOICE_ID_PATTERN.match(request.voice_id):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="voice_id may only contain letters, digits, '-' and '_' (at most 64 characters)."
+        )
+    pipeline = _ensure_tts_pipeline()
+    if request.prompt_text and request.prompt_language not in pipeline.configs.v2_languages:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unsupported prompt_language '{request.prompt_language}'.",
+        )
+    ref_path, aux_paths, temp_paths = _reference_inputs(request)
+    try:
+        async with _pipeline_lock:
+
+            def _register() -> Dict:
+                # 既定の音声モデルで特徴量を計算する (他のモデルで使う時は自動で再計算される)
+                _pipeline_for({})
+                voice = pipeline.register_voice(
+                    request.voice_id, ref_path, request.prompt_text or "", request.prompt_language, aux_paths
+                )
+                Path(TTS_VOICES_DIR).mkdir(parents=True, exist_ok=True)
+                pipeline.save_voice(request.voice_id, str(Path(TTS_VOICES_DIR) / f"{request.voice_id}.safetensors"))
+                return voice
+
+            try:
+                voice = await asyncio.to_thread(_register)
+            except (OSError, ValueError) as exc:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc)) from exc
+    finally:
+        for path in temp_paths:
+            Path(path).unlink(missing_ok=True)
+    return _voice_info(voice)
+
+
+@app.delete("/voices/{voice_id}")
+async def delete_voice(voice_id: str) -> Dict[str, str]:
+    _reject_in_worker_mode()
+    async with _pipeline_lock:
+        voice = _ensure_tts_pipeline().voices.pop(voice_id, None)
+    if voice is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Voice not found: {voice_id}")
+    if VOICE_ID_PATTERN.match(voice_id):
+        (Path(TTS_VOICES_DIR) / f"{voice_id}.safetensors").unlink(missing_ok=True)
+    return {"status": "deleted", "voice_id": voice_id}
+
+
+def _unlink(paths: List[str]) -> None:
+    for path in paths:
+        Path(path).unlink(missing_ok=True)
+
+
+def _prepare_inputs(request: SynthesisRequest, return_fragment: bool = False) -> Tuple[Dict, List[str]]:
+    """Validate a synthesis request and build the ``TTS.run`` inputs.
+
+    Returns the inputs together with the temporary files that must be removed once the
+    synthesis has finished.
+    """
+    if request.priority not in PRIORITY_CLASSES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unsupported priority '{request.priority}'. Options: {list(PRIORITY_CLASSES.keys())}",
+        )
+    # モデルパスが指定されている場合はその音声で合成する。
+    # まだパイプラインがなければ、その音声で組み立てる
+    models: Optional[VoiceKey] = None
+    if request.gpt_model_path and request.sovits_model_path:
+        models = _voice_key(request.gpt_model_path, request.sovits_model_path)
+        if _worker_pool is not None and not _voice_registry.resident(models):
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="With TTS_WORKERS > 1 only the default voice and the voices of TTS_WORKER_VOICES can be requested.",
+            )
+    pipeline = _request_pipeline(request)
 
     valid_languages = set(pipeline.configs.v2_languages)
 
@@ -273,60 +1220,377 @@ async def tts(request: SynthesisRequest) -> SynthesisResponse:
         )
 
     # リファレンス音声の処理
-    ref_path_to_delete = None
-    if request.reference_audio_path:
-        # ファイルパスが指定されている場合
-        ref_path = request.reference_audio_path
-        if not Path(ref_path).exists():
+    if request.voice_id:
+        # 登録済みの音色を使う場合はアップロード不要
+        if request.voice_id not in pipeline.voices:
             raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Reference audio file not found: {ref_path}"
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Voice not found: {request.voice_id}"
             )
-    elif request.reference_audio:
-        # Base64エンコードされた音声データの場合
-        ref_bytes = _decode_base64_audio(request.reference_audio)
-        ref_suffix = ".wav"
-        ref_path = _write_temp_audio(ref_bytes, ref_suffix)
-        ref_path_to_delete = ref_path
+        ref_path, aux_paths, temp_paths = None, [], []
+    else:
+        ref_path, aux_paths, temp_paths = _reference_inputs(request)
+
+    inputs = {
+        "text": request.text,
+        "text_lang": request.text_language,
+        "ref_audio_path": ref_path,
+        "aux_ref_audio_paths": aux_paths,
+        "prompt_text": request.prompt_text or "",
+        "prompt_lang": request.prompt_language,
+        "top_k": request.top_k,
+        "top_p": request.top_p,
+        "temperature": request.temperature,
+        "text_split_method": TEXT_SPLIT_METHODS[request.text_split_method],
+        "batch_size": request.batch_size,
+        "batch_threshold": request.batch_threshold,
+        "speed_factor": request.speed,
+        "split_bucket": not return_fragment,
+        "fragment_interval": request.pause,
+        "seed": request.seed,
+        "parallel_infer": request.parallel_infer if request.parallel_infer is not None else torch.cuda.is_available(),
+        "repetition_penalty": request.repetition_penalty,
+        "sample_steps": request.sample_steps,
+        "return_fragment": return_fragment,
+        "voice_id": request.voice_id,
+        "models": models,
+    }
+    return inputs, temp_paths
+
+
+@app.post("/tts", response_model=SynthesisResponse)
+async def tts(
+    request: SynthesisRequest, http_request: Request, response: Response, accept: Optional[str] = Header(None)
+):
+    """Synthesize the whole text.
+
+    The body is JSON with base64 WAV by default. ``response_format`` or the Accept header
+    (audio/L16, audio/wav, audio/flac, audio/ogg) selects a binary body instead, which
+    avoids the base64 overhead. The ``Server-Timing`` header breaks the latency down by
+    stage (queue, reference, frontend, bert, t2s, vits, postprocess).
+    """
+    response_format = _response_format(request.response_format, accept)
+    # 検証に通ったリクエストだけが文を分割してコストを見積もる
+    inputs, temp_paths = _prepare_inputs(request)
+    try:
+        ticket = await _ticket_for(request, inputs)
+    except BaseException:
+        _unlink(temp_paths)
+        raise
+    cancel_token = CancellationToken(ticket.deadline)
+    subscription = _coalescer.join(coalesce_key(inputs), cancel_token)
+    if subscription.leading:
+        flight_ticket = _flight_ticket(ticket, subscription)
+        subscription.start(lambda token: _admitted_synthesis(inputs, flight_ticket, token, temp_paths))
     else:
+        # 同じ合成が実行中なので、その結果を待つだけでキューには並ばない
+        for path in temp_paths:
+            Path(path).unlink(missing_ok=True)
+    try:
+        async with _cancel_on_disconnect(http_request, cancel_token):
+            sample_rate, pcm, stats = await subscription.result()
+    except SynthesisCancelled as exc:
+        raise _cancelled_exception(cancel_token) from exc
+    headers = {
+        "Server-Timing": server_timing(stats),
+        "X-Real-Time-Factor": f"{stats['synthesis_seconds'] / max(pcm.shape[0] / sample_rate, 1e-6):.3f}",
+    }
+    if not subscription.leading:
+        headers["X-Coalesced"] = "1"
+    if request.sample_rate and request.sample_rate != sample_rate:
+        pcm = await asyncio.to_thread(resample, pcm, sample_rate, request.sample_rate)
+        sample_rate = request.sample_rate
+    if response_format == "json":
+        response.headers.update(headers)
+        return await asyncio.to_thread(_json_response, sample_rate, pcm)
+    return await _audio_response(sample_rate, pcm, response_format, headers)
+
+
+async def _admitted_synthesis(
+    inputs: Dict, ticket: Ticket, cancel_token: CancellationToken, temp_paths: List[str]
+) -> AsyncIterator[Tuple[int, np.ndarray]]:
+    """Whole-text synthesis run by the leading /tts request of a flight.
+
+    Yields ``(sample_rate, pcm, stats)`` once.
+    """
+    stats: Dict = {}
+    try:
+        async with _admitted(ticket, cancel_token):
+            await _preload_voice(inputs)
+            sample_rate, pcm = await _synthesize(dict(inputs, cancel_token=cancel_token, stats=stats), ticket)
+            yield sample_rate, pcm, stats
+    except DeadlineExceededError as exc:
+        raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=str(exc)) from exc
+    finally:
+        for path in temp_paths:
+            Path(path).unlink(missing_ok=True)
+
+
+@app.post("/tts/stream")
+async def tts_stream(request: StreamingSynthesisRequest, http_request: Request) -> StreamingResponse:
+    """Stream the synthesized audio segment by segment as chunked raw PCM or WAV.
+
+    The response starts with the first fragment, so a full queue, a passed deadline or a
+    failed synthesis before any audio is still answered with a status code.
+    """
+    if request.response_format not in STREAM_FORMATS:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Either reference_audio or reference_audio_path must be provided"
+            detail=f"Unsupported response_format '{request.response_format}'. Options: {list(STREAM_FORMATS.keys())}",
         )
+    # 検証に通ったリクエストだけが文を分割してコストを見積もる
+    inputs, temp_paths = _prepare_inputs(request, return_fragment=True)
+    try:
+        ticket = await _ticket_for(request, inputs)
+    except BaseException:
+        _unlink(temp_paths)
+        raise
+    cancel_token = CancellationToken(ticket.deadline)
+    subscription = _coalescer.join(coalesce_key(inputs), cancel_token)
+    if subscription.leading:
+        # 先頭のリクエストだけがキューに並び、後から来た同じリクエストは断片を共有する。
+        # 合成はフライトのトークンで走るので、先頭のリクエストが去っても他は影響を受けない
+        flight_ticket = _flight_ticket(ticket, subscription)
+        subscription.start(lambda token: _admitted_fragments(inputs, flight_ticket, token, temp_paths))
+    else:
+        for path in temp_paths:
+            Path(path).unlink(missing_ok=True)
+    try:
+        async with _cancel_on_disconnect(http_request, cancel_token):
+            fragments = await _started(subscription.items())
+    except SynthesisCancelled as exc:
+        raise _cancelled_exception(cancel_token) from exc
+    sample_rate = request.sample_rate or int(_ensure_tts_pipeline().configs.sampling_rate)
+    media_type = STREAM_FORMATS[request.response_format]
+    if request.response_format == "pcm":
+        media_type = f"{media_type};rate={sample_rate};channels=1"
+    stream = _stream_synthesis(fragments, request.response_format, sample_rate=request.sample_rate)
+    return StreamingResponse(
+        stream,
+        media_type=media_type,
+        headers={"X-Sample-Rate": str(sample_rate)},
+        # 本文を一度も読まずに切断された場合も購読をやめ、誰も聞いていなければ合成を打ち切る
+        background=BackgroundTask(subscription.close),
+    )
 
-    aux_paths: List[str] = []
+
+def _flight_ticket(ticket: Ticket, subscription: Subscription) -> Ticket:
+    """Queue ticket of the flight led by ``subscription``.
+
+    A coalesced flight keeps the queue position of its leader but not its deadline: each
+    subscriber gives up at its own deadline, and the flight stops once the last one left.
+    """
+    if not subscription.shared:
+        return ticket
+    return dataclasses.replace(ticket, deadline=None)
+
+
+async def _admitted_fragments(
+    inputs: Dict, ticket: Ticket, cancel_token: CancellationToken, temp_paths: List[str]
+) -> AsyncIterator[Tuple[int, np.ndarray]]:
+    """Streamed synthesis run by the leading /tts/stream (or gRPC) request of a flight.
+
+    Waits for a queue slot with the flight's token and holds it until the last fragment,
+    whoever is still listening.
+    """
     try:
-        if request.auxiliary_reference_audios:
-            for encoded in request.auxiliary_reference_audios:
-                aux_bytes = _decode_base64_audio(encoded)
-                aux_paths.append(_write_temp_audio(aux_bytes, ref_suffix))
+        async with _admitted(ticket, cancel_token):
+            await _preload_voice(inputs)
+            fragments = _synthesis_fragments(dict(inputs, cancel_token=cancel_token), [])
+            try:
+                async for item in fragments:
+                    yield item
+            finally:
+                await fragments.aclose()
+    finally:
+        for path in temp_paths:
+            Path(path).unlink(missing_ok=True)
 
-        inputs = {
-            "text": request.text,
-            "text_lang": request.text_language,
-            "ref_audio_path": ref_path,
-            "aux_ref_audio_paths": aux_paths,
-            "prompt_text": request.prompt_text or "",
-            "prompt_lang": request.prompt_language,
-            "top_k": request.top_k,
-            "top_p": request.top_p,
-            "temperature": request.temperature,
-            "text_split_method": TEXT_SPLIT_METHODS[request.text_split_method],
-            "batch_size": request.batch_size,
-            "batch_threshold": request.batch_threshold,
-            "speed_factor": request.speed,
-            "split_bucket": True,
-            "fragment_interval": request.pause,
-            "seed": request.seed,
-            "parallel_infer": request.parallel_infer if request.parallel_infer is not None else torch.cuda.is_available(),
-            "repetition_penalty": request.repetition_penalty,
-            "sample_steps": request.sample_steps,
-            "return_fragment": False,
-        }
 
-        return await _synthesize(inputs)
+async def _started(items: AsyncIterator) -> AsyncIterator:
+    """Wait for the first item of ``items`` and return an iterator over all of them.
+
+    Errors raised before the first item surface here, while the response has not started.
+    """
+    try:
+        first = await items.__anext__()
+    except StopAsyncIteration:
+        return items
+    return _aprepend(first, items)
+
+
+async def _aprepend(first, items: AsyncIterator) -> AsyncIterator:
+    try:
+        yield first
+        async for item in items:
+            yield item
+    finally:
+        await items.aclose()
+
+
+def _job_info(job: Job) -> JobInfo:
+    return JobInfo(
+        job_id=job.job_id,
+        status=job.status,
+        segments_total=job.segments_total,
+        segments_done=job.segments_done,
+        audio_seconds=job.audio_seconds,
+        sample_rate=job.sample_rate,
+        eta_seconds=job.eta_seconds,
+        error=job.error,
+        expires_at=_jobs.expires_at(job),
+    )
+
+
+def _get_job(job_id: str) -> Job:
+    _jobs.evict_expired()
+    job = _jobs.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Job not found: {job_id}")
+    return job
+
+
+@app.post("/jobs", response_model=JobInfo, status_code=status.HTTP_202_ACCEPTED)
+async def create_job(request: JobRequest) -> JobInfo:
+    """Synthesize a long text in the background.
+
+    Poll ``GET /jobs/{job_id}`` for progress and fetch the audio written so far with
+    ``GET /jobs/{job_id}/audio``. ``deadline_ms`` does not apply to jobs. A finished job
+    and its audio are deleted at ``expires_at`` (``TTS_JOB_RETENTION_SECONDS`` later).
+    """
+    inputs, temp_paths = _prepare_inputs(request)
+    sample_rate = request.sample_rate or int(_ensure_tts_pipeline().configs.sampling_rate)
+    job = _jobs.submit(inputs, sample_rate, priority=request.priority, cleanup=temp_paths)
+    return _job_info(job)
+
+
+@app.get("/jobs/{job_id}", response_model=JobInfo)
+async def get_job(job_id: str) -> JobInfo:
+    return _job_info(_get_job(job_id))
+
+
+@app.get("/jobs/{job_id}/audio")
+async def get_job_audio(job_id: str) -> FileResponse:
+    """WAV of the segments finished so far. Supports HTTP Range requests."""
+    job = _get_job(job_id)
+    if not job.path.exists():
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Job {job_id} has no audio yet.")
+    return FileResponse(job.path, media_type="audio/wav", headers={"X-Job-Status": job.status})
+
+
+@app.delete("/jobs/{job_id}")
+async def delete_job(job_id: str) -> Dict[str, str]:
+    """Cancel the job if it is still running and delete its audio."""
+    if _jobs.cancel(job_id) is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Job not found: {job_id}")
+    return {"status": "deleted", "job_id": job_id}
+
+
+@app.websocket("/tts/ws")
+async def tts_ws(websocket: WebSocket) -> None:
+    """Incremental synthesis session.
+
+    The first message is a JSON ``StreamingSessionRequest`` carrying the reference audio,
+    prompt and sampling parameters. The client then sends ``{"type": "text", "text": ...}``
+    deltas, ``{"type": "flush"}`` to synthesize whatever is buffered and ``{"type": "end"}``
+    to finish. Every completed sentence is synthesized right away and sent back as binary
+    16-bit mono PCM frames, framed by ``segment_start``/``segment_end`` JSON messages.
+    """
+    await websocket.accept()
+    try:
+        request = StreamingSessionRequest(**(await websocket.receive_json()))
+        inputs, temp_paths = _prepare_inputs(request, return_fragment=True)
+        try:
+            await _preload_voice(inputs)
+        except HTTPException:
+            for path in temp_paths:
+                Path(path).unlink(missing_ok=True)
+            raise
+    except (ValidationError, ValueError, HTTPException) as exc:
+        detail = exc.detail if isinstance(exc, HTTPException) else str(exc)
+        await websocket.send_json({"type": "error", "detail": detail})
+        await websocket.close(code=1008)
+        return
+    except WebSocketDisconnect:
+        return
+
+    # 文はこれ以上分割せずにそのまま合成する
+    inputs["text_split_method"] = "cut0"
+    sentences: asyncio.Queue = asyncio.Queue()
+    session_state: Dict = {}
+
+    async def _receive() -> None:
+        completed, buffer = split_completed(request.text)
+        for sentence in completed:
+            await sentences.put(sentence)
+        while True:
+            message = await websocket.receive_json()
+            kind = message.get("type")
+            if kind == "text":
+                completed, buffer = split_completed(buffer + str(message.get("text", "")))
+                for sentence in completed:
+                    await sentences.put(sentence)
+            elif kind in ("flush", "end"):
+                if buffer.strip():
+                    await sentences.put(buffer)
+                buffer = ""
+                if kind == "end":
+                    await sentences.put(None)
+                    return
+            else:
+                await websocket.send_json({"type": "error", "detail": f"Unknown message type '{kind}'."})
+
+    async def _speak() -> None:
+        index = 0
+        while True:
+            sentence = await sentences.get()
+            if sentence is None:
+                break
+            ticket = await _ticket_for(request, inputs, sentence)
+            async with _admitted(ticket):
+                await websocket.send_json({"type": "segment_start", "index": index, "text": sentence})
+                # 文ごとに期限を設定し、切断時は _stream_synthesis が取り消す
+                sentence_inputs = dict(inputs, text=sentence, cancel_token=CancellationToken(ticket.deadline))
+                async for chunk in _stream_synthesis(
+                    _synthesis_fragments(sentence_inputs, [], session_state, endpoint="ws"),
+                    "pcm",
+                    sample_rate=request.sample_rate,
+                ):
+                    await websocket.send_bytes(chunk)
+                await websocket.send_json({"type": "segment_end", "index": index})
+            index += 1
+        await websocket.send_json({"type": "done"})
+
+    try:
+        sample_rate = request.sample_rate or int(_ensure_tts_pipeline().configs.sampling_rate)
+        await websocket.send_json({"type": "ready", "sample_rate": sample_rate})
+        receiver = asyncio.create_task(_receive())
+        speaker = asyncio.create_task(_speak())
+        try:
+            # テキストの受信と音声合成を並行して進める。"end" で受信が終わったら
+            # 終了済みのタスクを待ち続けると空回りするので、合成だけを待つ
+            waiting = {receiver, speaker}
+            while not speaker.done():
+                await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+                if receiver in waiting and receiver.done():
+                    if receiver.exception() is not None:
+                        break
+                    waiting.discard(receiver)
+        finally:
+            for task in (receiver, speaker):
+                if not task.done():
+                    task.cancel()
+            results = await asyncio.gather(receiver, speaker, return_exceptions=True)
+        if any(isinstance(result, WebSocketDisconnect) for result in results):
+            return
+        errors = [result for result in results if isinstance(result, Exception)]
+        if errors:
+            await websocket.send_json({"type": "error", "detail": str(errors[0])})
+            await websocket.close(code=1011)
+        else:
+            await websocket.close()
+    except WebSocketDisconnect:
+        pass
     finally:
-        if ref_path_to_delete:
-            Path(ref_path_to_delete).unlink(missing_ok=True)
-        for path in aux_paths:
+        for path in temp_paths:
             Path(path).unlink(missing_ok=True)
@@ -0,0 +1,121 @@
+"""Prometheus metrics of the synthesis pipeline."""
+
+from __future__ import annotations
+
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import psutil
+import torch
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# TTS.run() の stats のキー -> stage ラベル
+STAGES = {
+    "queue_seconds": "queue",
+    "reference_seconds": "reference",
+    "frontend_seconds": "frontend",
+    "bert_seconds": "bert",
+    "t2s_seconds": "t2s",
+    "vits_seconds": "vits",
+    "postprocess_seconds": "postprocess",
+}
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+_RTF_BUCKETS = (0.02, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 5.0)
+_BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+_TOKENS_PER_SECOND_BUCKETS = (10, 25, 50, 100, 200, 400, 800, 1600, 3200)
+
+# (metric name, help, labels, value, is_counter)
+Sample = Tuple[str, str, Dict[str, str], float, bool]
+
+
+def server_timing(stats: Dict) -> str:
+    """``Server-Timing`` header value with the stage durations of ``stats`` in milliseconds."""
+    parts = [f"{stage};dur={stats[key] * 1000:.1f}" for key, stage in STAGES.items() if key in stats]
+    if "synthesis_seconds" in stats:
+        parts.append(f"total;dur={stats['synthesis_seconds'] * 1000:.1f}")
+    return ", ".join(parts)
+
+
+class _SnapshotCollector:
+    """Export the values returned by ``snapshot`` (queue depths, cache counters, ...) and
+    the process memory at scrape time."""
+
+    def __init__(self, snapshot: Optional[Callable[[], Iterable[Sample]]]):
+        self.snapshot = snapshot
+
+    def collect(self):
+        samples: List[Sample] = list(self.snapshot()) if self.snapshot is not None else []
+        rss = psutil.Process().memory_info().rss
+        samples.append(("tts_process_resident_memory_bytes", "Resident memory of the server process.", {}, rss, False))
+        if torch.cuda.is_available():
+            allocated, reserved = torch.cuda.memory_allocated(), torch.cuda.memory_reserved()
+            samples.append(("tts_cuda_memory_allocated_bytes", "CUDA memory held by tensors.", {}, allocated, False))
+            samples.append(("tts_cuda_memory_reserved_bytes", "CUDA memory reserved by the allocator.", {}, reserved, False))
+        families: Dict[str, object] = {}
+        for name, documentation, labels, value, is_counter in samples:
+            family = families.get(name)
+            if family is None:
+                family_class = CounterMetricFamily if is_counter else GaugeMetricFamily
+                family = families[name] = family_class(name, documentation, labels=list(labels.keys()))
+            family.add_metric(list(labels.values()), value)
+        return list(families.values())
+
+
+class Metrics:
+    """Histograms of every synthesis, plus the gauges and counters returned by ``snapshot``.
+
+    ``observe`` takes the ``stats`` filled by ``TTS.run``/``TTS.run_batched``. For batched
+    requests the stage timings are those of the whole batch that served the request.
+    """
+
+    def __init__(self, snapshot: Optional[Callable[[], Iterable[Sample]]] = None):
+        self.registry = CollectorRegistry()
+        self.stage_seconds = Histogram(
+            "tts_stage_seconds", "Time spent in each pipeline stage per request.", ["stage"],
+            buckets=_LATENCY_BUCKETS, registry=self.registry,
+        )
+        self.synthesis_seconds = Histogram(
+            "tts_synthesis_seconds", "Synthesis time per request, after admission.", ["endpoint"],
+            buckets=_LATENCY_BUCKETS, registry=self.registry,
+        )
+        self.first_fragment_seconds = Histogram(
+            "tts_first_fragment_seconds", "Time until the first streamed fragment, after admission.", ["endpoint"],
+            buckets=_LATENCY_BUCKETS, registry=self.registry,
+        )
+        self.real_time_factor = Histogram(
+            "tts_real_time_factor", "Synthesis time divided by the duration of the audio.", ["endpoint"],
+            buckets=_RTF_BUCKETS, registry=self.registry,
+        )
+        self.t2s_tokens_per_second = Histogram(
+            "tts_t2s_tokens_per_second", "Semantic tokens decoded per second of T2S time.",
+            buckets=_TOKENS_PER_SECOND_BUCKETS, registry=self.registry,
+        )
+        self.t2s_batch_size = Histogram(
+            "tts_t2s_batch_size", "Rows of the T2S batches that served each request.",
+            buckets=_BATCH_BUCKETS, registry=self.registry,
+        )
+        self.t2s_tokens = Counter("tts_t2s_tokens", "Semantic tokens decoded.", registry=self.registry)
+        self.audio_seconds = Counter(
+            "tts_audio_seconds", "Seconds of audio synthesized.", ["endpoint"], registry=self.registry
+        )
+        self.registry.register(_SnapshotCollector(snapshot))
+
+    def observe(self, endpoint: str, stats: Dict, synthesis_seconds: float, audio_seconds: float) -> None:
+        for key, stage in STAGES.items():
+            if key in stats:
+                self.stage_seconds.labels(stage).observe(stats[key])
+        tokens = stats.get("t2s_tokens", 0)
+        if tokens and stats.get("t2s_seconds"):
+            self.t2s_tokens_per_second.observe(tokens / stats["t2s_seconds"])
+        # まとめて処理したグループの値なので、トークン数はリクエスト数で割って数える
+        self.t2s_tokens.inc(tokens / stats.get("batch_requests", 1))
+        for size in stats.get("batch_sizes", []):
+            self.t2s_batch_size.observe(size)
+        self.synthesis_seconds.labels(endpoint).observe(synthesis_seconds)
+        self.audio_seconds.labels(endpoint).inc(audio_seconds)
+        if audio_seconds > 0:
+            self.real_time_factor.labels(endpoint).observe(synthesis_seconds / audio_seconds)
+
+    def render(self) -> bytes:
+        return generate_latest(self.registry)
+
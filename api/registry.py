@@ -0,0 +1,155 @@
+"""Resident GPT/SoVITS voice models that share one TTS pipeline."""
+
+from __future__ import annotations
+
+import gc
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import torch
+
+from GPT_SoVITS.TTS_infer_pack.TTS import TTS
+
+VoiceKey = Tuple[str, str]
+
+
+def _module_bytes(module: torch.nn.Module) -> int:
+    tensors = list(module.parameters()) + list(module.buffers())
+    return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+
+
+class VoiceModelRegistry:
+    """LRU cache of ``(GPT ckpt, SoVITS pth)`` model pairs.
+
+    Only ``t2s_model``/``vits_model`` are loaded per voice; BERT, CNHuBERT and the SV model
+    stay on the pipeline and are shared by every voice. At most ``max_voices`` voices are
+    kept resident and, when ``memory_budget_mb`` is positive, their combined weights must
+    fit in that budget. The default voice is never evicted automatically.
+    """
+
+    def __init__(self, max_voices: int = 4, memory_budget_mb: float = 0):
+        self.max_voices = max(1, max_voices)
+        self.memory_budget = int(memory_budget_mb * 1024 * 1024)
+        self.default_key: Optional[VoiceKey] = None
+        self._voices: "OrderedDict[VoiceKey, Dict]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._loading: Dict[VoiceKey, threading.Lock] = {}
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def register(self, voice: Dict, default: bool = False) -> VoiceKey:
+        """Add already loaded models (e.g. the ones the pipeline was built with)."""
+        key = (voice["t2s_weights_path"], voice["vits_weights_path"])
+        with self._lock:
+            voice = dict(voice)
+            voice["bytes"] = _module_bytes(voice["t2s_model"]) + _module_bytes(voice["vits_model"])
+            self._voices[key] = voice
+            self._voices.move_to_end(key)
+            if default:
+                self.default_key = key
+            self._evict_over_budget(keep=key)
+        return key
+
+    def get(
+        self, pipeline: TTS, key: VoiceKey, progress: Optional[Callable[[str, float], None]] = None
+    ) -> Dict:
+        """Return the models for ``key``, loading them if they are not resident.
+
+        ``progress`` is passed to ``TTS.load_voice_models`` when the models are loaded.
+        """
+        with self._lock:
+            voice = self._touch(key)
+            if voice is not None:
+                self._stats["hits"] += 1
+                return voice
+            load_lock = self._loading.setdefault(key, threading.Lock())
+        # 同じ音声の読み込みは一度だけ行い、他の音声の利用はブロックしない
+        with load_lock:
+            with self._lock:
+                voice = self._touch(key)
+                if voice is not None:
+                    self._stats["hits"] += 1
+                    return voice
+                self._stats["misses"] += 1
+            loaded = pipeline.load_voice_models(*key, progress=progress)
+            self.register(loaded)
+            with self._lock:
+                self._loading.pop(key, None)
+                return self._voices[key]
+
+    def resident(self, key: VoiceKey) -> bool:
+        with self._lock:
+            return key in self._voices
+
+    def activate(self, pipeline: TTS, key: Optional[VoiceKey] = None) -> TTS:
+        """Switch the pipeline to ``key`` (the default voice if ``None``).
+
+        Must be called while holding the pipeline lock.
+        """
+        key = key or self.default_key
+        if key is None:
+            return pipeline
+        voice = self.get(pipeline, key)
+        if voice["t2s_model"] is not pipeline.t2s_model or voice["vits_model"] is not pipeline.vits_model:
+            pipeline.set_voice_models(voice)
+        return pipeline
+
+    def evict(self, key: VoiceKey) -> bool:
+        with self._lock:
+            if key == self.default_key:
+                raise ValueError("The default voice cannot be evicted.")
+            if self._voices.pop(key, None) is None:
+                return False
+            self._stats["evictions"] += 1
+        # 参照がなくなった重みをすぐに解放する
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        return True
+
+    def list(self) -> List[Dict]:
+        """Resident voices, least recently used first."""
+        with self._lock:
+            return [
+                {
+                    "gpt_model_path": key[0],
+                    "sovits_model_path": key[1],
+                    "memory_mb": voice["bytes"] / (1024 * 1024),
+                    "default": key == self.default_key,
+                }
+                for key, voice in self._voices.items()
+            ]
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["resident"] = len(self._voices)
+            stats["memory_mb"] = sum(voice["bytes"] for voice in self._voices.values()) / (1024 * 1024)
+            stats["max_voices"] = self.max_voices
+            stats["memory_budget_mb"] = self.memory_budget / (1024 * 1024)
+        return stats
+
+    def _touch(self, key: VoiceKey) -> Optional[Dict]:
+        voice = self._voices.get(key)
+        if voice is not None:
+            self._voices.move_to_end(key)
+        return voice
+
+    def _evict_over_budget(self, keep: VoiceKey) -> None:
+        def over_budget() -> bool:
+            if len(self._voices) > self.max_voices:
+                return True
+            if self.memory_budget > 0:
+                return sum(voice["bytes"] for voice in self._voices.values()) > self.memory_budget
+            return False
+
+        evicted = False
+        while over_budget():
+            candidates = [key for key in self._voices if key not in (keep, self.default_key)]
+            if not candidates:
+                break
+            del self._voices[candidates[0]]
+            self._stats["evictions"] += 1
+            evicted = True
+        if evicted and torch.cuda.is_available():
+            torch.cuda.empty_cache()
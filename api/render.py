@@ -0,0 +1,280 @@
+"""Offline bulk rendering of JSONL synthesis requests.
+
+Every line is a JSON object in the ``SynthesisRequest`` shape plus an optional ``id``
+(defaults to the line number). Lines that share the voice, reference and sampling
+parameters are grouped, sorted by text length and synthesized in large buckets with
+``TTS.run_batched``, so the T2S decoder runs with full batches instead of one request at
+a time. Each finished line is appended to ``manifest.jsonl`` in the output directory;
+running the same command again skips the lines that are already in the manifest. Lines
+that are not valid JSON are reported and skipped.
+
+    python -m api.render lines.jsonl --out-dir renders --batch-size 16 --bucket-size 64
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+from fastapi import HTTPException
+from pydantic import ValidationError
+
+from TTS_infer_pack.feature_cache import file_digest
+from .audio import encode_compressed, resample, to_int16, wav_header
+from .main import SynthesisRequest, _ensure_tts_pipeline, _pipeline_for, _prepare_inputs
+from .scheduler import batch_key
+
+RENDER_FORMATS = ("wav", "flac", "ogg")
+MANIFEST_NAME = "manifest.jsonl"
+_UNSAFE_ID_CHARS = re.compile(r"[^A-Za-z0-9_.-]")
+
+
+@dataclass
+class _Item:
+    item_id: str
+    text: str
+    inputs: Dict
+
+
+def _read_requests(path: str) -> Iterator[Tuple[str, Optional[Dict], Optional[str]]]:
+    """Yield ``(id, payload, error)`` per non-empty line; ``payload`` is ``None`` and
+    ``error`` says why when the line is not a JSON object (``id`` is then the line number)."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                payload = json.loads(line)
+            except json.JSONDecodeError as exc:
+                yield str(line_number), None, f"invalid JSON: {exc}"
+                continue
+            if not isinstance(payload, dict):
+                yield str(line_number), None, f"expected a JSON object, got {type(payload).__name__}"
+                continue
+            yield str(payload.pop("id", line_number)), payload, None
+
+
+def _completed_ids(manifest_path: Path) -> Set[str]:
+    completed = set()
+    if not manifest_path.exists():
+        return completed
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # 中断時に書きかけだった行
+                continue
+            if entry.get("status") == "ok":
+                completed.add(entry["id"])
+    return completed
+
+
+def _encode(pcm: np.ndarray, sample_rate: int, response_format: str) -> bytes:
+    if response_format == "wav":
+        return wav_header(sample_rate, pcm.shape[0]) + pcm.tobytes()
+    return encode_compressed(pcm, sample_rate, response_format)
+
+
+class BulkRenderer:
+    """Render JSONL requests into ``out_dir`` and record them in the manifest.
+
+    Args:
+        out_dir: directory of the audio files and the manifest.
+        response_format: one of ``RENDER_FORMATS``.
+        sample_rate: optional output sampling rate.
+        batch_size: maximum number of segments per T2S batch.
+        bucket_size: number of requests handed to ``TTS.run_batched`` at once.
+    """
+
+    def __init__(
+        self,
+        out_dir: str,
+        response_format: str = "wav",
+        sample_rate: Optional[int] = None,
+        batch_size: int = 16,
+        bucket_size: int = 64,
+    ):
+        if response_format not in RENDER_FORMATS:
+            raise ValueError(f"Unsupported format '{response_format}'. Options: {list(RENDER_FORMATS)}")
+        self.out_dir = Path(out_dir)
+        self.response_format = response_format
+        self.sample_rate = sample_rate
+        self.batch_size = batch_size
+        self.bucket_size = bucket_size
+        self.manifest_path = self.out_dir / MANIFEST_NAME
+        self.audio_seconds = 0.0
+        self.rendered = 0
+        self.failed = 0
+
+    def render(self, requests_path: str) -> Dict[str, float]:
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        completed = _completed_ids(self.manifest_path)
+        groups, temp_paths, skipped = self._load_groups(requests_path, completed)
+        total = sum(len(items) for items in groups.values())
+        print(f"{total} requests to render in {len(groups)} groups ({skipped} already rendered).")
+
+        started = time.perf_counter()
+        try:
+            with open(self.manifest_path, "a", encoding="utf-8") as manifest:
+                # 同じモデルを使うグループを続けて処理し、モデルの切り替えを減らす
+                for key in sorted(groups, key=lambda key: repr(key)):
+                    items = sorted(groups[key], key=lambda item: len(item.text))
+                    for start in range(0, len(items), self.bucket_size):
+                        self._render_bucket(items[start : start + self.bucket_size], manifest)
+                        self._report(started)
+        finally:
+            for path in temp_paths:
+                Path(path).unlink(missing_ok=True)
+        return self._report(started)
+
+    def _load_groups(self, requests_path: str, completed: Set[str]) -> Tuple[Dict, List[str], int]:
+        groups: Dict[Tuple, List[_Item]] = defaultdict(list)
+        temp_paths: List[str] = []
+        references: Dict[str, str] = {}
+        skipped = 0
+        for item_id, payload, error in _read_requests(requests_path):
+            if error is not None:
+                # 壊れた行は報告して飛ばし、残りの行はそのまま合成する
+                print(f"Skipping line {item_id}: {error}")
+                self.failed += 1
+                continue
+            if item_id in completed:
+                skipped += 1
+                continue
+            try:
+                request = SynthesisRequest(**payload)
+                inputs, paths = _prepare_inputs(request)
+            except (ValidationError, HTTPException) as exc:
+                detail = exc.detail if isinstance(exc, HTTPException) else str(exc)
+                print(f"Skipping {item_id}: {detail}")
+                self.failed += 1
+                continue
+            # 同じ参照音声は一つの一時ファイルにまとめ、行数分のファイルを残さない
+            for path in paths:
+                digest = file_digest(path)
+                if digest in references:
+                    Path(path).unlink(missing_ok=True)
+                    if inputs["ref_audio_path"] == path:
+                        inputs["ref_audio_path"] = references[digest]
+                    inputs["aux_ref_audio_paths"] = [
+                        references[digest] if aux == path else aux for aux in inputs["aux_ref_audio_paths"]
+                    ]
+                else:
+                    references[digest] = path
+                    temp_paths.append(path)
+            if request.parallel_infer is None:
+                inputs["parallel_infer"] = True
+            # 固定 seed の行は同じ seed 同士でまとめる (seed はバケット単位で適用される)
+            key = batch_key(dict(inputs, seed=-1)) + (inputs["seed"],)
+            groups[key].append(_Item(item_id, request.text, inputs))
+        return groups, temp_paths, skipped
+
+    def _synthesize(self, pipeline, items: List[_Item]) -> List:
+        # 失敗してもここでは重みを読み直さない (やり直しの後に _render_bucket が一度だけ読み直す)
+        return pipeline.run_batched(
+            [item.inputs for item in items], batch_size=self.batch_size, reload_on_error=False
+        )
+
+    def _render_bucket(self, items: List[_Item], manifest) -> None:
+        pipeline = _pipeline_for(items[0].inputs)
+        try:
+            outcomes = self._synthesize(pipeline, items)
+        except Exception as exc:
+            outcomes = [exc]
+            if len(items) > 1:
+                # 失敗した行を特定するため、読み込み済みのパイプラインで一行ずつやり直す
+                outcomes = []
+                for item in items:
+                    try:
+                        outcomes.extend(self._synthesize(pipeline, [item]))
+                    except Exception as item_exc:
+                        outcomes.append(item_exc)
+        if any(isinstance(outcome, Exception) for outcome in outcomes):
+            # 失敗した合成が残した状態を捨てる (run() と同じ)
+            pipeline.reload_models()
+        for item, outcome in zip(items, outcomes):
+            if isinstance(outcome, Exception):
+                self._record(manifest, item, error=f"{type(outcome).__name__}: {outcome}")
+                continue
+            sample_rate, audio = outcome
+            pcm = to_int16(audio)
+            if self.sample_rate and self.sample_rate != sample_rate:
+                pcm = resample(pcm, sample_rate, self.sample_rate)
+                sample_rate = self.sample_rate
+            self._record(manifest, item, pcm=pcm, sample_rate=sample_rate)
+        manifest.flush()
+        os.fsync(manifest.fileno())
+
+    def _record(self, manifest, item: _Item, pcm: np.ndarray = None, sample_rate: int = 0, error: str = None) -> None:
+        entry = {"id": item.item_id, "text": item.text}
+        if error is None:
+            name = f"{_UNSAFE_ID_CHARS.sub('_', item.item_id)}.{self.response_format}"
+            path = self.out_dir / name
+            # 書き込み途中のファイルが完成品に見えないよう一時ファイルから置き換える
+            tmp_path = path.with_name(f".{name}.tmp")
+            tmp_path.write_bytes(_encode(pcm, sample_rate, self.response_format))
+            os.replace(tmp_path, path)
+            duration = pcm.shape[0] / sample_rate
+            entry.update(status="ok", path=name, sample_rate=sample_rate, duration_seconds=round(duration, 3))
+            self.audio_seconds += duration
+            self.rendered += 1
+        else:
+            entry.update(status="error", error=error)
+            self.failed += 1
+            print(f"Failed {item.item_id}: {error}")
+        manifest.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def _report(self, started: float) -> Dict[str, float]:
+        wall_seconds = time.perf_counter() - started
+        stats = {
+            "rendered": self.rendered,
+            "failed": self.failed,
+            "audio_seconds": self.audio_seconds,
+            "wall_seconds": wall_seconds,
+            # RTF < 1 は実時間より速いことを示す
+            "rtf": wall_seconds / self.audio_seconds if self.audio_seconds else 0.0,
+            "audio_seconds_per_second": self.audio_seconds / wall_seconds if wall_seconds else 0.0,
+        }
+        print(
+            f"rendered={stats['rendered']} failed={stats['failed']} audio={stats['audio_seconds']:.1f}s "
+            f"wall={stats['wall_seconds']:.1f}s RTF={stats['rtf']:.3f} "
+            f"({stats['audio_seconds_per_second']:.2f} audio-s/s)"
+        )
+        return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Render JSONL synthesis requests offline in large batches.")
+    parser.add_argument("requests", help="JSONL file with one SynthesisRequest per line (optional 'id').")
+    parser.add_argument("--out-dir", required=True, help="Directory for the audio files and manifest.jsonl.")
+    parser.add_argument("--format", default="wav", choices=RENDER_FORMATS, help="Audio file format.")
+    parser.add_argument("--sample-rate", type=int, default=None, help="Resample the output to this rate.")
+    parser.add_argument("--batch-size", type=int, default=16, help="Maximum segments per T2S batch.")
+    parser.add_argument("--bucket-size", type=int, default=64, help="Requests synthesized together per run_batched call.")
+    parser.add_argument("--gpt-model-path", default=None, help="Default GPT model (else GPT_MODEL_PATH).")
+    parser.add_argument("--sovits-model-path", default=None, help="Default SoVITS model (else SOVITS_MODEL_PATH).")
+    args = parser.parse_args()
+
+    _ensure_tts_pipeline(args.gpt_model_path, args.sovits_model_path)
+    renderer = BulkRenderer(
+        args.out_dir,
+        response_format=args.format,
+        sample_rate=args.sample_rate,
+        batch_size=args.batch_size,
+        bucket_size=args.bucket_size,
+    )
+    renderer.render(args.requests)
+
+
+if __name__ == "__main__":
+    main()
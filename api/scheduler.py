@@ -0,0 +1,219 @@
+"""Cross-request dynamic batching for the /tts endpoint."""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from GPT_SoVITS.TTS_infer_pack.TTS import TTS, SynthesisCancelled
+from TTS_infer_pack.feature_cache import file_digest
+from .admission import DeadlineExceededError, Ticket
+
+# Requests can only share a T2S batch when everything that conditions the decoder is equal.
+_SHARED_KEYS = (
+    "voice_id",
+    "prompt_text",
+    "prompt_lang",
+    "top_k",
+    "top_p",
+    "temperature",
+    "repetition_penalty",
+    "speed_factor",
+    "parallel_infer",
+    "sample_steps",
+    "batch_threshold",
+    # run_batched() はグループ全体に最初のリクエストの値を使う
+    "super_sampling",
+)
+
+
+def batch_key(inputs: Dict) -> Optional[Tuple]:
+    """Key under which requests may be merged, or ``None`` if the request must run alone.
+
+    Requests with a fixed seed are never merged so that they stay reproducible. Reference
+    audio is compared by content so that base64 uploads of the same clip can be merged.
+    """
+    seed = inputs.get("seed", -1)
+    if seed not in (-1, "", None):
+        return None
+    references = (
+        inputs.get("models"),
+        file_digest(inputs.get("ref_audio_path")),
+        tuple(sorted(file_digest(path) for path in inputs.get("aux_ref_audio_paths") or [])),
+    )
+    return references + tuple(inputs.get(key) for key in _SHARED_KEYS)
+
+
+@dataclass
+class _Pending:
+    inputs: Dict
+    key: Optional[Tuple]
+    future: asyncio.Future
+    ticket: Optional[Ticket] = None
+    enqueued_at: float = field(default_factory=time.perf_counter)
+
+
+class BatchScheduler:
+    """Collect concurrent requests for a short window and synthesize compatible ones together.
+
+    All pipeline access happens while holding ``lock`` so that the scheduler can coexist
+    with endpoints that drive the pipeline directly (e.g. streaming). ``get_pipeline`` is
+    called with the inputs of the group and must return the pipeline ready for them.
+
+    With ``concurrent`` the groups that use the same voice are synthesized in parallel
+    threads; this pays off when the pipeline decodes with continuous batching
+    (``TTS.enable_continuous_batching``), where their T2S rows share one decoding batch.
+    """
+
+    def __init__(
+        self,
+        get_pipeline: Callable[[Dict], TTS],
+        lock: asyncio.Lock,
+        window: float = 0.01,
+        max_batch_size: int = 8,
+        max_requests: int = 16,
+        concurrent: bool = False,
+    ):
+        self.get_pipeline = get_pipeline
+        self.lock = lock
+        self.concurrent = concurrent
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.max_requests = max_requests
+        self._pending: List[_Pending] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._stats = {
+            "dispatches": 0,
+            "requests": 0,
+            "t2s_batches": 0,
+            "t2s_batch_rows": 0,
+            "queue_delay_seconds_total": 0.0,
+            "queue_delay_seconds_max": 0.0,
+            "expired": 0,
+        }
+
+    async def submit(self, inputs: Dict, ticket: Optional[Ticket] = None) -> Tuple[int, np.ndarray]:
+        """Synthesize ``inputs``; pending requests are dispatched in ``ticket.rank`` order."""
+        key = await asyncio.to_thread(batch_key, inputs)
+        loop = asyncio.get_running_loop()
+        pending = _Pending(inputs=inputs, key=key, future=loop.create_future(), ticket=ticket)
+        self._pending.append(pending)
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        self._wakeup.set()
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+        return await pending.future
+
+    def stats(self) -> Dict[str, float]:
+        stats = dict(self._stats)
+        dispatches = max(stats["dispatches"], 1)
+        t2s_batches = max(stats["t2s_batches"], 1)
+        stats["queue_depth"] = len(self._pending)
+        stats["mean_requests_per_dispatch"] = stats["requests"] / dispatches
+        stats["request_occupancy"] = stats["mean_requests_per_dispatch"] / self.max_requests
+        stats["t2s_batch_occupancy"] = stats["t2s_batch_rows"] / (t2s_batches * self.max_batch_size)
+        stats["mean_queue_delay_seconds"] = stats["queue_delay_seconds_total"] / max(stats["requests"], 1)
+        return stats
+
+    async def _run(self) -> None:
+        while True:
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            # 少し待って同時に到着したリクエストをまとめる
+            if self.window > 0:
+                await asyncio.sleep(self.window)
+            async with self.lock:
+                groups = self._take_groups()
+                if not self.concurrent:
+                    for group in groups:
+                        await self._dispatch(group)
+                    continue
+                # 音声モデルの切り替えは並行できないので、同じモデルのグループごとにまとめて実行する
+                by_models: Dict[Optional[Tuple], List[List[_Pending]]] = {}
+                for group in groups:
+                    by_models.setdefault(group[0].inputs.get("models"), []).append(group)
+                for same_models in by_models.values():
+                    await asyncio.gather(*[self._dispatch(group) for group in same_models])
+
+    def _take_groups(self) -> List[List[_Pending]]:
+        pending, self._pending = self._pending, []
+        # 優先度・期限・推定コストの順に並べ、先頭の要求を含むグループから処理する
+        pending.sort(key=lambda item: item.ticket.rank if item.ticket is not None else (float("inf"),))
+        groups: List[List[_Pending]] = []
+        by_key: Dict[Tuple, List[_Pending]] = {}
+        now = time.monotonic()
+        for item in pending:
+            if item.future.done():
+                continue
+            cancel_token = item.inputs.get("cancel_token")
+            if cancel_token is not None and cancel_token.cancelled:
+                item.future.set_exception(SynthesisCancelled(cancel_token.reason))
+                continue
+            if item.ticket is not None and item.ticket.expired(now):
+                self._stats["expired"] += 1
+                item.future.set_exception(DeadlineExceededError("The request deadline passed before synthesis started."))
+                continue
+            if item.key is None:
+                groups.append([item])
+                continue
+            group = by_key.get(item.key)
+            if group is None or len(group) >= self.max_requests:
+                group = by_key[item.key] = []
+                groups.append(group)
+            group.append(item)
+        return groups
+
+    async def _dispatch(self, group: List[_Pending]) -> None:
+        now = time.perf_counter()
+        for item in group:
+            delay = now - item.enqueued_at
+            self._stats["queue_delay_seconds_total"] += delay
+            self._stats["queue_delay_seconds_max"] = max(self._stats["queue_delay_seconds_max"], delay)
+        self._stats["dispatches"] += 1
+        self._stats["requests"] += len(group)
+
+        def _work() -> Tuple[List[Tuple[int, np.ndarray]], List[int]]:
+            pipeline = self.get_pipeline(group[0].inputs)
+            if len(group) == 1:
+                inputs = group[0].inputs
+                result = None
+                for result in pipeline.run(inputs):
+                    pass
+                if result is None:
+                    raise RuntimeError("No audio generated.")
+                # 単独実行のバッチ構成は run() の内部で決まるので占有率には数えない
+                return [result], []
+            batch_stats: Dict = {}
+            results = pipeline.run_batched(
+                [item.inputs for item in group], batch_size=self.max_batch_size, stats=batch_stats
+            )
+            # 各段階の時間はまとめて処理したグループ全体の値を各リクエストに記録する
+            for item in group:
+                if item.inputs.get("stats") is not None:
+                    item.inputs["stats"].update(batch_stats, batch_requests=len(group))
+            return results, batch_stats.get("batch_sizes", [])
+
+        try:
+            results, batch_sizes = await asyncio.to_thread(_work)
+        except Exception as exc:
+            for item in group:
+                if not item.future.done():
+                    item.future.set_exception(exc)
+            return
+        self._stats["t2s_batches"] += len(batch_sizes)
+        self._stats["t2s_batch_rows"] += sum(batch_sizes)
+        for item, result in zip(group, results):
+            if item.future.done():
+                continue
+            if result is None:
+                # 取消されたリクエストは run_batched() が結果を返さない
+                item.future.set_exception(SynthesisCancelled("cancelled"))
+            else:
+                item.future.set_result(result)
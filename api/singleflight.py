@@ -0,0 +1,204 @@
+"""Single-flight coalescing of identical in-flight synthesis requests."""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Set, Tuple
+
+from GPT_SoVITS.TTS_infer_pack.TTS import CancellationToken, SynthesisCancelled
+from TTS_infer_pack.feature_cache import file_digest
+from .scheduler import _SHARED_KEYS
+
+# 出力の形を決める入力。これらと参照音声・seed・文章が同じなら同じ音声になる
+_OUTPUT_KEYS = (
+    "text_lang",
+    "text_split_method",
+    "batch_size",
+    "split_bucket",
+    "return_fragment",
+    "fragment_interval",
+)
+
+
+def coalesce_key(inputs: Dict) -> Optional[Tuple]:
+    """Key of the ``TTS.run`` inputs whose output is identical, or ``None`` if the request
+    must run on its own.
+
+    Only requests with a fixed seed are deterministic, so only those are coalesced. The
+    text is compared with its whitespace normalized and reference audio by content.
+    """
+    seed = inputs.get("seed", -1)
+    if seed in (-1, "", None):
+        return None
+    references = (
+        inputs.get("models"),
+        file_digest(inputs.get("ref_audio_path")),
+        tuple(sorted(file_digest(path) for path in inputs.get("aux_ref_audio_paths") or [])),
+    )
+    text = " ".join(str(inputs.get("text", "")).split())
+    return (text, seed) + references + tuple(inputs.get(key) for key in _SHARED_KEYS + _OUTPUT_KEYS)
+
+
+class _Flight:
+    def __init__(self, key: Optional[Tuple], token: CancellationToken):
+        self.key = key
+        self.token = token
+        self.items: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self.wakers: Set[asyncio.Event] = set()
+
+    def notify(self) -> None:
+        for waker in self.wakers:
+            waker.set()
+
+
+class Subscription:
+    """One caller's view of a flight. The first caller of a key leads and must either
+    ``start`` the work or ``fail`` the flight; the others only read the items."""
+
+    def __init__(self, owner: "SingleFlight", flight: _Flight, cancel_token: CancellationToken, leading: bool):
+        self._owner = owner
+        self._flight = flight
+        self.cancel_token = cancel_token
+        self.leading = leading
+        self._closed = False
+
+    @property
+    def shared(self) -> bool:
+        """Whether other callers may join this flight (its key is not ``None``)."""
+        return self._flight.key is not None
+
+    def start(self, produce: Callable[[CancellationToken], AsyncIterator[Any]]) -> None:
+        """Run ``produce(token)`` in a task and share its items with every subscriber.
+
+        ``token`` is cancelled once all subscribers have left.
+        """
+        flight = self._flight
+
+        async def _run() -> None:
+            error = None
+            try:
+                async for item in produce(flight.token):
+                    flight.items.append(item)
+                    flight.notify()
+            except BaseException as exc:  # forwarded to the subscribers
+                error = exc
+            self._owner._finish(flight, error)
+
+        flight.task = asyncio.ensure_future(_run())
+
+    def fail(self, error: BaseException) -> None:
+        """Give up a flight that was never started, e.g. when admission failed."""
+        self._owner._finish(self._flight, error)
+
+    async def items(self) -> AsyncIterator[Any]:
+        """Yield every item of the flight from the first one, then raise its error if any.
+
+        Raises ``SynthesisCancelled`` when this caller's token is cancelled (its client left
+        or its deadline passed); the flight itself goes on for the other subscribers.
+        """
+        flight = self._flight
+        loop = asyncio.get_running_loop()
+        waker = asyncio.Event()
+        flight.wakers.add(waker)
+        self.cancel_token.add_callback(lambda: loop.call_soon_threadsafe(waker.set))
+        try:
+            index = 0
+            while True:
+                while index < len(flight.items):
+                    yield flight.items[index]
+                    index += 1
+                if flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                self.cancel_token.raise_if_cancelled()
+                deadline = self.cancel_token.deadline
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    await asyncio.wait_for(waker.wait(), timeout)
+                except asyncio.TimeoutError:
+                    # 次のループで期限切れとして扱われる
+                    pass
+                waker.clear()
+        finally:
+            flight.wakers.discard(waker)
+            self.close()
+
+    async def result(self) -> Any:
+        """The last item of the flight (for work that produces a single result)."""
+        result = None
+        async for result in self.items():
+            pass
+        return result
+
+    def close(self) -> None:
+        """Leave the flight. Safe to call more than once."""
+        if not self._closed:
+            self._closed = True
+            self._owner._leave(self._flight)
+
+
+class SingleFlight:
+    """Run identical in-flight requests once and fan the result out to every caller.
+
+    ``join(key, cancel_token)`` attaches to the running flight of ``key`` or, if there is
+    none, registers a new one that the caller leads. Callers that attach later still get
+    every item from the first one. A ``None`` key never coalesces; its flight runs with
+    the caller's own token, exactly as without coalescing.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._flights: Dict[Tuple, _Flight] = {}
+        self._stats = {"flights": 0, "coalesced": 0, "cancelled_flights": 0}
+
+    def join(self, key: Optional[Tuple], cancel_token: CancellationToken) -> Subscription:
+        if not self.enabled:
+            key = None
+        flight = self._flights.get(key) if key is not None else None
+        leading = flight is None
+        if leading:
+            flight = _Flight(key, cancel_token if key is None else CancellationToken())
+            if key is not None:
+                self._flights[key] = flight
+                self._stats["flights"] += 1
+        else:
+            self._stats["coalesced"] += 1
+        flight.subscribers += 1
+        return Subscription(self, flight, cancel_token, leading)
+
+    def stats(self) -> Dict[str, int]:
+        stats = dict(self._stats)
+        stats["enabled"] = self.enabled
+        stats["in_flight"] = len(self._flights)
+        stats["subscribers"] = sum(flight.subscribers for flight in self._flights.values())
+        return stats
+
+    def _finish(self, flight: _Flight, error: Optional[BaseException]) -> None:
+        if flight.done:
+            return
+        flight.done = True
+        flight.error = error
+        self._forget(flight)
+        flight.notify()
+
+    def _leave(self, flight: _Flight) -> None:
+        flight.subscribers -= 1
+        if flight.subscribers > 0 or flight.done:
+            return
+        # 待っている呼び出し元がいなくなったら合成を打ち切り、次のリクエストは新しく始める
+        self._forget(flight)
+        if flight.key is not None:
+            self._stats["cancelled_flights"] += 1
+        flight.token.cancel("disconnected")
+        if flight.task is None:
+            self._finish(flight, SynthesisCancelled("disconnected"))
+
+    def _forget(self, flight: _Flight) -> None:
+        if flight.key is not None and self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
@@ -0,0 +1,95 @@
+"""Replace the default GPT/SoVITS models without interrupting synthesis."""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Dict, Optional
+
+from GPT_SoVITS.TTS_infer_pack.TTS import TTS
+from .registry import VoiceKey, VoiceModelRegistry
+
+SWAP_STATES = ("idle", "loading", "draining", "swapping", "releasing", "ready", "failed")
+
+
+class SwapInProgressError(Exception):
+    pass
+
+
+class ModelSwapper:
+    """Load new default models next to the serving ones, then switch over.
+
+    The standby models are loaded through the registry outside ``lock``, so requests
+    keep being served by the current models in the meantime. The switch itself takes
+    ``lock``: the request holding it finishes on the old models and every request
+    dispatched afterwards gets the new ones. The previous default is then dropped from
+    the registry, which frees its weights as soon as the pipeline no longer references
+    them. Both sets of weights are resident during the load, so the memory must fit both.
+
+    ``status`` reports the state of the last swap and the duration of each stage.
+    """
+
+    def __init__(self, registry: VoiceModelRegistry, lock: asyncio.Lock):
+        self.registry = registry
+        self.lock = lock
+        self.status: Dict = {"state": "idle", "stages": []}
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def busy(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self, pipeline: TTS, key: VoiceKey, keep_previous: bool = False) -> asyncio.Task:
+        """Start swapping the default voice to ``key``; the task never raises, failures
+        are reported in ``status``."""
+        if self.busy:
+            raise SwapInProgressError(
+                f"Models are already being loaded: GPT={self.status['gpt_model_path']}, "
+                f"SoVITS={self.status['sovits_model_path']}"
+            )
+        previous = self.registry.default_key
+        self.status = {
+            "state": "loading",
+            "gpt_model_path": key[0],
+            "sovits_model_path": key[1],
+            "previous_gpt_model_path": previous[0] if previous else None,
+            "previous_sovits_model_path": previous[1] if previous else None,
+            "stages": [],
+            "started_at": time.time(),
+            "finished_at": None,
+            "error": None,
+        }
+        self._task = asyncio.create_task(self._swap(pipeline, key, keep_previous))
+        return self._task
+
+    async def _swap(self, pipeline: TTS, key: VoiceKey, keep_previous: bool) -> None:
+        status = self.status
+        try:
+            # 読み込み中も現在のモデルで合成を続ける
+            await asyncio.to_thread(self.registry.get, pipeline, key, self._stage)
+            status["state"] = "draining"
+            t0 = time.perf_counter()
+            async with self.lock:
+                # ロックを持っていたリクエストは古いモデルのまま完了している
+                self._stage("drain", time.perf_counter() - t0)
+                status["state"] = "swapping"
+                t0 = time.perf_counter()
+                previous = self.registry.default_key
+                await asyncio.to_thread(self.registry.activate, pipeline, key)
+                self.registry.default_key = key
+                self._stage("swap", time.perf_counter() - t0)
+            if previous is not None and previous != key and not keep_previous:
+                status["state"] = "releasing"
+                t0 = time.perf_counter()
+                await asyncio.to_thread(self.registry.evict, previous)
+                self._stage("release_previous", time.perf_counter() - t0)
+            status["state"] = "ready"
+        except Exception as exc:
+            status["state"] = "failed"
+            status["error"] = f"{type(exc).__name__}: {exc}"
+        finally:
+            status["finished_at"] = time.time()
+
+    def _stage(self, stage: str, seconds: float) -> None:
+        # 読み込みスレッドからも呼ばれるが、list.append はスレッドセーフ
+        self.status["stages"].append({"stage": stage, "seconds": seconds, "error": None})
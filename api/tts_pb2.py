@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+# Generated by the protocol buffer compiler.  DO NOT EDIT!
+# NO CHECKED-IN PROTOBUF GENCODE
+# source: api/tts.proto
+# Protobuf Python Version: 7.35.1
+"""Generated protocol buffer code."""
+from google.protobuf import descriptor as _descriptor
+from google.protobuf import descriptor_pool as _descriptor_pool
+from google.protobuf import runtime_version as _runtime_version
+from google.protobuf import symbol_database as _symbol_database
+from google.protobuf.internal import builder as _builder
+_runtime_version.ValidateProtobufRuntimeVersion(
+    _runtime_version.Domain.PUBLIC,
+    7,
+    35,
+    1,
+    '',
+    'api/tts.proto'
+)
+# @@protoc_insertion_point(imports)
+
+_sym_db = _symbol_database.Default()
+
+
+
+
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\rapi/tts.proto\x12\x0cgptsovits.v1\"\xd7\x07\n\x11SynthesizeRequest\x12\x0c\n\x04text\x18\x01 \x01(\t\x12\x17\n\x0freference_audio\x18\x02 \x01(\x0c\x12\x1c\n\x14reference_audio_path\x18\x03 \x01(\t\x12\x10\n\x08voice_id\x18\x04 \x01(\t\x12\x16\n\x0egpt_model_path\x18\x05 \x01(\t\x12\x19\n\x11sovits_model_path\x18\x06 \x01(\t\x12\x1a\n\rtext_language\x18\x07 \x01(\tH\x00\x88\x01\x01\x12\x18\n\x0bprompt_text\x18\x08 \x01(\tH\x01\x88\x01\x01\x12\x1c\n\x0fprompt_language\x18\t \x01(\tH\x02\x88\x01\x01\x12\"\n\x1a\x61uxiliary_reference_audios\x18\n \x03(\x0c\x12\x12\n\x05top_k\x18\x0b \x01(\x05H\x03\x88\x01\x01\x12\x12\n\x05top_p\x18\x0c \x01(\x01H\x04\x88\x01\x01\x12\x18\n\x0btemperature\x18\r \x01(\x01H\x05\x88\x01\x01\x12\x1e\n\x11text_split_method\x18\x0e \x01(\tH\x06\x88\x01\x01\x12\x17\n\nbatch_size\x18\x0f \x01(\x05H\x07\x88\x01\x01\x12\x1c\n\x0f\x62\x61tch_threshold\x18\x10 \x01(\x01H\x08\x88\x01\x01\x12\x12\n\x05speed\x18\x11 \x01(\x01H\t\x88\x01\x01\x12\x12\n\x05pause\x18\x12 \x01(\x01H\n\x88\x01\x01\x12\x11\n\x04seed\x18\x13 \x01(\x03H\x0b\x88\x01\x01\x12\x1b\n\x0eparallel_infer\x18\x14 \x01(\x08H\x0c\x88\x01\x01\x12\x1f\n\x12repetition_penalty\x18\x15 \x01(\x01H\r\x88\x01\x01\x12\x19\n\x0csample_steps\x18\x16 \x01(\x05H\x0e\x88\x01\x01\x12\x18\n\x0bsample_rate\x18\x17 \x01(\x05H\x0f\x88\x01\x01\x12\x15\n\x08priority\x18\x18 \x01(\tH\x10\x88\x01\x01\x12\x18\n\x0b\x64\x65\x61\x64line_ms\x18\x19 \x01(\x05H\x11\x88\x01\x01\x12\x1c\n\x0fresponse_format\x18\x1a \x01(\tH\x12\x88\x01\x01\x42\x10\n\x0e_text_languageB\x0e\n\x0c_prompt_textB\x12\n\x10_prompt_languageB\x08\n\x06_top_kB\x08\n\x06_top_pB\x0e\n\x0c_temperatureB\x14\n\x12_text_split_methodB\r\n\x0b_batch_sizeB\x12\n\x10_batch_thresholdB\x08\n\x06_speedB\x08\n\x06_pauseB\x07\n\x05_seedB\x11\n\x0f_parallel_inferB\x15\n\x13_repetition_penaltyB\x0f\n\r_sample_stepsB\x0e\n\x0c_sample_rateB\x0b\n\t_priorityB\x0e\n\x0c_deadline_msB\x12\n\x10_response_format\"\xfe\x01\n\x12SynthesizeResponse\x12\r\n\x05\x61udio\x18\x01 \x01(\x0c\x12\x17\n\x0fresponse_format\x18\x02 \x01(\t\x12\x13\n\x0bsample_rate\x18\x03 \x01(\x05\x12\x18\n\x10\x64uration_seconds\x18\x04 \x01(\x01\x12I\n\rstage_seconds\x18\x05 \x03(\x0b\x32\x32.gptsovits.v1.SynthesizeResponse.StageSecondsEntry\x12\x11\n\tcoalesced\x18\x06 \x01(\x08\x1a\x33\n\x11StageSecondsEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\r\n\x05value\x18\x02 \x01(\x01:\x02\x38\x01\".\n\nAudioChunk\x12\x0b\n\x03pcm\x18\x01 \x01(\x0c\x12\x13\n\x0bsample_rate\x18\x02 \x01(\x05\x32\xb0\x01\n\x0cTextToSpeech\x12O\n\nSynthesize\x12\x1f.gptsovits.v1.SynthesizeRequest\x1a .gptsovits.v1.SynthesizeResponse\x12O\n\x10SynthesizeStream\x12\x1f.gptsovits.v1.SynthesizeRequest\x1a\x18.gptsovits.v1.AudioChunk0\x01\x62\x06proto3')
+
+_globals = globals()
+_builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
+_builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'api.tts_pb2', _globals)
+if not _descriptor._USE_C_DESCRIPTORS:
+  DESCRIPTOR._loaded_options = None
+  _globals['_SYNTHESIZERESPONSE_STAGESECONDSENTRY']._loaded_options = None
+  _globals['_SYNTHESIZERESPONSE_STAGESECONDSENTRY']._serialized_options = b'8\001'
+  _globals['_SYNTHESIZEREQUEST']._serialized_start=32
+  _globals['_SYNTHESIZEREQUEST']._serialized_end=1015
+  _globals['_SYNTHESIZERESPONSE']._serialized_start=1018
+  _globals['_SYNTHESIZERESPONSE']._serialized_end=1272
+  _globals['_SYNTHESIZERESPONSE_STAGESECONDSENTRY']._serialized_start=1221
+  _globals['_SYNTHESIZERESPONSE_STAGESECONDSENTRY']._serialized_end=1272
+  _globals['_AUDIOCHUNK']._serialized_start=1274
+  _globals['_AUDIOCHUNK']._serialized_end=1320
+  _globals['_TEXTTOSPEECH']._serialized_start=1323
+  _globals['_TEXTTOSPEECH']._serialized_end=1499
+# @@protoc_insertion_point(module_scope)
@@ -0,0 +1,145 @@
+# Generated by the gRPC Python protocol compiler plugin. DO NOT EDIT!
+"""Client and server classes corresponding to protobuf-defined services."""
+import grpc
+import warnings
+
+from api import tts_pb2 as api_dot_tts__pb2
+
+GRPC_GENERATED_VERSION = '1.84.0'
+GRPC_VERSION = grpc.__version__
+_version_not_supported = False
+
+try:
+    from grpc._utilities import first_version_is_lower
+    _version_not_supported = first_version_is_lower(GRPC_VERSION, GRPC_GENERATED_VERSION)
+except ImportError:
+    _version_not_supported = True
+
+if _version_not_supported:
+    raise RuntimeError(
+        f'The grpc package installed is at version {GRPC_VERSION},'
+        + ' but the generated code in api/tts_pb2_grpc.py depends on'
+        + f' grpcio>={GRPC_GENERATED_VERSION}.'
+        + f' Please upgrade your grpc module to grpcio>={GRPC_GENERATED_VERSION}'
+        + f' or downgrade your generated code using grpcio-tools<={GRPC_VERSION}.'
+    )
+
+
+class TextToSpeechStub:
+    """Served by the same process, pipeline, queue and caches as the HTTP API.
+    """
+
+    def __init__(self, channel):
+        """Constructor.
+
+        Args:
+            channel: A grpc.Channel.
+        """
+        self.Synthesize = channel.unary_unary(
+                '/gptsovits.v1.TextToSpeech/Synthesize',
+                request_serializer=api_dot_tts__pb2.SynthesizeRequest.SerializeToString,
+                response_deserializer=api_dot_tts__pb2.SynthesizeResponse.FromString,
+                _registered_method=True)
+        self.SynthesizeStream = channel.unary_stream(
+                '/gptsovits.v1.TextToSpeech/SynthesizeStream',
+                request_serializer=api_dot_tts__pb2.SynthesizeRequest.SerializeToString,
+                response_deserializer=api_dot_tts__pb2.AudioChunk.FromString,
+                _registered_method=True)
+
+
+class TextToSpeechServicer:
+    """Served by the same process, pipeline, queue and caches as the HTTP API.
+    """
+
+    def Synthesize(self, request, context):
+        """Synthesize the whole text and return it in one message.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def SynthesizeStream(self, request, context):
+        """Stream 16-bit mono PCM segment by segment, as soon as each one is synthesized.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+
+def add_TextToSpeechServicer_to_server(servicer, server):
+    rpc_method_handlers = {
+            'Synthesize': grpc.unary_unary_rpc_method_handler(
+                    servicer.Synthesize,
+                    request_deserializer=api_dot_tts__pb2.SynthesizeRequest.FromString,
+                    response_serializer=api_dot_tts__pb2.SynthesizeResponse.SerializeToString,
+            ),
+            'SynthesizeStream': grpc.unary_stream_rpc_method_handler(
+                    servicer.SynthesizeStream,
+                    request_deserializer=api_dot_tts__pb2.SynthesizeRequest.FromString,
+                    response_serializer=api_dot_tts__pb2.AudioChunk.SerializeToString,
+            ),
+    }
+    generic_handler = grpc.method_handlers_generic_handler(
+            'gptsovits.v1.TextToSpeech', rpc_method_handlers)
+    server.add_generic_rpc_handlers((generic_handler,))
+    server.add_registered_method_handlers('gptsovits.v1.TextToSpeech', rpc_method_handlers)
+
+
+ # This class is part of an EXPERIMENTAL API.
+class TextToSpeech:
+    """Served by the same process, pipeline, queue and caches as the HTTP API.
+    """
+
+    @staticmethod
+    def Synthesize(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/gptsovits.v1.TextToSpeech/Synthesize',
+            api_dot_tts__pb2.SynthesizeRequest.SerializeToString,
+            api_dot_tts__pb2.SynthesizeResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def SynthesizeStream(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(
+            request,
+            target,
+            '/gptsovits.v1.TextToSpeech/SynthesizeStream',
+            api_dot_tts__pb2.SynthesizeRequest.SerializeToString,
+            api_dot_tts__pb2.AudioChunk.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
@@ -0,0 +1,267 @@
+"""Pre-forked worker processes that share the pipeline weights copy-on-write."""
+
+from __future__ import annotations
+
+import asyncio
+import gc
+import itertools
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import traceback
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+
+from GPT_SoVITS.TTS_infer_pack.TTS import TTS, CancellationToken, SynthesisCancelled
+
+
+def _limit_threads(num_threads: int) -> None:
+    for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "ORT_NUM_THREADS"):
+        os.environ[name] = str(num_threads)
+    torch.set_num_threads(num_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # 親プロセスで既に並列処理が走っている場合は変更できない
+        pass
+
+
+class _WorkerCancellationToken(CancellationToken):
+    """Token of a job running in a worker; the parent cancels it through ``cancel_job``."""
+
+    def __init__(self, job_id: int, cancel_job, deadline: Optional[float] = None):
+        super().__init__(deadline)
+        self.job_id = job_id
+        self.cancel_job = cancel_job
+
+    @property
+    def cancelled(self) -> bool:
+        if self.cancel_job.value == self.job_id:
+            self.cancel()
+        return super().cancelled
+
+
+def _worker_main(
+    get_pipeline: Callable[[Dict], TTS], tasks, results, current_job, cancel_job, num_threads: int
+) -> None:
+    # シャットダウンは親プロセスが管理する
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    if num_threads > 0:
+        _limit_threads(num_threads)
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        job_id, inputs, deadline = task
+        # キュー経由だと異常終了時に届かないことがあるので共有メモリで知らせる
+        current_job.value = job_id
+        inputs["cancel_token"] = _WorkerCancellationToken(job_id, cancel_job, deadline)
+        inputs["stats"] = {}
+        try:
+            pipeline = get_pipeline(inputs)
+            for item in pipeline.run(inputs):
+                results.put((job_id, "item", item))
+        except SynthesisCancelled as exc:
+            results.put((job_id, "cancelled", str(exc)))
+        except Exception as exc:
+            traceback.print_exc()
+            results.put((job_id, "error", f"{type(exc).__name__}: {exc}"))
+        else:
+            # 各段階の時間は親プロセスで集計する
+            results.put((job_id, "done", inputs["stats"]))
+        current_job.value = -1
+
+
+@dataclass
+class _Job:
+    loop: asyncio.AbstractEventLoop
+    queue: asyncio.Queue = field(default_factory=asyncio.Queue)
+    abandoned: bool = False
+
+
+class WorkerPool:
+    """Run ``TTS.run`` in ``num_workers`` forked processes.
+
+    The parent loads the pipeline once and then forks, so every worker maps the same
+    weight pages copy-on-write instead of holding its own copy. ``threads_per_worker``
+    partitions the CPU cores between workers for torch and onnxruntime. Forking requires
+    CPU inference; CUDA contexts do not survive ``fork``.
+
+    Thread pools do not survive ``fork`` either: the parent must run torch with a single
+    thread until the workers are started, and the g2pW onnxruntime session is re-created
+    in each worker. Models loaded by a worker after the fork are private to it, so every
+    voice the workers use has to be loaded before ``start``.
+    """
+
+    def __init__(
+        self,
+        get_pipeline: Callable[[Dict], TTS],
+        num_workers: int,
+        threads_per_worker: int = 0,
+    ):
+        self.get_pipeline = get_pipeline
+        self.num_workers = num_workers
+        if threads_per_worker <= 0:
+            threads_per_worker = max(1, (os.cpu_count() or 1) // num_workers)
+        self.threads_per_worker = threads_per_worker
+        self._ctx = multiprocessing.get_context("fork")
+        self._tasks = self._ctx.Queue()
+        self._results = self._ctx.Queue()
+        self._workers: List[multiprocessing.Process] = []
+        self._current_jobs: List = []
+        self._cancel_jobs: List = []
+        self._cancelled: set = set()
+        self._cancel_lock = threading.Lock()
+        self._jobs: Dict[int, _Job] = {}
+        self._ids = itertools.count()
+        self._reader: Optional[threading.Thread] = None
+        self._closed = False
+        self._stats = {"jobs": 0, "failed_jobs": 0, "cancelled_jobs": 0, "restarts": 0}
+
+    def start(self, pipeline: TTS) -> None:
+        if "cuda" in str(pipeline.configs.device):
+            raise RuntimeError("The worker pool requires CPU inference (CUDA cannot be shared across fork).")
+        if torch.get_num_threads() > 1:
+            print("Warning: torch uses more than one thread before fork; the workers may hang in parallel ops.")
+        # 共有する重みは推論中に書き換えないので勾配を無効にしておく
+        for module in (pipeline.t2s_model, pipeline.vits_model, pipeline.bert_model, pipeline.cnhuhbert_model):
+            if module is not None:
+                module.requires_grad_(False)
+        # GC が古いオブジェクトに触れてページがコピーされるのを防ぐ
+        gc.collect()
+        gc.freeze()
+        for _ in range(self.num_workers):
+            current_job = self._ctx.Value("q", -1, lock=False)
+            cancel_job = self._ctx.Value("q", -1, lock=False)
+            self._current_jobs.append(current_job)
+            self._cancel_jobs.append(cancel_job)
+            self._workers.append(self._spawn(current_job, cancel_job))
+        self._reader = threading.Thread(target=self._read_results, name="tts-worker-results", daemon=True)
+        self._reader.start()
+
+    def close(self) -> None:
+        self._closed = True
+        for _ in self._workers:
+            self._tasks.put(None)
+        for process in self._workers:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+
+    async def run(self, inputs: Dict) -> AsyncIterator[Tuple[int, np.ndarray]]:
+        """Yield what ``TTS.run(inputs)`` yields, computed in one of the workers.
+
+        ``inputs["cancel_token"]`` stays in this process; cancelling it (or its deadline
+        passing) stops the job in the worker and raises ``SynthesisCancelled`` here.
+        ``inputs["stats"]`` is filled with the stage timings once the job is done.
+        """
+        inputs = dict(inputs)
+        token: Optional[CancellationToken] = inputs.pop("cancel_token", None)
+        stats: Optional[Dict] = inputs.pop("stats", None)
+        job_id = next(self._ids)
+        job = _Job(loop=asyncio.get_running_loop())
+        self._jobs[job_id] = job
+        self._stats["jobs"] += 1
+        self._tasks.put((job_id, inputs, token.deadline if token is not None else None))
+        if token is not None:
+            token.add_callback(lambda: self._cancel(job_id))
+        finished = False
+        try:
+            while True:
+                kind, payload = await job.queue.get()
+                if kind == "item":
+                    yield payload
+                elif kind == "done":
+                    finished = True
+                    if stats is not None:
+                        stats.update(payload)
+                    return
+                elif kind == "cancelled":
+                    finished = True
+                    self._stats["cancelled_jobs"] += 1
+                    raise SynthesisCancelled(payload)
+                else:
+                    finished = True
+                    self._stats["failed_jobs"] += 1
+                    raise RuntimeError(payload)
+        finally:
+            if finished:
+                self._jobs.pop(job_id, None)
+            else:
+                # 残りの推論を打ち切り、それまでの結果は読み捨てる
+                job.abandoned = True
+                self._cancel(job_id)
+
+    def stats(self) -> Dict[str, float]:
+        stats = dict(self._stats)
+        stats["workers"] = self.num_workers
+        stats["alive_workers"] = sum(process.is_alive() for process in self._workers)
+        stats["threads_per_worker"] = self.threads_per_worker
+        stats["in_flight"] = len(self._jobs)
+        return stats
+
+    def _cancel(self, job_id: int) -> None:
+        with self._cancel_lock:
+            self._cancelled.add(job_id)
+        self._signal_cancelled()
+
+    def _signal_cancelled(self) -> None:
+        # まだキューにあるジョブは、ワーカーが取り出した後に読み取りスレッドが通知する
+        with self._cancel_lock:
+            for current_job, cancel_job in zip(self._current_jobs, self._cancel_jobs):
+                if current_job.value in self._cancelled:
+                    cancel_job.value = current_job.value
+
+    def _spawn(self, current_job, cancel_job) -> multiprocessing.Process:
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(self.get_pipeline, self._tasks, self._results, current_job, cancel_job, self.threads_per_worker),
+            name="tts-worker",
+            daemon=True,
+        )
+        process.start()
+        return process
+
+    def _read_results(self) -> None:
+        while not self._closed:
+            try:
+                job_id, kind, payload = self._results.get(timeout=1.0)
+            except queue.Empty:
+                job_id = None
+            self._reap()
+            self._signal_cancelled()
+            if job_id is None:
+                continue
+            if kind != "item":
+                with self._cancel_lock:
+                    self._cancelled.discard(job_id)
+            job = self._jobs.get(job_id)
+            if job is None:
+                continue
+            if job.abandoned:
+                if kind != "item":
+                    self._jobs.pop(job_id, None)
+                continue
+            job.loop.call_soon_threadsafe(job.queue.put_nowait, (kind, payload))
+
+    def _reap(self) -> None:
+        for index, process in enumerate(self._workers):
+            if process.is_alive() or self._closed:
+                continue
+            print(f"TTS worker {process.pid} exited with code {process.exitcode}, restarting.")
+            current_job = self._current_jobs[index]
+            with self._cancel_lock:
+                self._cancelled.discard(current_job.value)
+            job = self._jobs.pop(current_job.value, None)
+            if job is not None and not job.abandoned:
+                message = f"Worker process exited with code {process.exitcode}."
+                job.loop.call_soon_threadsafe(job.queue.put_nowait, ("error", message))
+            current_job.value = -1
+            self._workers[index] = self._spawn(current_job, self._cancel_jobs[index])
+            self._stats["restarts"] += 1
@@ -0,0 +1,32 @@
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+# GPT_SoVITS 内のモジュールは GPT_SoVITS をパスに入れた状態で import される
+for path in (REPO_ROOT, REPO_ROOT / "GPT_SoVITS"):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
+
+import torch  # noqa: E402
+
+from AR.models.t2s_model import Text2SemanticDecoder  # noqa: E402
+
+# テストで使う小さな T2S モデルの設定 (語彙は本物と同じ)
+TINY_T2S_CONFIG = {
+    "model": {
+        "embedding_dim": 64,
+        "hidden_dim": 64,
+        "head": 4,
+        "n_layer": 2,
+        "dropout": 0,
+        "EOS": 1024,
+        "vocab_size": 1025,
+        "phoneme_vocab_size": 512,
+    }
+}
+
+
+def tiny_t2s_model(seed: int = 0, n_layer: int = 2) -> Text2SemanticDecoder:
+    """Randomly initialized T2S model of TINY_T2S_CONFIG, the same for the same seed."""
+    torch.manual_seed(seed)
+    return Text2SemanticDecoder({"model": dict(TINY_T2S_CONFIG["model"], n_layer=n_layer)}).eval()
@@ -0,0 +1,14 @@
+import sys
+
+import api.main  # noqa: F401
+from api import render, scheduler, singleflight
+from TTS_infer_pack import feature_cache, text_segmentation_method
+
+
+def test_api_shares_the_modules_of_tts():
+    # 同じモジュールが二つの名前で読み込まれると、キャッシュや統計が別々になる
+    assert "GPT_SoVITS.TTS_infer_pack.feature_cache" not in sys.modules
+    assert api.main.SegmentCache is feature_cache.SegmentCache
+    assert api.main.split_completed is text_segmentation_method.split_completed
+    for module in (render, scheduler, singleflight):
+        assert module.file_digest is feature_cache.file_digest
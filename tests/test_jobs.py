@@ -0,0 +1,53 @@
+import asyncio
+
+import numpy as np
+
+from api.admission import AdmissionController
+from api.jobs import JobManager
+
+
+async def _synthesize(inputs, ticket):
+    return 32000, np.zeros(320, dtype=np.int16)
+
+
+def _manager(tmp_path, **kwargs) -> JobManager:
+    return JobManager(
+        str(tmp_path),
+        synthesize=_synthesize,
+        segment_text=lambda inputs: inputs["text"].split("."),
+        admission=AdmissionController(capacity=4),
+        **kwargs,
+    )
+
+
+def _run_jobs(manager: JobManager, count: int):
+    async def scenario():
+        jobs = [manager.submit({"text": "a.b"}, 32000) for _ in range(count)]
+        await asyncio.gather(*(job.task for job in jobs))
+        return jobs
+
+    return asyncio.run(scenario())
+
+
+def test_finished_jobs_expire_with_their_audio(tmp_path):
+    manager = _manager(tmp_path, retention_seconds=0.0)
+    (job,) = _run_jobs(manager, 1)
+    assert job.status == "done"
+    assert job.job_id not in manager.jobs
+    assert not job.path.exists()
+
+
+def test_finished_jobs_are_kept_within_retention(tmp_path):
+    manager = _manager(tmp_path, retention_seconds=3600.0)
+    (job,) = _run_jobs(manager, 1)
+    assert manager.jobs[job.job_id] is job
+    assert job.path.exists()
+    assert manager.expires_at(job) == job.finished_at + 3600.0
+
+
+def test_oldest_finished_jobs_are_evicted_beyond_max_finished(tmp_path):
+    manager = _manager(tmp_path, max_finished=2)
+    jobs = _run_jobs(manager, 4)
+    kept = sorted(jobs, key=lambda job: job.finished_at)[-2:]
+    assert set(manager.jobs) == {job.job_id for job in kept}
+    assert sorted(path.name for path in tmp_path.iterdir()) == sorted(job.path.name for job in kept)
@@ -0,0 +1,53 @@
+import json
+
+import numpy as np
+
+from api import render
+from api.render import BulkRenderer, _Item, _read_requests
+
+
+class _Pipeline:
+    """Fails every batch that contains the text "bad"."""
+
+    def __init__(self):
+        self.calls = []
+        self.reloads = 0
+
+    def run_batched(self, inputs_list, batch_size=8, stats=None, reload_on_error=True):
+        assert not reload_on_error
+        self.calls.append([inputs["text"] for inputs in inputs_list])
+        if any(inputs["text"] == "bad" for inputs in inputs_list):
+            raise RuntimeError("synthesis failed")
+        return [(32000, np.zeros(320, dtype=np.float32)) for _ in inputs_list]
+
+    def reload_models(self):
+        self.reloads += 1
+
+
+def test_read_requests_skips_malformed_lines(tmp_path):
+    path = tmp_path / "lines.jsonl"
+    path.write_text('{"id": "a", "text": "x"}\n{"text": \n\n[1, 2]\n{"text": "y"}\n', encoding="utf-8")
+    lines = list(_read_requests(str(path)))
+    assert [(item_id, payload) for item_id, payload, _ in lines] == [
+        ("a", {"text": "x"}),
+        ("2", None),
+        ("4", None),
+        ("5", {"text": "y"}),
+    ]
+    assert lines[1][2].startswith("invalid JSON")
+
+
+def test_failed_bucket_is_retried_in_the_same_pipeline(tmp_path, monkeypatch):
+    pipeline = _Pipeline()
+    monkeypatch.setattr(render, "_pipeline_for", lambda inputs: pipeline)
+    renderer = BulkRenderer(str(tmp_path))
+    items = [_Item(text, text, {"text": text}) for text in ["a", "bad", "c"]]
+    with open(tmp_path / "manifest.jsonl", "w", encoding="utf-8") as manifest:
+        renderer._render_bucket(items, manifest)
+
+    assert pipeline.calls == [["a", "bad", "c"], ["a"], ["bad"], ["c"]]
+    assert pipeline.reloads == 1
+    with open(tmp_path / "manifest.jsonl", encoding="utf-8") as f:
+        entries = {entry["id"]: entry["status"] for entry in map(json.loads, f)}
+    assert entries == {"a": "ok", "bad": "error", "c": "ok"}
+    assert (renderer.rendered, renderer.failed) == (2, 1)
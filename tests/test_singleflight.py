@@ -0,0 +1,116 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from api.admission import Ticket
+from api.main import _flight_ticket, _started
+from api.singleflight import SingleFlight
+from GPT_SoVITS.TTS_infer_pack.TTS import CancellationToken, SynthesisCancelled
+
+
+async def _produce(token: CancellationToken, count: int = 5, delay: float = 0.01):
+    for i in range(count):
+        await asyncio.sleep(delay)
+        token.raise_if_cancelled()
+        yield i
+
+
+async def _collect(subscription):
+    return [item async for item in subscription.items()]
+
+
+def test_follower_survives_leader_disconnect():
+    async def scenario():
+        flights = SingleFlight()
+        leader_token, follower_token = CancellationToken(), CancellationToken()
+        leader = flights.join(("key",), leader_token)
+        follower = flights.join(("key",), follower_token)
+        assert leader.leading and not follower.leading
+        leader.start(_produce)
+        follower_items = asyncio.ensure_future(_collect(follower))
+        await asyncio.sleep(0.015)
+        leader_token.cancel("disconnected")
+        with pytest.raises(SynthesisCancelled):
+            await _collect(leader)
+        return await follower_items
+
+    assert asyncio.run(scenario()) == [0, 1, 2, 3, 4]
+
+
+def test_follower_survives_leader_deadline():
+    async def scenario():
+        flights = SingleFlight()
+        leader = flights.join(("key",), CancellationToken(time.monotonic() + 0.015))
+        follower = flights.join(("key",), CancellationToken())
+        leader.start(_produce)
+        results = await asyncio.gather(_collect(leader), _collect(follower), return_exceptions=True)
+        return results
+
+    leader_result, follower_result = asyncio.run(scenario())
+    assert isinstance(leader_result, SynthesisCancelled)
+    assert follower_result == [0, 1, 2, 3, 4]
+
+
+def test_flight_cancelled_when_last_subscriber_leaves():
+    async def scenario():
+        flights = SingleFlight()
+        tokens = [CancellationToken(), CancellationToken()]
+        subscriptions = [flights.join(("key",), token) for token in tokens]
+        flight_tokens = []
+
+        def produce(token):
+            flight_tokens.append(token)
+            return _produce(token, count=100)
+
+        subscriptions[0].start(produce)
+        consumers = [asyncio.ensure_future(_collect(subscription)) for subscription in subscriptions]
+        await asyncio.sleep(0.02)
+        tokens[0].cancel("disconnected")
+        await asyncio.sleep(0.02)
+        assert not flight_tokens[0].cancelled
+        tokens[1].cancel("disconnected")
+        await asyncio.gather(*consumers, return_exceptions=True)
+        return flight_tokens[0], flights.stats()
+
+    flight_token, stats = asyncio.run(scenario())
+    assert flight_token.cancelled
+    assert stats["in_flight"] == 0 and stats["cancelled_flights"] == 1
+
+
+def test_admission_error_surfaces_before_first_item():
+    async def scenario():
+        flights = SingleFlight()
+        leader = flights.join(("key",), CancellationToken())
+        follower = flights.join(("key",), CancellationToken())
+
+        async def rejected(token):
+            raise HTTPException(status_code=429, detail="Too many queued requests.")
+            yield
+
+        leader.start(rejected)
+        for subscription in (leader, follower):
+            with pytest.raises(HTTPException) as info:
+                await _started(subscription.items())
+            assert info.value.status_code == 429
+
+    asyncio.run(scenario())
+
+
+def test_started_yields_every_item():
+    async def scenario():
+        flights = SingleFlight()
+        subscription = flights.join(("key",), CancellationToken())
+        subscription.start(_produce)
+        return [item async for item in await _started(subscription.items())]
+
+    assert asyncio.run(scenario()) == [0, 1, 2, 3, 4]
+
+
+def test_flight_ticket_drops_deadline_only_when_shared():
+    flights = SingleFlight()
+    ticket = Ticket(deadline=time.monotonic() + 1.0, rank=(0, 1.0, 0.0))
+    shared = _flight_ticket(ticket, flights.join(("key",), CancellationToken()))
+    assert shared.deadline is None and shared.rank == ticket.rank
+    assert _flight_ticket(ticket, flights.join(None, CancellationToken())) is ticket
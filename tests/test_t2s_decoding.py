@@ -0,0 +1,92 @@
+import torch
+
+from AR.models.utils import BatchSampler, sample
+from conftest import tiny_t2s_model
+
+
+def _inputs(seed: int = 1):
+    generator = torch.Generator().manual_seed(seed)
+    x = torch.randint(0, 512, (1, 12), generator=generator)
+    bert_feature = torch.randn(1, 1024, 12, generator=generator)
+    prompt = torch.randint(0, 1024, (1, 10), generator=generator)
+    return x, bert_feature, prompt
+
+
+def test_speculative_matches_naive_with_top_k_1():
+    # top_k=1 では主モデルの分布が one-hot なので、草稿の採否にかかわらず同じトークン列になる
+    model = tiny_t2s_model()
+    x, bert_feature, prompt = _inputs()
+    with torch.no_grad():
+        expected_y, expected_idx = model.infer_panel_naive(x, None, prompt, bert_feature, top_k=1, early_stop_num=40)
+        # 同じモデルを草稿にするとすべて採択され、別の重みの草稿では棄却が起きる
+        for draft, all_accepted in ((model, True), (tiny_t2s_model(seed=1, n_layer=1), False)):
+            stats = {}
+            y, idx = model.infer_panel_speculative(
+                x, None, prompt, bert_feature, top_k=1, early_stop_num=40, draft_model=draft, num_draft_tokens=3, stats=stats
+            )
+            assert idx == expected_idx
+            assert torch.equal(y, expected_y)
+            assert (stats["accepted"] == stats["proposed"]) == all_accepted
+
+
+def test_static_kv_cache_matches_concat():
+    # 事前確保した kv キャッシュと、ステップごとに連結する従来のキャッシュで同じトークン列になる
+    model = tiny_t2s_model()
+    x, bert_feature, prompt = _inputs()
+    with torch.no_grad():
+        results = [
+            model.infer_panel_naive(
+                x, None, prompt, bert_feature, top_k=1, early_stop_num=40, static_kv_cache=static_kv_cache
+            )
+            for static_kv_cache in (True, False)
+        ]
+    assert results[0][1] == results[1][1]
+    assert torch.equal(results[0][0], results[1][0])
+
+    # 長さの異なる行を左詰めのパディングでまとめる batch_infer でも同じ
+    rows = [_inputs(seed) for seed in (1, 2)]
+    rows[1] = (rows[1][0][:, :7], rows[1][1][:, :, :7], rows[1][2])
+    with torch.no_grad():
+        results = [
+            model.infer_panel_batch_infer(
+                [row[0][0] for row in rows],
+                torch.tensor([row[0].shape[1] for row in rows]),
+                torch.cat([row[2] for row in rows]),
+                [row[1][0] for row in rows],
+                top_k=1,
+                early_stop_num=40,
+                static_kv_cache=static_kv_cache,
+            )
+            for static_kv_cache in (True, False)
+        ]
+    (static_y, static_idx), (concat_y, concat_idx) = results
+    assert list(static_idx) == list(concat_idx)
+    for a, b in zip(static_y, concat_y):
+        assert torch.equal(a, b)
+
+
+def test_batch_sampler_matches_sample():
+    # 行ごとに異なるパラメーターと生成器で、各行を sample() で逐次サンプリングした結果と一致する
+    vocab_size = 1025
+    params = [
+        {"top_k": 15, "top_p": 1.0, "temperature": 1.0, "repetition_penalty": 1.35},
+        {"top_k": 5, "top_p": 0.6, "temperature": 0.7, "repetition_penalty": 1.0},
+        {"top_k": None, "top_p": 0.9, "temperature": 1.3, "repetition_penalty": 1.2},
+    ]
+    generator = torch.Generator().manual_seed(2)
+    history = [torch.randint(0, vocab_size, (1, 6), generator=generator) for _ in params]
+
+    sampler = BatchSampler(vocab_size, torch.device("cpu"))
+    for i, (kwargs, previous_tokens) in enumerate(zip(params, history)):
+        sampler.add_rows(previous_tokens, generator=torch.Generator().manual_seed(10 + i), **kwargs)
+    generators = [torch.Generator().manual_seed(10 + i) for i in range(len(params))]
+
+    for step in range(20):
+        logits = torch.randn(len(params), vocab_size, generator=generator) * 3
+        # 最初の数ステップは EOS を除いた語彙だけからサンプリングする
+        width = vocab_size - 1 if step < 3 else vocab_size
+        tokens, _ = sampler.sample(logits[:, :width].clone())
+        for i, kwargs in enumerate(params):
+            expected, _ = sample(logits[i : i + 1, :width].clone(), history[i], generator=generators[i], **kwargs)
+            assert int(tokens[i, 0]) == int(expected[0, 0])
+            history[i] = torch.cat([history[i], expected.long()], dim=1)
@@ -0,0 +1,69 @@
+import torch
+
+from AR.models.t2s_engine import T2SDecodeEngine, T2SRequest
+from conftest import tiny_t2s_model
+
+
+def _inputs(num_rows: int):
+    generator = torch.Generator().manual_seed(1)
+    rows = []
+    for i in range(num_rows):
+        phones = 8 + 3 * i
+        rows.append(
+            (
+                torch.randint(0, 512, (phones,), generator=generator),
+                torch.randn(1024, phones, generator=generator),
+                torch.randint(0, 1024, (10 + 2 * i,), generator=generator),
+            )
+        )
+    return rows
+
+
+def _naive(model, x, bert_feature, prompt, early_stop_num):
+    # top_k=1 で乱数に依存せず、行ごとの結果を比べられる
+    with torch.no_grad():
+        y, idx = model.infer_panel_naive(
+            x.unsqueeze(0),
+            None,
+            prompt.unsqueeze(0),
+            bert_feature.unsqueeze(0),
+            top_k=1,
+            early_stop_num=early_stop_num,
+            repetition_penalty=1.35,
+        )
+    return y[0], idx
+
+
+def _engine_results(model, rows, early_stop_num, **engine_kwargs):
+    engine = T2SDecodeEngine(model, **engine_kwargs)
+    try:
+        requests = [
+            T2SRequest(x, bert_feature, prompt, top_k=1, early_stop_num=early_stop_num, repetition_penalty=1.35)
+            for x, bert_feature, prompt in rows
+        ]
+        ys, idxs = engine.decode(requests)
+        return ys, idxs, engine.stats()
+    finally:
+        engine.close()
+
+
+def test_engine_matches_naive():
+    model = tiny_t2s_model()
+    rows = _inputs(4)
+    ys, idxs, _ = _engine_results(model, rows, early_stop_num=30, max_batch_size=3)
+    for (x, bert_feature, prompt), y, idx in zip(rows, ys, idxs):
+        expected_y, expected_idx = _naive(model, x, bert_feature, prompt, 30)
+        assert torch.equal(y, expected_y)
+        assert idx == expected_idx
+
+
+def test_engine_matches_naive_with_preemption():
+    model = tiny_t2s_model()
+    rows = _inputs(3)
+    # 3 行が最後まで入りきらないブロック数にして、途中で抢占と再 prefill を起こす
+    ys, idxs, stats = _engine_results(model, rows, early_stop_num=40, num_blocks=14, block_size=8)
+    assert stats["preempted"] > 0
+    for (x, bert_feature, prompt), y, idx in zip(rows, ys, idxs):
+        expected_y, expected_idx = _naive(model, x, bert_feature, prompt, 40)
+        assert torch.equal(y, expected_y)
+        assert idx == expected_idx
@@ -0,0 +1,95 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+import torch
+
+from GPT_SoVITS.TTS_infer_pack.TTS import TTS
+from TTS_infer_pack.feature_cache import SegmentCache
+from TTS_infer_pack.session import SynthesisSession
+from conftest import tiny_t2s_model
+
+
+def _pipeline() -> TTS:
+    # T2S の推論に使う属性だけを持つ TTS (重みの読み込みはしない)
+    pipeline = TTS.__new__(TTS)
+    pipeline.t2s_model = SimpleNamespace(model=tiny_t2s_model())
+    pipeline.t2s_draft_model = None
+    pipeline.prefix_cache = None
+    pipeline.configs = SimpleNamespace(
+        device=torch.device("cpu"), hz=1, max_sec=40, num_draft_tokens=4, t2s_weights_path=""
+    )
+    pipeline.precision = torch.float32
+    pipeline._t2s_engine_options = None
+    pipeline._t2s_engine_lock = threading.Lock()
+    return pipeline
+
+
+def _segments():
+    generator = torch.Generator().manual_seed(1)
+    segments = {}
+    for i, text in enumerate(["a", "b", "c"]):
+        phones = 8 + 3 * i
+        segments[text] = (
+            torch.randint(0, 512, (phones,), generator=generator),
+            torch.randn(1024, phones, generator=generator),
+        )
+    return segments
+
+
+def _predict(pipeline, texts, segment_keys, parallel_infer):
+    segments = _segments()
+    prompt = {
+        "prompt_semantic": torch.randint(0, 1024, (1, 10), generator=torch.Generator().manual_seed(2)),
+        "refer_spec": [],
+        "aux_ref_audio_paths": [],
+        "sv_emb": [],
+    }
+    # どの実行もリクエストの seed は同じで、文ごとの生成器はキャッシュキーから作られる
+    session = SynthesisSession(prompt, torch.device("cpu"), seed=7, parallel_infer=parallel_infer)
+    item = {
+        "all_phones": [segments[text][0] for text in texts],
+        "all_phones_len": torch.tensor([segments[text][0].shape[0] for text in texts]),
+        "all_bert_features": [segments[text][1] for text in texts],
+        "max_len": max(segments[text][0].shape[0] for text in texts),
+        "generators": pipeline._segment_generators(segment_keys, texts),
+    }
+    with torch.no_grad():
+        pred_semantic_list, idx_list = pipeline._predict_semantic(item, False, session)
+    return {text: semantic[-idx:] for text, semantic, idx in zip(texts, pred_semantic_list, idx_list)}
+
+
+def test_segment_seed_depends_on_key():
+    assert SegmentCache.seed(("a", 1)) == SegmentCache.seed(("a", 1))
+    assert SegmentCache.seed(("a", 1)) != SegmentCache.seed(("a", 2))
+
+
+@pytest.mark.parametrize("parallel_infer", [True, False])
+def test_cached_segment_matches_uncached_run(parallel_infer):
+    pipeline = _pipeline()
+    segment_keys = {text: (text, "ja", 7) for text in ["a", "b", "c"]}
+    # "b" を合成してキャッシュした実行と、別の文と同じ batch で "b" を合成し直す実行
+    stored = _predict(pipeline, ["a", "b"], segment_keys, parallel_infer)
+    uncached = _predict(pipeline, ["c", "b"], segment_keys, parallel_infer)
+    alone = _predict(pipeline, ["b"], segment_keys, parallel_infer)
+    assert torch.equal(stored["b"], uncached["b"])
+    assert torch.equal(stored["b"], alone["b"])
+
+
+def test_prefix_cache_is_keyed_by_content():
+    pipeline = _pipeline()
+    pipeline.enable_prefix_cache(4)
+
+    def prompt(seed):
+        generator = torch.Generator().manual_seed(seed)
+        return {
+            "phones": torch.randint(0, 512, (6,), generator=generator).tolist(),
+            "bert_features": torch.randn(1024, 6, generator=generator),
+            "prompt_semantic": torch.randint(0, 1024, (1, 10), generator=generator),
+        }
+
+    prefix = pipeline._get_t2s_prefix(prompt(0))
+    # 同じ内容の別のテンソルは同じプレフィックスを使い、内容が違えば作り直す
+    assert pipeline._get_t2s_prefix(prompt(0)) is prefix
+    assert pipeline._get_t2s_prefix(prompt(1)) is not prefix
+    assert pipeline.prefix_cache.stats()["hits"] == 1
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""Microbenchmark of one T2S decoding step with the static and the paged kv cache.
+
+  static   the preallocated per-batch cache of infer_panel_naive/batch_infer: every row's
+           positions are contiguous and attention reads them in place
+  paged    the block pools of the continuous-batching engine (PagedKVCache): every layer
+           first gathers the positions of each row from its blocks into a reused buffer
+
+Both decode ``--steps`` tokens for ``batch`` rows that already have ``context`` positions,
+with random weights of the given size (the default is the size of the released models).
+
+    python tools/bench_kv_cache.py
+    python tools/bench_kv_cache.py --device cuda --half --batch-sizes 1 8 16 --context 200 1000
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+from typing import Callable
+
+import torch
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT / "GPT_SoVITS"))
+
+from AR.models.t2s_engine import PagedKVCache  # noqa: E402
+from AR.models.t2s_model import Text2SemanticDecoder  # noqa: E402
+
+
+def timeit(fn: Callable[[], None], device: torch.device, steps: int) -> float:
+    """Mean seconds of one step."""
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    t0 = time.perf_counter()
+    for _ in range(steps):
+        fn()
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    return (time.perf_counter() - t0) / steps
+
+
+def bench(model, batch_size: int, context: int, steps: int, block_size: int, device: torch.device) -> dict:
+    transformer = model.t2s_transformer
+    dim = model.model_dim
+    dtype = next(model.parameters()).dtype
+    x = torch.randn(batch_size, 1, dim, device=device, dtype=dtype)
+    max_len = context + 2 * steps + 1
+
+    k_cache = [torch.randn(batch_size, max_len, dim, device=device, dtype=dtype) for _ in range(model.num_layers)]
+    v_cache = [torch.randn(batch_size, max_len, dim, device=device, dtype=dtype) for _ in range(model.num_layers)]
+    cache_len = context
+
+    def static_step():
+        nonlocal cache_len
+        transformer.decode_next_token_static(x, k_cache, v_cache, cache_len)
+        cache_len += 1
+
+    cache = PagedKVCache(model.num_layers, dim, batch_size * (max_len // block_size + 1), block_size, dtype, device)
+    seq_ids = list(range(batch_size))
+    for seq_id in seq_ids:
+        cache.allocate(seq_id, context)
+
+    def paged_step():
+        write_slots = torch.tensor([cache.append(seq_id) for seq_id in seq_ids], device=device)
+        read_slots, attn_mask = cache.gather(seq_ids)
+        k_buffer, v_buffer = cache.buffers(read_slots.numel())
+        transformer.decode_next_token_paged(
+            x, cache.k_pool, cache.v_pool, write_slots, read_slots, k_buffer, v_buffer, attn_mask
+        )
+
+    # 1 ステップ目はバッファの確保などを含むので捨てる
+    static_step()
+    paged_step()
+    return {"static": timeit(static_step, device, steps), "paged": timeit(paged_step, device, steps)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--half", action="store_true", help="fp16 weights and caches (GPU only).")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--context", type=int, nargs="+", default=[200, 600, 1200], help="Positions already cached per row.")
+    parser.add_argument("--steps", type=int, default=20, help="Timed decoding steps per case (mean is reported).")
+    parser.add_argument("--block-size", type=int, default=16)
+    parser.add_argument("--layers", type=int, default=24)
+    parser.add_argument("--hidden-dim", type=int, default=512)
+    parser.add_argument("--heads", type=int, default=16)
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    config = {
+        "model": {
+            "embedding_dim": args.hidden_dim,
+            "hidden_dim": args.hidden_dim,
+            "head": args.heads,
+            "n_layer": args.layers,
+            "dropout": 0,
+            "EOS": 1024,
+            "vocab_size": 1025,
+            "phoneme_vocab_size": 732,
+        }
+    }
+    model = Text2SemanticDecoder(config).eval().to(device)
+    if args.half:
+        model = model.half()
+    print(f"{'batch':>6}{'context':>9}{'static':>10}{'paged':>10}{'x':>7}")
+    with torch.no_grad():
+        for batch_size in args.batch_sizes:
+            for context in args.context:
+                r = bench(model, batch_size, context, args.steps, args.block_size, device)
+                print(
+                    f"{batch_size:>6}{context:>9}{r['static'] * 1e3:>10.2f}{r['paged'] * 1e3:>10.2f}"
+                    f"{r['paged'] / r['static']:>7.2f}"
+                )
+    print("(ms per decoding step, mean; x = paged / static)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""Microbenchmark of the T2S token samplers.
+
+Compares one decoding step of ``AR.models.utils.sample()`` with ``BatchSampler.sample()``
+for several batch sizes and history lengths:
+
+  shared      every row has the same parameters: one sample() call for the whole batch
+  per-row     every row has its own parameters and generator: one sample() call per row,
+              as the continuous-batching engine had to do, against one BatchSampler call
+
+sample() gathers the whole token history for the repetition penalty and sorts the
+vocabulary for top_p, so its cost grows with the history; BatchSampler keeps an
+occurrence table and evaluates top_p within the top-k candidates.
+
+    python tools/bench_sampler.py
+    python tools/bench_sampler.py --device cuda --batch-sizes 1 8 32 --history 100 1000
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+from typing import Callable, List
+
+import torch
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT / "GPT_SoVITS"))
+
+from AR.models.utils import BatchSampler, sample  # noqa: E402
+
+VOCAB_SIZE = 1025
+
+
+def timeit(fn: Callable[[], None], device: torch.device, repeat: int) -> float:
+    """Median seconds of one call."""
+    for _ in range(3):
+        fn()
+    times = []
+    for _ in range(repeat):
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+        t0 = time.perf_counter()
+        fn()
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+        times.append(time.perf_counter() - t0)
+    times.sort()
+    return times[len(times) // 2]
+
+
+def row_params(batch_size: int, top_p: float) -> List[dict]:
+    # 行ごとに異なる設定 (API で指定できる範囲の代表値)
+    top_ks = [5, 15, 30, 50]
+    temperatures = [1.0, 0.8, 1.2]
+    return [
+        {
+            "top_k": top_ks[i % len(top_ks)],
+            "top_p": top_p,
+            "temperature": temperatures[i % len(temperatures)],
+            "repetition_penalty": 1.35,
+        }
+        for i in range(batch_size)
+    ]
+
+
+def bench(batch_size: int, history: int, top_p: float, device: torch.device, dtype: torch.dtype, repeat: int) -> dict:
+    logits = torch.randn(batch_size, VOCAB_SIZE, device=device).to(dtype)
+    previous_tokens = torch.randint(0, VOCAB_SIZE - 1, (batch_size, history), device=device)
+    params = row_params(batch_size, top_p)
+    generators = [torch.Generator(device=device).manual_seed(i) for i in range(batch_size)]
+
+    shared = BatchSampler(VOCAB_SIZE, device)
+    shared.add_rows(previous_tokens, generator=generators[0], **params[0])
+    per_row = BatchSampler(VOCAB_SIZE, device)
+    for i in range(batch_size):
+        per_row.add_rows(previous_tokens[i : i + 1], generator=generators[i], **params[i])
+    rows = list(range(batch_size))
+
+    # 毎ステップ出現表が更新されるのは同じなので、計測中の更新はそのままにする
+    def sample_shared():
+        sample(logits.clone(), previous_tokens, generator=generators[0], **params[0])
+
+    def sample_per_row():
+        for i in range(batch_size):
+            sample(logits[i : i + 1].clone(), previous_tokens[i : i + 1], generator=generators[i], **params[i])
+
+    return {
+        "shared_sample": timeit(sample_shared, device, repeat),
+        "shared_batch": timeit(lambda: shared.sample(logits), device, repeat),
+        "per_row_sample": timeit(sample_per_row, device, repeat),
+        "per_row_batch": timeit(lambda: per_row.sample(logits, rows), device, repeat),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--device", default="cpu", help="Device of the logits.")
+    parser.add_argument("--half", action="store_true", help="fp16 logits (as with is_half).")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--history", type=int, nargs="+", default=[100, 500, 1500], help="Tokens seen so far per row.")
+    parser.add_argument("--top-p", type=float, nargs="+", default=[1.0, 0.9])
+    parser.add_argument("--repeat", type=int, default=50, help="Timed calls per case (median is reported).")
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    dtype = torch.float16 if args.half else torch.float32
+    print(f"{'batch':>6}{'history':>9}{'top_p':>7}{'shared old':>12}{'new':>9}{'x':>7}{'per-row old':>13}{'new':>9}{'x':>7}")
+    with torch.no_grad():
+        for top_p in args.top_p:
+            for batch_size in args.batch_sizes:
+                for history in args.history:
+                    r = bench(batch_size, history, top_p, device, dtype, args.repeat)
+                    print(
+                        f"{batch_size:>6}{history:>9}{top_p:>7.2f}"
+                        f"{r['shared_sample'] * 1e3:>12.3f}{r['shared_batch'] * 1e3:>9.3f}"
+                        f"{r['shared_sample'] / r['shared_batch']:>7.1f}"
+                        f"{r['per_row_sample'] * 1e3:>13.3f}{r['per_row_batch'] * 1e3:>9.3f}"
+                        f"{r['per_row_sample'] / r['per_row_batch']:>7.1f}"
+                    )
+    print("(ms per decoding step, median; x = speedup of BatchSampler)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""Speedup of speculative T2S decoding with a draft GPT model.
+
+Decodes the same segments with ``infer_panel_naive`` and with ``infer_panel_speculative``
+and reports tokens/s of both, the speedup, the acceptance rate of the draft tokens and the
+number of tokens per forward pass of the GPT model.
+
+The draft is either a GPT checkpoint (``--draft``, e.g. a model with a few layers trained
+with ``s1_train.py``) or the first ``--draft-layers`` layers of the GPT model itself, which
+needs no training but is usually accepted less often. The inputs are random phonemes, BERT
+features and prompt tokens, so the acceptance rate is lower than on real text; compare
+``speculative_acceptance_rate`` of ``/scheduler/stats`` on real traffic.
+
+    python tools/bench_speculative.py --gpt GPT_weights/model.ckpt --draft GPT_weights/draft.ckpt
+    python tools/bench_speculative.py --gpt GPT_weights/model.ckpt --draft-layers 4 --num-draft-tokens 3
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import copy
+import io
+import sys
+import time
+from pathlib import Path
+
+import torch
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT / "GPT_SoVITS"))
+
+from AR.models.t2s_model import T2STransformer, Text2SemanticDecoder  # noqa: E402
+
+
+def load_gpt(path: str, device: torch.device, half: bool):
+    dict_s1 = torch.load(path, map_location=device, weights_only=False)
+    # 推論には Lightning は要らないので、デコーダだけを組み立てる
+    model = Text2SemanticDecoder(config=dict_s1["config"], top_k=3)
+    model.load_state_dict({key[len("model.") :]: value for key, value in dict_s1["weight"].items() if key.startswith("model.")})
+    model = model.to(device).eval()
+    return model.half() if half else model
+
+
+def truncated(model, num_layers: int):
+    # 先頭の num_layers 層だけを使う草稿モデル (埋め込みと出力層は共有する)
+    draft = copy.copy(model)
+    draft.num_layers = num_layers
+    draft.t2s_transformer = T2STransformer(num_layers, model.t2s_transformer.blocks[:num_layers])
+    return draft
+
+
+def decode(model, inputs, args, generator, **kwargs):
+    x, bert_feature, prompt = inputs
+    # infer_panel_* の進捗表示とログは計測の邪魔になるので捨てる
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        if kwargs:
+            y, _ = model.infer_panel_speculative(
+                x, None, prompt, bert_feature, args.top_k, args.top_p, args.early_stop_num,
+                args.temperature, args.repetition_penalty, generator=generator, **kwargs
+            )
+        else:
+            y, _ = model.infer_panel_naive(
+                x, None, prompt, bert_feature, args.top_k, args.top_p, args.early_stop_num,
+                args.temperature, args.repetition_penalty, generator=generator
+            )
+    return y.shape[1] - prompt.shape[1]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--gpt", required=True, help="GPT (.ckpt) weights.")
+    draft = parser.add_mutually_exclusive_group(required=True)
+    draft.add_argument("--draft", help="Draft GPT (.ckpt) weights.")
+    draft.add_argument("--draft-layers", type=int, help="Use the first N layers of the GPT model as the draft.")
+    parser.add_argument("--num-draft-tokens", type=int, nargs="+", default=[2, 4, 6])
+    parser.add_argument("--segments", type=int, default=5, help="Segments decoded per configuration.")
+    parser.add_argument("--phones", type=int, default=40, help="Phonemes per segment.")
+    parser.add_argument("--prompt-tokens", type=int, default=150, help="Semantic tokens of the reference.")
+    parser.add_argument("--early-stop-num", type=int, default=300, help="Maximum tokens per segment.")
+    parser.add_argument("--top-k", type=int, default=15)
+    parser.add_argument("--top-p", type=float, default=1.0)
+    parser.add_argument("--temperature", type=float, default=1.0)
+    parser.add_argument("--repetition-penalty", type=float, default=1.35)
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--half", action="store_true", help="fp16 models (GPU only).")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    model = load_gpt(args.gpt, device, args.half)
+    draft_model = load_gpt(args.draft, device, args.half) if args.draft else truncated(model, args.draft_layers)
+    print(f"GPT: {model.num_layers} layers, draft: {draft_model.num_layers} layers")
+
+    torch.manual_seed(args.seed)
+    dtype = next(model.parameters()).dtype
+    segments = [
+        (
+            torch.randint(0, model.phoneme_vocab_size, (1, args.phones), device=device),
+            torch.randn(1, 1024, args.phones, device=device, dtype=dtype),
+            torch.randint(0, model.EOS, (1, args.prompt_tokens), device=device),
+        )
+        for _ in range(args.segments)
+    ]
+
+    def run(**kwargs):
+        tokens = 0
+        t0 = time.perf_counter()
+        with torch.no_grad():
+            for i, inputs in enumerate(segments):
+                generator = torch.Generator(device=device).manual_seed(args.seed + i)
+                tokens += decode(model, inputs, args, generator, **kwargs)
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+        return tokens, time.perf_counter() - t0
+
+    run()  # ウォームアップ
+    tokens, seconds = run()
+    baseline = tokens / seconds
+    print(f"{'draft tokens':>12}{'tokens/s':>10}{'speedup':>9}{'accepted':>10}{'tokens/fwd':>12}")
+    print(f"{'-':>12}{baseline:>10.1f}{1.0:>9.2f}{'-':>10}{1.0:>12.2f}")
+    for num_draft_tokens in args.num_draft_tokens:
+        stats = {}
+        tokens, seconds = run(draft_model=draft_model, num_draft_tokens=num_draft_tokens, stats=stats)
+        print(
+            f"{num_draft_tokens:>12}{tokens / seconds:>10.1f}{tokens / seconds / baseline:>9.2f}"
+            f"{stats['accepted'] / max(stats['proposed'], 1):>10.1%}{stats['tokens'] / max(stats['steps'], 1):>12.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""Compare the prefix mode of the T2S model with the default layout on real models.
+
+In the prefix mode (``TTS.enable_prefix_cache``) the reference prompt does not attend to
+the target text, so the semantic tokens are not those of the default layout. This script
+decodes the same segments, with the same reference, in both layouts and reports per segment
+
+  greedy   number of tokens of both layouts with top_k=1, the share of positions (up to
+           the shorter one) where they agree and the first position where they differ
+  sampled  mean number of tokens over ``--samples`` seeds with the given sampling
+           parameters (a large difference means the prefix mode changes the durations)
+
+With ``--out-dir`` the greedy audio of both layouts is written as ``000_default.wav``,
+``000_prefix.wav``, ... (one pair per segment) for a listening test.
+
+    python tools/compare_prefix_mode.py --gpt GPT_weights/model.ckpt --sovits SoVITS_weights/model.pth \\
+        --ref-audio ref.wav --prompt-text "..." --prompt-lang ja --text "..." --text-lang ja --out-dir prefix_check
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import wave
+from pathlib import Path
+
+import numpy as np
+import torch
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+sys.path.insert(0, str(REPO_ROOT / "GPT_SoVITS"))
+
+from TTS_infer_pack.TTS import TTS, TTS_Config  # noqa: E402
+
+MODES = ("default", "prefix")
+
+
+def build_pipeline(args) -> TTS:
+    device = args.device
+    config = {
+        "custom": {
+            "device": device,
+            "is_half": args.half,
+            "version": "v2ProPlus",
+            "t2s_weights_path": args.gpt,
+            "vits_weights_path": args.sovits,
+            "cnhuhbert_base_path": args.cnhubert,
+            "bert_base_path": args.bert,
+        }
+    }
+    return TTS(TTS_Config(config))
+
+
+def decode(pipeline: TTS, session, segment: dict, seed: int, top_k: int):
+    # run() と同じく、プレフィックスモードでは参照テキストを各行に連結しない
+    item = pipeline.to_batch(
+        [segment],
+        prompt_data=pipeline._batch_prompt_data(session, False),
+        batch_size=1,
+        split_bucket=False,
+        device=pipeline.configs.device,
+        precision=pipeline.precision,
+    )[0][0]
+    session.top_k = top_k
+    session.generator.manual_seed(seed)
+    with torch.no_grad():
+        pred_semantic_list, idx_list = pipeline._predict_semantic(item, False, session)
+    return item, pred_semantic_list, idx_list
+
+
+def write_wav(path: Path, audio: torch.Tensor, sample_rate: int) -> None:
+    audio = audio.float().cpu()
+    audio = audio / max(1.0, float(audio.abs().max()))
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes((audio.numpy() * 32767).astype(np.int16).tobytes())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--gpt", required=True, help="GPT (.ckpt) weights.")
+    parser.add_argument("--sovits", required=True, help="SoVITS (.pth) weights.")
+    parser.add_argument(
+        "--bert", default=os.environ.get("BERT_BASE_PATH", "GPT_SoVITS/pretrained_models/chinese-roberta-wwm-ext-large")
+    )
+    parser.add_argument(
+        "--cnhubert", default=os.environ.get("CNHUBERT_BASE_PATH", "GPT_SoVITS/pretrained_models/chinese-hubert-base")
+    )
+    parser.add_argument("--ref-audio", required=True, help="Reference audio.")
+    parser.add_argument("--prompt-text", required=True, help="Transcript of the reference audio.")
+    parser.add_argument("--prompt-lang", required=True)
+    parser.add_argument("--text", required=True, help="Target text, split into segments with --text-split-method.")
+    parser.add_argument("--text-lang", required=True)
+    parser.add_argument("--text-split-method", default="cut5")
+    parser.add_argument("--samples", type=int, default=5, help="Sampled decodings per segment and layout.")
+    parser.add_argument("--top-k", type=int, default=15, help="top_k of the sampled decodings.")
+    parser.add_argument("--out-dir", default=None, help="Write the greedy audio of both layouts here.")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--half", action="store_true", help="fp16 models (GPU only).")
+    args = parser.parse_args()
+
+    pipeline = build_pipeline(args)
+    session = pipeline.create_session({"seed": 0})
+    pipeline._set_reference(session, None, args.ref_audio, [], args.prompt_text, args.prompt_lang, False)
+    segments = pipeline.text_preprocessor.preprocess(
+        args.text, args.text_lang, args.text_split_method, pipeline.configs.version
+    )
+    out_dir = Path(args.out_dir) if args.out_dir else None
+    if out_dir is not None:
+        out_dir.mkdir(parents=True, exist_ok=True)
+
+    results = {mode: [] for mode in MODES}
+    for mode in MODES:
+        pipeline.enable_prefix_cache(8 if mode == "prefix" else 0)
+        for i, segment in enumerate(segments):
+            item, greedy, idx = decode(pipeline, session, segment, 0, 1)
+            tokens = greedy[0][-idx[0] :] if idx[0] else greedy[0][:0]
+            lengths = [
+                int(decode(pipeline, session, segment, seed, args.top_k)[2][0]) for seed in range(args.samples)
+            ]
+            results[mode].append((tokens.cpu(), lengths))
+            if out_dir is not None:
+                audio = pipeline._decode_audio(item, greedy, idx, 1.0, session)[0]
+                write_wav(out_dir / f"{i:03d}_{mode}.wav", audio, pipeline.configs.sampling_rate)
+
+    print(f"{'segment':>8}{'default':>9}{'prefix':>8}{'agree':>8}{'diverge at':>12}{'sampled ratio':>15}")
+    ratios = []
+    agreements = []
+    for i in range(len(segments)):
+        default_tokens, default_lengths = results["default"][i]
+        prefix_tokens, prefix_lengths = results["prefix"][i]
+        shared = min(len(default_tokens), len(prefix_tokens))
+        equal = (default_tokens[:shared] == prefix_tokens[:shared]).tolist()
+        diverge = equal.index(False) if False in equal else shared
+        agreement = sum(equal) / max(shared, 1)
+        ratio = np.mean(prefix_lengths) / max(np.mean(default_lengths), 1)
+        agreements.append(agreement)
+        ratios.append(ratio)
+        print(f"{i:>8}{len(default_tokens):>9}{len(prefix_tokens):>8}{agreement:>8.1%}{diverge:>12}{ratio:>15.2f}")
+    print(
+        f"mean greedy agreement {np.mean(agreements):.1%}, "
+        f"mean sampled length ratio (prefix / default) {np.mean(ratios):.2f}"
+    )
+
+
+if __name__ == "__main__":
+    main()
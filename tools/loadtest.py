@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""Load generator and latency report for the HTTP API (api/main.py).
+
+Replays a JSONL request mix against a running server. Every line is a /tts request body
+(the ``SynthesisRequest`` shape, as for ``api.render``) plus two optional keys:
+``endpoint`` (``tts`` or ``tts/stream``, default ``tts``) and ``weight`` (relative
+frequency in the mix, default 1).
+
+Two arrival models:
+  open loop   --rate R     Poisson arrivals at R requests/s, independent of the responses
+  closed loop --concurrency N   N clients that each send the next request on completion
+
+The report has p50/p95/p99 latency, time to first byte (the first audio byte after the
+WAV header for streaming), throughput in seconds of audio per second and the error rate,
+overall and per endpoint. ``--out`` writes it as JSON with every request, so that runs
+can be compared.
+
+    python tools/loadtest.py mix.jsonl --rate 2 --duration 60 --out open.json
+    python tools/loadtest.py mix.jsonl --concurrency 4 --requests 200 --out closed.json
+
+``tools/tiny_models.py`` creates random tiny models and a sample mix to run this
+fully offline on CPU.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+import numpy as np
+
+ENDPOINTS = ("tts", "tts/stream")
+PERCENTILES = (50, 95, 99)
+# 長さ不明のストリームで送られる WAV ヘッダー
+WAV_HEADER_BYTES = 44
+
+
+def load_mix(path: str) -> Tuple[List[Tuple[str, Dict]], List[float]]:
+    requests, weights = [], []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            body = json.loads(line)
+            endpoint = body.pop("endpoint", "tts").strip("/")
+            if endpoint not in ENDPOINTS:
+                raise SystemExit(f"{path}:{line_number}: unsupported endpoint '{endpoint}' (use one of {ENDPOINTS})")
+            weights.append(float(body.pop("weight", 1.0)))
+            body.pop("id", None)
+            requests.append((endpoint, body))
+    if not requests:
+        raise SystemExit(f"{path} has no requests.")
+    return requests, weights
+
+
+def _header_bytes(endpoint: str, body: Dict) -> int:
+    if endpoint == "tts/stream" and body.get("response_format", "wav") == "wav":
+        return WAV_HEADER_BYTES
+    return 0
+
+
+def _audio_seconds(endpoint: str, body: Dict, response: httpx.Response, content: bytes, num_bytes: int) -> float:
+    if endpoint == "tts/stream":
+        return max(num_bytes - _header_bytes(endpoint, body), 0) / 2 / int(response.headers["X-Sample-Rate"])
+    if "X-Duration-Seconds" in response.headers:
+        return float(response.headers["X-Duration-Seconds"])
+    return float(json.loads(content)["duration_seconds"])
+
+
+async def send(client: httpx.AsyncClient, endpoint: str, body: Dict, origin: float) -> Dict:
+    """Send one request and measure it; failures are recorded, never raised."""
+    t0 = time.perf_counter()
+    record: Dict = {"endpoint": endpoint, "started_at": t0 - origin, "status": None, "ttfb_seconds": None}
+    # WAV のストリームは合成前にヘッダーだけが届くことがあるので、その後の最初の音声を待つ
+    header_bytes = _header_bytes(endpoint, body)
+    try:
+        async with client.stream("POST", f"/{endpoint}", json=body) as response:
+            chunks = []
+            num_bytes = 0
+            async for chunk in response.aiter_bytes():
+                num_bytes += len(chunk)
+                if record["ttfb_seconds"] is None and num_bytes > header_bytes:
+                    record["ttfb_seconds"] = time.perf_counter() - t0
+                if endpoint == "tts":
+                    chunks.append(chunk)
+            record["latency_seconds"] = time.perf_counter() - t0
+            record["status"] = response.status_code
+            record["bytes"] = num_bytes
+            content = b"".join(chunks)
+            if response.status_code >= 400:
+                record["error"] = content[:200].decode("utf-8", "replace") or response.reason_phrase
+                return record
+            record["audio_seconds"] = _audio_seconds(endpoint, body, response, content, num_bytes)
+            if "Server-Timing" in response.headers:
+                record["server_timing"] = response.headers["Server-Timing"]
+    except (httpx.HTTPError, KeyError, ValueError) as exc:
+        record["latency_seconds"] = time.perf_counter() - t0
+        record["error"] = f"{type(exc).__name__}: {exc}"
+    return record
+
+
+async def open_loop(client, mix, weights, rng, rate: float, duration: float, max_requests: Optional[int]) -> List[Dict]:
+    """Poisson arrivals: the next request is sent on schedule whether or not earlier ones finished."""
+    origin = time.perf_counter()
+    tasks = []
+    next_arrival = 0.0
+    while next_arrival < duration and (max_requests is None or len(tasks) < max_requests):
+        delay = origin + next_arrival - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        endpoint, body = rng.choices(mix, weights)[0]
+        tasks.append(asyncio.create_task(send(client, endpoint, body, origin)))
+        next_arrival += rng.expovariate(rate)
+    return list(await asyncio.gather(*tasks))
+
+
+async def closed_loop(client, mix, weights, rng, concurrency: int, duration: float, max_requests: Optional[int]) -> List[Dict]:
+    """``concurrency`` clients, each sending its next request as soon as the previous one ends."""
+    origin = time.perf_counter()
+    records: List[Dict] = []
+    sent = 0
+
+    async def _client() -> None:
+        nonlocal sent
+        while time.perf_counter() - origin < duration and (max_requests is None or sent < max_requests):
+            sent += 1
+            endpoint, body = rng.choices(mix, weights)[0]
+            records.append(await send(client, endpoint, body, origin))
+
+    await asyncio.gather(*[_client() for _ in range(concurrency)])
+    return records
+
+
+def _percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {f"p{p}": None for p in PERCENTILES} | {"mean": None, "max": None}
+    result = {f"p{p}": float(np.percentile(values, p)) for p in PERCENTILES}
+    result["mean"] = float(np.mean(values))
+    result["max"] = float(np.max(values))
+    return result
+
+
+def summarize(records: List[Dict], wall_seconds: float) -> Dict:
+    """Latency percentiles, throughput and error rate, overall and per endpoint."""
+    groups = {"all": records}
+    for endpoint in ENDPOINTS:
+        selected = [record for record in records if record["endpoint"] == endpoint]
+        if selected:
+            groups[endpoint] = selected
+    summary = {}
+    for name, group in groups.items():
+        ok = [record for record in group if "error" not in record]
+        audio_seconds = sum(record["audio_seconds"] for record in ok)
+        summary[name] = {
+            "requests": len(group),
+            "succeeded": len(ok),
+            "error_rate": (len(group) - len(ok)) / len(group),
+            "status_counts": dict(Counter(str(record["status"]) for record in group)),
+            "latency_seconds": _percentiles([record["latency_seconds"] for record in ok]),
+            "ttfb_seconds": _percentiles([record["ttfb_seconds"] for record in ok if record["ttfb_seconds"] is not None]),
+            "audio_seconds": audio_seconds,
+            "requests_per_second": len(ok) / wall_seconds if wall_seconds else 0.0,
+            "audio_seconds_per_second": audio_seconds / wall_seconds if wall_seconds else 0.0,
+        }
+    return summary
+
+
+def print_summary(summary: Dict) -> None:
+    def ms(value: Optional[float]) -> str:
+        return "-" if value is None else f"{value * 1000:.0f}"
+
+    print(f"{'endpoint':<12}{'reqs':>6}{'err%':>7}{'p50':>8}{'p95':>8}{'p99':>8}{'ttfb50':>8}{'ttfb95':>8}{'audio-s/s':>11}")
+    for name, stats in summary.items():
+        latency, ttfb = stats["latency_seconds"], stats["ttfb_seconds"]
+        print(
+            f"{name:<12}{stats['requests']:>6}{stats['error_rate'] * 100:>7.1f}"
+            f"{ms(latency['p50']):>8}{ms(latency['p95']):>8}{ms(latency['p99']):>8}"
+            f"{ms(ttfb['p50']):>8}{ms(ttfb['p95']):>8}{stats['audio_seconds_per_second']:>11.2f}"
+        )
+    print("(latencies in ms)")
+
+
+async def wait_ready(client: httpx.AsyncClient, timeout: float) -> None:
+    """Poll /ready so that model loading and warm-up do not count as latency."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            response = await client.get("/ready")
+            if response.status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        if time.monotonic() > deadline:
+            raise SystemExit(f"Server not ready after {timeout:.0f}s.")
+        await asyncio.sleep(1.0)
+
+
+async def run(args: argparse.Namespace) -> Dict:
+    mix, weights = load_mix(args.mix)
+    rng = random.Random(args.seed)
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        if args.ready_timeout > 0:
+            await wait_ready(client, args.ready_timeout)
+        started_at = datetime.now(timezone.utc).isoformat()
+        t0 = time.perf_counter()
+        if args.rate:
+            records = await open_loop(client, mix, weights, rng, args.rate, args.duration, args.requests)
+        else:
+            records = await closed_loop(client, mix, weights, rng, args.concurrency, args.duration, args.requests)
+        wall_seconds = time.perf_counter() - t0
+    records.sort(key=lambda record: record["started_at"])
+    return {
+        "config": {
+            "url": args.url,
+            "mix": args.mix,
+            "mode": "open" if args.rate else "closed",
+            "rate": args.rate,
+            "concurrency": None if args.rate else args.concurrency,
+            "duration": args.duration,
+            "max_requests": args.requests,
+            "seed": args.seed,
+            "started_at": started_at,
+        },
+        "wall_seconds": wall_seconds,
+        "summary": summarize(records, wall_seconds),
+        "requests": records,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("mix", help="JSONL request mix (SynthesisRequest bodies plus optional endpoint/weight).")
+    parser.add_argument("--url", default="http://localhost:9880", help="Base URL of the server.")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--rate", type=float, default=None, help="Open loop: Poisson arrival rate in requests/s.")
+    mode.add_argument("--concurrency", type=int, default=1, help="Closed loop: number of concurrent clients.")
+    parser.add_argument("--duration", type=float, default=60.0, help="Stop sending new requests after this many seconds.")
+    parser.add_argument("--requests", type=int, default=None, help="Stop after sending this many requests.")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Per-request timeout in seconds.")
+    parser.add_argument("--ready-timeout", type=float, default=600.0, help="Wait this long for /ready first (0 to skip).")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the request order and arrival times.")
+    parser.add_argument("--out", default=None, help="Write the report and every request as JSON to this file.")
+    args = parser.parse_args()
+    if args.rate is not None and args.rate <= 0:
+        parser.error("--rate must be positive")
+
+    report = asyncio.run(run(args))
+    print_summary(report["summary"])
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
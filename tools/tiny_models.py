@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""Create tiny randomly initialised v2ProPlus models for offline load tests.
+
+Writes a GPT checkpoint, a SoVITS checkpoint, BERT and CNHuBERT directories, an SV
+checkpoint, a noise reference clip and a sample request mix for ``tools/loadtest.py``. The
+audio is noise, but every stage of the pipeline runs its real code with the real tensor
+interfaces, so queueing, batching and streaming can be measured on CPU without
+downloading the pretrained weights. The text frontend assets (G2PW model, NLTK data)
+must already be installed as for normal use.
+
+Run from the repository root:
+
+    python tools/tiny_models.py --out-dir tiny_models
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import wave
+from pathlib import Path
+
+import numpy as np
+import torch
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+sys.path.insert(0, str(REPO_ROOT / "GPT_SoVITS"))
+sys.path.insert(0, str(REPO_ROOT / "GPT_SoVITS" / "eres2net"))
+
+# BERT/CNHuBERT/SV の出力次元は後段のモデルが前提としているので変えない
+BERT_HIDDEN_SIZE = 1024
+SSL_HIDDEN_SIZE = 768
+BERT_SPECIAL_TOKENS = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+
+TINY_GPT = {"embedding_dim": 128, "hidden_dim": 128, "head": 4, "n_layer": 2, "dropout": 0, "EOS": 1024, "vocab_size": 1025}
+# hidden/inter_channels は MRTE の入出力 (192) に合わせたまま、層数と幅だけを減らす
+TINY_SOVITS = {"filter_channels": 256, "n_layers": 2, "n_layers_q": 1, "upsample_initial_channel": 64}
+
+SAMPLE_MIX = [
+    {"endpoint": "tts", "weight": 3, "text": "This is a short sentence for the load test.", "text_language": "en"},
+    {"endpoint": "tts", "weight": 1, "text": "The quick brown fox jumps over the lazy dog. It was a bright cold day in April, and the clocks were striking thirteen.", "text_language": "en", "text_split_method": "sentences"},
+    {"endpoint": "tts/stream", "weight": 2, "text": "Streaming requests report the time to the first audio byte. Each sentence is sent as soon as it is ready.", "text_language": "en"},
+    {"endpoint": "tts", "weight": 2, "text": "今天天气很好，我们一起去公园散步吧。", "text_language": "zh"},
+]
+
+
+def make_gpt(path: Path, max_sec: int) -> None:
+    from AR.models.t2s_lightning_module import Text2SemanticLightningModule
+    from text import symbols2
+
+    config = {
+        "model": dict(TINY_GPT, phoneme_vocab_size=len(symbols2.symbols)),
+        # 乱数の重みでは EOS がほぼ出ないので、max_sec で 1 文あたりのトークン数を抑える
+        "data": {"max_sec": max_sec},
+    }
+    model = Text2SemanticLightningModule(config, "****", is_train=False)
+    torch.save({"config": config, "weight": model.state_dict(), "info": "tiny random"}, path)
+
+
+def make_sovits(path: Path) -> None:
+    from module.models import SynthesizerTrn
+    from process_ckpt import my_save2
+
+    with open(REPO_ROOT / "GPT_SoVITS" / "configs" / "s2v2ProPlus.json", "r", encoding="utf-8") as f:
+        hps = json.load(f)
+    hps["model"].update(TINY_SOVITS)
+    hps["model"]["version"] = "v2ProPlus"
+    model = SynthesizerTrn(
+        hps["data"]["filter_length"] // 2 + 1,
+        hps["train"]["segment_size"] // hps["data"]["hop_length"],
+        n_speakers=hps["data"]["n_speakers"],
+        **hps["model"],
+    )
+    # 推論で使わない enc_q は学習時の保存と同じく除く
+    weight = {key: value for key, value in model.state_dict().items() if "enc_q" not in key}
+    my_save2({"weight": weight, "config": hps, "info": "tiny random"}, str(path), "v2ProPlus")
+
+
+def make_bert(directory: Path) -> None:
+    from transformers import BertConfig, BertForMaskedLM, BertTokenizerFast
+
+    directory.mkdir(parents=True, exist_ok=True)
+    vocab_path = directory / "vocab.txt"
+    # 漢字はすべて [UNK] になるが、1 文字 1 トークンなので特徴量の長さは変わらない
+    vocab_path.write_text("\n".join(BERT_SPECIAL_TOKENS) + "\n", encoding="utf-8")
+    BertTokenizerFast(vocab_file=str(vocab_path)).save_pretrained(directory)
+    config = BertConfig(
+        vocab_size=len(BERT_SPECIAL_TOKENS),
+        hidden_size=BERT_HIDDEN_SIZE,
+        # TextPreprocessor は最後から 3 番目の隠れ層を使う
+        num_hidden_layers=2,
+        num_attention_heads=16,
+        intermediate_size=1024,
+    )
+    BertForMaskedLM(config).save_pretrained(directory)
+
+
+def make_cnhubert(directory: Path) -> None:
+    from transformers import HubertConfig, HubertModel, Wav2Vec2FeatureExtractor
+
+    directory.mkdir(parents=True, exist_ok=True)
+    config = HubertConfig(
+        hidden_size=SSL_HIDDEN_SIZE,
+        num_hidden_layers=1,
+        num_attention_heads=12,
+        intermediate_size=1024,
+    )
+    HubertModel(config).save_pretrained(directory)
+    Wav2Vec2FeatureExtractor(
+        feature_size=1, sampling_rate=16000, padding_value=0.0, do_normalize=True, return_attention_mask=False
+    ).save_pretrained(directory)
+
+
+def make_sv(path: Path) -> None:
+    from ERes2NetV2 import ERes2NetV2
+
+    # sv.py が固定の構成で読み込むので、構成はそのままで重みだけ乱数にする (fp16 で容量を半分に)
+    model = ERes2NetV2(baseWidth=24, scale=4, expansion=4)
+    torch.save({key: value.half() for key, value in model.state_dict().items()}, path)
+
+
+def make_reference(path: Path, seconds: float = 5.0, sample_rate: int = 32000) -> None:
+    rng = np.random.default_rng(0)
+    pcm = (rng.standard_normal(int(seconds * sample_rate)) * 3000).clip(-32768, 32767).astype(np.int16)
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(pcm.tobytes())
+
+
+def make_mix(path: Path, reference: Path) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        for request in SAMPLE_MIX:
+            request = dict(request, reference_audio_path=str(reference))
+            f.write(json.dumps(request, ensure_ascii=False) + "\n")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out-dir", default="tiny_models", help="Directory for the generated models.")
+    parser.add_argument("--max-sec", type=int, default=6, help="Longest T2S output per segment, in seconds.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random weights.")
+    args = parser.parse_args()
+
+    torch.manual_seed(args.seed)
+    out_dir = Path(args.out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    paths = {
+        "GPT_MODEL_PATH": out_dir / "gpt.ckpt",
+        "SOVITS_MODEL_PATH": out_dir / "sovits.pth",
+        "BERT_BASE_PATH": out_dir / "bert",
+        "CNHUBERT_BASE_PATH": out_dir / "cnhubert",
+        "SV_MODEL_PATH": out_dir / "sv.ckpt",
+    }
+    steps = [
+        ("GPT", make_gpt, paths["GPT_MODEL_PATH"], args.max_sec),
+        ("SoVITS", make_sovits, paths["SOVITS_MODEL_PATH"]),
+        ("BERT", make_bert, paths["BERT_BASE_PATH"]),
+        ("CNHuBERT", make_cnhubert, paths["CNHUBERT_BASE_PATH"]),
+        ("SV", make_sv, paths["SV_MODEL_PATH"]),
+    ]
+    for name, make, path, *extra in steps:
+        print(f"--> {name}: {path}")
+        make(path, *extra)
+    reference = out_dir / "reference.wav"
+    make_reference(reference)
+    make_mix(out_dir / "mix.jsonl", reference)
+
+    env = " ".join(f"{name}={path}" for name, path in paths.items())
+    print("\nStart the server with the tiny models:")
+    print(f"  {env} uvicorn api.main:app --port 9880")
+    print("Then run the load test:")
+    print(f"  python tools/loadtest.py {out_dir / 'mix.jsonl'} --rate 1 --duration 60 --out run.json")
+
+
+if __name__ == "__main__":
+    main()